@@ -0,0 +1,187 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src'))
+if SRC_DIR not in sys.path:
+    sys.path.insert(0, SRC_DIR)
+
+from calculate_emissions.batch import INPUT_COLUMNS
+from calculate_emissions.calculate_distance import un_locode_file_path, iata_icao_file_path, emission_factors_file_path
+from calculate_emissions.reference_data import load_locode_table, load_airport_table
+from calculate_emissions.sea_routing import SEAPORTS
+
+# Share of each kind of shipment in the generated workloads
+DEFAULT_MIX = {
+    'air': 0.3,
+    'sea': 0.3,
+    'land': 0.2,
+    'distance': 0.2,
+}
+
+# Units calculate_shipment_mass_batch converts; anything else would be read as tonnes
+MASS_UNITS = ('kg', 't', 'g')
+
+
+@dataclass
+class ReferenceSample:
+    """
+    The real codes and factor rows the generators draw from.
+    """
+
+    locodes: np.ndarray
+    locode_countries: np.ndarray
+    locode_latitudes: np.ndarray
+    locode_longitudes: np.ndarray
+    airports: np.ndarray
+    seaports: np.ndarray
+    # Rows of the emission_factors sheet per distance type: method, fuel, load, trade_lane
+    methods: Dict[str, pd.DataFrame]
+
+
+_reference = None
+
+
+def load_reference_sample() -> ReferenceSample:
+    """
+    Reads the LOCODEs with coordinates, the airports with an IATA code, the seaports of
+    the sea routing graph and the emission factor rows from src/data.
+    """
+    global _reference
+    if _reference is None:
+        locodes = load_locode_table(un_locode_file_path)
+        index = locodes.indexes['locode']
+        rows, codes = index.row_codes()
+        airports = load_airport_table(iata_icao_file_path)
+        factors = pd.read_excel(emission_factors_file_path, sheet_name='emission_factors')
+        factors = factors[['method', 'fuel', 'load', 'trade_lane', 'distance_calculation_method']].astype(object)
+        factors = factors.where(factors.notna(), None)
+        # Air methods are requested without their haul, which is picked from the distance
+        air = factors['distance_calculation_method'] == 'air'
+        factors.loc[air, 'method'] = factors.loc[air, 'method'].str.replace(r'_(short|long)_haul$', '', regex=True)
+        factors = factors.drop_duplicates()
+        _reference = ReferenceSample(
+            locodes=codes,
+            locode_countries=np.array([code[:2] for code in codes], dtype=object),
+            locode_latitudes=np.asarray(locodes.latitudes, dtype=np.float64)[rows],
+            locode_longitudes=np.asarray(locodes.longitudes, dtype=np.float64)[rows],
+            airports=airports.indexes['iata'].row_codes()[1],
+            # Routed seaports that are also LOCODEs with coordinates
+            seaports=np.array([code for code in SEAPORTS if code in index], dtype=object),
+            methods={distance_type: rows.drop(columns='distance_calculation_method').reset_index(drop=True)
+                     for distance_type, rows in factors.groupby('distance_calculation_method')},
+        )
+    return _reference
+
+
+def _kinds(n: int, mix: Dict[str, float], rng: np.random.Generator) -> np.ndarray:
+    names = list(mix)
+    weights = np.array([mix[name] for name in names], dtype=np.float64)
+    return np.array(names, dtype=object)[rng.choice(len(names), size=n, p=weights / weights.sum())]
+
+
+def _generate_columns(n: int, seed: int, mix: Optional[Dict[str, float]]) -> Dict[str, np.ndarray]:
+
+    reference = load_reference_sample()
+    rng = np.random.default_rng(seed)
+    kinds = _kinds(n, mix or DEFAULT_MIX, rng)
+    columns = {column: np.full(n, None, dtype=object) for column in INPUT_COLUMNS}
+
+    columns['mass_amount'] = np.round(rng.lognormal(7, 1.5, n), 1)
+    columns['mass_unit'] = np.array(MASS_UNITS, dtype=object)[rng.choice(len(MASS_UNITS), n, p=[0.8, 0.15, 0.05])]
+    columns['shipped_at'] = (pd.Timestamp('2023-01-01', tz='UTC')
+                             + pd.to_timedelta(rng.integers(0, 730 * 24 * 3600, n), unit='s')).strftime('%Y-%m-%dT%H:%M:%SZ').to_numpy(dtype=object)
+
+    for kind in ('air', 'sea', 'land', 'distance'):
+        rows = np.flatnonzero(kinds == kind)
+        if not len(rows):
+            continue
+        methods = reference.methods['land' if kind == 'distance' else kind]
+        picked = methods.iloc[rng.integers(0, len(methods), len(rows))]
+        for column in ('method', 'fuel', 'load', 'trade_lane'):
+            columns[column][rows] = picked[column].to_numpy()
+
+        if kind == 'air':
+            pairs = rng.integers(0, len(reference.airports), (2, len(rows)))
+            columns['source_airport_code'][rows] = reference.airports[pairs[0]]
+            columns['destination_airport_code'][rows] = reference.airports[pairs[1]]
+        elif kind == 'sea':
+            # Most sea legs run between routed seaports, the others between arbitrary LOCODEs
+            ports = np.where(rng.random((2, len(rows))) < 0.8,
+                             reference.seaports[rng.integers(0, len(reference.seaports), (2, len(rows)))],
+                             reference.locodes[rng.integers(0, len(reference.locodes), (2, len(rows)))])
+            columns['source_locode'][rows], columns['destination_locode'][rows] = ports
+        elif kind == 'land':
+            sources = rng.integers(0, len(reference.locodes), len(rows))
+            columns['source_locode'][rows] = reference.locodes[sources]
+            # A destination in the same country: LOCODEs are listed by country, so its neighbours mostly are
+            destinations = np.clip(sources + rng.integers(-50, 51, len(rows)), 0, len(reference.locodes) - 1)
+            same_country = reference.locode_countries[destinations] == reference.locode_countries[sources]
+            destinations = np.where(same_country, destinations, sources)
+            columns['destination_lat'][rows] = reference.locode_latitudes[destinations]
+            columns['destination_lon'][rows] = reference.locode_longitudes[destinations]
+            columns['country_code'][rows] = reference.locode_countries[sources]
+        else:
+            columns['distance'][rows] = np.round(rng.uniform(5, 2_000, len(rows)), 1)
+            columns['distance_unit'][rows] = 'km'
+            columns['country_code'][rows] = reference.locode_countries[rng.integers(0, len(reference.locodes), len(rows))]
+    return columns
+
+
+def generate_batch(n: int, seed: int = 0, mix: Optional[Dict[str, float]] = None) -> pd.DataFrame:
+    """
+    Generates n shipments as a batch DataFrame with the INPUT_COLUMNS.
+
+    Air legs fly between real airport codes, sea legs sail between real LOCODEs (mostly the
+    seaports of the routing graph), land legs run from a LOCODE to the coordinates of another
+    LOCODE in the same country and the rest carry an explicit distance. Methods, fuels, loads
+    and trade lanes are whole rows of the emission factor sheet, so every shipment can be calculated.
+
+    Args:
+        n (int): Number of shipments.
+        seed (int): Seed of the random generator; the same seed gives the same shipments.
+        mix (dict, optional): Share of 'air', 'sea', 'land' and 'distance' shipments (DEFAULT_MIX).
+
+    Returns:
+        pd.DataFrame: The shipments.
+    """
+    return pd.DataFrame(_generate_columns(n, seed, mix))
+
+
+def _location(row: dict, prefix: str) -> dict:
+    if row[f'{prefix}_airport_code'] is not None:
+        return {'airport_code': row[f'{prefix}_airport_code']}
+    if row[f'{prefix}_locode'] is not None:
+        return {'locode': {'locode': row[f'{prefix}_locode']}}
+    if row[f'{prefix}_lat'] is not None:
+        return {'coordinates': {'lat': float(row[f'{prefix}_lat']), 'lon': float(row[f'{prefix}_lon'])}}
+    return {}
+
+
+def generate_shipments(n: int, seed: int = 0, mix: Optional[Dict[str, float]] = None) -> List[dict]:
+    """
+    Generates n shipping_data dicts for calculate_emissions, drawn like generate_batch.
+    """
+    columns = _generate_columns(n, seed, mix)
+    shipments = []
+    for values in zip(*columns.values()):
+        row = dict(zip(columns, values))
+        route = ({'distance': row['distance'], 'unit': row['distance_unit']} if row['distance'] is not None
+                 else {'source': _location(row, 'source'), 'destination': _location(row, 'destination')})
+        shipments.append({
+            'shipment': {'mass': {'amount': float(row['mass_amount']), 'unit': row['mass_unit']}},
+            'route': route,
+            'method': {key: row[key] for key in ('method', 'fuel', 'load', 'trade_lane') if row[key] is not None},
+            'shipped_at': row['shipped_at'],
+            'country_code': row['country_code'],
+        })
+    return shipments
+
+
+if __name__ == "__main__":
+    # Example usage: a few shipments of each kind
+    for shipping_data in generate_shipments(8, seed=1):
+        print(shipping_data)
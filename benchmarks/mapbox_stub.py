@@ -0,0 +1,159 @@
+import sys
+import json
+import math
+import time
+import random
+import hashlib
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import unquote, urlsplit
+
+EARTH_RADIUS = 6371.0
+
+# Road distance / great circle distance of the stub's routes
+DETOUR_FACTOR = 1.3
+
+
+def _great_circle(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return EARTH_RADIUS * 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+
+
+def _coordinates(path_part: str):
+    # 'lon,lat;lon,lat;...' as in the Directions and Matrix APIs
+    return [tuple(float(value) for value in pair.split(','))[::-1] for pair in path_part.split(';')]
+
+
+def _geocode(query: str):
+    # The same query always lands on the same point
+    digest = hashlib.sha1(query.encode()).digest()
+    return int.from_bytes(digest[:4], 'big') / 2 ** 32 * 140 - 60, int.from_bytes(digest[4:8], 'big') / 2 ** 32 * 360 - 180
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        stub = self.server.stub
+        stub.wait()
+        failure = stub.take_failure()
+        if failure is not None:
+            status, retry_after = failure
+            self._send(status, {'message': 'Injected failure'}, {} if retry_after is None else {'Retry-After': str(retry_after)})
+            return
+        path = unquote(urlsplit(self.path).path)
+        if path.startswith('/geocoding/v5/mapbox.places/'):
+            latitude, longitude = _geocode(path[len('/geocoding/v5/mapbox.places/'):-len('.json')])
+            body = {'features': [{'geometry': {'coordinates': [longitude, latitude]}}]}
+        elif path.startswith('/directions/v5/mapbox/driving/'):
+            (lat1, lon1), (lat2, lon2) = _coordinates(path[len('/directions/v5/mapbox/driving/'):])
+            body = {'routes': [{'distance': _great_circle(lat1, lon1, lat2, lon2) * DETOUR_FACTOR * 1000}]}
+        elif path.startswith('/directions-matrix/v1/mapbox/driving/'):
+            points = _coordinates(path[len('/directions-matrix/v1/mapbox/driving/'):])
+            query = dict(part.split('=', 1) for part in urlsplit(self.path).query.split('&') if '=' in part)
+            sources = [int(i) for i in unquote(query.get('sources', '')).split(';') if i]
+            destinations = [int(i) for i in unquote(query.get('destinations', '')).split(';') if i]
+            body = {'distances': [[_great_circle(*points[i], *points[j]) * DETOUR_FACTOR * 1000 for j in destinations]
+                                  for i in sources]}
+        else:
+            self._send(404, {'message': 'Not Found'})
+            return
+        self._send(200, body)
+
+    def _send(self, status: int, body: dict, headers: Optional[dict] = None):
+        data = json.dumps(body).encode()
+        with self.server.stub.lock:
+            self.server.stub.requests += 1
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MapboxStub:
+    """
+    Local stand-in for the Geocoding, Directions and Matrix APIs with a configurable latency.
+
+    Geocoding answers a fixed point per query and routes are the great circle distance
+    times DETOUR_FACTOR, so results are reproducible. Point MAPBOX_API_URL at url.
+    fail makes the next requests fail, e.g. to exercise the client's retries.
+    """
+
+    def __init__(self, latency: float = 0.05, jitter: float = 0.0, host: str = '127.0.0.1', port: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.requests = 0
+        self.lock = threading.Lock()
+        # (status, Retry-After) of the next requests to fail
+        self._failures = []
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._server.stub = self
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def wait(self):
+        delay = self.latency + (random.uniform(-self.jitter, self.jitter) if self.jitter else 0.0)
+        if delay > 0:
+            time.sleep(delay)
+
+    def fail(self, count: int = 1, status: int = 503, retry_after: Optional[float] = None):
+        """
+        Answers the next count requests with status (and a Retry-After header if given).
+        """
+        with self.lock:
+            self._failures.extend([(status, retry_after)] * count)
+
+    def take_failure(self) -> Optional[tuple]:
+        with self.lock:
+            return self._failures.pop(0) if self._failures else None
+
+    def start(self) -> 'MapboxStub':
+        self._thread = threading.Thread(target=self._server.serve_forever, name='mapbox-stub', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Serve a local Mapbox stub with a fixed latency.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency', type=float, default=0.05, help="Seconds added to every response (default 0.05)")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Uniform +/- seconds around the latency")
+    args = parser.parse_args(argv)
+
+    with MapboxStub(args.latency, args.jitter, args.host, args.port) as stub:
+        print(f"Mapbox stub on {stub.url}; set MAPBOX_API_URL={stub.url}", file=sys.stderr)
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
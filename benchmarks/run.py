@@ -0,0 +1,496 @@
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import itertools
+import threading
+import subprocess
+import http.client
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.abspath(os.path.join(HERE, '..', 'src'))
+
+DEFAULT_SIZES = (1_000, 100_000, 1_000_000)
+DEFAULT_CALLS = 2_000
+DEFAULT_MAPBOX_ROWS = 1_000
+DEFAULT_MAPBOX_LATENCY = 0.02
+DEFAULT_COLD_REPEATS = 5
+DEFAULT_SERVICE_CLIENTS = (1, 4, 8)
+DEFAULT_THRESHOLD = 0.10
+DEFAULT_OUTPUT = os.path.join(HERE, 'results.json')
+DEFAULT_BASELINE = os.path.join(HERE, 'baseline.json')
+
+GROUPS = ('cold', 'latency', 'batch', 'mapbox', 'service')
+
+# Metrics compared against the baseline, and whether a higher value is an improvement
+COMPARED_METRICS = {
+    'seconds': False,
+    'p50_us': False,
+    'p99_us': False,
+    'rows_per_second': True,
+    'peak_rss_mb': False,
+}
+
+# Settings every benchmark process runs with: no config.json, no Mapbox cache and offline
+# land legs unless a benchmark asks for Mapbox, so results only depend on the code
+HERMETIC_ENVIRONMENT = {
+    'CALCULATE_EMISSIONS_CONFIG': os.devnull,
+    'MAPBOX_ACCESS_TOKEN': 'benchmark',
+    'MAPBOX_CACHE_PATH': '',
+    'LAND_DISTANCE_MODE': 'offline',
+}
+
+# Added for the Mapbox benchmarks, whose requests only go to the local stub
+MAPBOX_ENVIRONMENT = {
+    'LAND_DISTANCE_MODE': 'mapbox',
+    'MAPBOX_REQUESTS_PER_MINUTE': str(10 ** 9),
+}
+
+# A single air shipment, for the cold start benchmarks
+AIR_SHIPMENT = {
+    "shipment": {"mass": {"amount": 2000.0, "unit": "kg"}},
+    "route": {"source": {"airport_code": "JFK"}, "destination": {"airport_code": "SFO"}},
+    "method": {"method": "cargo_plane"},
+    "shipped_at": "2023-11-20T10:20:30Z",
+    "country_code": "USA",
+}
+
+COLD_START_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+main.calculate_emissions(json.loads(sys.argv[1]), as_json=False)
+print(json.dumps({'import': imported - start, 'first_call': time.perf_counter() - imported}))
+"""
+
+
+def _environment(**overrides) -> dict:
+    environment = {**os.environ, **HERMETIC_ENVIRONMENT, **overrides}
+    environment['PYTHONPATH'] = os.pathsep.join(filter(None, [SRC_DIR, HERE, os.environ.get('PYTHONPATH')]))
+    return environment
+
+
+def peak_rss_mb() -> Optional[float]:
+    """
+    Peak resident set size of this process in MB, or None where it cannot be read.
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def summarize(samples_us: np.ndarray) -> dict:
+    return {
+        'calls': int(len(samples_us)),
+        'mean_us': float(samples_us.mean()),
+        'p50_us': float(np.percentile(samples_us, 50)),
+        'p90_us': float(np.percentile(samples_us, 90)),
+        'p99_us': float(np.percentile(samples_us, 99)),
+        'max_us': float(samples_us.max()),
+    }
+
+
+def measure(function: Callable, inputs: Sequence[tuple], calls: int, warmup: int = 100) -> dict:
+    """
+    Times calls of function one by one, cycling through inputs.
+
+    Args:
+        function (callable): The function under test.
+        inputs (sequence): Argument tuples.
+        calls (int): Number of timed calls.
+        warmup (int): Untimed calls made first, to load lazily built tables.
+
+    Returns:
+        dict: The number of calls and the mean, p50, p90, p99 and max latency in microseconds.
+    """
+    for args in itertools.islice(itertools.cycle(inputs), warmup):
+        function(*args)
+    timer = time.perf_counter_ns
+    samples = np.empty(calls, dtype=np.float64)
+    for i, args in zip(range(calls), itertools.cycle(inputs)):
+        start = timer()
+        function(*args)
+        samples[i] = timer() - start
+    return summarize(samples / 1000)
+
+
+def run_cold_start(repeats: int) -> Dict[str, dict]:
+    """
+    Imports main.py and calculates one air shipment in fresh interpreters.
+    """
+    imports, first_calls = [], []
+    for _ in range(repeats):
+        output = subprocess.run([sys.executable, '-c', COLD_START_SCRIPT, json.dumps(AIR_SHIPMENT)], cwd=SRC_DIR,
+                                env=_environment(), check=True, capture_output=True, text=True).stdout
+        timings = json.loads(output.strip().splitlines()[-1])
+        imports.append(timings['import'])
+        first_calls.append(timings['first_call'])
+    return {
+        'cold.import_main': {'repeats': repeats, 'seconds': float(np.median(imports)), 'min_seconds': min(imports)},
+        'cold.first_call': {'repeats': repeats, 'seconds': float(np.median(first_calls)), 'min_seconds': min(first_calls)},
+    }
+
+
+def run_latency(calls: int, seed: int) -> Dict[str, dict]:
+    """
+    Per-call latency of the single-shipment hot paths, on warm reference data.
+    """
+    from main import calculate_emissions
+    from calculate_emissions.calculate_distance import un_locode_file_path, iata_icao_file_path, emission_factors_file_path
+    from calculate_emissions.calculate_emission_factor import get_emission_factor
+    from calculate_emissions.great_circle import haversine
+    from calculate_emissions.utils import get_coordinates, determine_distance_type, calculate_air_distance
+    from generators import generate_shipments
+
+    shipments = {kind: generate_shipments(1_000, seed, {kind: 1.0}) for kind in ('air', 'sea', 'land', 'distance')}
+    everything = [shipping_data for kind in shipments.values() for shipping_data in kind]
+    rng = np.random.default_rng(seed)
+    points = [tuple(values) for values in np.column_stack([rng.uniform(-80, 80, 1_000), rng.uniform(-180, 180, 1_000),
+                                                           rng.uniform(-80, 80, 1_000), rng.uniform(-180, 180, 1_000)]).tolist()]
+
+    def locations(kind, end):
+        return [(shipping_data['route'][end], un_locode_file_path, iata_icao_file_path) for shipping_data in shipments[kind]]
+
+    cases = {
+        'get_coordinates.locode': (get_coordinates, locations('sea', 'source')),
+        'get_coordinates.airport_code': (get_coordinates, locations('air', 'source')),
+        'get_coordinates.coordinates': (get_coordinates, locations('land', 'destination')),
+        'determine_distance_type': (determine_distance_type,
+                                    [(shipping_data['method'], emission_factors_file_path) for shipping_data in everything]),
+        'get_emission_factor': (get_emission_factor,
+                                [(shipping_data['method'], distance, shipping_data['country_code'])
+                                 for shipping_data, distance in zip(everything, rng.uniform(50, 12_000, len(everything)).tolist())]),
+        'haversine': (haversine, points),
+        'calculate_air_distance': (calculate_air_distance, [((lat1, lon1), (lat2, lon2)) for lat1, lon1, lat2, lon2 in points]),
+    }
+    for kind, kind_shipments in shipments.items():
+        cases[f'calculate_emissions.{kind}'] = (calculate_emissions, [(shipping_data, False) for shipping_data in kind_shipments])
+    cases['calculate_emissions.json'] = (calculate_emissions, [(shipping_data,) for shipping_data in shipments['air']])
+
+    return {f'latency.{name}': measure(function, inputs, calls) for name, (function, inputs) in cases.items()}
+
+
+def run_mapbox_latency(calls: int, seed: int, stub_url: str) -> Dict[str, dict]:
+    """
+    Per-call latency of land shipments calculated with Mapbox, answered by the stub.
+    """
+    from main import calculate_emissions
+    from calculate_emissions.config import reset_config
+    from generators import generate_shipments
+
+    os.environ.update(MAPBOX_ENVIRONMENT, MAPBOX_API_URL=stub_url)
+    reset_config()
+    try:
+        inputs = [(shipping_data, False) for shipping_data in generate_shipments(calls, seed, {'land': 1.0})]
+        return {'latency.calculate_emissions.land_mapbox': measure(calculate_emissions, inputs, calls, warmup=0)}
+    finally:
+        os.environ.update(HERMETIC_ENVIRONMENT)
+        reset_config()
+
+
+def run_batch(rows: int, seed: int, mix: Optional[dict] = None, **environment) -> dict:
+    """
+    Runs one batch in a fresh interpreter, so its peak RSS is its own.
+    """
+    command = [sys.executable, os.path.abspath(__file__), '--batch-worker', str(rows), '--seed', str(seed)]
+    if mix:
+        command += ['--mix', json.dumps(mix)]
+    output = subprocess.run(command, env=_environment(**environment), check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def batch_worker(rows: int, seed: int, mix: Optional[dict]) -> dict:
+    from calculate_emissions.batch import calculate_emissions_batch
+    from calculate_emissions.parallel import load_reference_data
+    from generators import generate_batch
+
+    start = time.perf_counter()
+    load_reference_data()
+    warm_up = time.perf_counter() - start
+    shipments = generate_batch(rows, seed, mix)
+
+    start = time.perf_counter()
+    results = calculate_emissions_batch(shipments)
+    seconds = time.perf_counter() - start
+    return {
+        'rows': rows,
+        'seconds': seconds,
+        'rows_per_second': rows / seconds,
+        'warm_up_seconds': warm_up,
+        'failed_rows': int(results['error'].notna().sum()),
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def _start_service() -> Tuple[subprocess.Popen, str, int]:
+    # The service runs in its own interpreter, so the clients do not compete with it for the GIL
+    service = subprocess.Popen([sys.executable, os.path.join(SRC_DIR, 'calculate_emissions', 'service.py'), '--port', '0'],
+                               env=_environment(), stderr=subprocess.PIPE, text=True)
+    line = service.stderr.readline()
+    if not line.startswith('Serving on http://'):
+        service.kill()
+        raise RuntimeError(f"The service did not start: {line.strip()}")
+    host, port = line.strip()[len('Serving on http://'):].rsplit(':', 1)
+    connection = http.client.HTTPConnection(host, int(port))
+    while True:
+        connection.request('GET', '/readyz')
+        response = connection.getresponse()
+        response.read()
+        if response.status == 200:
+            break
+        time.sleep(0.05)
+    connection.close()
+    return service, host, int(port)
+
+
+def run_service_load(calls: int, seed: int, clients: Sequence[int] = DEFAULT_SERVICE_CLIENTS) -> Dict[str, dict]:
+    """
+    Request latency of the HTTP service under concurrent keep-alive clients posting air and sea shipments.
+
+    Each client holds one connection and sends its share of calls one request after the other,
+    so the latency includes the time requests wait for the other clients' calculations.
+    """
+    from generators import generate_shipments
+
+    bodies = [json.dumps(shipping_data).encode() for shipping_data in generate_shipments(1_000, seed, {'air': 0.5, 'sea': 0.5})]
+    headers = {'Content-Type': 'application/json'}
+    service, host, port = _start_service()
+    try:
+        results = {}
+        for concurrency in clients:
+            per_client = max(calls // concurrency, 1)
+            samples = np.empty((concurrency, per_client), dtype=np.float64)
+            errors = []
+            start_line = threading.Barrier(concurrency + 1)
+
+            def client(index):
+                connection = http.client.HTTPConnection(host, port)
+                inputs = itertools.islice(itertools.cycle(bodies), index * per_client, None)
+                try:
+                    for body in itertools.islice(inputs, 20):
+                        connection.request('POST', '/v1/emissions', body, headers)
+                        connection.getresponse().read()
+                    start_line.wait()
+                    for i, body in zip(range(per_client), inputs):
+                        started = time.perf_counter_ns()
+                        connection.request('POST', '/v1/emissions', body, headers)
+                        response = connection.getresponse()
+                        response.read()
+                        samples[index, i] = time.perf_counter_ns() - started
+                        if response.status != 200:
+                            errors.append(response.status)
+                finally:
+                    connection.close()
+
+            threads = [threading.Thread(target=client, args=(index,)) for index in range(concurrency)]
+            for thread in threads:
+                thread.start()
+            start_line.wait()
+            started = time.perf_counter()
+            for thread in threads:
+                thread.join()
+            seconds = time.perf_counter() - started
+            if errors:
+                raise RuntimeError(f"The service answered {len(errors)} requests with status {errors[0]}")
+            results[f'service.clients_{concurrency}'] = dict(summarize(samples.ravel() / 1000), clients=concurrency,
+                                                             seconds=seconds, requests_per_second=samples.size / seconds)
+        return results
+    finally:
+        service.terminate()
+        service.wait()
+        service.stderr.close()
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def metadata(options: dict) -> dict:
+    import pandas as pd
+    return {
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'options': options,
+    }
+
+
+def compare(results: dict, baseline: dict, threshold: float = DEFAULT_THRESHOLD) -> List[dict]:
+    """
+    Compares the COMPARED_METRICS of every benchmark present in both runs.
+
+    Args:
+        results (dict): The current run, as written by run.
+        baseline (dict): An earlier run.
+        threshold (float): Relative change below which a metric counts as unchanged, e.g. 0.1 for 10%.
+
+    Returns:
+        list: One entry per metric with the 'benchmark', 'metric', 'baseline', 'current' value,
+        relative 'change' and 'verdict' ('improved', 'regressed' or 'unchanged').
+    """
+    comparison = []
+    for name, current in results['benchmarks'].items():
+        previous = baseline.get('benchmarks', {}).get(name)
+        if previous is None:
+            continue
+        for metric, higher_is_better in COMPARED_METRICS.items():
+            if current.get(metric) is None or not previous.get(metric):
+                continue
+            change = current[metric] / previous[metric] - 1
+            improvement = change if higher_is_better else -change
+            verdict = 'unchanged' if abs(change) <= threshold else 'improved' if improvement > 0 else 'regressed'
+            comparison.append({'benchmark': name, 'metric': metric, 'baseline': previous[metric],
+                               'current': current[metric], 'change': change, 'verdict': verdict})
+    return comparison
+
+
+def format_comparison(comparison: List[dict]) -> str:
+    lines = [f"{'benchmark':<45} {'metric':<16} {'baseline':>12} {'current':>12} {'change':>8}  verdict"]
+    for entry in comparison:
+        lines.append(f"{entry['benchmark']:<45} {entry['metric']:<16} {entry['baseline']:>12.4g} "
+                     f"{entry['current']:>12.4g} {entry['change']:>+8.1%}  {entry['verdict']}")
+    return '\n'.join(lines)
+
+
+def run(groups: Sequence[str] = GROUPS, sizes: Sequence[int] = DEFAULT_SIZES, calls: int = DEFAULT_CALLS,
+        mapbox_rows: int = DEFAULT_MAPBOX_ROWS, mapbox_latency: float = DEFAULT_MAPBOX_LATENCY,
+        cold_repeats: int = DEFAULT_COLD_REPEATS, seed: int = 0, progress=None,
+        service_clients: Sequence[int] = DEFAULT_SERVICE_CLIENTS) -> dict:
+    """
+    Runs the benchmark groups.
+
+    Args:
+        groups (sequence): Any of 'cold' (import and first call), 'latency' (per-call percentiles),
+            'batch' (throughput and peak RSS per size), 'mapbox' (land legs against the stub) and
+            'service' (HTTP request latency under concurrent clients).
+        sizes (sequence): Rows of each batch benchmark.
+        calls (int): Timed calls per latency benchmark.
+        mapbox_rows (int): Rows of the Mapbox batch benchmark.
+        mapbox_latency (float): Seconds the Mapbox stub waits before each response.
+        cold_repeats (int): Fresh interpreters started by the cold start benchmarks.
+        seed (int): Seed of the shipment generators.
+        progress (callable, optional): Called with the name of each benchmark group as it starts.
+        service_clients (sequence): Concurrent clients of each service benchmark.
+
+    Returns:
+        dict: 'meta' (machine, versions, commit, options) and 'benchmarks' (metrics by benchmark name).
+    """
+    from mapbox_stub import MapboxStub
+
+    options = {'groups': list(groups), 'sizes': list(sizes), 'calls': calls, 'mapbox_rows': mapbox_rows,
+               'mapbox_latency': mapbox_latency, 'cold_repeats': cold_repeats, 'seed': seed,
+               'service_clients': list(service_clients)}
+    benchmarks = {}
+    progress = progress or (lambda group: None)
+    if 'cold' in groups:
+        progress('cold')
+        benchmarks.update(run_cold_start(cold_repeats))
+    if 'latency' in groups:
+        progress('latency')
+        benchmarks.update(run_latency(calls, seed))
+    if 'batch' in groups:
+        for rows in sizes:
+            progress(f'batch {rows}')
+            benchmarks[f'batch.{rows}'] = run_batch(rows, seed)
+    if 'mapbox' in groups:
+        progress('mapbox')
+        with MapboxStub(mapbox_latency) as stub:
+            benchmarks.update(run_mapbox_latency(min(calls, 200), seed, stub.url))
+            benchmarks[f'batch.mapbox.{mapbox_rows}'] = dict(
+                run_batch(mapbox_rows, seed, {'land': 1.0}, MAPBOX_API_URL=stub.url, **MAPBOX_ENVIRONMENT),
+                stub_latency=mapbox_latency, stub_requests=stub.requests)
+    if 'service' in groups:
+        progress('service')
+        benchmarks.update(run_service_load(calls, seed, service_clients))
+    return {'meta': metadata(options), 'benchmarks': benchmarks}
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the emission calculation hot paths and compare with a baseline.")
+    parser.add_argument('--groups', nargs='+', choices=GROUPS, default=list(GROUPS), help="Benchmark groups to run (default all)")
+    parser.add_argument('--sizes', nargs='+', type=int, default=list(DEFAULT_SIZES),
+                        help="Rows of each batch benchmark (default 1000 100000 1000000)")
+    parser.add_argument('--calls', type=int, default=DEFAULT_CALLS, help=f"Timed calls per latency benchmark (default {DEFAULT_CALLS})")
+    parser.add_argument('--mapbox-rows', type=int, default=DEFAULT_MAPBOX_ROWS,
+                        help=f"Rows of the Mapbox batch benchmark (default {DEFAULT_MAPBOX_ROWS})")
+    parser.add_argument('--mapbox-latency', type=float, default=DEFAULT_MAPBOX_LATENCY,
+                        help=f"Seconds the Mapbox stub waits per request (default {DEFAULT_MAPBOX_LATENCY})")
+    parser.add_argument('--cold-repeats', type=int, default=DEFAULT_COLD_REPEATS,
+                        help=f"Fresh interpreters per cold start benchmark (default {DEFAULT_COLD_REPEATS})")
+    parser.add_argument('--service-clients', nargs='+', type=int, default=list(DEFAULT_SERVICE_CLIENTS),
+                        help="Concurrent clients of each service benchmark (default 1 4 8)")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the shipment generators")
+    parser.add_argument('-o', '--output', default=DEFAULT_OUTPUT, help="Results file (default benchmarks/results.json)")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help="Baseline to compare with (default benchmarks/baseline.json)")
+    parser.add_argument('--save-baseline', action='store_true', help="Also store the results as the new baseline")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help=f"Relative change reported as a difference (default {DEFAULT_THRESHOLD})")
+    parser.add_argument('--fail-on-regression', action='store_true', help="Exit with status 1 when a metric regressed, 2 when there is no baseline")
+    parser.add_argument('--batch-worker', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--mix', type=json.loads, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.batch_worker is not None:
+        # Started by run_batch with the environment of its benchmark
+        print(json.dumps(batch_worker(args.batch_worker, args.seed, args.mix)))
+        return 0
+
+    # A regression check without a baseline would pass without comparing anything; fail before the benchmarks run
+    if args.fail_on_regression and not args.save_baseline and not os.path.isfile(args.baseline):
+        print(f"No baseline at {args.baseline}; create one on the base commit with "
+              f"'python benchmarks/run.py --save-baseline' (baselines are specific to a machine)", file=sys.stderr)
+        return 2
+
+    # The hermetic settings apply to this process too, before the package reads its configuration
+    os.environ.update(HERMETIC_ENVIRONMENT)
+
+    results = run(args.groups, args.sizes, args.calls, args.mapbox_rows, args.mapbox_latency, args.cold_repeats,
+                  args.seed, progress=lambda group: print(f"Running {group}...", file=sys.stderr),
+                  service_clients=args.service_clients)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}", file=sys.stderr)
+
+    status = 0
+    if os.path.isfile(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        comparison = compare(results, baseline, args.threshold)
+        print(f"Compared with {args.baseline} (commit {baseline['meta'].get('commit')}):")
+        print(format_comparison(comparison))
+        if args.fail_on_regression and any(entry['verdict'] == 'regressed' for entry in comparison):
+            status = 1
+    else:
+        print(f"No baseline at {args.baseline}; run with --save-baseline to store one", file=sys.stderr)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline saved to {args.baseline}", file=sys.stderr)
+    return status
+
+
+if __name__ == "__main__":
+    for path in (SRC_DIR, HERE):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+    sys.exit(main())
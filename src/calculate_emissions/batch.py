@@ -0,0 +1,521 @@
+import numpy as np
+import pandas as pd
+from typing import Tuple
+
+try:
+    from calculate_mass import calculate_shipment_mass_batch
+    from calculate_distance import un_locode_file_path, iata_icao_file_path, emission_factors_file_path
+    from calculate_emission_factor import get_emission_factor
+    from factor_registry import get_factor_registry
+    from mapbox_client import get_mapbox_client
+    from reference_data import load_locode_table, load_airport_table
+    from road_distance import land_distance_mode, offline_road_distances, MAPBOX_METHOD, DETOUR_FACTOR_METHOD
+    from sea_routing import load_sea_router, SEA_ROUTE_METHOD, SEA_FALLBACK_METHOD
+    from spatial_index import hub_snapping_enabled, snap_to_hubs, SNAP_FACILITIES
+    from utils import address_query, determine_distance_type
+    from great_circle import great_circle_distances
+    from instrumentation import instrumentation
+    from batch_planner import plan_batch
+    from country_codes import normalize_country_code
+except ImportError:
+    from calculate_emissions.calculate_mass import calculate_shipment_mass_batch
+    from calculate_emissions.calculate_distance import un_locode_file_path, iata_icao_file_path, emission_factors_file_path
+    from calculate_emissions.calculate_emission_factor import get_emission_factor
+    from calculate_emissions.factor_registry import get_factor_registry
+    from calculate_emissions.mapbox_client import get_mapbox_client
+    from calculate_emissions.reference_data import load_locode_table, load_airport_table
+    from calculate_emissions.road_distance import land_distance_mode, offline_road_distances, MAPBOX_METHOD, DETOUR_FACTOR_METHOD
+    from calculate_emissions.sea_routing import load_sea_router, SEA_ROUTE_METHOD, SEA_FALLBACK_METHOD
+    from calculate_emissions.spatial_index import hub_snapping_enabled, snap_to_hubs, SNAP_FACILITIES
+    from calculate_emissions.utils import address_query, determine_distance_type
+    from calculate_emissions.great_circle import great_circle_distances
+    from calculate_emissions.instrumentation import instrumentation
+    from calculate_emissions.batch_planner import plan_batch
+    from calculate_emissions.country_codes import normalize_country_code
+
+# Input columns understood by calculate_emissions_batch; all of them are optional.
+# Each row mirrors one shipping_data dict accepted by calculate_emissions, flattened.
+INPUT_COLUMNS = [
+    'mass_amount', 'mass_unit', 'containers', 'cargo_type',
+    'distance', 'distance_unit',
+    'source_locode', 'source_lat', 'source_lon', 'source_address', 'source_airport_code',
+    'destination_locode', 'destination_lat', 'destination_lon', 'destination_address', 'destination_airport_code',
+    'method', 'vessel_type', 'fuel', 'load', 'trade_lane',
+    'country_code', 'shipped_at',
+]
+
+OUTPUT_COLUMNS = [
+    'emissions',
+    'shipment_mass',
+    'distance',
+    'distance_calculation_method',
+    'emission_factor',
+    'emission_factor_calculation_method',
+    'dataset_version',
+    'error',
+]
+
+# Land legs are labelled by the method that produced them, see LAND_DISTANCE_MODE
+DISTANCE_CALCULATION_METHODS = {
+    'air': 'great_circle_distance',
+    'sea': SEA_ROUTE_METHOD,
+}
+
+
+def flatten_shipping_data(shipping_data: dict) -> dict:
+    """
+    Flattens one shipping_data dict, as accepted by calculate_emissions, into a batch row.
+
+    Args:
+        shipping_data (dict): The nested shipment, route and method details.
+
+    Returns:
+        dict: The INPUT_COLUMNS values of the shipment; missing fields are None.
+    """
+    shipment = shipping_data.get('shipment') or {}
+    mass = shipment.get('mass') or {}
+    route = shipping_data.get('route') or {}
+    method = shipping_data.get('method') or {}
+    row = {
+        'mass_amount': mass.get('amount'),
+        'mass_unit': mass.get('unit'),
+        'containers': shipment.get('containers'),
+        'cargo_type': shipment.get('cargo_type'),
+        'distance': route.get('distance'),
+        'distance_unit': route.get('unit'),
+        'method': method.get('method'),
+        'vessel_type': method.get('vessel_type'),
+        'fuel': method.get('fuel'),
+        'load': method.get('load'),
+        'trade_lane': method.get('trade_lane'),
+        'country_code': shipping_data.get('country_code'),
+        'shipped_at': shipping_data.get('shipped_at'),
+    }
+    for prefix in ('source', 'destination'):
+        location = route.get(prefix) or {}
+        coordinates = location.get('coordinates') or {}
+        row[f'{prefix}_locode'] = (location.get('locode') or {}).get('locode')
+        row[f'{prefix}_lat'] = coordinates.get('lat')
+        row[f'{prefix}_lon'] = coordinates.get('lon')
+        row[f'{prefix}_address'] = location.get('address')
+        row[f'{prefix}_airport_code'] = location.get('airport_code')
+    return row
+
+
+def _column(df: pd.DataFrame, name: str, dtype=object) -> np.ndarray:
+    if name not in df.columns:
+        return np.full(len(df), np.nan if dtype is np.float64 else None, dtype=dtype)
+    values = df[name]
+    if dtype is np.float64:
+        return pd.to_numeric(values, errors='coerce').to_numpy(dtype=np.float64)
+    # Normalize every flavour of missing value (NaN, pd.NA, '') to None
+    values = values.astype(object).to_numpy()
+    return np.array([None if v is None or v is pd.NA or v == '' or (isinstance(v, float) and np.isnan(v)) else v
+                     for v in values], dtype=object)
+
+
+def _row_mask(n: int, rows) -> np.ndarray:
+    mask = np.zeros(n, dtype=bool)
+    mask[rows] = True
+    return mask
+
+
+def _set_error(errors: np.ndarray, mask: np.ndarray, message: str):
+    # Keep the first error recorded for a row
+    errors[mask & (errors == None)] = message  # noqa: E711 - elementwise comparison
+
+
+def _resolve_endpoint(df: pd.DataFrame, prefix: str, rows: np.ndarray, errors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Resolves one route endpoint for the selected rows, following the precedence of get_coordinates:
+    locode, then coordinates, then address, then airport code, else (0.0, 0.0).
+    """
+    n = len(df)
+    latitudes = np.zeros(n)
+    longitudes = np.zeros(n)
+    pending = rows.copy()
+
+    locodes = _column(df, f'{prefix}_locode')
+    has_locode = pending & (locodes != None)  # noqa: E711
+    if has_locode.any():
+        with instrumentation.timed('coordinates', 'locode', int(has_locode.sum())):
+            lat, lon, found = load_locode_table(un_locode_file_path).get_many('locode', locodes[has_locode])
+            latitudes[has_locode], longitudes[has_locode] = lat, lon
+        _set_error(errors, _row_mask(n, np.flatnonzero(has_locode)[~found]), f"Coordinates not found for {prefix} LOCODE")
+        pending &= ~has_locode
+
+    lat_values = _column(df, f'{prefix}_lat', np.float64)
+    lon_values = _column(df, f'{prefix}_lon', np.float64)
+    # Zero coordinates are treated as missing, as in get_coordinates
+    has_coordinates = pending & (np.nan_to_num(lat_values) != 0) & (np.nan_to_num(lon_values) != 0)
+    latitudes[has_coordinates] = lat_values[has_coordinates]
+    longitudes[has_coordinates] = lon_values[has_coordinates]
+    pending &= ~has_coordinates
+
+    addresses = _column(df, f'{prefix}_address')
+    has_address = pending & (addresses != None)  # noqa: E711
+    if has_address.any():
+        address_rows = np.flatnonzero(has_address)
+        queries = [address if isinstance(address, str) else address_query(address) for address in addresses[address_rows]]
+        # Unique queries are geocoded concurrently; repeated addresses share one request
+        unique_queries = list(dict.fromkeys(queries))
+        with instrumentation.timed('coordinates', 'address', len(address_rows)):
+            geocoded = dict(zip(unique_queries, get_mapbox_client().geocode_many(unique_queries, return_exceptions=True)))
+        for row, query in zip(address_rows, queries):
+            result = geocoded[query]
+            if isinstance(result, Exception):
+                errors[row] = errors[row] or f"An error occurred while geocoding {prefix} address: {result}"
+                latitudes[row] = longitudes[row] = np.nan
+            else:
+                latitudes[row], longitudes[row] = result
+        pending &= ~has_address
+
+    airport_codes = _column(df, f'{prefix}_airport_code')
+    has_airport = pending & (airport_codes != None)  # noqa: E711
+    if has_airport.any():
+        airports = load_airport_table(iata_icao_file_path)
+        codes = airport_codes[has_airport].astype(str)
+        lengths = np.char.str_len(codes)
+        lat = np.full(len(codes), np.nan)
+        lon = np.full(len(codes), np.nan)
+        found = np.zeros(len(codes), dtype=bool)
+        with instrumentation.timed('coordinates', 'airport_code', len(codes)):
+            for length, index_name in ((3, 'iata'), (4, 'icao')):
+                selected = lengths == length
+                if selected.any():
+                    lat[selected], lon[selected], found[selected] = airports.get_many(index_name, codes[selected])
+        latitudes[has_airport], longitudes[has_airport] = lat, lon
+        _set_error(errors, _row_mask(n, np.flatnonzero(has_airport)[~found]), f"Coordinates not found for {prefix} airport code")
+
+    return latitudes, longitudes
+
+
+def _country_codes(df: pd.DataFrame, prefix: str) -> np.ndarray:
+    """
+    Alpha-2 country code of each endpoint, following get_country_code: the LOCODE prefix, then the address country.
+    """
+    locodes = _column(df, f'{prefix}_locode')
+    addresses = _column(df, f'{prefix}_address')
+    countries = [locode[:2] if locode else address.get('country_code') if isinstance(address, dict) else None
+                 for locode, address in zip(locodes, addresses)]
+    return np.array([normalize_country_code(country) for country in countries], dtype=object)
+
+
+def _provided_distances(df: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
+    provided = _column(df, 'distance', np.float64)
+    return provided, ~np.isnan(provided) & (provided != 0)
+
+
+def _method_keys(df: pd.DataFrame) -> np.ndarray:
+    # The distance type follows the method, or the vessel type when no method is given
+    method_names = _column(df, 'method')
+    return np.where(method_names != None, method_names, _column(df, 'vessel_type'))  # noqa: E711
+
+
+def _distance_types(method_keys: np.ndarray, rows: np.ndarray) -> np.ndarray:
+    # One distance type lookup per distinct method
+    distance_types = np.empty(len(method_keys), dtype=object)
+    for method_key in pd.unique(method_keys[rows]):
+        selected = rows & (method_keys == method_key)
+        distance_types[selected] = determine_distance_type({'method': method_key}, emission_factors_file_path) if method_key else None
+    return distance_types
+
+
+def requires_network(shipments: pd.DataFrame) -> np.ndarray:
+    """
+    Flags the shipments whose calculation calls Mapbox: endpoints resolved from an
+    address, or land legs routed by Mapbox (any LAND_DISTANCE_MODE other than 'offline').
+
+    Args:
+        shipments (pd.DataFrame): One row per shipment, with the INPUT_COLUMNS.
+
+    Returns:
+        np.ndarray: A boolean mask, True for the rows that need the network.
+    """
+    n = len(shipments)
+    routed = ~_provided_distances(shipments)[1]
+    network = np.zeros(n, dtype=bool)
+    for prefix in ('source', 'destination'):
+        # Addresses are only geocoded when neither a LOCODE nor coordinates are given
+        latitudes = np.nan_to_num(_column(shipments, f'{prefix}_lat', np.float64))
+        longitudes = np.nan_to_num(_column(shipments, f'{prefix}_lon', np.float64))
+        network |= ((_column(shipments, f'{prefix}_address') != None)  # noqa: E711
+                    & (_column(shipments, f'{prefix}_locode') == None)  # noqa: E711
+                    & ((latitudes == 0) | (longitudes == 0)))
+    network &= routed
+    if routed.any() and land_distance_mode() != 'offline':
+        network |= routed & (_distance_types(_method_keys(shipments), routed) == 'land')
+    return network
+
+
+def _snap_endpoints(df: pd.DataFrame, rows: np.ndarray, distance_types: np.ndarray, coordinates: Tuple[np.ndarray, ...]):
+    """
+    Moves endpoints given as coordinates or an address to the nearest airport (air legs) or
+    seaport (sea legs), in place; LOCODE and airport code endpoints are already hubs.
+    """
+    source_lat, source_lon, destination_lat, destination_lon = coordinates
+    for prefix, latitudes, longitudes in (('source', source_lat, source_lon), ('destination', destination_lat, destination_lon)):
+        raw = (rows & (_column(df, f'{prefix}_locode') == None)  # noqa: E711
+               & (_column(df, f'{prefix}_airport_code') == None)  # noqa: E711
+               & ~np.isnan(latitudes) & ~np.isnan(longitudes))
+        for distance_type in SNAP_FACILITIES:
+            selected = raw & (distance_types == distance_type)
+            if selected.any():
+                latitudes[selected], longitudes[selected], _ = snap_to_hubs(latitudes[selected], longitudes[selected], distance_type)
+
+
+def _calculate_distances(df: pd.DataFrame, method_keys: np.ndarray, errors: np.ndarray):
+    n = len(df)
+    distances = np.zeros(n)
+    calculation_methods = np.full(n, '', dtype=object)
+
+    # Directly provided distances
+    provided, has_distance = _provided_distances(df)
+    units = _column(df, 'distance_unit')
+    with instrumentation.timed('distance', 'user_provided', int(has_distance.sum())):
+        distances[has_distance] = np.select([units == 'mi', units == 'nm'],
+                                            [provided * 1.60934, provided * 1.852], provided)[has_distance]
+    calculation_methods[has_distance] = 'user_provided'
+
+    routed = ~has_distance
+    if not routed.any():
+        return distances, calculation_methods
+
+    distance_types = _distance_types(method_keys, routed)
+
+    # Frequently used port pairs are answered from the precomputed sea route matrix
+    sea_router = load_sea_router()
+    sea = routed & (distance_types == 'sea')
+    if sea.any():
+        with instrumentation.timed('distance', SEA_ROUTE_METHOD, int(sea.sum())):
+            port_distances = sea_router.port_distances_many(_column(df, 'source_locode')[sea], _column(df, 'destination_locode')[sea])
+        found = ~np.isnan(port_distances)
+        ports = _row_mask(n, np.flatnonzero(sea)[found])
+        distances[ports] = port_distances[found]
+        calculation_methods[ports] = SEA_ROUTE_METHOD
+        routed &= ~ports
+
+    source_lat, source_lon = _resolve_endpoint(df, 'source', routed, errors)
+    destination_lat, destination_lon = _resolve_endpoint(df, 'destination', routed, errors)
+
+    if hub_snapping_enabled():
+        with instrumentation.timed('coordinates', 'hub_snapping', int(routed.sum())):
+            _snap_endpoints(df, routed, distance_types, (source_lat, source_lon, destination_lat, destination_lon))
+
+    # Each distinct lane is calculated once and kept in the great circle memo
+    great_circle = np.zeros(n)
+    with instrumentation.timed('distance', DISTANCE_CALCULATION_METHODS['air'], int(routed.sum())):
+        great_circle[routed] = great_circle_distances(source_lat[routed], source_lon[routed], destination_lat[routed], destination_lon[routed])
+
+    air = routed & (distance_types == 'air')
+    distances[air] = great_circle[air]
+
+    sea = routed & (distance_types == 'sea')
+    sea_fallback = np.zeros(n, dtype=bool)
+    if sea.any():
+        with instrumentation.timed('distance', SEA_ROUTE_METHOD, int(sea.sum())):
+            sea_distances = sea_router.route_distances(source_lat[sea], source_lon[sea], destination_lat[sea], destination_lon[sea])
+        # Legs the sea routing graph cannot route fall back to the great circle distance times 2
+        sea_fallback[sea] = np.isnan(sea_distances)
+        distances[sea] = np.where(sea_fallback[sea], great_circle[sea] * 2, sea_distances)
+
+    land = routed & (distance_types == 'land')
+    if land.any():
+        mode = land_distance_mode()
+        calculation_methods[land] = DETOUR_FACTOR_METHOD if mode == 'offline' else MAPBOX_METHOD
+        land_rows = np.flatnonzero(land & (errors == None))  # noqa: E711
+        offline_rows = land_rows
+
+        if mode != 'offline':
+            lanes = list(zip(source_lat[land_rows], source_lon[land_rows], destination_lat[land_rows], destination_lon[land_rows]))
+            # Unique lanes are routed concurrently through the pooled Mapbox client, with Matrix
+            # requests when the lanes share enough sources and destinations
+            unique_lanes = list(dict.fromkeys(lanes))
+            with instrumentation.timed('distance', MAPBOX_METHOD, len(lanes)):
+                routed_distances = get_mapbox_client().lane_distances(
+                    [(lane[:2], lane[2:]) for lane in unique_lanes], return_exceptions=True)
+            lane_distances = dict(zip(unique_lanes, routed_distances))
+            failed = []
+            for row, lane in zip(land_rows, lanes):
+                result = lane_distances[lane]
+                if not isinstance(result, Exception):
+                    distances[row] = result
+                elif mode == 'mapbox':
+                    errors[row] = errors[row] or f"An error occurred while calculating land distance: {result}"
+                    distances[row] = np.nan
+                else:
+                    failed.append(row)
+            offline_rows = np.array(failed, dtype=np.int64)
+
+        if len(offline_rows):
+            source_countries = _country_codes(df, 'source')[offline_rows]
+            destination_countries = _country_codes(df, 'destination')[offline_rows]
+            with instrumentation.timed('distance', DETOUR_FACTOR_METHOD, len(offline_rows)):
+                distances[offline_rows], calculation_methods[offline_rows] = offline_road_distances(
+                    source_lat[offline_rows], source_lon[offline_rows], destination_lat[offline_rows], destination_lon[offline_rows],
+                    source_countries, destination_countries)
+
+    for distance_type, calculation_method in DISTANCE_CALCULATION_METHODS.items():
+        calculation_methods[routed & (distance_types == distance_type)] = calculation_method
+    calculation_methods[sea_fallback] = SEA_FALLBACK_METHOD
+
+    return distances, calculation_methods
+
+
+def _get_emission_factors(df: pd.DataFrame, method_names: np.ndarray, distances: np.ndarray, errors: np.ndarray,
+                          versions: np.ndarray):
+    n = len(df)
+    emission_factors = np.full(n, np.nan)
+    calculation_methods = np.full(n, None, dtype=object)
+
+    fuels = _column(df, 'fuel')
+    loads = _column(df, 'load')
+    trade_lanes = _column(df, 'trade_lane')
+    country_codes = _column(df, 'country_code')
+    # Haul classification only matters for planes; it is part of the lookup key
+    long_haul = distances > 1600
+
+    keys = pd.DataFrame({
+        'method': method_names, 'fuel': fuels, 'load': loads, 'trade_lane': trade_lanes,
+        'country_code': country_codes, 'long_haul': long_haul, 'version': versions,
+    })
+    groups = keys.groupby(list(keys.columns), dropna=False, sort=False).indices
+    for (method_name, fuel, load, trade_lane, country_code, _, version), rows in groups.items():
+        if not isinstance(method_name, str):
+            _set_error(errors, _row_mask(n, rows), "Method must be provided")
+            continue
+        method = {'method': method_name, 'fuel': fuel, 'load': load, 'trade_lane': trade_lane}
+        method = {k: (None if not isinstance(v, str) else v) for k, v in method.items()}
+        try:
+            emission_factor, calculation_method = get_emission_factor(
+                method, distances[rows[0]], country_code if isinstance(country_code, str) else None, version)
+        except ValueError as e:
+            _set_error(errors, _row_mask(n, rows), str(e))
+            continue
+        emission_factors[rows] = emission_factor
+        calculation_methods[rows] = calculation_method
+
+    return emission_factors, calculation_methods
+
+
+def resolve_dataset_versions(df: pd.DataFrame, factor_version: str = None) -> np.ndarray:
+    """
+    Resolve the emission factor dataset of each shipment.
+
+    Parameters:
+    - df (pd.DataFrame): The shipments.
+    - factor_version (str, optional): The dataset for every row; by default each row uses the
+      dataset that applied on its 'shipped_at', or the active one.
+
+    Returns:
+    - np.ndarray: The dataset version of each row.
+    """
+    registry = get_factor_registry()
+    if factor_version:
+        return np.full(len(df), registry.get(factor_version).version, dtype=object)
+    return registry.resolve_many(_column(df, 'shipped_at'))
+
+
+def calculate_emissions_batch(shipments, factor_version: str = None):
+    """
+    Calculate the emissions for many shipments at once.
+
+    Each input row is one shipment using the flat columns listed in INPUT_COLUMNS.
+    Mass conversion, coordinate resolution, great circle distances, haul
+    classification and emission factor lookups run once over the whole batch;
+    Mapbox calls run concurrently, once per distinct address or lane, and factor
+    lookups are made once per distinct key. Shipments that share their route,
+    method and dataset are planned together (see batch_planner.py), so each
+    distinct lane is resolved and routed once and its result scattered back.
+
+    Parameters:
+    - shipments (pd.DataFrame, pyarrow.Table or dict of columns): One row per shipment.
+    - factor_version (str, optional): The emission factor dataset for every row. By default each
+      row uses the dataset that applied on its 'shipped_at', or the active one.
+
+    Returns:
+    - pd.DataFrame (or pyarrow.Table if one was passed): The OUTPUT_COLUMNS for each shipment,
+      aligned with the input. Rows that could not be calculated have NaN emissions and an 'error'.
+    """
+    is_arrow = hasattr(shipments, 'to_pandas') and not isinstance(shipments, pd.DataFrame)
+    if is_arrow:
+        df = shipments.to_pandas()
+    elif isinstance(shipments, pd.DataFrame):
+        df = shipments
+    else:
+        df = pd.DataFrame(shipments)
+
+    n = len(df)
+    errors = np.full(n, None, dtype=object)
+
+    # Calculate the shipment mass
+    with instrumentation.timed('mass', None, n):
+        shipment_mass = calculate_shipment_mass_batch(
+            _column(df, 'mass_amount', np.float64), _column(df, 'mass_unit'),
+            _column(df, 'containers', np.float64), _column(df, 'cargo_type'))
+    _set_error(errors, np.isnan(shipment_mass), "Either mass or containers must be provided.")
+
+    # Group the shipments by lane, method and the dataset each one is calculated with
+    with instrumentation.timed('batch_plan', None, n):
+        versions = resolve_dataset_versions(df, factor_version)
+        plan = plan_batch(df, versions, errors != None)  # noqa: E711
+    if instrumentation.enabled:
+        instrumentation.cache('batch_plan', hits=plan.rows - plan.unique, misses=plan.unique)
+    lanes = df if plan.is_trivial else df.iloc[plan.unique_rows]
+    lane_errors = errors if plan.is_trivial else errors[plan.unique_rows]
+
+    # Calculate the distance
+    method_names = _column(lanes, 'method')
+    distances, distance_calculation_methods = _calculate_distances(lanes, _method_keys(lanes), lane_errors)
+
+    # Get the emission factor, from the dataset each shipment is calculated with
+    with instrumentation.timed('emission_factor', None, plan.unique):
+        emission_factors, emission_factor_calculation_methods = _get_emission_factors(
+            lanes, method_names, distances, lane_errors, versions if plan.is_trivial else versions[plan.unique_rows])
+
+    distances = plan.scatter(distances)
+    distance_calculation_methods = plan.scatter(distance_calculation_methods)
+    emission_factors = plan.scatter(emission_factors)
+    emission_factor_calculation_methods = plan.scatter(emission_factor_calculation_methods)
+    errors = plan.scatter(lane_errors)
+
+    # Calculate emissions
+    emissions = shipment_mass * distances * emission_factors
+    failed = errors != None  # noqa: E711
+    emissions[failed] = np.nan
+    if instrumentation.enabled and failed.any():
+        for message, count in pd.Series(errors[failed]).value_counts().items():
+            instrumentation.error(message, int(count))
+
+    result = pd.DataFrame({
+        'emissions': emissions,
+        'shipment_mass': shipment_mass,
+        'distance': distances,
+        'distance_calculation_method': distance_calculation_methods,
+        'emission_factor': emission_factors,
+        'emission_factor_calculation_method': emission_factor_calculation_methods,
+        'dataset_version': versions,
+        'error': errors,
+    }, index=df.index)
+
+    if is_arrow:
+        import pyarrow as pa
+        return pa.Table.from_pandas(result, preserve_index=False)
+    return result
+
+
+if __name__ == "__main__":
+    # Example usage
+    shipments = pd.DataFrame({
+        'mass_amount': [2000.0, 10.0, None],
+        'mass_unit': ['kg', 't', None],
+        'containers': [None, None, 2],
+        'source_airport_code': ['JFK', None, None],
+        'destination_airport_code': ['SFO', None, None],
+        'source_locode': [None, 'NLRTM', 'DEHAM'],
+        'destination_locode': [None, 'USNYC', 'NLRTM'],
+        'method': ['cargo_plane', 'sea_general_cargo_10dwkt_vlsfo', 'container_ship'],
+        'trade_lane': [None, None, 'aggregated_transsuez'],
+    })
+
+    print(calculate_emissions_batch(shipments).to_string())
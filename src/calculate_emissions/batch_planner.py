@@ -0,0 +1,196 @@
+import json
+import numpy as np
+import pandas as pd
+from typing import Optional
+
+# Columns compared as numbers, so '2000' and 2000.0 are the same input
+NUMERIC_COLUMNS = ('mass_amount', 'containers', 'distance', 'source_lat', 'source_lon', 'destination_lat', 'destination_lon')
+
+# Hashes of a missing value, used for absent columns and for fields a row does not use
+MISSING_TEXT = pd.util.hash_array(np.array([None], dtype=object))[0]
+MISSING_NUMBER = pd.util.hash_array(np.array([np.nan]))[0]
+
+_MULTIPLIER = np.uint64(1_000_003)
+
+
+def text_hashes(df: pd.DataFrame, name: str) -> np.ndarray:
+    """
+    Hashes a text column; None, NaN and '' all count as missing.
+
+    Structured addresses (dicts) are compared by content, whatever the order of their fields.
+
+    Args:
+        df (pd.DataFrame): The shipments.
+        name (str): The column to hash.
+
+    Returns:
+        np.ndarray: One uint64 hash per row (MISSING_TEXT for every row if the column is absent).
+    """
+    if name not in df.columns:
+        return np.full(len(df), MISSING_TEXT, dtype=np.uint64)
+    values = df[name].to_numpy(dtype=object)
+    if name.endswith('_address'):
+        present = np.flatnonzero(values != None)  # noqa: E711 - elementwise comparison
+        structured = present[[isinstance(values[i], dict) for i in present]]
+        if len(structured):
+            values = values.copy()
+            values[structured] = [json.dumps(values[i], sort_keys=True) for i in structured]
+    values = np.where(values == '', None, values)
+    return pd.util.hash_array(values, categorize=True)
+
+
+def numbers(df: pd.DataFrame, name: str) -> np.ndarray:
+    """
+    Returns a numeric column as float64, NaN where it is absent or not a number.
+    """
+    if name not in df.columns:
+        return np.full(len(df), np.nan)
+    return pd.to_numeric(df[name], errors='coerce').to_numpy(dtype=np.float64)
+
+
+def number_hashes(df: pd.DataFrame, name: str) -> np.ndarray:
+    """
+    Hashes a numeric column compared as numbers; NaN and non-numeric values count as missing.
+    """
+    if name not in df.columns:
+        return np.full(len(df), MISSING_NUMBER, dtype=np.uint64)
+    return _hash_numbers(numbers(df, name))
+
+
+def _hash_numbers(values: np.ndarray) -> np.ndarray:
+    # Adding 0.0 turns -0.0 into 0.0
+    return pd.util.hash_array(values + 0.0)
+
+
+def combine_hashes(keys: np.ndarray, hashes) -> np.ndarray:
+    """
+    Folds one more column of hashes into the running keys (multiply-xor; uint64 arithmetic wraps around).
+    """
+    return keys * _MULTIPLIER ^ hashes
+
+
+def calculation_keys(df: pd.DataFrame, dataset_versions: np.ndarray, failed: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Hashes everything that the distance and emission factor of a shipment depend on.
+
+    Location specs are canonical: an endpoint given by LOCODE is keyed by the LOCODE
+    alone, as its coordinates, address and airport code are never read, and a
+    shipment with a distance of its own is keyed by that distance instead of its
+    endpoints. Likewise the vessel type only counts when no method is given. The
+    mass is not part of the key, as it is calculated row by row.
+
+    Args:
+        df (pd.DataFrame): The shipments, with the batch INPUT_COLUMNS.
+        dataset_versions (np.ndarray): The emission factor dataset of each shipment.
+        failed (np.ndarray, optional): Rows that already failed (e.g. on their mass); they
+            skip the network calls of the distance calculation, so they are planned apart.
+
+    Returns:
+        np.ndarray: One uint64 key per row.
+    """
+    n = len(df)
+    keys = np.zeros(n, dtype=np.uint64)
+
+    distances = numbers(df, 'distance')
+    provided = ~np.isnan(distances) & (distances != 0)
+    keys = combine_hashes(keys, np.where(provided, _hash_numbers(distances), MISSING_NUMBER))
+    keys = combine_hashes(keys, np.where(provided, text_hashes(df, 'distance_unit'), MISSING_TEXT))
+
+    for prefix in ('source', 'destination'):
+        locodes = text_hashes(df, f'{prefix}_locode')
+        has_locode = locodes != MISSING_TEXT
+        keys = combine_hashes(keys, np.where(provided, MISSING_TEXT, locodes))
+        unused = provided | has_locode
+        for name in (f'{prefix}_lat', f'{prefix}_lon'):
+            keys = combine_hashes(keys, np.where(unused, MISSING_NUMBER, number_hashes(df, name)))
+        for name in (f'{prefix}_address', f'{prefix}_airport_code'):
+            keys = combine_hashes(keys, np.where(unused, MISSING_TEXT, text_hashes(df, name)))
+
+    methods = text_hashes(df, 'method')
+    keys = combine_hashes(keys, methods)
+    keys = combine_hashes(keys, np.where(methods == MISSING_TEXT, text_hashes(df, 'vessel_type'), MISSING_TEXT))
+    for name in ('fuel', 'load', 'trade_lane', 'country_code'):
+        keys = combine_hashes(keys, text_hashes(df, name))
+
+    keys = combine_hashes(keys, pd.util.hash_array(np.asarray(dataset_versions, dtype=object), categorize=True))
+    if failed is not None:
+        keys = combine_hashes(keys, np.asarray(failed, dtype=np.uint64))
+    return keys
+
+
+class BatchPlan:
+    """
+    Groups the shipments of a batch that share a calculation key (see calculation_keys).
+
+    The distance and emission factor are calculated for unique_rows only, one
+    representative shipment per key, and scattered back to every row with scatter.
+    """
+
+    def __init__(self, keys: np.ndarray):
+        self.inverse, uniques = pd.factorize(keys)
+        # Codes are numbered in order of first appearance, so a row holds the first
+        # occurrence of its code when the code exceeds every code before it
+        previous = np.maximum.accumulate(np.concatenate([[-1], self.inverse[:-1]]))
+        self.unique_rows = np.flatnonzero(self.inverse > previous)
+
+    @property
+    def rows(self) -> int:
+        return len(self.inverse)
+
+    @property
+    def unique(self) -> int:
+        return len(self.unique_rows)
+
+    @property
+    def is_trivial(self) -> bool:
+        """
+        True when every row is unique, so there is nothing to deduplicate.
+        """
+        return self.unique == self.rows
+
+    @property
+    def dedup_ratio(self) -> float:
+        """
+        Rows per calculation, e.g. 20.0 when twenty shipments share each lane on average.
+        """
+        return self.rows / self.unique if self.unique else 1.0
+
+    def scatter(self, values: np.ndarray) -> np.ndarray:
+        """
+        Expands values computed for unique_rows to every row of the batch.
+        """
+        return values if self.is_trivial else values[self.inverse]
+
+    def __str__(self) -> str:
+        return f"{self.rows} shipments in {self.unique} unique calculations (dedup ratio {self.dedup_ratio:.1f})"
+
+
+def plan_batch(df: pd.DataFrame, dataset_versions: np.ndarray, failed: Optional[np.ndarray] = None) -> BatchPlan:
+    """
+    Plans a batch so that each distinct lane, method and dataset is calculated once.
+
+    Args:
+        df (pd.DataFrame): The shipments, with the batch INPUT_COLUMNS.
+        dataset_versions (np.ndarray): The emission factor dataset of each shipment.
+        failed (np.ndarray, optional): Rows that already failed, see calculation_keys.
+
+    Returns:
+        BatchPlan: The representative rows and how to scatter their results back.
+    """
+    return BatchPlan(calculation_keys(df, dataset_versions, failed))
+
+
+if __name__ == "__main__":
+    # Example usage: 1000 shipments over three lanes
+    lanes = pd.DataFrame({
+        'source_locode': ['NLRTM', 'DEHAM', None],
+        'destination_locode': ['USNYC', 'NLRTM', None],
+        'source_airport_code': [None, None, 'JFK'],
+        'destination_airport_code': [None, None, 'SFO'],
+        'method': ['container_ship', 'container_ship', 'cargo_plane'],
+    })
+    shipments = lanes.sample(1000, replace=True, random_state=0).reset_index(drop=True)
+    shipments['mass_amount'] = np.arange(1000.0)
+
+    plan = plan_batch(shipments, np.full(len(shipments), 'bundled', dtype=object))
+    print(plan)
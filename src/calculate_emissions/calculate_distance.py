@@ -1,68 +1,104 @@
 import os
-import json
-import sys
 
 try:
     from utils import (
         convert_distance_to_km,
         get_coordinates,
-        determine_distance_type,
-        calculate_land_distance,
-        calculate_air_distance,
-        calculate_sea_distance
+        get_country_code,
+        determine_distance_type
     )
+    from great_circle import great_circle_distance
+    from road_distance import calculate_road_distance
+    from sea_routing import load_sea_router, calculate_sea_route_distance, SEA_ROUTE_METHOD
+    from instrumentation import instrumentation, timer
 except ImportError:
     from calculate_emissions.utils import (
         convert_distance_to_km,
         get_coordinates,
-        determine_distance_type,
-        calculate_land_distance,
-        calculate_air_distance,
-        calculate_sea_distance
+        get_country_code,
+        determine_distance_type
     )
+    from calculate_emissions.great_circle import great_circle_distance
+    from calculate_emissions.road_distance import calculate_road_distance
+    from calculate_emissions.sea_routing import load_sea_router, calculate_sea_route_distance, SEA_ROUTE_METHOD
+    from calculate_emissions.instrumentation import instrumentation, timer
 
-# Load configuration file
-config_file_path = os.path.join(os.path.dirname(__file__), '../../config.json')
-with open(config_file_path, 'r') as config_file:
-    config = json.load(config_file)
-
-# Extract Mapbox access token
-MAPBOX_ACCESS_TOKEN = config.get('MAPBOX_ACCESS_TOKEN')
-
-# Define paths to data files
+# Define paths to data files; they are only read on first use (see engine.py).
+# The configuration, including MAPBOX_ACCESS_TOKEN, is loaded lazily by config.py
 data_dir = os.path.join(os.path.dirname(__file__), '../data')
 
 un_locode_file_path = os.path.join(data_dir, 'un_locode.csv')
 iata_icao_file_path = os.path.join(data_dir, 'iata_icao_airport_coordinates.csv')
 emission_factors_file_path = os.path.join(data_dir, 'emission_factors.xlsx')
 
+_snap_location_function = None
+
+
+def _snap_location():
+    # Imported on first use since the spatial index reads the data file paths defined above.
+    # Kept afterwards: a failing 'from spatial_index import' searches sys.path on every call.
+    global _snap_location_function
+    if _snap_location_function is None:
+        try:
+            from spatial_index import snap_location
+        except ImportError:
+            from calculate_emissions.spatial_index import snap_location
+        _snap_location_function = snap_location
+    return _snap_location_function
+
+
+def _timed(start, result):
+    # Records the distance stage under the calculation method and passes the result through
+    if start is not None:
+        instrumentation.stage('distance', result[1], timer() - start)
+    return result
+
 def calculate_distance(route: dict, method: dict):
+    start = timer() if instrumentation.enabled else None
     if route.get('distance'):
         # Direct distance provided by user
         distance = float(route['distance'])
         unit = route['unit']
-        return convert_distance_to_km(distance, unit)
+        return _timed(start, (convert_distance_to_km(distance, unit), "user_provided"))
     else:
         # Calculate distance based on source and destination
         source = route['source']
         destination = route['destination']
 
+        # Determine distance type
+        distance_type = determine_distance_type(method, emission_factors_file_path)
+
+        if distance_type == 'sea':
+            # Frequently used port pairs are answered from the precomputed matrix
+            distance = load_sea_router().port_distance((source.get('locode') or {}).get('locode'),
+                                                       (destination.get('locode') or {}).get('locode'))
+            if distance is not None:
+                return _timed(start, (distance, SEA_ROUTE_METHOD))
+
         source_coordinates = get_coordinates(source, un_locode_file_path, iata_icao_file_path)
         destination_coordinates = get_coordinates(destination, un_locode_file_path, iata_icao_file_path)
 
-        # Determine distance type
-        distance_type = determine_distance_type(method, emission_factors_file_path)
+        if distance_type in ('air', 'sea'):
+            snap_location = _snap_location()
+            source_coordinates = snap_location(source, source_coordinates, distance_type)
+            destination_coordinates = snap_location(destination, destination_coordinates, distance_type)
+
+        # The coordinates are timed as a stage of their own
+        if start is not None:
+            start = timer()
+
         distance_calculation_method = ''
         if distance_type == 'land':
-            distance_calculation_method = "mapbox"
-            return calculate_land_distance(source_coordinates, destination_coordinates), distance_calculation_method
+            # Mapbox, offline or Mapbox with offline fallback, depending on LAND_DISTANCE_MODE
+            return _timed(start, calculate_road_distance(source_coordinates, destination_coordinates,
+                                                         get_country_code(source), get_country_code(destination)))
         elif distance_type == 'air':
             distance_calculation_method = "great_circle_distance"
-            return calculate_air_distance(source_coordinates, destination_coordinates), distance_calculation_method
+            return _timed(start, (great_circle_distance(source_coordinates, destination_coordinates),
+                                  distance_calculation_method))
         elif distance_type == 'sea':
-            distance_calculation_method = "great_circle_distance_2"
-            return calculate_sea_distance(source_coordinates, destination_coordinates), distance_calculation_method
-        return 0.0, distance_calculation_method
+            return _timed(start, calculate_sea_route_distance(source_coordinates, destination_coordinates))
+        return _timed(start, (0.0, distance_calculation_method))
 
 if __name__ == "__main__":
     # Example route and method definitions
@@ -3,15 +3,30 @@ import json
 import sys
 import pandas as pd
 
+try:
+    from country_codes import normalize_country_code
+    from reference_data import load_emission_factor_sheet
+    from factor_registry import get_factor_registry
+except ImportError:
+    from calculate_emissions.country_codes import normalize_country_code
+    from calculate_emissions.reference_data import load_emission_factor_sheet
+    from calculate_emissions.factor_registry import get_factor_registry
+
 # Define paths to data files
 data_dir = os.path.join(os.path.dirname(__file__), '../data')
 emission_factors_file_path = os.path.join(data_dir, 'emission_factors.xlsx')
 
-# Load the emission factors from the provided Excel file
-electricity_intensity_df = pd.read_excel(emission_factors_file_path, sheet_name='electricity_intensity')
-emission_factors_df = pd.read_excel(emission_factors_file_path, sheet_name='emission_factors')
 
-def get_emission_factor(method: dict, distance: float, country_code=None):
+def __getattr__(name):
+    # The emission factor sheets are loaded from the reference snapshot on first access
+    # rather than at import time; they remain available as module attributes.
+    if name == 'emission_factors_df':
+        return load_emission_factor_sheet(emission_factors_file_path, 'emission_factors')
+    if name == 'electricity_intensity_df':
+        return load_emission_factor_sheet(emission_factors_file_path, 'electricity_intensity')
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def get_emission_factor(method: dict, distance: float, country_code=None, factor_version=None):
     """
     Fetch the emission factor for the given method and country code.
 
@@ -19,6 +34,8 @@ def get_emission_factor(method: dict, distance: float, country_code=None):
     - method (dict): Dictionary containing method information.
     - distance (float): Distance traveled.
     - country_code (str, optional): The country code for electricity intensity.
+    - factor_version (str, optional): The emission factor dataset to use (see factor_registry);
+      defaults to the active dataset.
 
     Returns:
     - float: Emission factor for the specified method.
@@ -38,39 +55,16 @@ def get_emission_factor(method: dict, distance: float, country_code=None):
 
         emission_factor_calculation_method = method_name
 
-        query = emission_factors_df['method'] == method_name
-        is_electric = emission_factors_df.loc[emission_factors_df['method'] == method_name, 'is_electric'].values[0]
-
-        if fuel:
-            query = query & (emission_factors_df['fuel'] == fuel)
-        if load:
-            query = query & (emission_factors_df['load'] == load)
-        if trade_lane:
-            query = query & (emission_factors_df['trade_lane'] == trade_lane)
-
-        matching_rows = emission_factors_df[query]
-
-        if matching_rows.empty:
-            raise ValueError(f"Emission factor for method {method_name}, fuel {fuel}, load {load} not found.")
-
-        if len(matching_rows) > 1:
-            emission_factor = matching_rows['emission_factor'].mean()
-        else:
-            emission_factor = matching_rows['emission_factor'].values[0]
-
-        if is_electric.lower() == "yes":
-            if country_code:
-                electricity_intensity = get_electricity_intensity(electricity_intensity_df, country_code=country_code)
-            else:
-                electricity_intensity = get_electricity_intensity(electricity_intensity_df)
-            emission_factor *= electricity_intensity
+        # Every method/fuel/load/trade_lane combination is precompiled, including the averaged ones
+        emission_factor = get_factor_registry().get(factor_version).table.resolve(
+            method_name, fuel, load, trade_lane, country_code)
 
         return emission_factor, emission_factor_calculation_method
 
     except KeyError as e:
         raise ValueError(f"Required column is missing: {e}")
-    except IndexError:
-        raise ValueError(f"Method {method_name} not found in emission factors.")
+    except ValueError:
+        raise
     except Exception as e:
         raise ValueError(f"An error occurred while fetching the emission factor: {e}")
 
@@ -86,6 +80,7 @@ def get_electricity_intensity(electricity_intensity_df, country_code=None):
     Returns:
     - float: The electricity intensity for the specified region or the global average if the region is not found or not provided.
     """
+    country_code = normalize_country_code(country_code)
     if country_code:
         try:
             intensity = electricity_intensity_df.loc[
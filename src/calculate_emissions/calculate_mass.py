@@ -1,6 +1,16 @@
 import re
+import numpy as np
+import pandas as pd
 from typing import Optional
 
+# Conversion factors for cargo types (tonnes per TEU)
+CARGO_CONVERSION = {
+    'lightweight': 6.0,
+    'average': 10.0,
+    'heavyweight': 14.5,
+    'container_only': 2.0
+}
+
 def calculate_shipment_mass(shipment: dict) -> float:
     """
     Calculate the mass of the shipment.
@@ -12,14 +22,6 @@ def calculate_shipment_mass(shipment: dict) -> float:
     float: The mass of the shipment in tonnes.
     """
     
-    # Conversion factors for cargo types
-    cargo_conversion = {
-        'lightweight': 6.0,
-        'average': 10.0,
-        'heavyweight': 14.5,
-        'container_only': 2.0
-    }
-    
     mass_info = shipment.get('mass')
     containers = shipment.get('containers')
     cargo_type = shipment.get('cargo_type', 'average')
@@ -38,15 +40,39 @@ def calculate_shipment_mass(shipment: dict) -> float:
         return mass
 
     if containers:
-        if cargo_type not in cargo_conversion:
+        if cargo_type not in CARGO_CONVERSION:
             cargo_type = 'average'  # default cargo type
         
-        mass = containers * cargo_conversion[cargo_type]
+        mass = containers * CARGO_CONVERSION[cargo_type]
 
         return mass
 
     raise ValueError("Either mass or containers must be provided.")
 
+def calculate_shipment_mass_batch(mass_amount, mass_unit, containers, cargo_type) -> np.ndarray:
+    """
+    Calculate the mass of many shipments at once.
+
+    Parameters:
+    mass_amount (array-like): Mass amounts, NaN where no mass was given.
+    mass_unit (array-like): Mass units ('g', 'kg' or 't').
+    containers (array-like): Number of TEUs, NaN or 0 where no containers were given.
+    cargo_type (array-like): Cargo types, missing or unknown values count as 'average'.
+
+    Returns:
+    np.ndarray: The mass of each shipment in tonnes, NaN where neither mass nor containers was given.
+    """
+    mass_amount = np.asarray(mass_amount, dtype=np.float64)
+    mass_unit = pd.Series(mass_unit, dtype=object).to_numpy()
+    containers = np.nan_to_num(np.asarray(containers, dtype=np.float64), nan=0.0)
+    cargo_factor = pd.Series(cargo_type, dtype=object).map(CARGO_CONVERSION).fillna(CARGO_CONVERSION['average']).to_numpy(dtype=np.float64)
+
+    # Convert mass to tonnes
+    mass = np.select([mass_unit == 'g', mass_unit == 'kg'], [mass_amount / 1e6, mass_amount / 1e3], mass_amount)
+
+    return np.where(~np.isnan(mass_amount), mass,
+                    np.where(containers != 0, containers * cargo_factor, np.nan))
+
 if __name__ == "__main__":
     # Example usage
     shipment = {
@@ -0,0 +1,365 @@
+import os
+import sys
+import gzip
+import functools
+import json
+import argparse
+import contextlib
+import pandas as pd
+from typing import Iterator, List, Optional, Tuple
+
+try:
+    from batch import calculate_emissions_batch, flatten_shipping_data, INPUT_COLUMNS
+    from parallel import ParallelExecutor
+    from instrumentation import instrumentation, timer, MetricsRecorder
+    from ledger import IncrementalLedger
+except ImportError:
+    from calculate_emissions.batch import calculate_emissions_batch, flatten_shipping_data, INPUT_COLUMNS
+    from calculate_emissions.parallel import ParallelExecutor
+    from calculate_emissions.instrumentation import instrumentation, timer, MetricsRecorder
+    from calculate_emissions.ledger import IncrementalLedger
+
+INPUT_FORMATS = ('ndjson', 'csv')
+OUTPUT_FORMATS = ('ndjson', 'csv', 'parquet')
+
+# File extensions used to infer the format when it is not given explicitly
+FORMAT_EXTENSIONS = {
+    '.ndjson': 'ndjson',
+    '.jsonl': 'ndjson',
+    '.json': 'ndjson',
+    '.csv': 'csv',
+    '.parquet': 'parquet',
+}
+
+DEFAULT_CHUNK_SIZE = 10_000
+
+
+def infer_format(path: str, default: str) -> str:
+    """
+    Infers a file format from its extension, ignoring a trailing .gz.
+
+    Args:
+        path (str): The file path, or '-' for stdin/stdout.
+        default (str): The format used when the extension is not recognised.
+
+    Returns:
+        str: The format name.
+    """
+    if path.endswith('.gz'):
+        path = path[:-3]
+    return FORMAT_EXTENSIONS.get(os.path.splitext(path)[1].lower(), default)
+
+
+def _open_input(path: str):
+    if path == '-':
+        # stdin is left open for the caller
+        return contextlib.nullcontext(sys.stdin)
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8')
+    return open(path, 'r', encoding='utf-8', newline='')
+
+
+def _ndjson_row(line: str, id_field: str) -> Tuple[dict, Optional[str]]:
+    try:
+        record = json.loads(line)
+        if not isinstance(record, dict):
+            raise ValueError("expected a JSON object")
+    except ValueError as e:
+        return {}, f"Invalid NDJSON record: {e}"
+    if 'journey' in record:
+        # A journey's legs and hubs do not fit the one result row per shipment the writers produce
+        return {id_field: record.get(id_field)}, "Journeys are not supported by the CLI, use calculate_journeys"
+    # Nested shipping_data dicts are flattened, flat batch rows are used as is
+    if 'shipment' in record or 'route' in record:
+        row = flatten_shipping_data(record)
+    else:
+        row = {column: record.get(column) for column in INPUT_COLUMNS}
+    row[id_field] = record.get(id_field)
+    return row, None
+
+
+def read_ndjson_chunks(stream, chunk_size: int, id_field: str = 'id') -> Iterator[Tuple[pd.DataFrame, List]]:
+    """
+    Reads NDJSON shipments in chunks of at most chunk_size rows.
+
+    Each line is either a shipping_data dict as accepted by calculate_emissions or a flat
+    row with the INPUT_COLUMNS. Blank lines are skipped; multi-leg journeys are reported
+    as parse errors.
+
+    Args:
+        stream: A text stream.
+        chunk_size (int): Maximum number of rows per chunk.
+        id_field (str): Field echoed to the output to identify each shipment.
+
+    Returns:
+        iterator: (DataFrame, parse errors) pairs; the errors list has one entry per row, None when the line parsed.
+    """
+    rows, parse_errors = [], []
+    for line in stream:
+        if not line.strip():
+            continue
+        row, parse_error = _ndjson_row(line, id_field)
+        rows.append(row)
+        parse_errors.append(parse_error)
+        if len(rows) == chunk_size:
+            yield pd.DataFrame(rows, columns=INPUT_COLUMNS + [id_field]), parse_errors
+            rows, parse_errors = [], []
+    if rows:
+        yield pd.DataFrame(rows, columns=INPUT_COLUMNS + [id_field]), parse_errors
+
+
+def read_csv_chunks(stream, chunk_size: int, id_field: str = 'id') -> Iterator[Tuple[pd.DataFrame, List]]:
+    """
+    Reads CSV shipments in chunks of at most chunk_size rows.
+
+    The header names the INPUT_COLUMNS; unknown columns other than id_field are ignored
+    and addresses are given as geocoding query strings.
+
+    Args:
+        stream: A text stream.
+        chunk_size (int): Maximum number of rows per chunk.
+        id_field (str): Column echoed to the output to identify each shipment.
+
+    Returns:
+        iterator: (DataFrame, parse errors) pairs, as read_ndjson_chunks.
+    """
+    # Everything is read as text, numeric columns are converted by the batch API
+    for chunk in pd.read_csv(stream, chunksize=chunk_size, dtype=str, keep_default_na=False):
+        yield chunk.reindex(columns=INPUT_COLUMNS + [id_field]), [None] * len(chunk)
+
+
+def _timed_chunks(chunks: Iterator, input_format: str) -> Iterator:
+    # Reports the time spent reading and parsing each chunk as the 'parsing' stage
+    while True:
+        start = timer()
+        try:
+            chunk, parse_errors = next(chunks)
+        except StopIteration:
+            return
+        instrumentation.stage('parsing', input_format, timer() - start, len(chunk))
+        yield chunk, parse_errors
+
+
+class NdjsonWriter:
+    """
+    Writes results as one JSON object per line.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, results: pd.DataFrame):
+        # NaN is not valid JSON, missing values are written as null
+        records = results.astype(object).where(results.notna(), None).to_dict('records')
+        self.stream.writelines(json.dumps(record) + '\n' for record in records)
+
+    def close(self):
+        self.stream.flush()
+
+
+class CsvWriter:
+    """
+    Writes results as CSV with a single header line.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.header = True
+
+    def write(self, results: pd.DataFrame):
+        results.to_csv(self.stream, header=self.header, index=False)
+        self.header = False
+
+    def close(self):
+        self.stream.flush()
+
+
+class ParquetWriter:
+    """
+    Writes results as a Parquet file, one row group per chunk. Requires pyarrow.
+    """
+
+    def __init__(self, stream, id_field: Optional[str] = None):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError("Parquet output requires pyarrow, install it with 'pip install pyarrow'")
+        self._pa = pa
+        fields = [(id_field, pa.string())] if id_field else []
+        fields += [
+            ('emissions', pa.float64()),
+            ('shipment_mass', pa.float64()),
+            ('distance', pa.float64()),
+            ('distance_calculation_method', pa.string()),
+            ('emission_factor', pa.float64()),
+            ('emission_factor_calculation_method', pa.string()),
+            ('dataset_version', pa.string()),
+            ('error', pa.string()),
+        ]
+        # The schema is fixed up front so chunks without e.g. any errors still line up
+        self.schema = pa.schema(fields)
+        self.writer = pq.ParquetWriter(stream, self.schema)
+
+    def write(self, results: pd.DataFrame):
+        columns = {}
+        for field in self.schema:
+            values = results[field.name]
+            if field.type == self._pa.string():
+                values = values.astype(object).where(values.notna(), None).map(lambda v: v if v is None else str(v))
+            columns[field.name] = self._pa.array(values, type=field.type, from_pandas=True)
+        self.writer.write_table(self._pa.table(columns, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+def process_chunk(chunk: pd.DataFrame, parse_errors: List, id_field: Optional[str] = None,
+                  calculate=calculate_emissions_batch) -> pd.DataFrame:
+    """
+    Calculates the emissions for one chunk of shipments.
+
+    Args:
+        chunk (pd.DataFrame): The shipments, with the INPUT_COLUMNS.
+        parse_errors (list): One entry per row; rows with an entry are reported with that error.
+        id_field (str): Input column copied to the first output column, if any.
+        calculate (callable): The batch function, e.g. a ParallelExecutor's calculate.
+
+    Returns:
+        pd.DataFrame: The OUTPUT_COLUMNS (preceded by id_field) for each shipment.
+    """
+    results = calculate(chunk.reset_index(drop=True))
+    invalid = pd.notna(pd.Series(parse_errors, dtype=object)).to_numpy()
+    if invalid.any():
+        results.loc[invalid, 'error'] = [error for error in parse_errors if error is not None]
+        results.loc[invalid, 'emissions'] = float('nan')
+    if id_field:
+        results.insert(0, id_field, chunk[id_field].to_numpy())
+    return results
+
+
+def run(inputs: List[str], output: str = '-', input_format: Optional[str] = None, output_format: Optional[str] = None,
+        chunk_size: int = DEFAULT_CHUNK_SIZE, id_field: Optional[str] = 'id', workers: int = 1,
+        factor_version: Optional[str] = None, ledger: Optional[IncrementalLedger] = None) -> Tuple[int, int]:
+    """
+    Streams shipments from the inputs through the batch API into the output.
+
+    Only one chunk is held in memory at a time, so memory use does not grow with the input size.
+
+    Args:
+        inputs (list): Input paths, '-' for stdin. Paths ending in .gz are decompressed.
+        output (str): Output path, '-' for stdout.
+        input_format (str): 'ndjson' or 'csv'; inferred from each input's extension by default.
+        output_format (str): 'ndjson', 'csv' or 'parquet'; inferred from the output's extension by default.
+        chunk_size (int): Number of shipments calculated at once.
+        id_field (str): Input field echoed as the first output column, or None.
+        workers (int): Worker processes calculating each chunk; 0 uses every CPU.
+        factor_version (str): Emission factor dataset for every shipment; by default the one that
+            applied on each shipment's shipped_at.
+        ledger (IncrementalLedger, optional): Reuse the results of shipments calculated in an earlier
+            run; its report counts the reused and recalculated shipments.
+
+    Returns:
+        tuple: The number of shipments processed and the number of them that failed.
+    """
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be at least 1")
+    output_format = output_format or infer_format(output, 'ndjson')
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unsupported output format: {output_format}")
+
+    if output_format == 'parquet':
+        stream = sys.stdout.buffer if output == '-' else open(output, 'wb')
+        writer = ParquetWriter(stream, id_field)
+    else:
+        stream = sys.stdout if output == '-' else open(output, 'w', encoding='utf-8', newline='')
+        writer = NdjsonWriter(stream) if output_format == 'ndjson' else CsvWriter(stream)
+
+    # Chunks are still written one at a time; the executor spreads each one over the cores
+    executor = ParallelExecutor(workers or None) if workers != 1 else None
+    calculate = functools.partial(executor.calculate if executor is not None else calculate_emissions_batch,
+                                  factor_version=factor_version)
+    if ledger is not None:
+        calculate = functools.partial(ledger.calculate, factor_version=factor_version, calculate=calculate.func)
+
+    processed = failed = 0
+    try:
+        for path in inputs:
+            path_format = input_format or infer_format(path, 'ndjson')
+            if path_format not in INPUT_FORMATS:
+                raise ValueError(f"Unsupported input format: {path_format}")
+            read_chunks = read_ndjson_chunks if path_format == 'ndjson' else read_csv_chunks
+            with _open_input(path) as input_stream:
+                chunks = read_chunks(input_stream, chunk_size, id_field or 'id')
+                if instrumentation.enabled:
+                    chunks = _timed_chunks(chunks, path_format)
+                for chunk, parse_errors in chunks:
+                    results = process_chunk(chunk, parse_errors, id_field, calculate)
+                    with instrumentation.timed('serialization', output_format, len(results)):
+                        writer.write(results)
+                    processed += len(results)
+                    failed += int(results['error'].notna().sum())
+    finally:
+        if executor is not None:
+            executor.close()
+        writer.close()
+        if output != '-':
+            stream.close()
+    return processed, failed
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Calculate shipping emissions for NDJSON or CSV shipment files, streaming them in chunks.")
+    parser.add_argument('inputs', nargs='*', default=['-'],
+                        help="Input files (NDJSON or CSV, optionally .gz); '-' or nothing reads stdin")
+    parser.add_argument('-o', '--output', default='-', help="Output file; stdout by default")
+    parser.add_argument('--input-format', choices=INPUT_FORMATS,
+                        help="Input format; inferred from the file extension, NDJSON otherwise")
+    parser.add_argument('--output-format', choices=OUTPUT_FORMATS,
+                        help="Output format; inferred from the file extension, NDJSON otherwise")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                        help=f"Shipments calculated at once (default {DEFAULT_CHUNK_SIZE})")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Worker processes calculating each chunk; 0 uses every CPU (default 1)")
+    parser.add_argument('--id-field', default='id',
+                        help="Input field echoed as the first output column (default 'id'); empty to disable")
+    parser.add_argument('--factor-version',
+                        help="Emission factor dataset for every shipment; by default the one that applied on its shipped_at")
+    parser.add_argument('--ledger',
+                        help="Result store (SQLite file) of an incremental run: shipments calculated before with "
+                             "the same reference data are reused, the others are calculated and stored")
+    parser.add_argument('--recalculate-network', action='store_true',
+                        help="With --ledger, always recalculate the shipments that call Mapbox")
+    parser.add_argument('--metrics',
+                        help="Write stage timings, cache hit ratios, Mapbox calls and error categories to this file "
+                             "in the Prometheus text format (measured in this process only, so use --workers 1)")
+    args = parser.parse_args(argv)
+
+    recorder = instrumentation.add_hook(MetricsRecorder()) if args.metrics else None
+    ledger = IncrementalLedger(args.ledger, args.recalculate_network) if args.ledger else None
+    try:
+        processed, failed = run(args.inputs, args.output, args.input_format, args.output_format,
+                                args.chunk_size, args.id_field or None, args.workers, args.factor_version, ledger)
+    except BrokenPipeError:
+        # The reader went away (e.g. piped into head); stop quietly
+        sys.stdout = open(os.devnull, 'w')
+        return 1
+    except (OSError, RuntimeError, ValueError) as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 2
+    finally:
+        if ledger is not None:
+            ledger.close()
+        if recorder is not None:
+            instrumentation.remove_hook(recorder)
+            with open(args.metrics, 'w', encoding='utf-8') as metrics_file:
+                metrics_file.write(recorder.to_prometheus())
+    print(f"Processed {processed} shipments, {failed} failed", file=sys.stderr)
+    if ledger is not None:
+        print(f"Ledger: {ledger.report}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
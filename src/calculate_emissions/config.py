@@ -0,0 +1,133 @@
+import os
+import json
+import threading
+
+# Default location of the configuration file, overridable with CALCULATE_EMISSIONS_CONFIG
+DEFAULT_CONFIG_PATH = os.path.join(os.path.dirname(__file__), '../../config.json')
+CONFIG_PATH_ENV = 'CALCULATE_EMISSIONS_CONFIG'
+
+# Settings used when they are not present in config.json
+DEFAULTS = {
+    'MAPBOX_ACCESS_TOKEN': None,
+    'MAPBOX_API_URL': 'https://api.mapbox.com',
+    'MAPBOX_CACHE_PATH': os.path.join(os.path.expanduser('~'), '.cache', 'calculate_emissions', 'mapbox_cache.sqlite'),
+    'MAPBOX_CACHE_TTL': 30 * 24 * 3600,
+    'MAPBOX_CACHE_MAX_ENTRIES': 1_000_000,
+    'MAPBOX_CACHE_COORDINATE_PRECISION': 4,
+    'MAPBOX_MAX_CONCURRENCY': 8,
+    'MAPBOX_REQUESTS_PER_MINUTE': 300,
+    'MAPBOX_TIMEOUT': 10,
+    'MAPBOX_MAX_RETRIES': 5,
+    'LAND_DISTANCE_MODE': 'mapbox',
+    'ROAD_DETOUR_FACTORS': {},
+    'ROAD_DEFAULT_DETOUR_FACTOR': 1.3,
+    'ROAD_GRAPH_PATH': None,
+    'ROAD_GRAPH_MAX_SNAP_DISTANCE': 25.0,
+    'SNAP_TO_HUBS': False,
+    'SNAP_MAX_DISTANCE': 500.0,
+    'GREAT_CIRCLE_CACHE_MAX_ENTRIES': 100_000,
+    'EMISSION_FACTOR_DATASETS': [],
+    'EMISSION_FACTOR_VERSION': None,
+    'SERVICE_HOST': '127.0.0.1',
+    'SERVICE_PORT': 8080,
+    'SERVICE_MAX_BATCH_SIZE': 10_000,
+    'IDEMPOTENCY_CACHE_MAX_ENTRIES': 100_000,
+    'IDEMPOTENCY_CACHE_TTL': 24 * 3600,
+}
+
+# Spellings of booleans accepted in environment variables
+TRUE_VALUES = ('1', 'true', 'yes', 'on')
+FALSE_VALUES = ('0', 'false', 'no', 'off')
+
+_config = None
+_config_lock = threading.Lock()
+
+
+def parse_setting(key: str, value):
+    """
+    Converts a setting given as a string to the type of its entry in DEFAULTS.
+
+    Numbers, lists and dicts are parsed as JSON, booleans also accept yes/no, 1/0 and
+    on/off. Settings whose default is a string or None, and empty strings, are kept as they are.
+
+    Args:
+        key (str): The setting name.
+        value: The value from the environment or config.json.
+
+    Returns:
+        The converted value.
+
+    Raises:
+        ValueError: If the value cannot be converted.
+    """
+    default = DEFAULTS.get(key)
+    if not isinstance(value, str) or value == '' or default is None or isinstance(default, str):
+        return value
+    if isinstance(default, bool):
+        if value.strip().lower() in TRUE_VALUES:
+            return True
+        if value.strip().lower() in FALSE_VALUES:
+            return False
+        raise ValueError(f"{key} must be a boolean, got {value!r}")
+    try:
+        parsed = json.loads(value)
+    except ValueError:
+        raise ValueError(f"{key} must be JSON, got {value!r}") from None
+    if isinstance(default, (int, float)):
+        if isinstance(parsed, bool) or not isinstance(parsed, (int, float)):
+            raise ValueError(f"{key} must be a number, got {value!r}")
+        return float(parsed) if isinstance(default, float) else parsed
+    if not isinstance(parsed, type(default)):
+        raise ValueError(f"{key} must be a JSON {type(default).__name__}, got {value!r}")
+    return parsed
+
+
+def load_config() -> dict:
+    """
+    Loads config.json once per process and merges it over DEFAULTS.
+
+    Any setting can also be overridden by an environment variable of the same name.
+    Values given as strings are converted to the type of their default, see parse_setting.
+
+    Returns:
+        dict: The configuration.
+    """
+    global _config
+    if _config is None:
+        with _config_lock:
+            if _config is None:
+                config = dict(DEFAULTS)
+                config_file_path = os.environ.get(CONFIG_PATH_ENV, DEFAULT_CONFIG_PATH)
+                if os.path.isfile(config_file_path):
+                    with open(config_file_path, 'r') as config_file:
+                        config.update(json.load(config_file))
+                for key in list(config):
+                    if key in os.environ:
+                        config[key] = os.environ[key]
+                    config[key] = parse_setting(key, config[key])
+                _config = config
+    return _config
+
+
+def get_config_value(key: str, default=None):
+    """
+    Returns a single configuration value.
+
+    Args:
+        key (str): The setting name, e.g. 'MAPBOX_ACCESS_TOKEN'.
+        default: Value returned when the setting is missing or empty.
+
+    Returns:
+        The configured value, or default.
+    """
+    value = load_config().get(key)
+    return default if value is None or value == '' else value
+
+
+def reset_config():
+    """
+    Forgets the loaded configuration so the next access re-reads it.
+    """
+    global _config
+    with _config_lock:
+        _config = None
@@ -0,0 +1,162 @@
+import hashlib
+import itertools
+import numpy as np
+import pandas as pd
+from typing import Dict, Optional, Tuple
+
+try:
+    from country_codes import normalize_country_code
+except ImportError:
+    from calculate_emissions.country_codes import normalize_country_code
+
+# Columns that narrow down the emission factor rows of a method; a missing value matches any row
+FILTER_COLUMNS = ['fuel', 'load', 'trade_lane']
+
+
+def _present(value) -> bool:
+    return isinstance(value, str) and value != ''
+
+
+def _same(a, b) -> bool:
+    # Missing intensities are NaN, which never equals itself
+    return a == b or (a != a and b != b)
+
+
+class EmissionFactorTable:
+    """
+    Emission factors compiled into dicts so that resolving a factor is a single probe.
+
+    Every (method, fuel, load, trade_lane) combination that get_emission_factor can
+    answer is precomputed, including the wildcard combinations where some of fuel,
+    load or trade_lane are omitted and the factor is the mean of the matching rows.
+
+    When a previous table is given (e.g. the factor set a new release replaces), the
+    compiled entries of every method whose rows did not change are reused from it, and
+    only the changed methods are compiled again.
+    """
+
+    def __init__(self, emission_factors_df: pd.DataFrame, electricity_intensity_df: pd.DataFrame,
+                 previous: Optional['EmissionFactorTable'] = None):
+        self.factors: Dict[Tuple, float] = {}
+        self.is_electric: Dict[str, bool] = {}
+        self.distance_types: Dict[str, str] = {}
+        # Fingerprint of the rows of each method, to tell which methods differ between two tables
+        self.method_digests: Dict[str, str] = {}
+        self._method_keys: Dict[str, list] = {}
+
+        methods = emission_factors_df['method'].to_numpy(dtype=object)
+        filters = [emission_factors_df[column].to_numpy(dtype=object) for column in FILTER_COLUMNS]
+        values = emission_factors_df['emission_factor'].to_numpy(dtype=np.float64)
+        is_electric = emission_factors_df['is_electric'].to_numpy(dtype=object)
+        distance_types = emission_factors_df['distance_calculation_method'].to_numpy(dtype=object)
+
+        rows_by_method = {}
+        for row, method_name in enumerate(methods):
+            if method_name not in rows_by_method:
+                rows_by_method[method_name] = []
+                # The first row of a method decides whether it is electric and how distance is measured
+                self.is_electric[method_name] = str(is_electric[row]).lower() == "yes"
+                self.distance_types[method_name] = distance_types[row]
+            rows_by_method[method_name].append(row)
+
+        for method_name, rows in rows_by_method.items():
+            rows = np.array(rows)
+            digest = hashlib.sha1(repr([column[rows].tolist() for column in filters]
+                                       + [values[rows].tolist(), is_electric[rows].tolist(),
+                                          distance_types[rows].tolist()]).encode()).hexdigest()
+            self.method_digests[method_name] = digest
+            if previous is not None and previous.method_digests.get(method_name) == digest:
+                self._method_keys[method_name] = previous._method_keys[method_name]
+                for key in self._method_keys[method_name]:
+                    self.factors[key] = previous.factors[key]
+                continue
+
+            keys = self._method_keys[method_name] = []
+            # Each filter is either omitted (None) or one of the values present for the method
+            candidates = [[None] + sorted({v for v in column[rows] if _present(v)}) for column in filters]
+            for key in itertools.product(*candidates):
+                selected = rows
+                for column, value in zip(filters, key):
+                    if value is not None:
+                        selected = selected[column[selected] == value]
+                if len(selected) == 0:
+                    continue
+                matching = values[selected]
+                # Same arithmetic as Series.mean() so results are bit-for-bit unchanged
+                self.factors[(method_name,) + key] = matching[0] if len(matching) == 1 else matching.sum() / len(matching)
+                keys.append((method_name,) + key)
+
+        country_codes = electricity_intensity_df['country_code'].to_numpy(dtype=object)
+        intensities = electricity_intensity_df['value'].to_numpy(dtype=np.float64)
+        self.intensities: Dict[str, float] = {}
+        for country_code, intensity in zip(country_codes, intensities):
+            self.intensities.setdefault(country_code, intensity)
+        self.global_intensity = self.intensities.get('global_average')
+        # Fingerprint of the whole table, the same for two tables compiled from the same rows
+        self.digest = hashlib.sha1(repr((sorted(self.method_digests.items()),
+                                         sorted(self.intensities.items(), key=repr))).encode()).hexdigest()
+
+        self._electric_factors: Dict[Tuple, float] = {}
+        if previous is not None:
+            # Electric factors stay valid while both the method and the country's intensity are unchanged
+            unchanged = set(self.method_digests) - self.changed_methods(previous)
+            for electric_key, electric_factor in list(previous._electric_factors.items()):
+                country_code = electric_key[-1]
+                if electric_key[0] in unchanged and _same(self.electricity_intensity(country_code), previous.electricity_intensity(country_code)):
+                    self._electric_factors[electric_key] = electric_factor
+
+    def changed_methods(self, other: 'EmissionFactorTable') -> set:
+        """
+        Returns the methods whose rows differ from other, including methods only one table has.
+        """
+        return {method_name for method_name in set(self.method_digests) | set(other.method_digests)
+                if self.method_digests.get(method_name) != other.method_digests.get(method_name)}
+
+    def changed_countries(self, other: 'EmissionFactorTable') -> set:
+        """
+        Returns the country codes whose electricity intensity differs from other.
+        """
+        return {country_code for country_code in set(self.intensities) | set(other.intensities)
+                if not _same(self.intensities.get(country_code), other.intensities.get(country_code))}
+
+    def has_method(self, method_name: str) -> bool:
+        return method_name in self.is_electric
+
+    def electricity_intensity(self, country_code: Optional[str] = None) -> float:
+        """
+        Returns the electricity intensity for a country, falling back to the global average.
+        """
+        country_code = normalize_country_code(country_code)
+        if country_code:
+            return self.intensities.get(country_code, self.global_intensity)
+        return self.global_intensity
+
+    def resolve(self, method_name: str, fuel=None, load=None, trade_lane=None, country_code=None) -> float:
+        """
+        Resolves the emission factor for a (haul-adjusted) method name.
+
+        Args:
+            method_name (str): The method, including the haul suffix for planes.
+            fuel (str, optional): The fuel type.
+            load (str, optional): The load type.
+            trade_lane (str, optional): The trade lane.
+            country_code (str, optional): The country used for electricity intensity.
+
+        Returns:
+            float: The emission factor, multiplied by the electricity intensity for electric methods.
+        """
+        key = (method_name, fuel or None, load or None, trade_lane or None)
+        emission_factor = self.factors.get(key)
+        if emission_factor is None:
+            if not self.has_method(method_name):
+                raise ValueError(f"Method {method_name} not found in emission factors.")
+            raise ValueError(f"Emission factor for method {method_name}, fuel {fuel}, load {load} not found.")
+
+        if self.is_electric[method_name]:
+            electric_key = key + (country_code or None,)
+            electric_factor = self._electric_factors.get(electric_key)
+            if electric_factor is None:
+                electric_factor = emission_factor * self.electricity_intensity(country_code)
+                self._electric_factors[electric_key] = electric_factor
+            return electric_factor
+        return emission_factor
@@ -0,0 +1,136 @@
+import threading
+from typing import Optional
+
+try:
+    from calculate_distance import un_locode_file_path, iata_icao_file_path, emission_factors_file_path
+    from config import load_config, reset_config
+    from factor_registry import get_factor_registry, reset_factor_registry, FactorRegistry
+    from great_circle import reset_great_circle_memo
+    from mapbox_cache import reset_mapbox_cache
+    from mapbox_client import get_mapbox_client, reset_mapbox_client, MapboxClient
+    from reference_data import (load_locode_table, load_airport_table, load_emission_factor_table,
+                                clear_reference_tables, ReferenceTable)
+    from road_distance import reset_road_graph
+    from sea_routing import load_sea_router, reset_sea_router, SeaRouter
+    from snapshot import clear_snapshots
+    from spatial_index import hub_snapping_enabled, load_facility_index, clear_facility_indexes, SNAP_FACILITIES
+except ImportError:
+    from calculate_emissions.calculate_distance import un_locode_file_path, iata_icao_file_path, emission_factors_file_path
+    from calculate_emissions.config import load_config, reset_config
+    from calculate_emissions.factor_registry import get_factor_registry, reset_factor_registry, FactorRegistry
+    from calculate_emissions.great_circle import reset_great_circle_memo
+    from calculate_emissions.mapbox_cache import reset_mapbox_cache
+    from calculate_emissions.mapbox_client import get_mapbox_client, reset_mapbox_client, MapboxClient
+    from calculate_emissions.reference_data import (load_locode_table, load_airport_table, load_emission_factor_table,
+                                                    clear_reference_tables, ReferenceTable)
+    from calculate_emissions.road_distance import reset_road_graph
+    from calculate_emissions.sea_routing import load_sea_router, reset_sea_router, SeaRouter
+    from calculate_emissions.snapshot import clear_snapshots
+    from calculate_emissions.spatial_index import (hub_snapping_enabled, load_facility_index, clear_facility_indexes,
+                                                   SNAP_FACILITIES)
+
+
+class Engine:
+    """
+    The process-wide state of the calculations: configuration, reference data and Mapbox client.
+
+    Importing the package reads nothing; each part is loaded on first use, once, under
+    a lock, and then shared by every thread. warm loads the offline parts up front.
+    An engine pickles as a reference to the process-wide engine, so handing it to a
+    worker process costs nothing: the worker loads its own, from the memory-mapped
+    reference data snapshot. A forked child drops the Mapbox client and cache
+    inherited from its parent and opens its own.
+    """
+
+    @property
+    def config(self) -> dict:
+        return load_config()
+
+    @property
+    def locodes(self) -> ReferenceTable:
+        return load_locode_table(un_locode_file_path)
+
+    @property
+    def airports(self) -> ReferenceTable:
+        return load_airport_table(iata_icao_file_path)
+
+    @property
+    def factor_registry(self) -> FactorRegistry:
+        return get_factor_registry()
+
+    @property
+    def sea_router(self) -> SeaRouter:
+        return load_sea_router()
+
+    @property
+    def mapbox(self) -> MapboxClient:
+        return get_mapbox_client()
+
+    def warm(self, factor_version: Optional[str] = None) -> 'Engine':
+        """
+        Loads every table used by the offline calculation paths.
+
+        Args:
+            factor_version (str, optional): An emission factor dataset that must exist; it is
+                looked up so a wrong version fails here rather than on every calculation.
+
+        Returns:
+            Engine: The engine itself.
+        """
+        load_locode_table(un_locode_file_path)
+        load_airport_table(iata_icao_file_path)
+        load_emission_factor_table(emission_factors_file_path)
+        registry = get_factor_registry()
+        if factor_version:
+            registry.get(factor_version)
+        load_sea_router()
+        if hub_snapping_enabled():
+            for facility in SNAP_FACILITIES.values():
+                load_facility_index(facility)
+        return self
+
+    def reset(self):
+        """
+        Forgets the configuration and everything built from it so it is loaded again on next use.
+
+        The Mapbox client and cache are closed; requests still running on them may fail.
+        """
+        reset_config()
+        clear_snapshots()
+        clear_reference_tables()
+        reset_factor_registry()
+        reset_mapbox_client()
+        reset_mapbox_cache()
+        reset_sea_router()
+        reset_road_graph()
+        clear_facility_indexes()
+        reset_great_circle_memo()
+
+    def __reduce__(self):
+        return get_engine, ()
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine() -> Engine:
+    """
+    Returns the process-wide engine; creating it does no I/O.
+
+    Returns:
+        Engine: The shared engine.
+    """
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = Engine()
+    return _engine
+
+
+if __name__ == "__main__":
+    # Example usage: load the reference data once, then look up a LOCODE and an airport
+    engine = get_engine().warm()
+    print(engine.locodes.get('locode', 'USNYC'), engine.airports.get('iata', 'JFK'))
+    print(f"Emission factor datasets: {engine.factor_registry.versions()}")
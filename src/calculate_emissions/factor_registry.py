@@ -0,0 +1,324 @@
+import os
+import hashlib
+import threading
+import numpy as np
+import pandas as pd
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+
+try:
+    from config import get_config_value
+    from country_codes import normalize_country_code
+    from emission_factor_table import EmissionFactorTable
+    from reference_data import load_emission_factor_table
+    from snapshot import snapshot_for
+except ImportError:
+    from calculate_emissions.config import get_config_value
+    from calculate_emissions.country_codes import normalize_country_code
+    from calculate_emissions.emission_factor_table import EmissionFactorTable
+    from calculate_emissions.reference_data import load_emission_factor_table
+    from calculate_emissions.snapshot import snapshot_for
+
+# The workbook shipped with the package, registered as the first dataset
+data_dir = os.path.join(os.path.dirname(__file__), '../data')
+emission_factors_file_path = os.path.join(data_dir, 'emission_factors.xlsx')
+
+SHEETS = ('emission_factors', 'electricity_intensity')
+
+
+@dataclass(frozen=True)
+class FactorDataset:
+    """
+    One named version of the emission factors and electricity intensities.
+
+    valid_from is the first shipment date the dataset applies to; a dataset without it
+    applies to every shipment older than the first dated dataset.
+    """
+
+    version: str
+    table: EmissionFactorTable
+    valid_from: Optional[pd.Timestamp] = None
+    source: Optional[str] = None
+
+
+@dataclass(frozen=True)
+class FactorChange:
+    """
+    What changed when the active dataset was swapped, passed to the registry listeners
+    so caches derived from the factors only drop the affected entries.
+
+    previous_version equals version when the active dataset was registered again.
+    """
+
+    previous_version: Optional[str]
+    version: str
+    methods: frozenset
+    countries: frozenset
+    # Methods whose factor is multiplied by the electricity intensity of the country
+    electric_methods: frozenset = frozenset()
+
+    def affects(self, method_name: Optional[str], country_code: Optional[str] = None) -> bool:
+        """
+        Whether a result calculated with the previous dataset, method_name and country_code
+        may differ with the new one. A country of None stands for any country, as results
+        without one use the global average intensity.
+        """
+        if method_name in self.methods:
+            return True
+        if method_name not in self.electric_methods or not self.countries:
+            return False
+        # Countries without an intensity of their own fall back to the global average
+        country_code = normalize_country_code(country_code)
+        return country_code is None or country_code in self.countries or 'global_average' in self.countries
+
+
+def _timestamp(value) -> Optional[pd.Timestamp]:
+    if value is None or value == '':
+        return None
+    timestamp = pd.Timestamp(value)
+    # Dates without a time zone are taken as UTC, like shipped_at values without one
+    return timestamp.tz_localize('UTC') if timestamp.tzinfo is None else timestamp.tz_convert('UTC')
+
+
+def _hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def bundled_version() -> str:
+    """
+    Version name of the bundled workbook, from its content hash (taken from the snapshot when there is one).
+    """
+    snapshot = snapshot_for(emission_factors_file_path, 'emission_factors')
+    digest = snapshot.manifest['sources']['emission_factors'] if snapshot is not None else _hash_file(emission_factors_file_path)
+    return f"bundled-{digest[:12]}"
+
+
+class FactorRegistry:
+    """
+    Holds several versions of the emission factors at once.
+
+    One dataset is active and answers every calculation that does not ask for a
+    version or a shipment date. Activating another dataset swaps a single reference,
+    so a calculation that took the active dataset keeps using it to the end while
+    new calculations see the new one. Registering a dataset compiles only the methods
+    whose rows differ from the active dataset, and listeners are told which methods and
+    countries changed when the active dataset is swapped.
+    """
+
+    def __init__(self):
+        self._datasets: Dict[str, FactorDataset] = {}
+        self._active: Optional[FactorDataset] = None
+        # (valid_from in ns, version) of the dated datasets, sorted for date lookups
+        self._dated = (np.zeros(0, dtype=np.int64), [])
+        self._listeners: List[Callable[[FactorChange], None]] = []
+        self._lock = threading.RLock()
+
+    @property
+    def active(self) -> FactorDataset:
+        if self._active is None:
+            raise ValueError("No emission factor dataset is active")
+        return self._active
+
+    def versions(self) -> List[str]:
+        return list(self._datasets)
+
+    def get(self, version: Optional[str] = None) -> FactorDataset:
+        """
+        Returns a dataset by version, or the active dataset when version is None.
+        """
+        if version is None:
+            return self.active
+        dataset = self._datasets.get(version)
+        if dataset is None:
+            raise ValueError(f"Unknown emission factor dataset version: {version}")
+        return dataset
+
+    def register(self, version: str, emission_factors_df: pd.DataFrame, electricity_intensity_df: pd.DataFrame,
+                 valid_from=None, source: Optional[str] = None, activate: bool = False) -> FactorDataset:
+        """
+        Adds (or replaces) a dataset.
+
+        Args:
+            version (str): The dataset name stamped on results, e.g. 'glec-v3.1'.
+            emission_factors_df (pd.DataFrame): Rows of the 'emission_factors' sheet.
+            electricity_intensity_df (pd.DataFrame): Rows of the 'electricity_intensity' sheet.
+            valid_from (str, date or datetime, optional): First shipment date the dataset applies to.
+            source (str, optional): Where the dataset was read from.
+            activate (bool): Make the dataset active once it is compiled.
+
+        Returns:
+            FactorDataset: The registered dataset.
+        """
+        with self._lock:
+            previous = self._datasets.get(version) or self._active
+        table = EmissionFactorTable(emission_factors_df, electricity_intensity_df,
+                                    previous=previous.table if previous is not None else None)
+        return self.add(FactorDataset(version, table, _timestamp(valid_from), source), activate)
+
+    def register_file(self, version: str, path: str, valid_from=None, activate: bool = False) -> FactorDataset:
+        """
+        Reads an emission factors workbook (same sheets as the bundled one) and registers it.
+
+        The file is read on every call, so registering it again picks up its new contents.
+        """
+        sheets = pd.read_excel(path, sheet_name=list(SHEETS))
+        return self.register(version, sheets['emission_factors'], sheets['electricity_intensity'],
+                             valid_from, source=path, activate=activate)
+
+    def add(self, dataset: FactorDataset, activate: bool = False) -> FactorDataset:
+        with self._lock:
+            replaced = self._datasets.get(dataset.version)
+            self._datasets[dataset.version] = dataset
+            self._index_dates()
+            if activate or self._active is None or self._active is replaced:
+                self.activate(dataset.version)
+        return dataset
+
+    def unregister(self, version: str):
+        with self._lock:
+            if self._active is not None and self._active.version == version:
+                raise ValueError(f"Cannot remove the active emission factor dataset: {version}")
+            self._datasets.pop(version, None)
+            self._index_dates()
+
+    def _index_dates(self):
+        dated = sorted((dataset.valid_from.value, dataset.version)
+                       for dataset in self._datasets.values() if dataset.valid_from is not None)
+        self._dated = (np.array([start for start, _ in dated], dtype=np.int64), [version for _, version in dated])
+
+    def activate(self, version: str) -> FactorChange:
+        """
+        Atomically makes a registered dataset the active one.
+
+        Returns:
+            FactorChange: The methods and countries whose factors differ from the previously active dataset.
+        """
+        with self._lock:
+            dataset = self.get(version)
+            previous = self._active
+            self._active = dataset
+            listeners = list(self._listeners)
+        electric_methods = {method_name for method_name, is_electric in dataset.table.is_electric.items() if is_electric}
+        if previous is None:
+            change = FactorChange(None, version, frozenset(dataset.table.method_digests), frozenset(dataset.table.intensities),
+                                  frozenset(electric_methods))
+        else:
+            electric_methods.update(method_name for method_name, is_electric in previous.table.is_electric.items() if is_electric)
+            change = FactorChange(previous.version, version, frozenset(dataset.table.changed_methods(previous.table)),
+                                  frozenset(dataset.table.changed_countries(previous.table)), frozenset(electric_methods))
+        for listener in listeners:
+            listener(change)
+        return change
+
+    def subscribe(self, listener: Callable[[FactorChange], None]):
+        """
+        Calls listener with a FactorChange every time the active dataset changes.
+
+        The IncrementalLedger and the service's IdempotencyCache subscribe to drop the
+        results that the change affects.
+        """
+        with self._lock:
+            self._listeners.append(listener)
+
+    def unsubscribe(self, listener: Callable[[FactorChange], None]):
+        with self._lock:
+            self._listeners.remove(listener)
+
+    def _baseline(self) -> FactorDataset:
+        # The undated dataset for shipments older than every dated one: the active dataset if it
+        # is undated, else the undated dataset registered last
+        active = self.active
+        if active.valid_from is None:
+            return active
+        undated = [dataset for dataset in self._datasets.values() if dataset.valid_from is None]
+        return undated[-1] if undated else active
+
+    def resolve(self, shipped_at=None) -> FactorDataset:
+        """
+        Returns the dataset that applied on a shipment date: the dated dataset with the latest
+        valid_from on or before shipped_at. Older shipments use the undated dataset, and
+        shipments without a date the active one.
+
+        Args:
+            shipped_at (str, date or datetime, optional): The shipment date, e.g. '2023-11-20T10:20:30Z'.
+
+        Returns:
+            FactorDataset: The dataset to calculate the shipment with.
+        """
+        return self.get(self.resolve_many([shipped_at])[0])
+
+    def resolve_many(self, shipped_at) -> np.ndarray:
+        """
+        Resolves the dataset version of many shipment dates at once, see resolve.
+
+        Returns:
+            np.ndarray: The version of each date.
+        """
+        active = self.active.version
+        starts, versions = self._dated
+        shipped_at = np.asarray(shipped_at, dtype=object)
+        resolved = np.full(len(shipped_at), active, dtype=object)
+        if not len(starts):
+            return resolved
+        dates = pd.to_datetime(pd.Series(shipped_at), utc=True, errors='coerce', format='ISO8601')
+        has_date = ~dates.isna().to_numpy()
+        positions = np.searchsorted(starts, dates.to_numpy(dtype='datetime64[ns]').view(np.int64), side='right') - 1
+        resolved[has_date & (positions < 0)] = self._baseline().version
+        dated = has_date & (positions >= 0)
+        resolved[dated] = np.array(versions, dtype=object)[positions[dated]]
+        return resolved
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_factor_registry() -> FactorRegistry:
+    """
+    Returns the process-wide registry.
+
+    It starts with the bundled workbook, followed by the EMISSION_FACTOR_DATASETS from the
+    configuration, and activates EMISSION_FACTOR_VERSION if it is set.
+    """
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                registry = FactorRegistry()
+                registry.add(FactorDataset(bundled_version(), load_emission_factor_table(emission_factors_file_path),
+                                           source=emission_factors_file_path))
+                for dataset in get_config_value('EMISSION_FACTOR_DATASETS', []):
+                    registry.register_file(dataset['version'], dataset['path'], dataset.get('valid_from'))
+                active_version = get_config_value('EMISSION_FACTOR_VERSION')
+                if active_version:
+                    registry.activate(active_version)
+                _registry = registry
+    return _registry
+
+
+def reset_factor_registry():
+    """
+    Forgets the registry so the next access builds it again from the configuration.
+    """
+    global _registry
+    with _registry_lock:
+        _registry = None
+
+
+if __name__ == "__main__":
+    # Example usage: a new release with a higher long haul factor, valid from 2024
+    registry = get_factor_registry()
+    bundled = registry.active
+    sheets = pd.read_excel(emission_factors_file_path, sheet_name=list(SHEETS))
+    factors = sheets['emission_factors']
+    factors.loc[factors['method'] == 'cargo_plane_long_haul', 'emission_factor'] *= 1.05
+    registry.subscribe(lambda change: print(f"{change.previous_version} -> {change.version}: {sorted(change.methods)}"))
+    registry.register('example-2024', factors, sheets['electricity_intensity'], valid_from='2024-01-01', activate=True)
+
+    for shipped_at in ('2023-11-20T10:20:30Z', '2024-06-01', None):
+        dataset = registry.resolve(shipped_at)
+        print(shipped_at, dataset.version, dataset.table.resolve('cargo_plane_long_haul'))
@@ -0,0 +1,265 @@
+import math
+import itertools
+import threading
+import numpy as np
+import pandas as pd
+from typing import Hashable, Optional
+
+try:
+    from config import get_config_value
+    from instrumentation import instrumentation
+except ImportError:
+    from calculate_emissions.config import get_config_value
+    from calculate_emissions.instrumentation import instrumentation
+
+EARTH_RADIUS = 6371.0  # Earth radius in kilometers
+
+DEFAULT_MAX_ENTRIES = 100_000
+
+
+# Rational approximation of fdlibm's asin: asin(x) = x + x * _asin_ratio(x * x) for |x| <= 0.5.
+# NumPy's SIMD arcsin and arctan2 round differently from libm's, while +, -, *, / and sqrt are
+# correctly rounded everywhere, so haversine and haversine_array share this to return the same bits.
+_ASIN_P = (1.66666666666666657415e-01, -3.25565818622400915405e-01, 2.01212532134862925881e-01,
+           -4.00555345006794114027e-02, 7.91534994289814532176e-04, 3.47933107596021167570e-05)
+_ASIN_Q = (-2.40339491173441421878e+00, 2.02094576023350569471e+00, -6.88283971605453293030e-01,
+           7.70381505559019352791e-02)
+HALF_PI = math.pi / 2
+
+
+def _asin_ratio(z):
+    p0, p1, p2, p3, p4, p5 = _ASIN_P
+    q1, q2, q3, q4 = _ASIN_Q
+    return (z * (p0 + z * (p1 + z * (p2 + z * (p3 + z * (p4 + z * p5)))))) / (1.0 + z * (q1 + z * (q2 + z * (q3 + z * q4))))
+
+
+def haversine(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """
+    Great circle distance between two points, for single coordinates.
+
+    Uses math instead of NumPy ufuncs on Python scalars, which cost about a microsecond each.
+    The central angle is 2 * asin(sqrt(a)), evaluated with _asin_ratio so that haversine_array
+    returns the same distance to the last bit.
+
+    Args:
+        lat1 (float): Latitude of the first point in degrees.
+        lon1 (float): Longitude of the first point in degrees.
+        lat2 (float): Latitude of the second point in degrees.
+        lon2 (float): Longitude of the second point in degrees.
+
+    Returns:
+        float: The distance in kilometers.
+    """
+    lat1, lon1, lat2, lon2 = math.radians(lat1), math.radians(lon1), math.radians(lat2), math.radians(lon2)
+    # Squares are products: float ** 2 goes through libm pow, NumPy squares by multiplying
+    sin_lat = math.sin((lat2 - lat1) / 2)
+    sin_lon = math.sin((lon2 - lon1) / 2)
+    a = sin_lat * sin_lat + math.cos(lat1) * math.cos(lat2) * (sin_lon * sin_lon)
+    if not 0.0 <= a <= 1.0:
+        # NaN coordinates; math.sqrt would raise instead of propagating them
+        return math.nan
+    if a < 0.25:
+        s = math.sqrt(a)
+        return EARTH_RADIUS * (2 * (s + s * _asin_ratio(a)))
+    # asin(x) = pi / 2 - 2 * asin(sqrt((1 - x) / 2)) keeps the argument of the approximation below 0.5
+    z = (1.0 - math.sqrt(a)) * 0.5
+    s = math.sqrt(z)
+    return EARTH_RADIUS * (2 * (HALF_PI - 2.0 * (s + s * _asin_ratio(z))))
+
+
+def haversine_array(lat1, lon1, lat2, lon2) -> np.ndarray:
+    """
+    Great circle distances between arrays of points, broadcasting like NumPy.
+
+    Args:
+        lat1 (array-like): Latitudes of the first points in degrees.
+        lon1 (array-like): Longitudes of the first points in degrees.
+        lat2 (array-like): Latitudes of the second points in degrees.
+        lon2 (array-like): Longitudes of the second points in degrees.
+
+    Returns:
+        np.ndarray: The distances in kilometers, identical to haversine for each pair.
+    """
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(values, dtype=np.float64)) for values in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    near = a < 0.25
+    z = np.where(near, a, (1.0 - np.sqrt(a)) * 0.5)
+    s = np.sqrt(z)
+    asin = s + s * _asin_ratio(z)
+    return EARTH_RADIUS * (2 * np.where(near, asin, HALF_PI - 2.0 * asin))
+
+
+def coordinate_id(latitude: float, longitude: float) -> complex:
+    """
+    Default id of a location: its coordinates packed into one complex number, which hashes
+    faster than a tuple and lets NumPy and pandas factorize whole columns of them.
+    """
+    return complex(latitude, longitude)
+
+
+class GreatCircleMemo:
+    """
+    Memo of great circle distances keyed by (origin id, destination id).
+
+    The ids default to the coordinates of each endpoint (see coordinate_id), so lanes are
+    shared between the single and batch calculations; callers may pass any hashable id,
+    e.g. a LOCODE, as long as it always stands for the same coordinates. When the memo
+    is full the oldest lanes are dropped first.
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.max_entries = int(max_entries)
+        self.hits = 0
+        self.misses = 0
+        self._distances = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._distances)
+
+    def _store(self, keys, distances):
+        if self.max_entries <= 0:
+            return
+        # Lanes beyond the capacity would be dropped again right away
+        keys, distances = keys[-self.max_entries:], distances[-self.max_entries:]
+        with self._lock:
+            self._distances.update(zip(keys, distances))
+            overflow = len(self._distances) - self.max_entries
+            if overflow > 0:
+                # Rebuilt rather than popped one by one, which leaves the dict scanning deleted slots
+                self._distances = dict(itertools.islice(self._distances.items(), overflow, None))
+
+    def distance(self, source_coordinates, destination_coordinates,
+                 origin_id: Optional[Hashable] = None, destination_id: Optional[Hashable] = None) -> float:
+        """
+        Great circle distance of one lane.
+
+        Args:
+            source_coordinates (tuple): The (latitude, longitude) of the source location.
+            destination_coordinates (tuple): The (latitude, longitude) of the destination location.
+            origin_id (hashable, optional): Id of the source; defaults to its coordinates.
+            destination_id (hashable, optional): Id of the destination; defaults to its coordinates.
+
+        Returns:
+            float: The distance in kilometers.
+        """
+        key = (coordinate_id(*source_coordinates) if origin_id is None else origin_id,
+               coordinate_id(*destination_coordinates) if destination_id is None else destination_id)
+        distance = self._distances.get(key)
+        if distance is not None:
+            self.hits += 1
+            if instrumentation.enabled:
+                instrumentation.cache('great_circle', hits=1)
+            return distance
+        self.misses += 1
+        if instrumentation.enabled:
+            instrumentation.cache('great_circle', misses=1)
+        distance = haversine(*source_coordinates, *destination_coordinates)
+        if not math.isnan(distance):
+            self._store([key], [distance])
+        return distance
+
+    def distances(self, source_latitudes, source_longitudes, destination_latitudes, destination_longitudes,
+                  origin_ids=None, destination_ids=None) -> np.ndarray:
+        """
+        Great circle distances of many lanes; each distinct lane is looked up or calculated once.
+
+        Args:
+            source_latitudes (array-like): Source latitudes.
+            source_longitudes (array-like): Source longitudes.
+            destination_latitudes (array-like): Destination latitudes.
+            destination_longitudes (array-like): Destination longitudes.
+            origin_ids (array-like, optional): Id of each source; defaults to its coordinates.
+            destination_ids (array-like, optional): Id of each destination; defaults to its coordinates.
+
+        Returns:
+            np.ndarray: The distances in kilometers.
+        """
+        source_latitudes = np.asarray(source_latitudes, dtype=np.float64)
+        source_longitudes = np.asarray(source_longitudes, dtype=np.float64)
+        destination_latitudes = np.asarray(destination_latitudes, dtype=np.float64)
+        destination_longitudes = np.asarray(destination_longitudes, dtype=np.float64)
+        if not len(source_latitudes):
+            return np.zeros(0)
+
+        origin_ids = (source_latitudes + 1j * source_longitudes if origin_ids is None
+                      else np.asarray(origin_ids, dtype=object))
+        destination_ids = (destination_latitudes + 1j * destination_longitudes if destination_ids is None
+                           else np.asarray(destination_ids, dtype=object))
+        origins = pd.factorize(origin_ids, use_na_sentinel=False)[0].astype(np.int64)
+        destinations = pd.factorize(destination_ids, use_na_sentinel=False)[0].astype(np.int64)
+        codes = pd.factorize(origins * (int(destinations.max()) + 1) + destinations)[0]
+        # Codes are numbered in order of appearance, so a lane first appears where its code
+        # exceeds every code before it; that row carries the lane's coordinates and ids
+        first = np.flatnonzero(codes > np.maximum.accumulate(np.r_[-1, codes[:-1]]))
+
+        keys = list(zip(origin_ids[first].tolist(), destination_ids[first].tolist()))
+        cached = np.array(list(map(self._distances.get, keys)), dtype=np.float64)
+        missing = np.flatnonzero(np.isnan(cached))
+        self.hits += len(keys) - len(missing)
+        self.misses += len(missing)
+        if instrumentation.enabled:
+            instrumentation.cache('great_circle', len(keys) - len(missing), len(missing))
+
+        if len(missing):
+            rows = first[missing]
+            calculated = haversine_array(source_latitudes[rows], source_longitudes[rows],
+                                         destination_latitudes[rows], destination_longitudes[rows])
+            cached[missing] = calculated
+            finite = ~np.isnan(calculated)
+            self._store([keys[i] for i in missing[finite]], calculated[finite].tolist())
+        return cached[codes]
+
+    def clear(self):
+        with self._lock:
+            self._distances.clear()
+            self.hits = self.misses = 0
+
+
+_memo = None
+_memo_lock = threading.Lock()
+
+
+def get_great_circle_memo() -> GreatCircleMemo:
+    """
+    Returns the process-wide memo, sized by GREAT_CIRCLE_CACHE_MAX_ENTRIES.
+    """
+    global _memo
+    if _memo is None:
+        with _memo_lock:
+            if _memo is None:
+                _memo = GreatCircleMemo(get_config_value('GREAT_CIRCLE_CACHE_MAX_ENTRIES', DEFAULT_MAX_ENTRIES))
+    return _memo
+
+
+def reset_great_circle_memo():
+    """
+    Forgets the memo so the next access creates it again with the configured size.
+    """
+    global _memo
+    with _memo_lock:
+        _memo = None
+
+
+def great_circle_distance(source_coordinates, destination_coordinates,
+                          origin_id: Optional[Hashable] = None, destination_id: Optional[Hashable] = None) -> float:
+    """
+    Memoized great circle distance of one lane, see GreatCircleMemo.distance.
+    """
+    return get_great_circle_memo().distance(source_coordinates, destination_coordinates, origin_id, destination_id)
+
+
+def great_circle_distances(source_latitudes, source_longitudes, destination_latitudes, destination_longitudes,
+                           origin_ids=None, destination_ids=None) -> np.ndarray:
+    """
+    Memoized great circle distances of many lanes, see GreatCircleMemo.distances.
+    """
+    return get_great_circle_memo().distances(source_latitudes, source_longitudes, destination_latitudes,
+                                             destination_longitudes, origin_ids, destination_ids)
+
+
+if __name__ == "__main__":
+    # Example usage: JFK -> SFO, computed once and then answered from the memo
+    print(great_circle_distance((40.63980103, -73.77890015), (37.61899948, -122.375)))
+    print(great_circle_distances([40.63980103] * 3, [-73.77890015] * 3, [37.61899948] * 3, [-122.375] * 3))
+    print(get_great_circle_memo().hits, get_great_circle_memo().misses)
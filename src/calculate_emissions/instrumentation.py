@@ -0,0 +1,350 @@
+import math
+import time
+import bisect
+import threading
+from contextlib import nullcontext
+from typing import Dict, Optional, Tuple
+
+# Clock used for every duration; hot paths read it only when instrumentation is enabled
+timer = time.perf_counter
+
+# Upper bounds in seconds of the duration histogram buckets
+DURATION_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+                    0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Error categories, by fragments of the error messages raised along the pipeline; the first match wins
+ERROR_CATEGORIES = (
+    ('unknown_dataset', ('Unknown emission factor dataset',)),
+    ('distance', ('Unable to calculate distance', 'calculating land distance', 'LAND_DISTANCE_MODE')),
+    ('external_service', ('Mapbox', 'geocoding', 'HTTP', 'timed out', 'Connection')),
+    ('unknown_location', ('Coordinates not found', 'Invalid airport code', 'Input should be in the format',
+                          'fetching coordinates')),
+    ('unknown_method', ('not found in emission factors', 'Emission factor for method', 'Unknown transshipment',
+                        'No emission factor for')),
+    ('missing_data', ('Required data is missing', 'Required column is missing', 'must be provided',
+                      'needs at least one leg')),
+)
+
+NULL_TIMER = nullcontext()
+
+
+def error_category(message: str) -> str:
+    """
+    Category of an error message, e.g. 'unknown_location' or 'missing_data'; 'other' if none matches.
+    """
+    for category, fragments in ERROR_CATEGORIES:
+        if any(fragment in message for fragment in fragments):
+            return category
+    return 'other'
+
+
+class Hook:
+    """
+    Receives the measurements of the calculation pipeline.
+
+    Subclass it and override the methods of interest, then register it with
+    instrumentation.add_hook. Hooks are called synchronously on the calculating
+    thread, possibly from several threads at once, so they should be quick and thread-safe.
+    """
+
+    def on_stage(self, stage: str, kind: Optional[str], seconds: float, count: int):
+        """
+        A pipeline stage ran: 'mass', 'coordinates' (kind: the location kind), 'distance'
+        (kind: the distance calculation method), 'emission_factor', 'serialization' or
+        'reference_data' (kind: the table loaded). count is the number of shipments it covered.
+        """
+
+    def on_cache(self, cache: str, hits: int, misses: int):
+        """
+        A cache was consulted: 'great_circle', 'mapbox' or 'idempotency'.
+        """
+
+    def on_external_call(self, service: str, operation: str, seconds: float, outcome: str):
+        """
+        A request to an external service finished; outcome is the HTTP status code or 'error'.
+        """
+
+    def on_error(self, category: str, count: int):
+        """
+        Shipments failed with an error of the given category, see error_category.
+        """
+
+
+class _StageTimer:
+    __slots__ = ('instrumentation', 'stage', 'kind', 'count', 'start')
+
+    def __init__(self, instrumentation, stage: str, kind: Optional[str], count: int):
+        self.instrumentation = instrumentation
+        self.stage = stage
+        self.kind = kind
+        self.count = count
+
+    def __enter__(self):
+        self.start = timer()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.instrumentation.stage(self.stage, self.kind, timer() - self.start, self.count)
+
+
+class Instrumentation:
+    """
+    Dispatches measurements to the registered hooks.
+
+    Call sites check enabled before reading the clock, so with no hook registered the
+    pipeline pays one attribute lookup per stage.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.hooks: Tuple[Hook, ...] = ()
+        self._lock = threading.Lock()
+
+    def add_hook(self, hook: Hook) -> Hook:
+        with self._lock:
+            self.hooks = self.hooks + (hook,)
+            self.enabled = True
+        return hook
+
+    def remove_hook(self, hook: Hook):
+        with self._lock:
+            self.hooks = tuple(registered for registered in self.hooks if registered is not hook)
+            self.enabled = bool(self.hooks)
+
+    def stage(self, stage: str, kind: Optional[str], seconds: float, count: int = 1):
+        for hook in self.hooks:
+            hook.on_stage(stage, kind, seconds, count)
+
+    def timed(self, stage: str, kind: Optional[str] = None, count: int = 1):
+        """
+        Context manager timing a stage; a shared no-op when instrumentation is disabled.
+        """
+        return _StageTimer(self, stage, kind, count) if self.enabled else NULL_TIMER
+
+    def cache(self, cache: str, hits: int = 0, misses: int = 0):
+        for hook in self.hooks:
+            hook.on_cache(cache, hits, misses)
+
+    def external_call(self, service: str, operation: str, seconds: float, outcome: str):
+        for hook in self.hooks:
+            hook.on_external_call(service, operation, seconds, outcome)
+
+    def error(self, message: str, count: int = 1):
+        category = error_category(message)
+        for hook in self.hooks:
+            hook.on_error(category, count)
+
+
+# The process-wide instrumentation used by the pipeline
+instrumentation = Instrumentation()
+
+
+class _Histogram:
+    __slots__ = ('buckets', 'sum', 'count')
+
+    def __init__(self):
+        self.buckets = [0] * (len(DURATION_BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.buckets[bisect.bisect_left(DURATION_BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _labels(**labels) -> str:
+    parts = []
+    for name, value in labels.items():
+        if value is not None:
+            value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+            parts.append(f'{name}="{value}"')
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+def _histogram_lines(name: str, histogram: _Histogram, **labels) -> list:
+    lines = []
+    cumulative = 0
+    for bound, count in zip(DURATION_BUCKETS + (math.inf,), histogram.buckets):
+        cumulative += count
+        lines.append(f"{name}_bucket{_labels(**labels, le='+Inf' if bound == math.inf else repr(bound))} {cumulative}")
+    lines.append(f"{name}_sum{_labels(**labels)} {histogram.sum!r}")
+    lines.append(f"{name}_count{_labels(**labels)} {histogram.count}")
+    return lines
+
+
+class MetricsRecorder(Hook):
+    """
+    Aggregates the measurements in memory and exports them in the Prometheus text format.
+    """
+
+    def __init__(self, prefix: str = 'calculate_emissions'):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._stages: Dict[tuple, _Histogram] = {}
+            self._stage_items: Dict[tuple, int] = {}
+            self._caches: Dict[str, list] = {}
+            self._external_calls: Dict[tuple, _Histogram] = {}
+            self._errors: Dict[str, int] = {}
+
+    def on_stage(self, stage, kind, seconds, count):
+        key = (stage, kind)
+        with self._lock:
+            histogram = self._stages.get(key)
+            if histogram is None:
+                histogram = self._stages[key] = _Histogram()
+            histogram.observe(seconds)
+            self._stage_items[key] = self._stage_items.get(key, 0) + count
+
+    def on_cache(self, cache, hits, misses):
+        with self._lock:
+            counts = self._caches.setdefault(cache, [0, 0])
+            counts[0] += hits
+            counts[1] += misses
+
+    def on_external_call(self, service, operation, seconds, outcome):
+        key = (service, operation, str(outcome))
+        with self._lock:
+            histogram = self._external_calls.get(key)
+            if histogram is None:
+                histogram = self._external_calls[key] = _Histogram()
+            histogram.observe(seconds)
+
+    def on_error(self, category, count):
+        with self._lock:
+            self._errors[category] = self._errors.get(category, 0) + count
+
+    def snapshot(self) -> dict:
+        """
+        The aggregated measurements as plain data.
+
+        Returns:
+            dict: 'stages' and 'external_calls' (calls, seconds and mean per label set),
+            'caches' (hits, misses and hit_ratio) and 'errors' (count per category).
+        """
+        with self._lock:
+            return {
+                'stages': {f"{stage}.{kind}" if kind else stage: {
+                    'calls': histogram.count, 'items': self._stage_items[(stage, kind)], 'seconds': histogram.sum,
+                    'mean_seconds': histogram.sum / histogram.count,
+                } for (stage, kind), histogram in self._stages.items()},
+                'caches': {cache: {
+                    'hits': hits, 'misses': misses, 'hit_ratio': hits / (hits + misses) if hits + misses else None,
+                } for cache, (hits, misses) in self._caches.items()},
+                'external_calls': {f"{service}.{operation}.{outcome}": {
+                    'calls': histogram.count, 'seconds': histogram.sum, 'mean_seconds': histogram.sum / histogram.count,
+                } for (service, operation, outcome), histogram in self._external_calls.items()},
+                'errors': dict(self._errors),
+            }
+
+    def to_prometheus(self) -> str:
+        """
+        Renders the measurements in the Prometheus text exposition format (version 0.0.4).
+        """
+        prefix = self.prefix
+        with self._lock:
+            lines = [f"# HELP {prefix}_stage_seconds Wall time of each run of a calculation stage.",
+                     f"# TYPE {prefix}_stage_seconds histogram"]
+            for (stage, kind), histogram in sorted(self._stages.items(), key=lambda item: (item[0][0], item[0][1] or '')):
+                lines += _histogram_lines(f"{prefix}_stage_seconds", histogram, stage=stage, kind=kind)
+            lines += [f"# HELP {prefix}_stage_items_total Shipments processed by each calculation stage.",
+                      f"# TYPE {prefix}_stage_items_total counter"]
+            for (stage, kind), items in sorted(self._stage_items.items(), key=lambda item: (item[0][0], item[0][1] or '')):
+                lines.append(f"{prefix}_stage_items_total{_labels(stage=stage, kind=kind)} {items}")
+
+            lines += [f"# HELP {prefix}_cache_requests_total Cache lookups by result.",
+                      f"# TYPE {prefix}_cache_requests_total counter"]
+            for cache, (hits, misses) in sorted(self._caches.items()):
+                lines.append(f"{prefix}_cache_requests_total{_labels(cache=cache, result='hit')} {hits}")
+                lines.append(f"{prefix}_cache_requests_total{_labels(cache=cache, result='miss')} {misses}")
+            lines += [f"# HELP {prefix}_cache_hit_ratio Share of cache lookups answered by the cache.",
+                      f"# TYPE {prefix}_cache_hit_ratio gauge"]
+            for cache, (hits, misses) in sorted(self._caches.items()):
+                if hits + misses:
+                    lines.append(f"{prefix}_cache_hit_ratio{_labels(cache=cache)} {hits / (hits + misses)!r}")
+
+            lines += [f"# HELP {prefix}_external_call_seconds Duration of requests to external services.",
+                      f"# TYPE {prefix}_external_call_seconds histogram"]
+            for (service, operation, outcome), histogram in sorted(self._external_calls.items()):
+                lines += _histogram_lines(f"{prefix}_external_call_seconds", histogram,
+                                          service=service, operation=operation, outcome=outcome)
+
+            lines += [f"# HELP {prefix}_errors_total Shipments that failed, by error category.",
+                      f"# TYPE {prefix}_errors_total counter"]
+            for category, count in sorted(self._errors.items()):
+                lines.append(f"{prefix}_errors_total{_labels(category=category)} {count}")
+        return '\n'.join(lines) + '\n'
+
+
+class OpenTelemetryHook(Hook):
+    """
+    Records the measurements with OpenTelemetry metric instruments (requires opentelemetry-api).
+
+    Args:
+        meter: The meter to create the instruments with; by default one named after this package
+            from the global meter provider.
+    """
+
+    def __init__(self, meter=None):
+        if meter is None:
+            from opentelemetry import metrics
+            meter = metrics.get_meter('calculate_emissions')
+        self._stage_duration = meter.create_histogram(
+            'calculate_emissions.stage.duration', unit='s', description="Wall time of each run of a calculation stage")
+        self._stage_items = meter.create_counter(
+            'calculate_emissions.stage.items', description="Shipments processed by each calculation stage")
+        self._cache_requests = meter.create_counter(
+            'calculate_emissions.cache.requests', description="Cache lookups by result")
+        self._external_call_duration = meter.create_histogram(
+            'calculate_emissions.external_call.duration', unit='s', description="Duration of requests to external services")
+        self._errors = meter.create_counter(
+            'calculate_emissions.errors', description="Shipments that failed, by error category")
+
+    def on_stage(self, stage, kind, seconds, count):
+        attributes = {'stage': stage, 'kind': kind or ''}
+        self._stage_duration.record(seconds, attributes)
+        self._stage_items.add(count, attributes)
+
+    def on_cache(self, cache, hits, misses):
+        if hits:
+            self._cache_requests.add(hits, {'cache': cache, 'result': 'hit'})
+        if misses:
+            self._cache_requests.add(misses, {'cache': cache, 'result': 'miss'})
+
+    def on_external_call(self, service, operation, seconds, outcome):
+        self._external_call_duration.record(seconds, {'service': service, 'operation': operation, 'outcome': str(outcome)})
+
+    def on_error(self, category, count):
+        self._errors.add(count, {'category': category})
+
+
+def enable_metrics() -> MetricsRecorder:
+    """
+    Registers a new MetricsRecorder, which is returned; remove it with instrumentation.remove_hook.
+    """
+    return instrumentation.add_hook(MetricsRecorder())
+
+
+if __name__ == "__main__":
+    # Example usage: metrics of a few calculations
+    import os
+    import sys
+    import json
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+    from main import calculate_emissions
+    # The pipeline modules report to the imported module, not to this script's copy of it
+    from instrumentation import enable_metrics as enable_pipeline_metrics
+
+    recorder = enable_pipeline_metrics()
+    shipping_data = {
+        "shipment": {"mass": {"amount": 2000.0, "unit": "kg"}},
+        "route": {"source": {"airport_code": "JFK"}, "destination": {"airport_code": "SFO"}},
+        "method": {"method": "cargo_plane"},
+    }
+    for _ in range(3):
+        calculate_emissions(shipping_data)
+    print(json.dumps(recorder.snapshot(), indent=4))
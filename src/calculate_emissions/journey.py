@@ -0,0 +1,268 @@
+import re
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Optional, Tuple
+
+try:
+    from batch import calculate_emissions_batch, flatten_shipping_data
+except ImportError:
+    from calculate_emissions.batch import calculate_emissions_batch, flatten_shipping_data
+
+# Hub emission factors in kg CO2e per tonne handled, see docs/TransshipmentEmissionsFactors.md
+TRANSSHIPMENT_FACTORS = {
+    ('transshipment', 'ambient'): 0.6,
+    ('transshipment', 'mixed'): 2.2,
+    ('storage_transshipment', 'ambient'): 2.1,
+    ('storage_transshipment', 'mixed'): 4.0,
+    ('warehouse', 'ambient'): 17.5,
+    ('warehouse', 'mixed'): 33.0,
+    ('liquid_bulk_terminal', 'ambient'): 3.1,
+    ('liquid_bulk_terminal', 'mixed'): 8.1,
+    ('maritime_container_terminal', 'ambient'): 10.7,
+    ('maritime_container_terminal', 'temperature_controlled'): 12.6,
+}
+
+# Spellings accepted for the hub categories, after normalize_name
+TRANSSHIPMENT_ALIASES = {
+    'transshipment': 'transshipment',
+    'transhipment': 'transshipment',
+    'storage_transshipment': 'storage_transshipment',
+    'storage_and_transshipment': 'storage_transshipment',
+    'warehouse': 'warehouse',
+    'liquid_bulk_terminal': 'liquid_bulk_terminal',
+    'liquid_bulk_terminals': 'liquid_bulk_terminal',
+    'maritime_container_terminal': 'maritime_container_terminal',
+    'maritime_container_terminals': 'maritime_container_terminal',
+    'container_terminal': 'maritime_container_terminal',
+}
+
+# Hubs are assumed to be ambient unless the temperature is given
+DEFAULT_TEMPERATURE = 'ambient'
+
+TEMPERATURE_ALIASES = {
+    'ambient': 'ambient',
+    'temperature_controlled': 'temperature_controlled',
+    'controlled': 'temperature_controlled',
+    'reefer': 'temperature_controlled',
+    'mixed': 'mixed',
+}
+
+
+def normalize_name(name: str) -> str:
+    """
+    Normalizes a category name, e.g. 'Storage + Transshipment' to 'storage_transshipment'.
+    """
+    return re.sub(r'[^a-z]+', '_', name.lower()).strip('_')
+
+
+def get_transshipment_factor(transshipment: str, temperature: Optional[str] = None) -> Tuple[float, str]:
+    """
+    Fetch the hub emission factor for a transshipment category.
+
+    Args:
+        transshipment (str): The hub category, e.g. 'Warehouse' or 'maritime_container_terminal'.
+        temperature (str, optional): 'ambient' (default), 'temperature_controlled' or 'mixed'.
+
+    Returns:
+        float: The emission factor in kg CO2e per tonne.
+        str: Calculation method used, e.g. 'warehouse_ambient'.
+    """
+    category = TRANSSHIPMENT_ALIASES.get(normalize_name(transshipment))
+    if category is None:
+        raise ValueError(f"Unknown transshipment category: {transshipment}")
+    temperature = TEMPERATURE_ALIASES.get(normalize_name(temperature or DEFAULT_TEMPERATURE))
+    factor = TRANSSHIPMENT_FACTORS.get((category, temperature))
+    if factor is None:
+        raise ValueError(f"No emission factor for {category} hubs at {temperature} temperature")
+    return factor, f"{category}_{temperature}"
+
+
+def _text(value) -> Optional[str]:
+    return value if isinstance(value, str) else None
+
+
+def _is_hub(element: dict) -> bool:
+    return element.get('type') == 'hub' or (element.get('type') is None and 'transshipment' in element)
+
+
+def _journey_legs(shipping_data: dict) -> Tuple[List[dict], List[dict]]:
+    """
+    Splits a journey into batch rows for its legs and hub descriptions, chaining locations.
+
+    A leg without a source starts where the previous leg (or the hub before it) ended,
+    and a leg without a destination ends at the location of the hub after it.
+    """
+    elements = shipping_data.get('journey') or []
+    if not elements:
+        raise ValueError("Required data is missing: 'journey'")
+
+    shipment = shipping_data.get('shipment') or {}
+    rows = []
+    hubs = []
+    location = None
+    for position, element in enumerate(elements):
+        if _is_hub(element):
+            hubs.append(dict(element, position=position))
+            if element.get('location'):
+                location = element['location']
+                # The hub also ends a previous leg that had no destination
+                if rows and not rows[-1]['route'].get('destination') and not rows[-1]['route'].get('distance'):
+                    rows[-1]['route']['destination'] = location
+            continue
+
+        route = dict(element.get('route') or {})
+        if not route.get('distance') and not route.get('source') and location is not None:
+            route['source'] = location
+        rows.append({
+            'position': position,
+            'shipment': shipment,
+            'route': route,
+            'method': element.get('method') or {},
+            'country_code': element.get('country_code', shipping_data.get('country_code')),
+            'shipped_at': shipping_data.get('shipped_at'),
+        })
+        location = route.get('destination')
+
+    if not rows:
+        raise ValueError("A journey needs at least one leg")
+    return rows, hubs
+
+
+def calculate_journeys(journeys: List[Dict], factor_version: Optional[str] = None) -> List[Dict]:
+    """
+    Calculate the emissions of many multi-leg journeys at once.
+
+    Every leg of every journey goes through one calculate_emissions_batch call, so each
+    distinct location is resolved and each distinct (method, fuel, load, trade_lane)
+    factor is looked up once. Hub emissions are the shipment mass times the
+    transshipment factor of the hub.
+
+    Args:
+        journeys (list): shipping_data dicts whose 'journey' is an ordered list of legs
+            ({'route', 'method', optional 'country_code'}) and hubs ({'type': 'hub',
+            'transshipment', optional 'temperature' and 'location'}).
+        factor_version (str, optional): The emission factor dataset of the legs; by default the
+            one that applied on each journey's 'shipped_at'.
+
+    Returns:
+        list: One result per journey with the total 'emissions', 'shipment_mass', 'distance',
+        'leg_emissions', 'hub_emissions' and the per-leg and per-hub results in 'journey'.
+        Journeys that cannot be calculated have NaN emissions and an 'error' instead.
+    """
+    results = []
+    rows = []
+    parsed = []
+    for shipping_data in journeys:
+        try:
+            legs, hubs = _journey_legs(shipping_data)
+        except ValueError as e:
+            parsed.append((None, [], [], str(e)))
+            continue
+        parsed.append((len(rows), legs, hubs, None))
+        rows.extend(flatten_shipping_data(leg) for leg in legs)
+
+    leg_results = calculate_emissions_batch(pd.DataFrame(rows), factor_version) if rows else None
+
+    for start, legs, hubs, error in parsed:
+        if error is not None:
+            results.append({'emissions': np.nan, 'error': error})
+            continue
+        leg_frame = leg_results.iloc[start:start + len(legs)]
+        elements = []
+        for leg, (_, leg_result) in zip(legs, leg_frame.iterrows()):
+            if isinstance(leg_result['error'], str) and error is None:
+                error = f"Leg {leg['position']}: {leg_result['error']}"
+            elements.append((leg['position'], {
+                'type': 'leg',
+                'emissions': leg_result['emissions'],
+                'distance': leg_result['distance'],
+                'distance_calculation_method': _text(leg_result['distance_calculation_method']),
+                'emission_factor': leg_result['emission_factor'],
+                'emission_factor_calculation_method': _text(leg_result['emission_factor_calculation_method']),
+                'dataset_version': _text(leg_result['dataset_version']),
+            }))
+
+        # Every leg carries the same shipment, so any leg gives its mass
+        shipment_mass = float(leg_frame['shipment_mass'].iloc[0])
+        default_transshipment = (legs[0]['shipment'] or {}).get('transshipment')
+        default_temperature = (legs[0]['shipment'] or {}).get('temperature')
+        for hub in hubs:
+            transshipment = hub.get('transshipment') or default_transshipment
+            try:
+                if not transshipment:
+                    raise ValueError("Transshipment category must be provided")
+                emission_factor, calculation_method = get_transshipment_factor(
+                    transshipment, hub.get('temperature') or default_temperature)
+            except ValueError as e:
+                error = error or f"Hub {hub['position']}: {e}"
+                emission_factor, calculation_method = np.nan, None
+            elements.append((hub['position'], {
+                'type': 'hub',
+                'emissions': shipment_mass * emission_factor,
+                'emission_factor': emission_factor,
+                'emission_factor_calculation_method': calculation_method,
+            }))
+
+        elements = [element for _, element in sorted(elements, key=lambda item: item[0])]
+        leg_emissions = float(leg_frame['emissions'].sum(min_count=1)) if error is None else np.nan
+        hub_emissions = sum(element['emissions'] for element in elements if element['type'] == 'hub') if error is None else np.nan
+        result = {
+            'emissions': leg_emissions + hub_emissions,
+            'shipment_mass': shipment_mass,
+            'distance': float(leg_frame['distance'].sum()),
+            'leg_emissions': leg_emissions,
+            'hub_emissions': hub_emissions,
+            # Every leg shares the journey's shipped_at, and so its emission factor dataset
+            'dataset_version': _text(leg_frame['dataset_version'].iloc[0]),
+            'journey': elements,
+        }
+        if error is not None:
+            result['error'] = error
+        results.append(result)
+    return results
+
+
+def calculate_journey(shipping_data: Dict, factor_version: Optional[str] = None) -> Dict:
+    """
+    Calculate the emissions of one multi-leg journey.
+
+    Args:
+        shipping_data (dict): The shipment and its ordered 'journey' of legs and hubs,
+            as described in calculate_journeys.
+        factor_version (str, optional): The emission factor dataset of the legs.
+
+    Returns:
+        dict: The totals and the per-leg and per-hub results.
+    """
+    result = calculate_journeys([shipping_data], factor_version)[0]
+    if 'error' in result:
+        raise ValueError(result['error'])
+    return result
+
+
+if __name__ == "__main__":
+    # Example usage: truck -> port -> vessel -> port -> truck
+    shipping_data = {
+        "shipment": {
+            "containers": 2,
+            "cargo_type": "average"
+        },
+        "journey": [
+            {
+                "route": {"distance": 120, "unit": "km"},
+                "method": {"method": "diesel_freight_train"}
+            },
+            {"type": "hub", "transshipment": "Maritime Container Terminals", "location": {"locode": {"locode": "DEHAM"}}},
+            {
+                "route": {"destination": {"locode": {"locode": "CNSHA"}}},
+                "method": {"method": "container_ship", "trade_lane": "aggregated_transsuez"}
+            },
+            {"type": "hub", "transshipment": "Maritime Container Terminals"},
+            {
+                "route": {"distance": 80, "unit": "km"},
+                "method": {"method": "diesel_freight_train"}
+            }
+        ]
+    }
+
+    print(calculate_journey(shipping_data))
@@ -0,0 +1,455 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+import numpy as np
+import pandas as pd
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional, Tuple
+
+try:
+    from batch import calculate_emissions_batch, requires_network, resolve_dataset_versions, INPUT_COLUMNS, OUTPUT_COLUMNS
+    from batch_planner import text_hashes, number_hashes, combine_hashes, BatchPlan, NUMERIC_COLUMNS
+    from calculate_distance import data_dir
+    from config import get_config_value
+    from factor_registry import get_factor_registry, FactorChange
+    from snapshot import load_snapshot
+except ImportError:
+    from calculate_emissions.batch import calculate_emissions_batch, requires_network, resolve_dataset_versions, INPUT_COLUMNS, OUTPUT_COLUMNS
+    from calculate_emissions.batch_planner import text_hashes, number_hashes, combine_hashes, BatchPlan, NUMERIC_COLUMNS
+    from calculate_emissions.calculate_distance import data_dir
+    from calculate_emissions.config import get_config_value
+    from calculate_emissions.factor_registry import get_factor_registry, FactorChange
+    from calculate_emissions.snapshot import load_snapshot
+
+# Bump whenever a change to the calculation makes stored results stale
+LEDGER_FORMAT_VERSION = 2
+
+# Settings that change the calculated distances
+DISTANCE_SETTINGS = (
+    'LAND_DISTANCE_MODE', 'ROAD_DETOUR_FACTORS', 'ROAD_DEFAULT_DETOUR_FACTOR', 'ROAD_GRAPH_PATH',
+    'ROAD_GRAPH_MAX_SNAP_DISTANCE', 'SNAP_TO_HUBS', 'SNAP_MAX_DISTANCE', 'MAPBOX_CACHE_COORDINATE_PRECISION',
+)
+
+# Output columns kept in the store; the error column is not, as failed rows are always recalculated
+STORED_COLUMNS = [column for column in OUTPUT_COLUMNS if column != 'error']
+TEXT_COLUMNS = ('distance_calculation_method', 'emission_factor_calculation_method', 'dataset_version')
+
+# The stored columns are kept as one float64 matrix and one matrix of category codes
+NUMBER_COLUMNS = [column for column in STORED_COLUMNS if column not in TEXT_COLUMNS]
+CODE_COLUMNS = [column for column in STORED_COLUMNS if column in TEXT_COLUMNS]
+
+# Segments beyond which the store is compacted into one
+DEFAULT_MAX_SEGMENTS = 32
+
+
+def _file_stat(path) -> Optional[list]:
+    try:
+        stat = os.stat(path)
+    except (OSError, TypeError):
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def dependency_fingerprint() -> str:
+    """
+    Fingerprint of everything besides the shipment and its emission factor dataset that a
+    result depends on: the reference data (LOCODE and airport CSVs and the bundled workbook,
+    by the version of their snapshot), the distance settings and LEDGER_FORMAT_VERSION.
+    The dataset is part of each row's key instead, see shipment_keys.
+
+    Returns:
+        str: A JSON document; any change to it invalidates every stored result.
+    """
+    settings = {key: get_config_value(key) for key in DISTANCE_SETTINGS}
+    return json.dumps({
+        'format_version': LEDGER_FORMAT_VERSION,
+        'reference_data': load_snapshot(data_dir).version,
+        'settings': settings,
+        'road_graph': _file_stat(settings['ROAD_GRAPH_PATH']),
+    }, sort_keys=True, default=str)
+
+
+def _factor_digest(table, method_name, country_code) -> str:
+    if not isinstance(method_name, str):
+        return ''
+    # Planes resolve to the short or long haul rows depending on the distance, see get_emission_factor
+    names = [f"{method_name}_long_haul", f"{method_name}_short_haul"] if 'plane' in method_name else [method_name]
+    parts = [table.method_digests.get(name) for name in names]
+    if any(table.is_electric.get(name) for name in names):
+        parts.append(table.electricity_intensity(country_code if isinstance(country_code, str) and country_code else None))
+    return repr(parts)
+
+
+def factor_digests(df: pd.DataFrame, dataset_versions: np.ndarray) -> np.ndarray:
+    """
+    Fingerprint of the emission factors each shipment can resolve to in its dataset: the
+    rows of its method (EmissionFactorTable.method_digests) and, for electric methods,
+    the electricity intensity of its country.
+
+    Args:
+        df (pd.DataFrame): The shipments.
+        dataset_versions (np.ndarray): The emission factor dataset of each shipment.
+
+    Returns:
+        np.ndarray: One digest per row; computed once per distinct dataset, method and country.
+    """
+    columns = [np.asarray(dataset_versions, dtype=object)]
+    for name in ('method', 'country_code'):
+        columns.append(df[name].to_numpy(dtype=object) if name in df.columns else np.full(len(df), None, dtype=object))
+    # One code per distinct combination; missing values (code -1) are a value of their own
+    combinations = np.zeros(len(df), dtype=np.int64)
+    for column in columns:
+        codes, uniques = pd.factorize(column)
+        combinations = combinations * (len(uniques) + 1) + codes + 1
+    plan = BatchPlan(combinations)
+    registry = get_factor_registry()
+    versions, methods, countries = columns
+    digests = np.array([_factor_digest(registry.get(versions[row]).table, methods[row], countries[row])
+                        for row in plan.unique_rows], dtype=object)
+    return digests[plan.inverse]
+
+
+def shipment_keys(df: pd.DataFrame, dataset_versions: np.ndarray, dependencies: str = '',
+                  digests: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Content hash of each shipment's normalized input.
+
+    Two rows get the same key when their INPUT_COLUMNS hold the same values (numbers
+    compared as numbers; None, NaN and '' all count as missing), they are calculated
+    with the same emission factor dataset, holding the same factors, and the
+    dependencies are the same. Other columns, such as an id, do not take part.
+
+    Args:
+        df (pd.DataFrame): The shipments.
+        dataset_versions (np.ndarray): The emission factor dataset of each shipment.
+        dependencies (str): Fingerprint shared by every row, see dependency_fingerprint.
+        digests (np.ndarray, optional): The fingerprint of the factors each shipment
+            can resolve to (see factor_digests), so a dataset registered again under the same
+            version only gives new keys to the shipments whose factors changed.
+
+    Returns:
+        np.ndarray: One 64-bit key per row, as int64.
+    """
+    n = len(df)
+    keys = np.full(n, pd.util.hash_array(np.array([dependencies], dtype=object))[0], dtype=np.uint64)
+    for name in INPUT_COLUMNS:
+        keys = combine_hashes(keys, number_hashes(df, name) if name in NUMERIC_COLUMNS else text_hashes(df, name))
+    keys = combine_hashes(keys, pd.util.hash_array(np.asarray(dataset_versions, dtype=object), categorize=True))
+    if digests is not None:
+        keys = combine_hashes(keys, pd.util.hash_array(np.asarray(digests, dtype=object), categorize=True))
+    return keys.view(np.int64)
+
+
+class LedgerStore:
+    """
+    Persistent store of calculated results by shipment key (see shipment_keys), in a SQLite file.
+
+    Each call to store writes one segment holding its rows as packed arrays, so a
+    million results load in well under a second instead of a million row reads. The
+    results are kept in memory sorted by key once loaded, and segments written by other
+    processes are picked up on the next lookup. A key stored again replaces its older
+    result, and the segments are merged once there are more than max_segments.
+    """
+
+    def __init__(self, path: str, max_segments: int = DEFAULT_MAX_SEGMENTS):
+        self.path = path
+        self.max_segments = max_segments
+        self._lock = threading.Lock()
+
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS segments (id INTEGER PRIMARY KEY AUTOINCREMENT, created_at REAL NOT NULL, '
+            'rows INTEGER NOT NULL, keys BLOB NOT NULL, numbers BLOB NOT NULL, codes BLOB NOT NULL, categories TEXT NOT NULL)')
+        self._reset()
+
+    def _reset(self):
+        self._keys = np.zeros(0, dtype=np.int64)
+        self._numbers = np.zeros((0, len(NUMBER_COLUMNS)))
+        self._codes = np.zeros((0, len(CODE_COLUMNS)), dtype=np.int32)
+        self._categories = [[] for _ in CODE_COLUMNS]
+        self._segments = 0
+        self._loaded_id = 0
+
+    def _merge(self, keys: np.ndarray, numbers: np.ndarray, codes: np.ndarray, categories: list):
+        # Codes are renumbered into the store's categories; -1 stays missing
+        codes = codes.copy()
+        for i, segment_categories in enumerate(categories):
+            known = {category: code for code, category in enumerate(self._categories[i])}
+            for category in segment_categories:
+                if category not in known:
+                    known[category] = len(self._categories[i])
+                    self._categories[i].append(category)
+            mapping = np.array([known[category] for category in segment_categories] + [-1], dtype=np.int32)
+            codes[:, i] = mapping[codes[:, i]]
+        all_keys = np.concatenate([self._keys, keys])
+        # A stable sort keeps equal keys in the order they were stored; the last one wins
+        order = np.argsort(all_keys, kind='stable')
+        sorted_keys = all_keys[order]
+        last = order[np.r_[sorted_keys[1:] != sorted_keys[:-1], True]]
+        self._keys = all_keys[last]
+        self._numbers = np.concatenate([self._numbers, numbers])[last]
+        self._codes = np.concatenate([self._codes, codes])[last]
+
+    def _refresh(self):
+        segments = self._connection.execute(
+            'SELECT id, rows, keys, numbers, codes, categories FROM segments WHERE id > ? ORDER BY id',
+            (self._loaded_id,)).fetchall()
+        for segment_id, rows, keys, numbers, codes, categories in segments:
+            self._merge(np.frombuffer(keys, dtype=np.int64),
+                        np.frombuffer(numbers, dtype=np.float64).reshape(rows, len(NUMBER_COLUMNS)),
+                        np.frombuffer(codes, dtype=np.int32).reshape(rows, len(CODE_COLUMNS)),
+                        json.loads(categories))
+            self._loaded_id = segment_id
+        self._segments = self._connection.execute('SELECT COUNT(*) FROM segments').fetchone()[0]
+
+    def _write_segment(self, keys: np.ndarray, numbers: np.ndarray, codes: np.ndarray, categories: list):
+        self._connection.execute(
+            'INSERT INTO segments (created_at, rows, keys, numbers, codes, categories) VALUES (?, ?, ?, ?, ?, ?)',
+            (time.time(), len(keys), np.ascontiguousarray(keys, dtype=np.int64).tobytes(),
+             np.ascontiguousarray(numbers, dtype=np.float64).tobytes(),
+             np.ascontiguousarray(codes, dtype=np.int32).tobytes(), json.dumps(categories)))
+
+    def __len__(self):
+        with self._lock:
+            self._refresh()
+            return len(self._keys)
+
+    def lookup(self, keys: np.ndarray) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+        """
+        Returns the stored results of the given keys.
+
+        Args:
+            keys (np.ndarray): int64 keys.
+
+        Returns:
+            tuple: A mask of the keys that are stored, and their STORED_COLUMNS as arrays
+            aligned with keys[mask].
+        """
+        keys = np.asarray(keys, dtype=np.int64)
+        with self._lock:
+            self._refresh()
+            positions = np.minimum(np.searchsorted(self._keys, keys), max(len(self._keys) - 1, 0))
+            found = self._keys[positions] == keys if len(self._keys) else np.zeros(len(keys), dtype=bool)
+            positions = positions[found]
+            columns = {column: self._numbers[positions, i] for i, column in enumerate(NUMBER_COLUMNS)}
+            for i, column in enumerate(CODE_COLUMNS):
+                categories = np.array(self._categories[i] + [None], dtype=object)
+                columns[column] = categories[self._codes[positions, i]]
+        return found, columns
+
+    def store(self, keys: np.ndarray, results: pd.DataFrame):
+        """
+        Stores results (with the STORED_COLUMNS) under their keys as one segment, replacing older entries.
+        """
+        numbers = np.column_stack([results[column].to_numpy(dtype=np.float64) for column in NUMBER_COLUMNS])
+        codes, categories = [], []
+        for column in CODE_COLUMNS:
+            column_codes, column_categories = pd.factorize(results[column].to_numpy(dtype=object))
+            codes.append(column_codes.astype(np.int32))
+            categories.append([str(category) for category in column_categories])
+        codes = np.column_stack(codes)
+        with self._lock:
+            self._write_segment(keys, numbers, codes, categories)
+            self._refresh()
+            if self._segments > self.max_segments:
+                self._compact()
+
+    def _compact(self, keep: Optional[Callable[[], np.ndarray]] = None):
+        # Rewrites the merged results as a single segment, without the rows keep() rejects
+        self._connection.execute('BEGIN IMMEDIATE')
+        try:
+            self._refresh()
+            if keep is not None:
+                kept = keep()
+                self._keys, self._numbers, self._codes = self._keys[kept], self._numbers[kept], self._codes[kept]
+            self._connection.execute('DELETE FROM segments WHERE id <= ?', (self._loaded_id,))
+            self._write_segment(self._keys, self._numbers, self._codes, self._categories)
+            self._connection.execute('COMMIT')
+        except BaseException:
+            self._connection.execute('ROLLBACK')
+            raise
+        self._loaded_id = self._connection.execute('SELECT MAX(id) FROM segments').fetchone()[0]
+        self._segments = 1
+
+    def compact(self):
+        """
+        Merges every segment into one, dropping the results replaced since.
+        """
+        with self._lock:
+            self._compact()
+
+    def discard(self, change: FactorChange) -> int:
+        """
+        Removes the results of change.previous_version whose method the change affects
+        (see FactorChange.affects; stored results do not record their country).
+
+        Returns:
+            int: The number of results removed.
+        """
+        version_column = CODE_COLUMNS.index('dataset_version')
+        method_column = CODE_COLUMNS.index('emission_factor_calculation_method')
+        removed = 0
+
+        def keep() -> np.ndarray:
+            nonlocal removed
+            categories = self._categories[version_column]
+            if change.previous_version not in categories:
+                return np.ones(len(self._keys), dtype=bool)
+            affected = np.array([change.affects(method_name) for method_name in self._categories[method_column]] + [False])
+            stale = ((self._codes[:, version_column] == categories.index(change.previous_version))
+                     & affected[self._codes[:, method_column]])
+            removed = int(stale.sum())
+            return ~stale
+
+        with self._lock:
+            self._compact(keep)
+        return removed
+
+    def clear(self):
+        """
+        Removes every stored result.
+        """
+        with self._lock:
+            self._connection.execute('DELETE FROM segments')
+            self._reset()
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+@dataclass
+class LedgerReport:
+    """
+    How a ledger run was calculated: rows answered from the store and rows calculated.
+
+    failed counts the recalculated rows that have an error; they are not stored, so
+    they are retried on the next run.
+    """
+
+    rows: int = 0
+    reused: int = 0
+    recalculated: int = 0
+    failed: int = 0
+
+    def __add__(self, other: 'LedgerReport') -> 'LedgerReport':
+        return LedgerReport(self.rows + other.rows, self.reused + other.reused,
+                            self.recalculated + other.recalculated, self.failed + other.failed)
+
+    def __str__(self) -> str:
+        share = self.reused / self.rows if self.rows else 0.0
+        return (f"{self.reused} of {self.rows} shipments reused ({share:.1%}), "
+                f"{self.recalculated} recalculated, {self.failed} failed")
+
+
+class IncrementalLedger:
+    """
+    Recalculates only the shipments of a ledger that changed since it was last calculated.
+
+    Results are stored by a content hash of each shipment's input, the factors of its
+    emission factor dataset and the reference data and settings it depends on (see
+    dependency_fingerprint). A rerun answers unchanged shipments from the store and sends
+    the others through the batch API; changing a dependency, e.g. new factors for a
+    dataset, recalculates every shipment that uses it.
+
+    Args:
+        path (str): The SQLite file of the store, created if missing.
+        recalculate_network (bool): Always recalculate the shipments that call Mapbox
+            (addresses, or land legs outside offline mode), whose results can change
+            without a local dependency changing.
+    """
+
+    def __init__(self, path: str, recalculate_network: bool = False):
+        self.store = LedgerStore(path)
+        self.recalculate_network = recalculate_network
+        # Totals over every run of this ledger
+        self.report = LedgerReport()
+        self._registry = get_factor_registry()
+        self._registry.subscribe(self._factor_change)
+
+    def _factor_change(self, change: FactorChange):
+        # Results of a dataset that is only deactivated stay valid for it; those of the methods
+        # that changed in an active dataset registered again have new keys and can never be used again
+        if change.previous_version == change.version:
+            self.store.discard(change)
+
+    def calculate(self, shipments, factor_version: Optional[str] = None,
+                  calculate: Callable = calculate_emissions_batch) -> pd.DataFrame:
+        """
+        Calculates a ledger, reusing the stored results of unchanged shipments.
+
+        Args:
+            shipments (pd.DataFrame or dict of columns): One row per shipment, with the INPUT_COLUMNS.
+            factor_version (str, optional): The emission factor dataset for every row, see
+                calculate_emissions_batch.
+            calculate (callable): The batch function for the rows to recalculate, e.g. a
+                ParallelExecutor's calculate.
+
+        Returns:
+            pd.DataFrame: The OUTPUT_COLUMNS for each shipment, as calculate_emissions_batch.
+            The counts of this run are added to report.
+        """
+        df = shipments if isinstance(shipments, pd.DataFrame) else pd.DataFrame(shipments)
+        n = len(df)
+
+        versions = resolve_dataset_versions(df, factor_version)
+        keys = shipment_keys(df, versions, dependency_fingerprint(), factor_digests(df, versions))
+
+        reused, stored = self.store.lookup(keys)
+        if self.recalculate_network and reused.any():
+            network = requires_network(df)
+            stored = {column: values[~network[reused]] for column, values in stored.items()}
+            reused &= ~network
+
+        columns = {column: np.full(n, None, dtype=object) if column in TEXT_COLUMNS + ('error',) else np.full(n, np.nan)
+                   for column in OUTPUT_COLUMNS}
+        for column, values in stored.items():
+            columns[column][reused] = values
+
+        recalculated = np.flatnonzero(~reused)
+        failed = 0
+        if len(recalculated):
+            calculated = calculate(df.iloc[recalculated], factor_version)
+            for column in OUTPUT_COLUMNS:
+                columns[column][recalculated] = calculated[column].to_numpy()
+            succeeded = calculated['error'].isna().to_numpy()
+            failed = int((~succeeded).sum())
+            # Only results calculated with the dataset they are keyed by are stored
+            succeeded = succeeded & (calculated['dataset_version'].to_numpy(dtype=object) == versions[recalculated])
+            # Repeated shipments are stored once
+            new_keys, first = np.unique(keys[recalculated[succeeded]], return_index=True)
+            if len(new_keys):
+                self.store.store(new_keys, calculated.iloc[np.flatnonzero(succeeded)[first]])
+
+        self.report = self.report + LedgerReport(n, int(reused.sum()), len(recalculated), failed)
+        return pd.DataFrame(columns, index=df.index)
+
+    def close(self):
+        self._registry.unsubscribe(self._factor_change)
+        self.store.close()
+
+
+if __name__ == "__main__":
+    # Example usage: the second run reuses every row
+    import tempfile
+    shipments = pd.DataFrame({
+        'mass_amount': [2000.0, 10.0, 2000.0],
+        'mass_unit': ['kg', 't', 'kg'],
+        'source_airport_code': ['JFK', None, 'JFK'],
+        'destination_airport_code': ['SFO', None, 'SFO'],
+        'source_locode': [None, 'NLRTM', None],
+        'destination_locode': [None, 'USNYC', None],
+        'method': ['cargo_plane', 'sea_general_cargo_10dwkt_vlsfo', 'cargo_plane'],
+    })
+    with tempfile.TemporaryDirectory() as directory:
+        ledger = IncrementalLedger(os.path.join(directory, 'ledger.sqlite'))
+        for _ in range(2):
+            print(ledger.calculate(shipments).to_string())
+        print(ledger.report)
+        ledger.close()
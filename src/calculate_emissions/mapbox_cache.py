@@ -0,0 +1,195 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from typing import Optional
+
+try:
+    from config import get_config_value
+except ImportError:
+    from calculate_emissions.config import get_config_value
+
+
+def address_cache_key(query: str) -> str:
+    """
+    Normalizes a geocoding query into a cache key.
+
+    Case, surrounding whitespace and repeated whitespace or commas do not change the key.
+
+    Args:
+        query (str): The geocoding query, e.g. '1 Main St, Springfield, 12345, US'.
+
+    Returns:
+        str: The cache key.
+    """
+    parts = [' '.join(part.split()) for part in str(query).lower().split(',')]
+    return 'geocode:' + ','.join(part for part in parts if part)
+
+
+def route_cache_key(source_coordinates, destination_coordinates, precision: int = 4) -> str:
+    """
+    Builds the cache key for a driving route between two coordinates.
+
+    Coordinates are rounded to the given number of decimals (4 decimals is roughly 11 m),
+    so requests for the same depot and store share an entry.
+
+    Args:
+        source_coordinates (tuple): The (latitude, longitude) of the source location.
+        destination_coordinates (tuple): The (latitude, longitude) of the destination location.
+        precision (int): Number of decimals kept.
+
+    Returns:
+        str: The cache key.
+    """
+    lat1, lon1 = source_coordinates
+    lat2, lon2 = destination_coordinates
+    # Adding 0.0 turns a rounded -0.0 into 0.0
+    values = [round(float(v), precision) + 0.0 for v in (lat1, lon1, lat2, lon2)]
+    return 'route:{:.{p}f},{:.{p}f};{:.{p}f},{:.{p}f}'.format(*values, p=precision)
+
+
+class MapboxCache:
+    """
+    Persistent SQLite cache for Mapbox geocoding and directions results.
+
+    Entries expire after ttl seconds and the least recently used entries are evicted
+    once the cache holds more than max_entries. Values are stored as JSON.
+    """
+
+    def __init__(self, path: str, ttl: float = 30 * 24 * 3600, max_entries: int = 1_000_000):
+        self.path = path
+        self.ttl = float(ttl)
+        self.max_entries = int(max_entries)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS entries ('
+            'key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL, accessed_at REAL NOT NULL)')
+        self._connection.execute('CREATE INDEX IF NOT EXISTS entries_accessed_at ON entries (accessed_at)')
+        self._size = self._count()
+
+    def get(self, key: str):
+        """
+        Returns the cached value for key, or None on a miss or an expired entry.
+        """
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute('SELECT value, created_at FROM entries WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            value, created_at = row
+            if self.ttl > 0 and now - created_at > self.ttl:
+                self._connection.execute('DELETE FROM entries WHERE key = ?', (key,))
+                self._size -= 1
+                self.misses += 1
+                return None
+            self._connection.execute('UPDATE entries SET accessed_at = ? WHERE key = ?', (now, key))
+            self.hits += 1
+        return json.loads(value)
+
+    def set(self, key: str, value):
+        """
+        Stores a JSON-serializable value under key, evicting the least recently used entries if full.
+        """
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO entries (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)',
+                (key, json.dumps(value), now, now))
+            # Replacements overcount; the count is corrected before anything is evicted
+            self._size += 1
+            if self._size > self.max_entries:
+                self._size = self._count()
+            if self._size > self.max_entries:
+                # Evict in batches of 1% to avoid a delete per insert
+                excess = self._size - self.max_entries + max(1, self.max_entries // 100)
+                self._connection.execute(
+                    'DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY accessed_at LIMIT ?)', (excess,))
+                self._size = self._count()
+
+    def _count(self) -> int:
+        return self._connection.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+
+    def clear(self):
+        """
+        Removes every entry and resets the hit and miss counters.
+        """
+        with self._lock:
+            self._connection.execute('DELETE FROM entries')
+            self._size = 0
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        """
+        Returns the hit and miss counters and the number of stored entries.
+        """
+        lookups = self.hits + self.misses
+        with self._lock:
+            self._size = self._count()
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+            'entries': self._size,
+        }
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_mapbox_cache() -> Optional[MapboxCache]:
+    """
+    Returns the process-wide Mapbox cache configured in config.json.
+
+    The cache is disabled when MAPBOX_CACHE_PATH is set to an empty string or null.
+
+    Returns:
+        MapboxCache: The shared cache, or None if caching is disabled.
+    """
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                path = get_config_value('MAPBOX_CACHE_PATH')
+                if not path:
+                    return None
+                _cache = MapboxCache(path, ttl=get_config_value('MAPBOX_CACHE_TTL', 0),
+                                     max_entries=get_config_value('MAPBOX_CACHE_MAX_ENTRIES', 1_000_000))
+    return _cache
+
+
+def reset_mapbox_cache():
+    """
+    Closes the process-wide cache so the next access opens it again from the configuration.
+    """
+    global _cache
+    with _cache_lock:
+        cache, _cache = _cache, None
+    if cache is not None:
+        cache.close()
+
+
+def _forget_cache_after_fork():
+    # A SQLite connection must not be used across a fork; the child opens its own
+    global _cache, _cache_lock
+    _cache = None
+    _cache_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_forget_cache_after_fork)
@@ -0,0 +1,426 @@
+import os
+import time
+import threading
+import numpy as np
+import requests
+from concurrent.futures import Future, ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from typing import List, Optional, Sequence, Tuple
+from urllib.parse import quote
+
+try:
+    from config import get_config_value
+    from mapbox_cache import get_mapbox_cache, address_cache_key, route_cache_key
+    from instrumentation import instrumentation, timer
+except ImportError:
+    from calculate_emissions.config import get_config_value
+    from calculate_emissions.mapbox_cache import get_mapbox_cache, address_cache_key, route_cache_key
+    from calculate_emissions.instrumentation import instrumentation, timer
+
+# Status codes worth retrying: rate limited or a transient server error
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# The Matrix API accepts at most 25 coordinates per request
+MATRIX_MAX_COORDINATES = 25
+
+# Matrix responses are billed per element; lanes only use them when more than this share
+# of the elements requested are lanes that were asked for
+MATRIX_MIN_DENSITY = 0.5
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket limiting how many requests are started per second.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Blocks until a token is available and takes it.
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+                self._updated_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class MapboxClient:
+    """
+    Pooled, rate-limited Mapbox client for geocoding, directions and matrix requests.
+
+    Requests share one keep-alive session; at most max_concurrency of them are in flight
+    and at most requests_per_minute are started. 429 and 5xx responses are retried with
+    exponential backoff. Identical requests that are already in flight are coalesced so
+    they share one call, and results go through the persistent Mapbox cache when enabled.
+    """
+
+    def __init__(self, access_token: Optional[str] = None, api_url: Optional[str] = None,
+                 max_concurrency: int = 8, requests_per_minute: float = 300, timeout: float = 10.0,
+                 max_retries: int = 5, backoff: float = 0.5, cache=None, coordinate_precision: int = 4):
+        self.access_token = access_token
+        self.api_url = (api_url or 'https://api.mapbox.com').rstrip('/')
+        self.max_concurrency = int(max_concurrency)
+        self.timeout = float(timeout)
+        self.max_retries = int(max_retries)
+        self.backoff = float(backoff)
+        self.cache = cache
+        self.coordinate_precision = int(coordinate_precision)
+        self.request_count = 0
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_concurrency)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self._rate_limiter = TokenBucket(float(requests_per_minute) / 60.0)
+        self._slots = threading.BoundedSemaphore(self.max_concurrency)
+        self._executor = None
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def _get_json(self, path: str, params: dict) -> dict:
+        params = dict(params, access_token=self.access_token)
+        for attempt in range(self.max_retries + 1):
+            self._rate_limiter.acquire()
+            with self._slots:
+                if instrumentation.enabled:
+                    response = self._timed_get(path, params)
+                else:
+                    response = self.session.get(f"{self.api_url}{path}", params=params, timeout=self.timeout)
+            with self._lock:
+                self.request_count += 1
+            if response.status_code not in RETRY_STATUS_CODES or attempt == self.max_retries:
+                break
+            # Honour Retry-After when Mapbox sends it, otherwise back off exponentially
+            retry_after = response.headers.get('Retry-After')
+            try:
+                delay = float(retry_after)
+            except (TypeError, ValueError):
+                delay = self.backoff * (2 ** attempt)
+            time.sleep(delay)
+        response.raise_for_status()
+        return response.json()
+
+    def _timed_get(self, path: str, params: dict):
+        # One request, reported to the instrumentation under the API it calls (geocoding, directions, ...)
+        operation = path.split('/')[1]
+        start = timer()
+        try:
+            response = self.session.get(f"{self.api_url}{path}", params=params, timeout=self.timeout)
+        except Exception:
+            instrumentation.external_call('mapbox', operation, timer() - start, 'error')
+            raise
+        instrumentation.external_call('mapbox', operation, timer() - start, str(response.status_code))
+        return response
+
+    def _cached(self, key: str):
+        if self.cache is None:
+            return None
+        cached = self.cache.get(key)
+        if instrumentation.enabled:
+            instrumentation.cache('mapbox', hits=int(cached is not None), misses=int(cached is None))
+        return cached
+
+    def _coalesced(self, key: str, fetch, lookup: bool = True):
+        # Cached results first (unless the caller just looked), then join an identical request that is already running
+        cached = self._cached(key) if lookup else None
+        if cached is not None:
+            return cached
+
+        with self._lock:
+            future = self._in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._in_flight[key] = future
+        if not owner:
+            return future.result()
+
+        try:
+            result = fetch()
+            if self.cache is not None:
+                self.cache.set(key, result)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+    def geocode(self, query: str) -> Tuple[float, float]:
+        """
+        Geocodes an address query.
+
+        Args:
+            query (str): The address, e.g. '1 Main St, Springfield, 12345, US'.
+
+        Returns:
+            tuple: The (latitude, longitude) of the best match, or (0.0, 0.0) if nothing matched.
+        """
+        def fetch():
+            # The query is a path segment: '/', '?' or '#' in an address must not end it
+            response_data = self._get_json(f"/geocoding/v5/mapbox.places/{quote(query, safe='')}.json", {})
+            if response_data['features']:
+                coordinates = response_data['features'][0]['geometry']['coordinates']
+                return [coordinates[1], coordinates[0]]  # return as (lat, lon)
+            return [0.0, 0.0]
+
+        return tuple(self._coalesced(address_cache_key(query), fetch))
+
+    def route_distance(self, source_coordinates, destination_coordinates, lookup: bool = True) -> float:
+        """
+        Calculates the driving distance between two sets of coordinates with the Directions API.
+
+        Args:
+            source_coordinates (tuple): The (latitude, longitude) of the source location.
+            destination_coordinates (tuple): The (latitude, longitude) of the destination location.
+            lookup (bool): Look the lane up in the cache first; False when the caller already did.
+
+        Returns:
+            float: The distance in kilometers.
+        """
+        lat1, lon1 = source_coordinates
+        lat2, lon2 = destination_coordinates
+
+        def fetch():
+            # Only the distance is needed, so the route geometry is not requested
+            response_data = self._get_json(f"/directions/v5/mapbox/driving/{lon1},{lat1};{lon2},{lat2}",
+                                           {'overview': 'false', 'steps': 'false'})
+            if 'routes' in response_data and len(response_data['routes']) > 0:
+                distance_meters = response_data['routes'][0]['distance']
+                return distance_meters / 1000  # Convert meters to kilometers
+            raise ValueError("Unable to calculate distance using Mapbox API")
+
+        key = route_cache_key(source_coordinates, destination_coordinates, self.coordinate_precision)
+        return self._coalesced(key, fetch, lookup)
+
+    def _matrix_block(self, sources: List[tuple], destinations: List[tuple]) -> np.ndarray:
+        # One Matrix request; every routed pair is cached under the key route_distance uses
+        coordinates = ';'.join(f"{lon},{lat}" for lat, lon in sources + destinations)
+        response_data = self._get_json(f"/directions-matrix/v1/mapbox/driving/{coordinates}", {
+            'annotations': 'distance',
+            'sources': ';'.join(str(k) for k in range(len(sources))),
+            'destinations': ';'.join(str(len(sources) + k) for k in range(len(destinations))),
+        })
+        distances = np.array(response_data['distances'], dtype=np.float64) / 1000  # None becomes NaN
+        if self.cache is not None:
+            for i, source in enumerate(sources):
+                for j, destination in enumerate(destinations):
+                    if not np.isnan(distances[i, j]):
+                        self.cache.set(route_cache_key(source, destination, self.coordinate_precision), float(distances[i, j]))
+        return distances
+
+    @staticmethod
+    def _matrix_blocks(pairs: Sequence) -> List[Tuple[List[tuple], List[tuple]]]:
+        # The distinct sources and destinations are cut into groups that fit one request;
+        # only the (source group, destination group) blocks holding one of the pairs are kept
+        sources = list(dict.fromkeys(source for source, _ in pairs))
+        destinations = list(dict.fromkeys(destination for _, destination in pairs))
+        source_block = MATRIX_MAX_COORDINATES // 2
+        destination_block = MATRIX_MAX_COORDINATES - source_block
+        source_groups = {source: k // source_block for k, source in enumerate(sources)}
+        destination_groups = {destination: k // destination_block for k, destination in enumerate(destinations)}
+        blocks = dict.fromkeys((source_groups[source], destination_groups[destination]) for source, destination in pairs)
+        return [(sources[i * source_block:(i + 1) * source_block], destinations[j * destination_block:(j + 1) * destination_block])
+                for i, j in blocks]
+
+    def _matrix_pairs(self, pairs: Sequence) -> dict:
+        # Distance (NaN without a route) or exception of each pair, fetched with concurrent Matrix requests
+        blocks = self._matrix_blocks(pairs)
+        results = {}
+        for (sources, destinations), block in zip(blocks, self._map(self._matrix_block, blocks, return_exceptions=True)):
+            for i, source in enumerate(sources):
+                for j, destination in enumerate(destinations):
+                    results[(source, destination)] = block if isinstance(block, Exception) else block[i, j]
+        return {pair: results[pair] for pair in pairs}
+
+    def matrix_distances(self, sources: Sequence, destinations: Sequence) -> np.ndarray:
+        """
+        Calculates driving distances from every source to every destination with the Matrix API.
+
+        Pairs found in the Mapbox cache are not requested again, and every pair a response
+        holds is cached. Large requests are split into blocks that fit the API's coordinate
+        limit and run concurrently.
+
+        Args:
+            sources (sequence): (latitude, longitude) pairs.
+            destinations (sequence): (latitude, longitude) pairs.
+
+        Returns:
+            np.ndarray: A len(sources) x len(destinations) array of kilometers, NaN where no route exists.
+        """
+        sources = [tuple(source) for source in sources]
+        destinations = [tuple(destination) for destination in destinations]
+        distances = np.full((len(sources), len(destinations)), np.nan)
+        pending = {}
+        for i, source in enumerate(sources):
+            for j, destination in enumerate(destinations):
+                cached = self._cached(route_cache_key(source, destination, self.coordinate_precision))
+                if cached is not None:
+                    distances[i, j] = cached
+                else:
+                    pending.setdefault((source, destination), []).append((i, j))
+        for pair, result in self._matrix_pairs(list(pending)).items():
+            if isinstance(result, Exception):
+                raise result
+            for i, j in pending[pair]:
+                distances[i, j] = result
+        return distances
+
+    def _pool(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.max_concurrency, thread_name_prefix='mapbox')
+            return self._executor
+
+    def _map(self, fn, items, return_exceptions: bool) -> List:
+        futures = [self._pool().submit(fn, *item) for item in items]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                if not return_exceptions:
+                    raise
+                results.append(e)
+        return results
+
+    def geocode_many(self, queries: Sequence[str], return_exceptions: bool = False) -> List:
+        """
+        Geocodes many queries concurrently; duplicates share one request.
+
+        Args:
+            queries (sequence): Address queries.
+            return_exceptions (bool): Return failures in place of results instead of raising.
+
+        Returns:
+            list: A (latitude, longitude) tuple (or exception) per query, in order.
+        """
+        return self._map(self.geocode, [(query,) for query in queries], return_exceptions)
+
+    def route_distances(self, pairs: Sequence, return_exceptions: bool = False) -> List:
+        """
+        Calculates many driving distances concurrently; duplicates share one request.
+
+        Args:
+            pairs (sequence): (source_coordinates, destination_coordinates) pairs.
+            return_exceptions (bool): Return failures in place of results instead of raising.
+
+        Returns:
+            list: The distance in kilometers (or exception) per pair, in order.
+        """
+        return self._map(self.route_distance, pairs, return_exceptions)
+
+    def lane_distances(self, pairs: Sequence, return_exceptions: bool = False) -> List:
+        """
+        Calculates the driving distances of many lanes with as few requests as possible.
+
+        Lanes found in the Mapbox cache are not requested. The others go to the Matrix API
+        when their distinct sources and destinations fit into fewer Matrix requests than one
+        Directions request per lane and more than MATRIX_MIN_DENSITY of the elements requested
+        are lanes (e.g. many depots to many stores), and to the Directions API otherwise.
+        Either way each lane is cached under the same key.
+
+        Args:
+            pairs (sequence): (source_coordinates, destination_coordinates) pairs.
+            return_exceptions (bool): Return failures in place of results instead of raising.
+
+        Returns:
+            list: The distance in kilometers (or exception) per pair, in order.
+        """
+        pairs = [(tuple(source), tuple(destination)) for source, destination in pairs]
+        results = {}
+        pending = []
+        for pair in dict.fromkeys(pairs):
+            cached = self._cached(route_cache_key(*pair, self.coordinate_precision))
+            if cached is not None:
+                results[pair] = cached
+            else:
+                pending.append(pair)
+
+        blocks = self._matrix_blocks(pending)
+        elements = sum(len(sources) * len(destinations) for sources, destinations in blocks)
+        if len(blocks) < len(pending) and len(pending) > MATRIX_MIN_DENSITY * elements:
+            for pair, result in self._matrix_pairs(pending).items():
+                if not isinstance(result, Exception) and np.isnan(result):
+                    result = ValueError("Unable to calculate distance using Mapbox API")
+                results[pair] = result
+        else:
+            results.update(zip(pending, self._map(self.route_distance, [pair + (False,) for pair in pending], True)))
+
+        if not return_exceptions:
+            for pair in pairs:
+                if isinstance(results[pair], Exception):
+                    raise results[pair]
+        return [results[pair] for pair in pairs]
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        self.session.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_mapbox_client() -> MapboxClient:
+    """
+    Returns the process-wide Mapbox client configured in config.json.
+
+    Returns:
+        MapboxClient: The shared client.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = MapboxClient(
+                    access_token=get_config_value('MAPBOX_ACCESS_TOKEN'),
+                    api_url=get_config_value('MAPBOX_API_URL'),
+                    max_concurrency=get_config_value('MAPBOX_MAX_CONCURRENCY', 8),
+                    requests_per_minute=get_config_value('MAPBOX_REQUESTS_PER_MINUTE', 300),
+                    timeout=get_config_value('MAPBOX_TIMEOUT', 10),
+                    max_retries=get_config_value('MAPBOX_MAX_RETRIES', 5),
+                    cache=get_mapbox_cache(),
+                    coordinate_precision=get_config_value('MAPBOX_CACHE_COORDINATE_PRECISION', 4),
+                )
+    return _client
+
+
+def reset_mapbox_client():
+    """
+    Closes the process-wide client so the next access creates it again from the configuration.
+    """
+    global _client
+    with _client_lock:
+        client, _client = _client, None
+    if client is not None:
+        client.close()
+
+
+def _forget_client_after_fork():
+    # The session's sockets and the worker threads of the parent do not survive a fork,
+    # and the lock may have been held by another thread; the child creates its own client
+    global _client, _client_lock
+    _client = None
+    _client_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_forget_client_after_fork)
@@ -0,0 +1,335 @@
+import os
+import math
+import threading
+import multiprocessing
+import numpy as np
+import pandas as pd
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+try:
+    from batch import calculate_emissions_batch, requires_network, OUTPUT_COLUMNS, resolve_dataset_versions
+    from engine import get_engine
+    from factor_registry import get_factor_registry, FactorDataset
+except ImportError:
+    from calculate_emissions.batch import calculate_emissions_batch, requires_network, OUTPUT_COLUMNS, resolve_dataset_versions
+    from calculate_emissions.engine import get_engine
+    from calculate_emissions.factor_registry import get_factor_registry, FactorDataset
+
+# Rows per process shard; large enough to amortize pickling, small enough to balance the pool
+DEFAULT_SHARD_SIZE = 5_000
+
+# Rows per I/O shard; the Mapbox client runs the requests of each shard concurrently
+DEFAULT_IO_SHARD_SIZE = 1_000
+DEFAULT_IO_WORKERS = 4
+
+TEXT_COLUMNS = {'distance_calculation_method', 'emission_factor_calculation_method', 'dataset_version', 'error'}
+
+# Shards submitted to the process pool ahead of the results being collected, per worker
+SHARDS_IN_FLIGHT_PER_WORKER = 2
+
+
+def load_reference_data():
+    """
+    Loads every table used by the offline calculation paths.
+
+    The tables come from the reference data snapshot and the precomputed sea route
+    matrix, which are memory-mapped, so worker processes share their pages instead
+    of each parsing the CSV and Excel sources. See Engine.warm.
+    """
+    get_engine().warm()
+
+
+def _failed_rows(index: pd.Index, message: str) -> pd.DataFrame:
+    results = pd.DataFrame({column: np.full(len(index), None if column in TEXT_COLUMNS else np.nan,
+                                            dtype=object if column in TEXT_COLUMNS else np.float64)
+                            for column in OUTPUT_COLUMNS}, index=index)
+    results['error'] = message
+    return results
+
+
+def install_datasets(datasets: Sequence[FactorDataset]):
+    """
+    Adds datasets resolved in another process to this process's registry, replacing a
+    dataset of the same version whose factors differ. The active dataset is not changed.
+    """
+    registry = get_factor_registry()
+    for dataset in datasets:
+        if dataset.version not in registry.versions() or registry.get(dataset.version).table.digest != dataset.table.digest:
+            registry.add(dataset)
+
+
+def _calculate_versions(shard: pd.DataFrame, factor_version: Optional[str], versions: Optional[np.ndarray]) -> pd.DataFrame:
+    if versions is None:
+        return calculate_emissions_batch(shard, factor_version)
+    groups = pd.Series(versions).groupby(versions, sort=False).indices
+    if len(groups) == 1:
+        return calculate_emissions_batch(shard, next(iter(groups)))
+    parts = [(rows, calculate_emissions_batch(shard.iloc[rows], version)) for version, rows in groups.items()]
+    result = pd.concat([part for _, part in parts])
+    return result.iloc[np.argsort(np.concatenate([rows for rows, _ in parts]), kind='stable')]
+
+
+def calculate_shard(shard: pd.DataFrame, factor_version: Optional[str] = None, versions: Optional[np.ndarray] = None,
+                    datasets: Sequence[FactorDataset] = ()) -> pd.DataFrame:
+    """
+    Calculates one shard of shipments, isolating failures to the rows that cause them.
+
+    calculate_emissions_batch already reports invalid shipments per row; if it still
+    raises, the shard is retried row by row so only the offending shipments fail.
+
+    Args:
+        shard (pd.DataFrame): The shipments, with the INPUT_COLUMNS.
+        factor_version (str, optional): The emission factor dataset, see calculate_emissions_batch.
+        versions (np.ndarray, optional): The dataset of each row, resolved by the caller
+            (see resolve_dataset_versions); it takes precedence over factor_version.
+        datasets (sequence of FactorDataset): Datasets to install first, e.g. those a parent
+            process registered at runtime, see install_datasets.
+
+    Returns:
+        pd.DataFrame: The OUTPUT_COLUMNS for each shipment, aligned with the shard.
+    """
+    install_datasets(datasets)
+    try:
+        return _calculate_versions(shard, factor_version, versions)
+    except Exception:
+        pass
+    results = []
+    for position in range(len(shard)):
+        row = shard.iloc[position:position + 1]
+        try:
+            results.append(_calculate_versions(row, factor_version, None if versions is None else versions[position:position + 1]))
+        except Exception as e:
+            results.append(_failed_rows(row.index, f"An error occurred while calculating emissions: {e}"))
+    return pd.concat(results)
+
+
+def _shard_result(df: pd.DataFrame, positions: np.ndarray, future) -> pd.DataFrame:
+    try:
+        return future.result()
+    except Exception as e:
+        # e.g. a worker process died; only this shard is lost
+        return _failed_rows(df.index[positions], f"An error occurred while calculating emissions: {e}")
+
+
+def _split(positions: np.ndarray, shard_size: int) -> List[np.ndarray]:
+    return [positions[i:i + shard_size] for i in range(0, len(positions), shard_size)]
+
+
+def _default_context():
+    # forkserver children start from a clean interpreter, which is safe even while the
+    # parent runs Mapbox threads; they map the snapshot instead of inheriting the tables
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+
+class ParallelExecutor:
+    """
+    Runs calculate_emissions_batch over many cores for large shipment batches.
+
+    Offline shipments (explicit distances, air and sea legs, offline land legs) are
+    split into shards and calculated by a process pool whose workers map the reference
+    data snapshot read-only. Shipments that call Mapbox go to a separate thread pool,
+    since they are bound by network latency rather than CPU. Results are merged back
+    in input order, and a shard that fails only fails its own rows.
+
+    The pools are started on first use and reused across calls; close the executor
+    (or use it as a context manager) to stop them.
+    """
+
+    def __init__(self, workers: Optional[int] = None, io_workers: int = DEFAULT_IO_WORKERS,
+                 shard_size: int = DEFAULT_SHARD_SIZE, io_shard_size: int = DEFAULT_IO_SHARD_SIZE, mp_context=None):
+        self.workers = int(workers or os.cpu_count() or 1)
+        self.io_workers = int(io_workers)
+        self.shard_size = int(shard_size)
+        self.io_shard_size = int(io_shard_size)
+        self.mp_context = mp_context
+        self._processes = None
+        self._threads = None
+        self._lock = threading.Lock()
+
+    def _process_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._processes is None:
+                # Build the snapshot and sea route matrix here once, so the workers only map them
+                load_reference_data()
+                self._processes = ProcessPoolExecutor(self.workers, mp_context=self.mp_context or _default_context(),
+                                                      initializer=load_reference_data)
+            return self._processes
+
+    def _thread_pool(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._threads is None:
+                self._threads = ThreadPoolExecutor(self.io_workers, thread_name_prefix='emissions-io')
+            return self._threads
+
+    def _reset_process_pool(self, pool: ProcessPoolExecutor):
+        with self._lock:
+            if self._processes is pool:
+                self._processes = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    @staticmethod
+    def _submit(pool: ProcessPoolExecutor, df: pd.DataFrame, positions: np.ndarray, versions: np.ndarray, datasets: dict):
+        # The datasets travel with each shard, so workers calculate with the parent's factors,
+        # including datasets registered or replaced at runtime
+        shard_versions = versions[positions]
+        return pool.submit(calculate_shard, df.iloc[positions], None, shard_versions,
+                           [datasets[version] for version in pd.unique(shard_versions)])
+
+    def _run(self, df: pd.DataFrame, shards: List[np.ndarray], versions: np.ndarray,
+             datasets: dict) -> Iterator[Tuple[np.ndarray, pd.DataFrame]]:
+        # At most a few shards per worker are pending at once, so the pickled copies stay bounded
+        pool = self._process_pool()
+        limit = self.workers * SHARDS_IN_FLIGHT_PER_WORKER
+        pending = {}
+        broken = []
+        shards = iter(shards)
+        while True:
+            for positions in shards:
+                try:
+                    pending[self._submit(pool, df, positions, versions, datasets)] = positions
+                except BrokenProcessPool:
+                    broken.append(positions)
+                    continue
+                if len(pending) >= limit:
+                    break
+            if not pending:
+                break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                positions = pending.pop(future)
+                if isinstance(future.exception(), BrokenProcessPool):
+                    broken.append(positions)
+                else:
+                    yield positions, _shard_result(df, positions, future)
+            if broken and pool is self._processes:
+                self._reset_process_pool(pool)
+                pool = self._process_pool()
+
+        # A crashed worker takes every shard in flight down with it; retry those one at a
+        # time on a fresh pool so only the shard that crashes again is reported as failed
+        for positions in broken:
+            pool = self._process_pool()
+            future = self._submit(pool, df, positions, versions, datasets)
+            wait([future])
+            if isinstance(future.exception(), BrokenProcessPool):
+                self._reset_process_pool(pool)
+            yield positions, _shard_result(df, positions, future)
+
+    def calculate(self, shipments, factor_version: Optional[str] = None):
+        """
+        Calculate the emissions for many shipments in parallel.
+
+        The emission factor dataset of each row is resolved once, in this process, and the
+        datasets are sent to the worker processes with the shards, so every row is calculated
+        with this process's registry (including datasets registered or activated at runtime).
+
+        Parameters:
+        - shipments (pd.DataFrame, pyarrow.Table or dict of columns): One row per shipment,
+          with the INPUT_COLUMNS accepted by calculate_emissions_batch.
+        - factor_version (str, optional): The emission factor dataset, see calculate_emissions_batch.
+
+        Returns:
+        - pd.DataFrame (or pyarrow.Table if one was passed): The same result as
+          calculate_emissions_batch, in input order.
+        """
+        is_arrow = hasattr(shipments, 'to_pandas') and not isinstance(shipments, pd.DataFrame)
+        if is_arrow:
+            df = shipments.to_pandas()
+        elif isinstance(shipments, pd.DataFrame):
+            df = shipments
+        else:
+            df = pd.DataFrame(shipments)
+
+        index = df.index
+        df = df.reset_index(drop=True)
+        versions = resolve_dataset_versions(df, factor_version)
+        registry = get_factor_registry()
+        datasets = {version: registry.get(version) for version in pd.unique(versions)}
+        network = requires_network(df)
+        offline_positions = np.flatnonzero(~network)
+        network_positions = np.flatnonzero(network)
+
+        # Spread small batches over every worker instead of filling one shard
+        shard_size = max(1, min(self.shard_size, math.ceil(len(offline_positions) / self.workers)))
+        offline_shards = _split(offline_positions, shard_size)
+        network_shards = _split(network_positions, self.io_shard_size)
+
+        # Network-bound shards start first so their requests overlap the CPU-bound work
+        network_futures = [(positions, self._thread_pool().submit(calculate_shard, df.iloc[positions], None, versions[positions]))
+                           for positions in network_shards]
+        if len(offline_shards) > 1 and self.workers > 1:
+            parts = list(self._run(df, offline_shards, versions, datasets))
+        else:
+            parts = [(positions, calculate_shard(df.iloc[positions], None, versions[positions])) for positions in offline_shards]
+        parts.extend((positions, _shard_result(df, positions, future)) for positions, future in network_futures)
+
+        # Deterministic output: rows go back to their input position whatever order shards finished in
+        if parts:
+            positions = np.concatenate([positions for positions, _ in parts])
+            result = pd.concat([part for _, part in parts], ignore_index=True)
+            result = result.iloc[np.argsort(positions, kind='stable')]
+        else:
+            result = _failed_rows(pd.RangeIndex(0), '')
+        # Rebuilt from plain arrays so the dtypes match calculate_emissions_batch whatever the shards held
+        result = pd.DataFrame({
+            column: result[column].to_numpy(dtype=object if column in TEXT_COLUMNS else np.float64, na_value=None if column in TEXT_COLUMNS else np.nan)
+            for column in OUTPUT_COLUMNS
+        }, index=index)
+
+        if is_arrow:
+            import pyarrow as pa
+            return pa.Table.from_pandas(result, preserve_index=False)
+        return result
+
+    def close(self):
+        with self._lock:
+            if self._processes is not None:
+                self._processes.shutdown(wait=True)
+                self._processes = None
+            if self._threads is not None:
+                self._threads.shutdown(wait=True)
+                self._threads = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def calculate_emissions_parallel(shipments, workers: Optional[int] = None, io_workers: int = DEFAULT_IO_WORKERS,
+                                 factor_version: Optional[str] = None):
+    """
+    Calculate the emissions for many shipments with a temporary ParallelExecutor.
+
+    Parameters:
+    - shipments (pd.DataFrame, pyarrow.Table or dict of columns): One row per shipment.
+    - workers (int, optional): Worker processes; defaults to the number of CPUs.
+    - io_workers (int): Threads calculating shipments that call Mapbox.
+    - factor_version (str, optional): The emission factor dataset, see calculate_emissions_batch.
+
+    Returns:
+    - pd.DataFrame (or pyarrow.Table if one was passed): The OUTPUT_COLUMNS for each shipment, in input order.
+    """
+    with ParallelExecutor(workers, io_workers) as executor:
+        return executor.calculate(shipments, factor_version)
+
+
+if __name__ == "__main__":
+    # Example usage
+    shipments = pd.DataFrame({
+        'mass_amount': [2000.0, 10.0, None] * 1000,
+        'mass_unit': ['kg', 't', None] * 1000,
+        'containers': [None, None, 2] * 1000,
+        'source_airport_code': ['JFK', None, None] * 1000,
+        'destination_airport_code': ['SFO', None, None] * 1000,
+        'source_locode': [None, 'NLRTM', 'DEHAM'] * 1000,
+        'destination_locode': [None, 'USNYC', 'NLRTM'] * 1000,
+        'method': ['cargo_plane', 'sea_general_cargo_10dwkt_vlsfo', 'container_ship'] * 1000,
+        'trade_lane': [None, None, 'aggregated_transsuez'] * 1000,
+    })
+
+    print(calculate_emissions_parallel(shipments).head().to_string())
@@ -0,0 +1,245 @@
+import threading
+import numpy as np
+import pandas as pd
+from typing import Dict, Optional, Tuple
+
+try:
+    from snapshot import snapshot_for, read_locode_csv, read_airport_csv
+    from emission_factor_table import EmissionFactorTable
+    from instrumentation import instrumentation
+except ImportError:
+    from calculate_emissions.snapshot import snapshot_for, read_locode_csv, read_airport_csv
+    from calculate_emissions.emission_factor_table import EmissionFactorTable
+    from calculate_emissions.instrumentation import instrumentation
+
+
+def encode_codes(codes) -> np.ndarray:
+    """
+    Converts codes to the fixed-width bytes stored in a CodeIndex.
+
+    Args:
+        codes (array-like): The codes as strings (or bytes).
+
+    Returns:
+        np.ndarray: The UTF-8 encoded codes as a bytes ('S') array.
+    """
+    codes = np.asarray(codes)
+    if codes.dtype.kind == 'S':
+        return codes
+    codes = codes.astype(str)
+    try:
+        return codes.astype(np.bytes_)
+    except UnicodeEncodeError:
+        return np.char.encode(codes, 'utf-8')
+
+
+class CodeIndex:
+    """
+    Sorted code index: fixed-width bytes codes and the table row of each.
+
+    A lookup is a binary search, so the index costs a few bytes per code
+    instead of a Python string and dict entry.
+    """
+
+    def __init__(self, codes):
+        codes = encode_codes(codes)
+        # The first row wins for duplicated codes, matching the previous DataFrame lookups
+        order = np.argsort(codes, kind='stable')
+        codes = codes[order]
+        first = np.ones(len(codes), dtype=bool)
+        first[1:] = codes[1:] != codes[:-1]
+        first &= codes != b''
+        self.codes = codes[first]
+        self.rows = order[first].astype(np.int32)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __contains__(self, code) -> bool:
+        return self.get(code) is not None
+
+    def get(self, code) -> Optional[int]:
+        """
+        Returns the row of a code, or None if it is not in the index.
+        """
+        code = code.encode('utf-8') if isinstance(code, str) else code
+        position = int(np.searchsorted(self.codes, code))
+        if position < len(self.codes) and self.codes[position] == code:
+            return int(self.rows[position])
+        return None
+
+    def lookup(self, codes) -> np.ndarray:
+        """
+        Returns the row of every code, -1 where the code is not in the index.
+        """
+        # Batches repeat a limited set of codes, so only the distinct ones are encoded and searched
+        positions, uniques = pd.factorize(np.asarray(codes, dtype=object))
+        uniques = encode_codes(np.asarray(uniques, dtype=object))
+        # One extra slot answers the missing (-1) positions
+        rows = np.full(len(uniques) + 1, -1, dtype=np.int64)
+        if len(self.codes) and len(uniques):
+            matches = np.minimum(np.searchsorted(self.codes, uniques), len(self.codes) - 1)
+            found = self.codes[matches] == uniques
+            rows[:-1][found] = self.rows[matches[found]]
+        return rows[positions]
+
+    def row_codes(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the indexed rows in table order and their codes as strings.
+        """
+        order = np.argsort(self.rows)
+        return self.rows[order], np.char.decode(self.codes[order], 'utf-8').astype(object)
+
+
+class ReferenceTable:
+    """
+    In-memory coordinate table with code indexes on one or more code columns.
+
+    Coordinates are kept as parallel float arrays and every index maps a code
+    (e.g. a LOCODE or an IATA code) to its row by a binary search over sorted
+    fixed-width bytes, so the table holds no per-row Python objects.
+    """
+
+    def __init__(self, latitudes: np.ndarray, longitudes: np.ndarray, indexes: Dict[str, CodeIndex]):
+        self.latitudes = latitudes
+        self.longitudes = longitudes
+        self.indexes = indexes
+
+    def __len__(self):
+        return len(self.latitudes)
+
+    def get(self, index_name: str, code: str) -> Optional[Tuple[float, float]]:
+        """
+        Looks up the coordinates for a code in the given index.
+
+        Args:
+            index_name (str): The index to search, e.g. 'locode', 'iata' or 'icao'.
+            code (str): The code to look up.
+
+        Returns:
+            tuple: The (latitude, longitude) of the location, or None if the code is unknown.
+        """
+        row = self.indexes[index_name].get(code)
+        if row is None:
+            return None
+        return float(self.latitudes[row]), float(self.longitudes[row])
+
+    def get_many(self, index_name: str, codes) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Looks up the coordinates for an array of codes.
+
+        Args:
+            index_name (str): The index to search, e.g. 'locode', 'iata' or 'icao'.
+            codes (array-like): The codes to look up.
+
+        Returns:
+            tuple: Latitude and longitude arrays (NaN where not found) and a boolean found mask.
+        """
+        rows = self.indexes[index_name].lookup(codes)
+        found = rows >= 0
+        latitudes = np.full(len(rows), np.nan)
+        longitudes = np.full(len(rows), np.nan)
+        latitudes[found] = self.latitudes[rows[found]]
+        longitudes[found] = self.longitudes[rows[found]]
+        return latitudes, longitudes, found
+
+
+def _read_locode_table(un_locodes_csv_path: str) -> ReferenceTable:
+    snapshot = snapshot_for(un_locodes_csv_path, 'un_locode')
+    columns = snapshot.table('locode') if snapshot is not None else read_locode_csv(un_locodes_csv_path)
+    return ReferenceTable(columns['latitude'], columns['longitude'], {'locode': CodeIndex(columns['code'])})
+
+
+def _read_airport_table(iata_icao_csv_path: str) -> ReferenceTable:
+    snapshot = snapshot_for(iata_icao_csv_path, 'iata_icao')
+    columns = snapshot.table('airports') if snapshot is not None else read_airport_csv(iata_icao_csv_path)
+    return ReferenceTable(columns['latitude'], columns['longitude'],
+                          {'iata': CodeIndex(columns['iata']), 'icao': CodeIndex(columns['icao'])})
+
+
+def _read_excel_sheet(key) -> pd.DataFrame:
+    emission_factors_file_path, sheet_name = key
+    snapshot = snapshot_for(emission_factors_file_path, 'emission_factors')
+    if snapshot is not None:
+        return snapshot.frame(sheet_name)
+    return pd.read_excel(emission_factors_file_path, sheet_name=sheet_name)
+
+
+_tables = {}
+_tables_lock = threading.RLock()
+
+
+def _load_table(kind: str, path, reader):
+    key = (kind, path)
+    table = _tables.get(key)
+    if table is None:
+        with _tables_lock:
+            table = _tables.get(key)
+            if table is None:
+                with instrumentation.timed('reference_data', kind):
+                    table = reader(path)
+                _tables[key] = table
+    return table
+
+
+def load_locode_table(un_locodes_csv_path: str) -> ReferenceTable:
+    """
+    Returns the UN/LOCODE table for the given CSV file, loading it once per process.
+
+    Args:
+        un_locodes_csv_path (str): The path to the CSV file containing location data.
+
+    Returns:
+        ReferenceTable: Coordinates indexed by 'locode'.
+    """
+    return _load_table('locode', un_locodes_csv_path, _read_locode_table)
+
+
+def load_airport_table(iata_icao_csv_path: str) -> ReferenceTable:
+    """
+    Returns the airport table for the given CSV file, loading it once per process.
+
+    Args:
+        iata_icao_csv_path (str): The path to the CSV file containing airport data.
+
+    Returns:
+        ReferenceTable: Coordinates indexed by 'iata' and 'icao'.
+    """
+    return _load_table('airport', iata_icao_csv_path, _read_airport_table)
+
+
+def load_emission_factor_sheet(emission_factors_file_path: str, sheet_name: str) -> pd.DataFrame:
+    """
+    Returns a sheet of the emission factors workbook, loading it once per process.
+
+    Args:
+        emission_factors_file_path (str): The path to the emission factors Excel file.
+        sheet_name (str): The sheet to load, e.g. 'emission_factors' or 'electricity_intensity'.
+
+    Returns:
+        pd.DataFrame: The sheet contents.
+    """
+    return _load_table('sheet', (emission_factors_file_path, sheet_name), _read_excel_sheet)
+
+
+def load_emission_factor_table(emission_factors_file_path: str) -> EmissionFactorTable:
+    """
+    Returns the compiled emission factor table for the given Excel file, building it once per process.
+
+    Args:
+        emission_factors_file_path (str): The path to the emission factors Excel file.
+
+    Returns:
+        EmissionFactorTable: The compiled factors and electricity intensities.
+    """
+    return _load_table('factor_table', emission_factors_file_path, lambda path: EmissionFactorTable(
+        load_emission_factor_sheet(path, 'emission_factors'),
+        load_emission_factor_sheet(path, 'electricity_intensity')))
+
+
+def clear_reference_tables():
+    """
+    Drops every loaded table so the next lookup reloads it from disk.
+    """
+    with _tables_lock:
+        _tables.clear()
@@ -0,0 +1,179 @@
+import json
+import math
+import uuid
+from dataclasses import dataclass
+from typing import Optional
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    from instrumentation import instrumentation, timer
+except ImportError:
+    from calculate_emissions.instrumentation import instrumentation, timer
+
+EMISSIONS_UNIT = 'kgCO2e'
+MASS_UNIT = 't'
+DISTANCE_UNIT = 'km'
+
+
+def _number(value):
+    # NaN is not valid JSON; missing numbers are written as null
+    return None if value is None or (isinstance(value, float) and math.isnan(value)) else value
+
+
+def _location(location: Optional[dict]) -> dict:
+    location = location or {}
+    return {
+        'address': location.get('address'),
+        'coordinates': location.get('coordinates'),
+        'locode': location.get('locode'),
+        'airport_code': location.get('airport_code'),
+    }
+
+
+def echo_request(shipping_data: dict) -> dict:
+    """
+    Normalizes a shipping_data dict into the request echo of the output schema.
+
+    Args:
+        shipping_data (dict): The request passed to calculate_emissions.
+
+    Returns:
+        dict: The request with every documented field present, defaults filled in.
+    """
+    shipment = shipping_data.get('shipment') or {}
+    route = shipping_data.get('route') or {}
+    method = shipping_data.get('method') or {}
+    return {
+        'shipment': {
+            'containers': shipment.get('containers'),
+            'cargo_type': shipment.get('cargo_type', 'average'),
+            'mass': shipment.get('mass'),
+        },
+        'route': {
+            'distance': route.get('distance'),
+            'source': _location(route.get('source')),
+            'destination': _location(route.get('destination')),
+        },
+        'method': {
+            'method': method.get('method'),
+            'fuel': method.get('fuel'),
+            'load': method.get('load'),
+            'trade_lane': method.get('trade_lane'),
+        },
+        'is_shipment': shipping_data.get('is_shipment'),
+        'shipped_at': shipping_data.get('shipped_at'),
+        'name': shipping_data.get('name'),
+        'country_code': shipping_data.get('country_code'),
+        'idempotency_key': shipping_data.get('idempotency_key'),
+    }
+
+
+@dataclass(slots=True)
+class EmissionResult:
+    """
+    The result of one emission calculation.
+
+    Only the calculated values and a reference to the request are kept; the nested
+    output schema (see the README) is built when the result is serialized.
+    """
+
+    emissions: float
+    shipment_mass: float
+    distance: float
+    distance_calculation_method: str
+    emission_factor: float
+    emission_factor_calculation_method: str
+    request: Optional[dict] = None
+    id: Optional[str] = None
+    dataset_version: Optional[str] = None
+
+    def as_flat_dict(self) -> dict:
+        """
+        Returns the calculated values only, as produced by earlier versions of calculate_emissions.
+        """
+        return {
+            'emissions': self.emissions,
+            'shipment_mass': self.shipment_mass,
+            'distance': self.distance,
+            'distance_calculation_method': self.distance_calculation_method,
+            'emission_factor': self.emission_factor,
+            'emission_factor_calculation_method': self.emission_factor_calculation_method,
+            'dataset_version': self.dataset_version,
+        }
+
+    def to_dict(self) -> dict:
+        """
+        Builds the output schema: emissions, mass, distance and emission factor objects,
+        with the request echo and its idempotency key.
+
+        Returns:
+            dict: The result, ready to be serialized.
+        """
+        request = self.request or {}
+        if self.id is None:
+            self.id = request.get('id') or uuid.uuid4().hex
+        return {
+            'id': self.id,
+            'is_shipment': request.get('is_shipment'),
+            'shipped_at': request.get('shipped_at'),
+            'emissions-mass': {
+                'amount': _number(self.emissions),
+                'unit': EMISSIONS_UNIT,
+            },
+            'mass': {
+                'amount': _number(self.shipment_mass),
+                'unit': MASS_UNIT,
+            },
+            'distance': {
+                'amount': _number(self.distance),
+                'unit': DISTANCE_UNIT,
+                'distance_calculation_method': self.distance_calculation_method,
+            },
+            'emission_factor': {
+                'methodology': self.emission_factor_calculation_method,
+                'emission_factor': _number(self.emission_factor),
+                'unit': EMISSIONS_UNIT,
+                'dataset_version': self.dataset_version,
+            },
+            'idempotency_key': request.get('idempotency_key'),
+            'request': echo_request(request),
+        }
+
+    def to_json(self, compact: bool = True) -> str:
+        """
+        Serializes the result with to_dict.
+
+        Args:
+            compact (bool): Leave out whitespace (default); otherwise indent by 4 spaces.
+
+        Returns:
+            str: The JSON document. orjson is used for compact output when it is installed.
+        """
+        return dumps(self.to_dict(), compact)
+
+
+def dumps(data, compact: bool = True) -> str:
+    """
+    Serializes data to JSON, with orjson when it is installed and compact output is requested.
+
+    Args:
+        data: A JSON-serializable value.
+        compact (bool): Leave out whitespace (default); otherwise indent by 4 spaces.
+
+    Returns:
+        str: The JSON document.
+    """
+    start = timer() if instrumentation.enabled else None
+    if not compact:
+        kind, document = 'json', json.dumps(data, indent=4)
+    elif orjson is not None:
+        kind, document = 'orjson', orjson.dumps(data, option=orjson.OPT_SERIALIZE_NUMPY).decode()
+    else:
+        kind, document = 'json', json.dumps(data, separators=(',', ':'))
+    if start is not None:
+        instrumentation.stage('serialization', kind, timer() - start)
+    return document
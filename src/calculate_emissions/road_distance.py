@@ -0,0 +1,294 @@
+import heapq
+import threading
+import numpy as np
+from typing import Dict, List, Optional, Sequence, Tuple
+
+try:
+    from config import get_config_value
+    from country_codes import normalize_country_code
+    from utils import calculate_air_distance, calculate_land_distance
+except ImportError:
+    from calculate_emissions.config import get_config_value
+    from calculate_emissions.country_codes import normalize_country_code
+    from calculate_emissions.utils import calculate_air_distance, calculate_land_distance
+
+# Land distance modes selected with LAND_DISTANCE_MODE
+LAND_DISTANCE_MODES = ('mapbox', 'offline', 'mapbox_with_offline_fallback')
+
+# Reported as the distance_calculation_method of land legs
+MAPBOX_METHOD = 'mapbox'
+DETOUR_FACTOR_METHOD = 'road_detour_factor'
+ROAD_GRAPH_METHOD = 'road_graph'
+
+# Ratio of road distance to great circle distance used when a country has no factor of its own
+DEFAULT_DETOUR_FACTOR = 1.3
+
+# Typical road circuity per country (road distance / great circle distance).
+# Override or extend with ROAD_DETOUR_FACTORS in config.json, e.g. {"DE": 1.25}.
+DETOUR_FACTORS = {
+    'US': 1.20, 'CA': 1.25, 'MX': 1.30,
+    'BR': 1.30, 'AR': 1.25, 'CL': 1.35, 'CO': 1.45, 'PE': 1.45,
+    'GB': 1.25, 'IE': 1.25, 'FR': 1.22, 'DE': 1.22, 'NL': 1.25, 'BE': 1.22, 'LU': 1.22,
+    'ES': 1.22, 'PT': 1.25, 'IT': 1.27, 'CH': 1.35, 'AT': 1.32, 'DK': 1.25, 'SE': 1.25,
+    'NO': 1.45, 'FI': 1.25, 'PL': 1.22, 'CZ': 1.25, 'SK': 1.30, 'HU': 1.22, 'RO': 1.30,
+    'BG': 1.30, 'GR': 1.40, 'TR': 1.35,
+    'CN': 1.30, 'JP': 1.35, 'KR': 1.30, 'IN': 1.30, 'ID': 1.40, 'TH': 1.25, 'VN': 1.35,
+    'MY': 1.30, 'AE': 1.25, 'SA': 1.25,
+    'ZA': 1.25, 'NG': 1.35, 'KE': 1.35, 'EG': 1.30, 'MA': 1.30,
+    'AU': 1.25, 'NZ': 1.40,
+}
+
+
+def detour_factors() -> Dict[str, float]:
+    """
+    Returns the detour factor per country, including overrides from ROAD_DETOUR_FACTORS.
+
+    Returns:
+        dict: ISO alpha-2 country code to detour factor; overrides may use alpha-3 codes.
+    """
+    overrides = get_config_value('ROAD_DETOUR_FACTORS', {})
+    factors = dict(DETOUR_FACTORS)
+    factors.update({normalize_country_code(country): float(factor) for country, factor in overrides.items()})
+    return factors
+
+
+def detour_factor(source_country: Optional[str], destination_country: Optional[str], factors: Optional[Dict[str, float]] = None) -> float:
+    """
+    Returns the detour factor for a lane; cross-border lanes use the mean of both countries.
+
+    Args:
+        source_country (str, optional): ISO alpha-2 or alpha-3 country code of the source location.
+        destination_country (str, optional): ISO alpha-2 or alpha-3 country code of the destination location.
+        factors (dict, optional): Detour factors per country, defaults to detour_factors().
+
+    Returns:
+        float: The detour factor.
+    """
+    factors = detour_factors() if factors is None else factors
+    default = get_config_value('ROAD_DEFAULT_DETOUR_FACTOR', DEFAULT_DETOUR_FACTOR)
+    source_factor = factors.get(normalize_country_code(source_country), default)
+    destination_factor = factors.get(normalize_country_code(destination_country), default)
+    return (source_factor + destination_factor) / 2
+
+
+class RoadGraph:
+    """
+    A local road network extract used to refine offline land distances.
+
+    The extract is an .npz file with node arrays 'latitude' and 'longitude' and
+    undirected edge arrays 'source', 'target' (node rows) and 'length' (km).
+    Locations are snapped to their nearest node and legs are routed with Dijkstra.
+    """
+
+    def __init__(self, latitudes: np.ndarray, longitudes: np.ndarray, sources: np.ndarray,
+                 targets: np.ndarray, lengths: np.ndarray, max_snap_distance: float = 25.0):
+        self.latitudes = np.asarray(latitudes, dtype=np.float64)
+        self.longitudes = np.asarray(longitudes, dtype=np.float64)
+        self.max_snap_distance = float(max_snap_distance)
+
+        lat, lon = np.radians(self.latitudes), np.radians(self.longitudes)
+        self._vectors = np.stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)], axis=-1)
+
+        # Adjacency in CSR form, both directions of every edge
+        heads = np.concatenate([sources, targets]).astype(np.int64)
+        tails = np.concatenate([targets, sources]).astype(np.int64)
+        weights = np.concatenate([lengths, lengths]).astype(np.float64)
+        order = np.argsort(heads, kind='stable')
+        self._neighbours = tails[order].tolist()
+        self._weights = weights[order].tolist()
+        self._offsets = np.concatenate([[0], np.cumsum(np.bincount(heads, minlength=len(self.latitudes)))]).tolist()
+
+    @classmethod
+    def load(cls, path: str, max_snap_distance: float = 25.0) -> 'RoadGraph':
+        with np.load(path) as extract:
+            return cls(extract['latitude'], extract['longitude'], extract['source'], extract['target'],
+                       extract['length'], max_snap_distance)
+
+    def snap(self, latitudes: np.ndarray, longitudes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Finds the nearest node for each location.
+
+        Returns:
+            tuple: The node rows (-1 where no node is within max_snap_distance) and the snap distances in km.
+        """
+        latitudes = np.asarray(latitudes, dtype=np.float64)
+        longitudes = np.asarray(longitudes, dtype=np.float64)
+        nodes = np.full(len(latitudes), -1, dtype=np.int64)
+        snap_distances = np.full(len(latitudes), np.nan)
+        for i, (lat, lon) in enumerate(zip(np.radians(latitudes), np.radians(longitudes))):
+            if np.isnan(lat) or np.isnan(lon):
+                continue
+            vector = np.array([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+            node = int(np.argmax(self._vectors @ vector))
+            distance = calculate_air_distance((latitudes[i], longitudes[i]), (self.latitudes[node], self.longitudes[node]))
+            if distance <= self.max_snap_distance:
+                nodes[i] = node
+                snap_distances[i] = distance
+        return nodes, snap_distances
+
+    def shortest_paths(self, source: int, targets) -> Dict[int, float]:
+        """
+        Runs Dijkstra from source until every target is settled.
+
+        Returns:
+            dict: Target node to path length in km; unreachable targets are left out.
+        """
+        remaining = set(targets)
+        settled = {}
+        queue = [(0.0, source)]
+        best = {source: 0.0}
+        while queue and remaining:
+            distance, node = heapq.heappop(queue)
+            if node in settled:
+                continue
+            settled[node] = distance
+            remaining.discard(node)
+            for k in range(self._offsets[node], self._offsets[node + 1]):
+                neighbour = self._neighbours[k]
+                candidate = distance + self._weights[k]
+                if candidate < best.get(neighbour, np.inf):
+                    best[neighbour] = candidate
+                    heapq.heappush(queue, (candidate, neighbour))
+        return {target: settled[target] for target in targets if target in settled}
+
+    def route_distances(self, source_latitudes, source_longitudes, destination_latitudes, destination_longitudes) -> np.ndarray:
+        """
+        Calculates road distances for arrays of source and destination coordinates.
+
+        Returns:
+            np.ndarray: The distances in kilometers, NaN where a location is off the extract or unreachable.
+        """
+        source_nodes, source_snaps = self.snap(source_latitudes, source_longitudes)
+        destination_nodes, destination_snaps = self.snap(destination_latitudes, destination_longitudes)
+        distances = np.full(len(source_nodes), np.nan)
+
+        # One Dijkstra run per distinct source node, stopping once its destinations are settled
+        targets_by_source: Dict[int, List[int]] = {}
+        for source, destination in zip(source_nodes.tolist(), destination_nodes.tolist()):
+            if source >= 0 and destination >= 0:
+                targets_by_source.setdefault(source, []).append(destination)
+        paths = {source: self.shortest_paths(source, targets) for source, targets in targets_by_source.items()}
+
+        for i, (source, destination) in enumerate(zip(source_nodes.tolist(), destination_nodes.tolist())):
+            length = paths.get(source, {}).get(destination)
+            if length is not None:
+                distances[i] = source_snaps[i] + length + destination_snaps[i]
+        return distances
+
+
+_road_graph = None
+_road_graph_lock = threading.Lock()
+
+
+def load_road_graph() -> Optional[RoadGraph]:
+    """
+    Returns the road graph configured with ROAD_GRAPH_PATH, loading it once per process.
+
+    Returns:
+        RoadGraph: The shared road graph, or None if no extract is configured.
+    """
+    global _road_graph
+    path = get_config_value('ROAD_GRAPH_PATH')
+    if not path:
+        return None
+    if _road_graph is None:
+        with _road_graph_lock:
+            if _road_graph is None:
+                _road_graph = RoadGraph.load(path, get_config_value('ROAD_GRAPH_MAX_SNAP_DISTANCE', 25.0))
+    return _road_graph
+
+
+def reset_road_graph():
+    """
+    Forgets the road graph so the next access loads the configured extract again.
+    """
+    global _road_graph
+    with _road_graph_lock:
+        _road_graph = None
+
+
+def offline_road_distances(source_latitudes, source_longitudes, destination_latitudes, destination_longitudes,
+                           source_countries: Sequence, destination_countries: Sequence) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Calculates road distances without network calls.
+
+    Lanes are routed over the road graph when one is configured and covers both
+    ends; every other lane is the great circle distance times the detour factor
+    for its pair of countries.
+
+    Args:
+        source_latitudes (array-like): Source latitudes.
+        source_longitudes (array-like): Source longitudes.
+        destination_latitudes (array-like): Destination latitudes.
+        destination_longitudes (array-like): Destination longitudes.
+        source_countries (sequence): ISO country codes of the sources, None where unknown.
+        destination_countries (sequence): ISO country codes of the destinations, None where unknown.
+
+    Returns:
+        tuple: The distances in kilometers and the distance calculation method of each lane.
+    """
+    source_latitudes = np.asarray(source_latitudes, dtype=np.float64)
+    source_longitudes = np.asarray(source_longitudes, dtype=np.float64)
+    destination_latitudes = np.asarray(destination_latitudes, dtype=np.float64)
+    destination_longitudes = np.asarray(destination_longitudes, dtype=np.float64)
+
+    # One factor per distinct pair of countries
+    factors = detour_factors()
+    pair_factors = {}
+    lane_factors = np.empty(len(source_latitudes))
+    for i, pair in enumerate(zip(source_countries, destination_countries)):
+        factor = pair_factors.get(pair)
+        if factor is None:
+            factor = pair_factors[pair] = detour_factor(pair[0], pair[1], factors)
+        lane_factors[i] = factor
+
+    distances = calculate_air_distance((source_latitudes, source_longitudes),
+                                       (destination_latitudes, destination_longitudes)) * lane_factors
+    methods = np.full(len(distances), DETOUR_FACTOR_METHOD, dtype=object)
+
+    road_graph = load_road_graph()
+    if road_graph is not None and len(distances):
+        graph_distances = road_graph.route_distances(source_latitudes, source_longitudes,
+                                                     destination_latitudes, destination_longitudes)
+        routed = ~np.isnan(graph_distances)
+        distances = np.where(routed, graph_distances, distances)
+        methods[routed] = ROAD_GRAPH_METHOD
+    return distances, methods
+
+
+def land_distance_mode() -> str:
+    """
+    Returns the configured LAND_DISTANCE_MODE: 'mapbox', 'offline' or 'mapbox_with_offline_fallback'.
+    """
+    mode = get_config_value('LAND_DISTANCE_MODE', 'mapbox')
+    if mode not in LAND_DISTANCE_MODES:
+        raise ValueError(f"Unknown LAND_DISTANCE_MODE {mode}, expected one of {', '.join(LAND_DISTANCE_MODES)}")
+    return mode
+
+
+def calculate_road_distance(source_coordinates, destination_coordinates, source_country: Optional[str] = None,
+                            destination_country: Optional[str] = None) -> Tuple[float, str]:
+    """
+    Calculates the road distance between two sets of coordinates using the configured LAND_DISTANCE_MODE.
+
+    Args:
+        source_coordinates (tuple): The (latitude, longitude) of the source location.
+        destination_coordinates (tuple): The (latitude, longitude) of the destination location.
+        source_country (str, optional): ISO country code of the source location.
+        destination_country (str, optional): ISO country code of the destination location.
+
+    Returns:
+        tuple: The distance in kilometers and the distance calculation method that produced it.
+    """
+    mode = land_distance_mode()
+    if mode != 'offline':
+        try:
+            return calculate_land_distance(source_coordinates, destination_coordinates), MAPBOX_METHOD
+        except Exception:
+            if mode == 'mapbox':
+                raise
+
+    lat1, lon1 = source_coordinates
+    lat2, lon2 = destination_coordinates
+    distances, methods = offline_road_distances([lat1], [lon1], [lat2], [lon2], [source_country], [destination_country])
+    return float(distances[0]), methods[0]
@@ -0,0 +1,908 @@
+import os
+import json
+import hashlib
+import tempfile
+import threading
+import numpy as np
+from typing import Dict, Optional, Sequence, Tuple
+
+try:
+    from snapshot import _default_snapshot_root
+    from utils import calculate_air_distance, calculate_sea_distance
+except ImportError:
+    from calculate_emissions.snapshot import _default_snapshot_root
+    from calculate_emissions.utils import calculate_air_distance, calculate_sea_distance
+
+# Bump whenever the graph, the land mask or the routing rules change so cached matrices are rebuilt
+SEA_ROUTE_VERSION = 2
+
+# Reported as the distance_calculation_method of routed sea legs
+SEA_ROUTE_METHOD = 'shorter_feasible_distance'
+SEA_FALLBACK_METHOD = 'great_circle_distance_2'
+
+# Number of waypoints a port or coordinate is connected to
+PORT_LINKS = 3
+
+# Nearest waypoints checked for the PORT_LINKS of a coordinate
+LINK_CANDIDATES = 8
+
+# Locations further than this from every waypoint (km) are not routed
+MAX_PORT_LINK_DISTANCE = 1500.0
+
+# Locations within this distance of one of the SEAPORTS (km) sail from it
+SEAPORT_RADIUS = 25.0
+
+# Rows routed at once; bounds the (rows x waypoints) working arrays
+ROUTE_CHUNK_SIZE = 8192
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), '../data')
+
+# Land cells of a 0.1 degree grid, row 0 at 90N and column 0 at 180W, bit-packed along the rows.
+# A cell is land only when none of the 30 arc-second GLOBE cells it covers is water, so narrow
+# straits and estuaries stay open.
+LAND_MASK_PATH = os.path.join(DATA_DIR, 'land_mask.npz')
+LAND_MASK_RESOLUTION = 0.1
+
+# Land within this distance of a location (km) is its harbour approach; river ports and
+# terminals behind breakwaters sit on land cells of the mask
+COAST_TOLERANCE = 50.0
+
+# Spacing of the points checked along a leg (km), below the size of a mask cell
+LAND_SAMPLE_SPACING = 10.0
+
+# Open-water waypoints at the approaches to straits, canals and capes, as (latitude, longitude).
+# Every lane between two waypoints below runs over water.
+WAYPOINTS = {
+    # North Europe and the Baltic
+    'channel_west': (49.4, -5.5),
+    'english_channel': (50.2, -1.5),
+    'dover_strait': (51.0, 1.45),
+    'north_sea_south': (52.3, 3.0),
+    'north_sea_central': (55.0, 3.5),
+    'north_sea_north': (58.5, 2.0),
+    'german_bight': (54.2, 7.3),
+    'elbe_mouth': (53.95, 8.5),
+    'jutland_west': (56.0, 7.5),
+    'skagerrak': (57.6, 8.0),
+    'skagen': (58.0, 10.8),
+    'kattegat': (57.2, 11.3),
+    'oresund': (55.8, 12.75),
+    'falsterbo': (55.25, 12.8),
+    'kiel_bay': (54.5, 10.3),
+    'fehmarn_belt': (54.5, 11.2),
+    'kadet_channel': (54.4, 12.2),
+    'baltic_south': (55.2, 14.5),
+    'baltic_central': (56.0, 19.0),
+    'baltic_northeast': (59.0, 21.0),
+    'gulf_of_finland': (59.8, 24.5),
+    'fair_isle': (59.6, -2.2),
+    'hebrides_north': (59.0, -6.5),
+    'hebrides_west': (57.5, -9.0),
+    'ireland_west': (53.5, -11.0),
+    'ireland_southwest': (51.2, -10.5),
+    # Iberia, the Mediterranean and the Black Sea
+    'ushant': (48.3, -6.0),
+    'finisterre': (43.0, -10.0),
+    'portugal_west': (39.0, -10.0),
+    'cape_st_vincent': (36.8, -9.3),
+    'gibraltar': (35.95, -5.6),
+    'alboran': (36.0, -3.0),
+    'med_west': (37.8, 2.5),
+    'menorca_east': (39.6, 4.6),
+    'gulf_of_lion': (42.6, 4.5),
+    'ligurian_sea': (43.3, 8.5),
+    'corsica_channel': (43.0, 9.6),
+    'tyrrhenian_north': (41.5, 11.0),
+    'tyrrhenian_south': (39.2, 14.5),
+    'bonifacio': (41.3, 9.25),
+    'sardinia_south': (38.5, 8.8),
+    'sicily_channel': (37.35, 11.7),
+    'malta_south': (35.6, 14.5),
+    'messina_north': (38.35, 15.68),
+    'messina_strait': (38.05, 15.62),
+    'ionian_west': (37.5, 16.5),
+    'ionian': (36.5, 19.0),
+    'otranto': (40.0, 19.0),
+    'adriatic_central': (42.6, 15.5),
+    'adriatic_north': (44.8, 13.0),
+    'matapan': (36.1, 22.5),
+    'crete_north': (35.9, 25.0),
+    'crete_south': (34.6, 24.5),
+    'kasos_strait': (35.35, 26.6),
+    'saronic_gulf': (37.55, 23.8),
+    'kea_channel': (37.6, 24.15),
+    'kafireas_strait': (38.05, 24.6),
+    'aegean_north': (39.5, 25.2),
+    'dardanelles': (40.05, 26.2),
+    'gelibolu': (40.4, 26.75),
+    'marmara': (40.75, 28.0),
+    'bosporus_south': (41.0, 28.98),
+    'bosporus_north': (41.25, 29.13),
+    'black_sea_west': (43.0, 30.0),
+    'black_sea_central': (43.5, 34.5),
+    'black_sea_east': (43.5, 38.5),
+    'med_east': (33.8, 28.0),
+    'port_said': (31.35, 32.35),
+    # Red Sea, Arabian Sea, the Gulf and the Indian Ocean
+    'suez': (29.85, 32.55),
+    'gulf_of_suez_north': (29.3, 32.75),
+    'gulf_of_suez': (28.6, 33.1),
+    'gulf_of_suez_south': (27.7, 33.9),
+    'red_sea_north': (26.0, 35.3),
+    'red_sea_central': (20.0, 38.6),
+    'red_sea_south': (15.5, 41.6),
+    'bab_el_mandeb': (12.55, 43.3),
+    'gulf_of_aden': (12.3, 45.5),
+    'gulf_of_aden_east': (12.8, 50.0),
+    'arabian_sea_west': (13.5, 55.5),
+    'arabian_sea': (13.0, 60.0),
+    'ras_al_hadd': (22.8, 60.5),
+    'gulf_of_oman': (24.8, 58.3),
+    'jask': (25.4, 57.6),
+    'hormuz': (26.5, 56.6),
+    'gulf_central': (26.2, 53.0),
+    'gulf_north': (28.5, 50.0),
+    'kutch': (22.4, 68.6),
+    'india_west': (18.5, 71.0),
+    'india_southwest': (8.5, 75.8),
+    'dondra': (5.6, 80.6),
+    'indian_ocean_south': (-20.0, 75.0),
+    # East Africa
+    'guardafui_north': (12.2, 52.0),
+    'guardafui_east': (10.5, 52.5),
+    'somalia': (7.0, 51.0),
+    'somalia_south': (0.0, 44.0),
+    'tanzania': (-7.0, 41.0),
+    'mozambique_channel': (-17.0, 41.0),
+    'mozambique_channel_south': (-25.0, 36.5),
+    'port_elizabeth_offshore': (-34.4, 26.0),
+    'south_africa_east': (-32.0, 30.5),
+    # Southeast Asia
+    'malacca_north': (6.4, 96.8),
+    'malacca_central': (3.0, 100.6),
+    'malacca_south': (1.4, 102.9),
+    'singapore_strait': (1.17, 103.75),
+    'singapore_east': (1.35, 104.6),
+    'gulf_of_thailand': (9.0, 102.0),
+    'scs_south': (5.0, 106.5),
+    'scs_central': (12.5, 114.0),
+    'ca_mau': (8.0, 105.0),
+    'vietnam_southeast': (10.0, 109.3),
+    'hainan_southeast': (17.5, 111.5),
+    'karimata_strait': (-1.7, 108.8),
+    'java_sea': (-5.0, 110.0),
+    'java_sea_west': (-5.5, 106.5),
+    'java_sea_east': (-6.0, 115.0),
+    'sunda_strait': (-5.9, 105.85),
+    'sunda_approach': (-7.0, 104.5),
+    'lombok_strait': (-8.7, 115.85),
+    # East Asia
+    'hong_kong_approach': (21.9, 114.3),
+    'taiwan_strait_south': (22.3, 118.0),
+    'taiwan_strait': (24.3, 119.6),
+    'taiwan_strait_north': (25.5, 120.4),
+    'luzon_strait': (21.2, 121.0),
+    'east_china_sea': (29.0, 123.0),
+    'yangtze_approach': (31.0, 123.0),
+    'yellow_sea': (35.0, 123.5),
+    'shandong_east': (37.3, 123.0),
+    'bohai_strait': (38.5, 121.0),
+    'jeju_south': (32.8, 126.5),
+    'korea_strait': (34.6, 129.0),
+    'sea_of_japan': (38.0, 134.0),
+    'tsugaru_strait': (41.5, 140.5),
+    'tsugaru_east': (41.65, 141.3),
+    'japan_northeast': (41.0, 142.5),
+    'osumi_strait': (30.95, 130.9),
+    'shikoku_south': (32.7, 134.0),
+    'kii_channel': (33.8, 134.9),
+    'kii_south': (33.2, 136.0),
+    'tokyo_approach': (34.6, 139.9),
+    'japan_east': (35.3, 141.3),
+    # Oceania
+    'australia_northwest': (-18.5, 117.5),
+    'north_west_cape': (-21.3, 113.3),
+    'shark_bay_west': (-25.5, 112.3),
+    'australia_west': (-29.0, 112.8),
+    'cape_leeuwin': (-35.0, 114.8),
+    'great_australian_bight': (-36.0, 130.0),
+    'kangaroo_island': (-36.3, 137.0),
+    'bass_strait_west': (-39.2, 143.0),
+    'bass_strait': (-39.6, 145.8),
+    'australia_southeast': (-38.2, 150.3),
+    'sydney_offshore': (-34.0, 151.8),
+    'new_south_wales_north': (-31.3, 153.5),
+    'byron_offshore': (-28.6, 154.0),
+    'brisbane_offshore': (-27.3, 153.8),
+    'coral_sea': (-17.0, 158.0),
+    'solomon_east': (-8.0, 165.0),
+    'tasman_sea': (-35.0, 163.0),
+    'nz_north': (-34.0, 174.3),
+    'nz_northeast': (-35.5, 175.5),
+    # Pacific
+    'guam': (12.8, 144.0),
+    'equator_pacific': (0.0, 158.0),
+    'hawaii': (20.3, -158.2),
+    'north_pacific_west': (42.0, 155.0),
+    'aleutian_south': (49.5, -175.0),
+    'north_pacific_east': (47.5, -140.0),
+    'south_pacific': (-35.0, -140.0),
+    'juan_de_fuca': (48.45, -124.9),
+    'juan_de_fuca_east': (48.3, -123.2),
+    'cape_blanco_offshore': (42.8, -125.2),
+    'cape_mendocino_offshore': (40.4, -124.9),
+    'san_francisco_approach': (37.6, -123.2),
+    'point_conception': (34.2, -120.8),
+    'channel_islands_south': (33.6, -119.8),
+    'los_angeles_approach': (33.65, -118.3),
+    'baja_west': (28.0, -116.0),
+    'cabo_san_lucas': (22.5, -110.0),
+    'mexico_pacific': (18.0, -104.5),
+    'acapulco_offshore': (15.5, -98.0),
+    'central_america_pacific': (9.0, -86.0),
+    'azuero_south': (6.7, -80.2),
+    'panama_pacific': (8.88, -79.52),
+    'ecuador': (-1.0, -81.5),
+    'paita_offshore': (-5.0, -81.8),
+    'peru': (-12.0, -77.6),
+    'chile_north': (-23.0, -71.0),
+    'chile_central': (-33.0, -72.3),
+    'arauco_offshore': (-37.5, -74.2),
+    'chile_south': (-45.0, -76.0),
+    'chile_far_south': (-53.0, -77.0),
+    'cape_horn': (-57.3, -67.0),
+    # Americas, Atlantic side
+    'staten_island_east': (-55.0, -63.0),
+    'patagonia': (-47.0, -63.5),
+    'rio_de_la_plata': (-35.8, -55.5),
+    'rio_grande_offshore': (-32.5, -50.5),
+    'santos_offshore': (-25.0, -45.5),
+    'cabo_frio': (-23.4, -41.8),
+    'abrolhos': (-18.5, -37.5),
+    'brazil_east': (-10.0, -35.5),
+    'paraiba_offshore': (-7.5, -34.4),
+    'cabo_sao_roque': (-5.0, -34.5),
+    'brazil_north': (0.0, -44.0),
+    'amazon_offshore': (3.0, -48.0),
+    'guianas': (8.0, -54.0),
+    'trinidad_east': (11.0, -59.5),
+    'st_vincent_passage': (13.55, -61.1),
+    'anegada_passage': (18.4, -63.8),
+    'caribbean_central': (14.0, -76.0),
+    'caribbean_west': (17.0, -83.0),
+    'jamaica_south': (17.3, -77.0),
+    'jamaica_channel': (18.2, -75.2),
+    'windward_passage': (20.0, -73.9),
+    'crooked_island_passage': (22.6, -74.45),
+    'bahamas_northeast': (25.0, -75.5),
+    'panama_atlantic': (9.38, -79.92),
+    'yucatan_channel': (21.7, -85.9),
+    'gulf_of_mexico': (26.0, -90.0),
+    'florida_strait': (23.8, -82.5),
+    'florida_strait_east': (24.2, -80.3),
+    'florida_east': (26.0, -79.7),
+    'savannah_offshore': (31.5, -79.5),
+    'hatteras': (34.8, -75.0),
+    'new_york_approach': (40.3, -73.5),
+    'nantucket': (40.3, -69.5),
+    'nova_scotia_south': (42.8, -63.0),
+    'grand_banks_south': (42.0, -50.0),
+    'north_atlantic_central': (45.0, -35.0),
+    'azores': (38.5, -27.0),
+    'bermuda': (32.0, -65.0),
+    # West Africa
+    'spartel': (35.85, -6.1),
+    'morocco_west': (33.5, -9.5),
+    'canaries': (28.0, -14.8),
+    'cape_blanc': (21.0, -18.0),
+    'cape_verde': (14.7, -18.0),
+    'sierra_leone': (7.5, -14.5),
+    'cape_palmas': (3.8, -7.8),
+    'gulf_of_guinea': (4.0, 2.5),
+    'gabon': (0.0, 8.0),
+    'angola': (-10.0, 12.0),
+    'benguela_offshore': (-15.0, 11.0),
+    'skeleton_coast': (-19.0, 11.5),
+    'namibia': (-23.0, 13.5),
+    'good_hope': (-35.0, 18.3),
+    'agulhas': (-35.5, 20.5),
+}
+
+# Sea lanes between waypoints; the lane length is the great circle distance unless listed in CANALS
+SEA_LANES = [
+    # North Europe and the Baltic
+    ('channel_west', 'english_channel'), ('english_channel', 'dover_strait'), ('dover_strait', 'north_sea_south'),
+    ('north_sea_south', 'german_bight'), ('north_sea_south', 'north_sea_central'), ('german_bight', 'elbe_mouth'),
+    ('german_bight', 'jutland_west'), ('north_sea_central', 'jutland_west'), ('north_sea_central', 'north_sea_north'),
+    ('jutland_west', 'skagerrak'), ('north_sea_north', 'skagerrak'), ('skagerrak', 'skagen'), ('skagen', 'kattegat'),
+    ('kattegat', 'oresund'), ('oresund', 'falsterbo'), ('falsterbo', 'baltic_south'),
+    ('elbe_mouth', 'kiel_bay'), ('kiel_bay', 'fehmarn_belt'), ('fehmarn_belt', 'kadet_channel'),
+    ('kadet_channel', 'baltic_south'), ('baltic_south', 'baltic_central'), ('baltic_central', 'baltic_northeast'),
+    ('baltic_northeast', 'gulf_of_finland'),
+    ('north_sea_north', 'fair_isle'), ('fair_isle', 'hebrides_north'), ('hebrides_north', 'hebrides_west'),
+    ('hebrides_west', 'ireland_west'), ('ireland_west', 'ireland_southwest'), ('ireland_southwest', 'channel_west'),
+    ('channel_west', 'ushant'),
+    # Atlantic Europe and the Mediterranean
+    ('ushant', 'finisterre'), ('finisterre', 'portugal_west'), ('portugal_west', 'cape_st_vincent'),
+    ('cape_st_vincent', 'gibraltar'), ('gibraltar', 'alboran'), ('alboran', 'med_west'),
+    ('med_west', 'menorca_east'), ('menorca_east', 'gulf_of_lion'), ('gulf_of_lion', 'ligurian_sea'),
+    ('ligurian_sea', 'corsica_channel'), ('corsica_channel', 'tyrrhenian_north'), ('gulf_of_lion', 'bonifacio'),
+    ('bonifacio', 'tyrrhenian_north'), ('bonifacio', 'tyrrhenian_south'), ('tyrrhenian_north', 'tyrrhenian_south'),
+    ('menorca_east', 'sardinia_south'), ('med_west', 'sardinia_south'), ('sardinia_south', 'sicily_channel'),
+    ('sardinia_south', 'tyrrhenian_south'), ('tyrrhenian_south', 'messina_north'),
+    ('messina_north', 'messina_strait'), ('messina_strait', 'ionian_west'), ('ionian_west', 'otranto'),
+    ('sicily_channel', 'malta_south'), ('malta_south', 'ionian_west'), ('malta_south', 'ionian'),
+    ('malta_south', 'crete_south'), ('ionian_west', 'ionian'), ('ionian', 'otranto'),
+    ('otranto', 'adriatic_central'), ('adriatic_central', 'adriatic_north'), ('ionian', 'matapan'),
+    ('ionian', 'crete_south'), ('matapan', 'crete_north'), ('crete_north', 'kea_channel'),
+    ('crete_north', 'kasos_strait'), ('kasos_strait', 'med_east'), ('crete_south', 'med_east'),
+    ('med_east', 'port_said'), ('saronic_gulf', 'kea_channel'), ('kea_channel', 'kafireas_strait'),
+    ('kafireas_strait', 'aegean_north'), ('aegean_north', 'dardanelles'), ('dardanelles', 'gelibolu'),
+    ('gelibolu', 'marmara'), ('marmara', 'bosporus_south'), ('bosporus_south', 'bosporus_north'),
+    ('bosporus_north', 'black_sea_west'), ('black_sea_west', 'black_sea_central'),
+    ('black_sea_central', 'black_sea_east'),
+    # Suez, Red Sea, the Gulf and the Indian Ocean
+    ('port_said', 'suez'), ('suez', 'gulf_of_suez_north'), ('gulf_of_suez_north', 'gulf_of_suez'),
+    ('gulf_of_suez', 'gulf_of_suez_south'), ('gulf_of_suez_south', 'red_sea_north'),
+    ('red_sea_north', 'red_sea_central'), ('red_sea_central', 'red_sea_south'), ('red_sea_south', 'bab_el_mandeb'),
+    ('bab_el_mandeb', 'gulf_of_aden'), ('gulf_of_aden', 'gulf_of_aden_east'),
+    ('gulf_of_aden_east', 'arabian_sea_west'),
+    ('arabian_sea_west', 'arabian_sea'), ('arabian_sea_west', 'ras_al_hadd'), ('arabian_sea', 'ras_al_hadd'),
+    ('ras_al_hadd', 'gulf_of_oman'), ('gulf_of_oman', 'jask'), ('jask', 'hormuz'), ('hormuz', 'gulf_central'),
+    ('gulf_central', 'gulf_north'), ('ras_al_hadd', 'kutch'), ('ras_al_hadd', 'india_west'),
+    ('arabian_sea', 'india_west'), ('arabian_sea', 'india_southwest'), ('kutch', 'india_west'),
+    ('india_west', 'india_southwest'), ('india_southwest', 'dondra'), ('dondra', 'malacca_north'),
+    ('dondra', 'indian_ocean_south'), ('arabian_sea', 'guardafui_east'),
+    ('gulf_of_aden_east', 'guardafui_north'), ('guardafui_north', 'guardafui_east'), ('guardafui_east', 'somalia'),
+    ('somalia', 'somalia_south'),
+    ('somalia_south', 'tanzania'), ('tanzania', 'mozambique_channel'),
+    ('mozambique_channel', 'mozambique_channel_south'),
+    ('mozambique_channel_south', 'south_africa_east'), ('south_africa_east', 'port_elizabeth_offshore'),
+    ('port_elizabeth_offshore', 'agulhas'),
+    ('agulhas', 'indian_ocean_south'), ('agulhas', 'cape_leeuwin'), ('indian_ocean_south', 'australia_west'),
+    ('indian_ocean_south', 'sunda_approach'),
+    # Southeast and East Asia
+    ('malacca_north', 'malacca_central'), ('malacca_central', 'malacca_south'), ('malacca_south', 'singapore_strait'),
+    ('singapore_strait', 'singapore_east'), ('singapore_east', 'scs_south'), ('singapore_east', 'karimata_strait'),
+    ('scs_south', 'gulf_of_thailand'), ('scs_south', 'vietnam_southeast'), ('scs_south', 'scs_central'),
+    ('gulf_of_thailand', 'ca_mau'), ('ca_mau', 'vietnam_southeast'), ('vietnam_southeast', 'hainan_southeast'),
+    ('hainan_southeast', 'hong_kong_approach'), ('scs_central', 'hong_kong_approach'),
+    ('scs_central', 'luzon_strait'),
+    ('karimata_strait', 'java_sea'), ('java_sea', 'java_sea_west'), ('java_sea_west', 'sunda_strait'),
+    ('sunda_strait', 'sunda_approach'), ('java_sea', 'java_sea_east'), ('java_sea_east', 'lombok_strait'),
+    ('lombok_strait', 'australia_northwest'), ('australia_northwest', 'north_west_cape'),
+    ('north_west_cape', 'shark_bay_west'), ('shark_bay_west', 'australia_west'),
+    ('hong_kong_approach', 'taiwan_strait_south'), ('taiwan_strait_south', 'taiwan_strait'),
+    ('taiwan_strait_south', 'luzon_strait'), ('taiwan_strait', 'taiwan_strait_north'),
+    ('taiwan_strait_north', 'east_china_sea'), ('luzon_strait', 'east_china_sea'),
+    ('east_china_sea', 'yangtze_approach'),
+    ('yangtze_approach', 'yellow_sea'), ('yellow_sea', 'shandong_east'), ('shandong_east', 'bohai_strait'),
+    ('yangtze_approach', 'jeju_south'), ('east_china_sea', 'jeju_south'), ('jeju_south', 'korea_strait'),
+    ('yellow_sea', 'jeju_south'), ('korea_strait', 'sea_of_japan'), ('sea_of_japan', 'tsugaru_strait'),
+    ('tsugaru_strait', 'tsugaru_east'), ('tsugaru_east', 'japan_northeast'), ('japan_northeast', 'japan_east'),
+    ('japan_northeast', 'north_pacific_west'),
+    ('yangtze_approach', 'osumi_strait'), ('east_china_sea', 'osumi_strait'), ('jeju_south', 'osumi_strait'),
+    ('osumi_strait', 'shikoku_south'), ('shikoku_south', 'kii_channel'), ('shikoku_south', 'kii_south'),
+    ('kii_channel', 'kii_south'), ('kii_south', 'tokyo_approach'), ('tokyo_approach', 'japan_east'),
+    ('luzon_strait', 'guam'), ('japan_east', 'guam'), ('guam', 'equator_pacific'),
+    # Oceania
+    ('australia_west', 'cape_leeuwin'), ('cape_leeuwin', 'great_australian_bight'),
+    ('great_australian_bight', 'kangaroo_island'), ('kangaroo_island', 'bass_strait_west'),
+    ('bass_strait_west', 'bass_strait'), ('bass_strait', 'australia_southeast'),
+    ('australia_southeast', 'sydney_offshore'),
+    ('sydney_offshore', 'new_south_wales_north'), ('new_south_wales_north', 'byron_offshore'),
+    ('byron_offshore', 'brisbane_offshore'), ('brisbane_offshore', 'coral_sea'), ('coral_sea', 'solomon_east'),
+    ('solomon_east', 'equator_pacific'), ('sydney_offshore', 'tasman_sea'), ('australia_southeast', 'tasman_sea'),
+    ('tasman_sea', 'nz_north'), ('nz_north', 'nz_northeast'), ('nz_northeast', 'south_pacific'),
+    # Pacific
+    ('japan_east', 'north_pacific_west'), ('north_pacific_west', 'aleutian_south'),
+    ('aleutian_south', 'north_pacific_east'), ('north_pacific_east', 'juan_de_fuca'),
+    ('juan_de_fuca', 'juan_de_fuca_east'), ('north_pacific_east', 'san_francisco_approach'),
+    ('juan_de_fuca', 'cape_blanco_offshore'), ('cape_blanco_offshore', 'cape_mendocino_offshore'),
+    ('cape_mendocino_offshore', 'san_francisco_approach'), ('japan_east', 'hawaii'), ('guam', 'hawaii'),
+    ('equator_pacific', 'hawaii'), ('hawaii', 'san_francisco_approach'), ('hawaii', 'los_angeles_approach'),
+    ('hawaii', 'azuero_south'), ('san_francisco_approach', 'point_conception'),
+    ('point_conception', 'channel_islands_south'), ('channel_islands_south', 'los_angeles_approach'),
+    ('los_angeles_approach', 'baja_west'), ('baja_west', 'cabo_san_lucas'), ('cabo_san_lucas', 'mexico_pacific'),
+    ('mexico_pacific', 'acapulco_offshore'), ('acapulco_offshore', 'central_america_pacific'),
+    ('central_america_pacific', 'azuero_south'), ('azuero_south', 'panama_pacific'),
+    ('panama_pacific', 'ecuador'), ('azuero_south', 'ecuador'), ('ecuador', 'paita_offshore'),
+    ('paita_offshore', 'peru'), ('peru', 'chile_north'), ('chile_north', 'chile_central'),
+    ('chile_central', 'arauco_offshore'), ('arauco_offshore', 'chile_south'), ('chile_south', 'chile_far_south'),
+    ('chile_far_south', 'cape_horn'),
+    ('south_pacific', 'chile_central'), ('south_pacific', 'azuero_south'),
+    # Americas, Atlantic side
+    ('cape_horn', 'staten_island_east'), ('staten_island_east', 'patagonia'), ('patagonia', 'rio_de_la_plata'),
+    ('rio_de_la_plata', 'rio_grande_offshore'), ('rio_grande_offshore', 'santos_offshore'),
+    ('santos_offshore', 'cabo_frio'), ('cabo_frio', 'abrolhos'), ('abrolhos', 'brazil_east'),
+    ('brazil_east', 'paraiba_offshore'), ('paraiba_offshore', 'cabo_sao_roque'), ('cabo_sao_roque', 'brazil_north'),
+    ('brazil_north', 'amazon_offshore'),
+    ('amazon_offshore', 'guianas'), ('guianas', 'trinidad_east'), ('trinidad_east', 'st_vincent_passage'),
+    ('st_vincent_passage', 'caribbean_central'), ('caribbean_central', 'panama_atlantic'),
+    ('caribbean_central', 'jamaica_south'), ('caribbean_central', 'jamaica_channel'),
+    ('caribbean_central', 'caribbean_west'), ('caribbean_central', 'anegada_passage'),
+    ('caribbean_west', 'yucatan_channel'), ('caribbean_west', 'panama_atlantic'), ('jamaica_south', 'caribbean_west'),
+    ('jamaica_channel', 'windward_passage'), ('windward_passage', 'crooked_island_passage'),
+    ('crooked_island_passage', 'bahamas_northeast'), ('bahamas_northeast', 'hatteras'),
+    ('yucatan_channel', 'gulf_of_mexico'), ('yucatan_channel', 'florida_strait'),
+    ('gulf_of_mexico', 'florida_strait'),
+    ('florida_strait', 'florida_strait_east'), ('florida_strait_east', 'florida_east'),
+    ('florida_east', 'savannah_offshore'), ('savannah_offshore', 'hatteras'), ('hatteras', 'new_york_approach'),
+    ('new_york_approach', 'nantucket'), ('nantucket', 'nova_scotia_south'),
+    ('nova_scotia_south', 'grand_banks_south'),
+    ('grand_banks_south', 'north_atlantic_central'), ('north_atlantic_central', 'ireland_southwest'),
+    ('north_atlantic_central', 'channel_west'), ('north_atlantic_central', 'ushant'), ('hatteras', 'bermuda'),
+    ('new_york_approach', 'bermuda'), ('bermuda', 'azores'), ('anegada_passage', 'bermuda'),
+    ('anegada_passage', 'azores'), ('azores', 'cape_st_vincent'), ('azores', 'gibraltar'), ('azores', 'ushant'),
+    ('azores', 'grand_banks_south'), ('trinidad_east', 'cape_verde'), ('cabo_sao_roque', 'cape_verde'),
+    ('cabo_sao_roque', 'canaries'), ('cabo_frio', 'good_hope'), ('cabo_frio', 'namibia'),
+    # West Africa
+    ('gibraltar', 'spartel'), ('spartel', 'morocco_west'), ('cape_st_vincent', 'morocco_west'),
+    ('morocco_west', 'canaries'),
+    ('cape_st_vincent', 'canaries'), ('canaries', 'cape_blanc'), ('cape_blanc', 'cape_verde'),
+    ('cape_verde', 'sierra_leone'), ('sierra_leone', 'cape_palmas'), ('cape_palmas', 'gulf_of_guinea'),
+    ('gulf_of_guinea', 'gabon'), ('gabon', 'angola'), ('angola', 'benguela_offshore'),
+    ('benguela_offshore', 'skeleton_coast'), ('skeleton_coast', 'namibia'), ('namibia', 'good_hope'),
+    ('good_hope', 'agulhas'), ('cape_palmas', 'angola'),
+]
+
+# Lanes through canals use the canal length instead of the great circle distance (km)
+CANALS = {
+    ('port_said', 'suez'): 193.0,
+    ('panama_atlantic', 'panama_pacific'): 82.0,
+    ('elbe_mouth', 'kiel_bay'): 98.0,
+}
+SEA_LANES += [lane for lane in CANALS if lane not in SEA_LANES]
+
+# Frequently used seaports and the (latitude, longitude) of their terminals.
+# un_locode.csv has no coordinates for many of the busiest ports and gives city
+# centres for others, so the terminal positions are listed here.
+SEAPORTS = {
+    'CNSHA': (30.63, 122.07), 'CNNGB': (29.93, 121.85), 'CNSZX': (22.48, 113.88), 'CNYTN': (22.57, 114.27),
+    'CNCAN': (22.75, 113.62), 'CNTAO': (36.08, 120.32), 'CNTSN': (38.97, 117.78), 'CNXMN': (24.45, 118.07),
+    'CNDLC': (38.93, 121.65), 'HKHKG': (22.30, 114.17), 'SGSIN': (1.26, 103.82), 'MYPKG': (3.00, 101.39),
+    'MYTPP': (1.36, 103.55), 'KRPUS': (35.10, 129.04), 'JPTYO': (35.62, 139.78), 'JPYOK': (35.45, 139.65),
+    'JPUKB': (34.68, 135.20), 'TWKHH': (22.61, 120.28), 'VNSGN': (10.77, 106.70), 'THLCH': (13.08, 100.88),
+    'IDTPP': (-6.10, 106.88), 'LKCMB': (6.95, 79.84), 'INNSA': (18.95, 72.95), 'INMUN': (22.74, 69.70),
+    'AEJEA': (25.01, 55.06), 'OMSLL': (16.94, 54.00), 'SAJED': (21.48, 39.17), 'EGPSD': (31.26, 32.30),
+    'DJJIB': (11.60, 43.13), 'MAPTM': (35.89, -5.50), 'ESALG': (36.13, -5.44), 'ESVLC': (39.44, -0.32),
+    'ESBCN': (41.35, 2.17), 'FRFOS': (43.42, 4.87), 'ITGOA': (44.40, 8.92), 'ITGIT': (38.44, 15.90),
+    'ITTRS': (45.65, 13.75), 'SIKOP': (45.55, 13.73), 'GRPIR': (37.94, 23.62), 'TRAMR': (40.96, 28.69),
+    'MTMAR': (35.82, 14.54), 'ROCND': (44.17, 28.66), 'RUNVS': (44.72, 37.80), 'NLRTM': (51.95, 4.05),
+    'BEANR': (51.27, 4.33), 'DEHAM': (53.54, 9.93), 'DEBRV': (53.57, 8.55), 'GBFXT': (51.95, 1.32),
+    'GBSOU': (50.90, -1.40), 'GBLGP': (51.50, 0.48), 'FRLEH': (49.48, 0.11), 'PLGDN': (54.40, 18.67),
+    'SEGOT': (57.69, 11.85), 'PTSIN': (37.95, -8.87), 'USNYC': (40.67, -74.05), 'USSAV': (32.08, -81.09),
+    'USHOU': (29.73, -95.02), 'USLAX': (33.73, -118.26), 'USLGB': (33.75, -118.20), 'USOAK': (37.80, -122.32),
+    'USSEA': (47.58, -122.35), 'CAVAN': (49.29, -123.10), 'CAHAL': (44.63, -63.57), 'PABLB': (8.95, -79.57),
+    'PAMIT': (9.36, -79.88), 'MXZLO': (19.05, -104.32), 'BRSSZ': (-23.98, -46.30), 'ARBUE': (-34.60, -58.37),
+    'UYMVD': (-34.90, -56.21), 'CLSAI': (-33.59, -71.62), 'PECLL': (-12.05, -77.15), 'COCTG': (10.39, -75.53),
+    'JMKIN': (17.97, -76.80), 'ZADUR': (-29.87, 31.03), 'ZACPT': (-33.91, 18.43), 'NGAPP': (6.44, 3.36),
+    'TGLFW': (6.13, 1.28), 'KEMBA': (-4.06, 39.66), 'AUMEL': (-37.84, 144.92), 'AUSYD': (-33.97, 151.22),
+    'AUBNE': (-27.38, 153.17), 'NZAKL': (-36.84, 174.77),
+}
+
+# The waypoints each of the SEAPORTS sails to, at most PORT_LINKS of them. The nearest
+# waypoints of a terminal are not always reachable over water (Genoa is closer to the
+# northern Adriatic than to the Tyrrhenian Sea), so the links are listed by hand.
+SEAPORT_LINKS = {
+    'CNSHA': ('yangtze_approach', 'east_china_sea', 'yellow_sea'), 'CNNGB': ('east_china_sea', 'yangtze_approach'),
+    'CNSZX': ('hong_kong_approach', 'taiwan_strait_south', 'hainan_southeast'),
+    'CNYTN': ('hong_kong_approach', 'taiwan_strait_south', 'hainan_southeast'), 'CNCAN': ('hong_kong_approach',),
+    'CNTAO': ('yellow_sea', 'jeju_south'), 'CNTSN': ('bohai_strait',),
+    'CNXMN': ('taiwan_strait', 'taiwan_strait_south', 'taiwan_strait_north'),
+    'CNDLC': ('bohai_strait', 'shandong_east'),
+    'HKHKG': ('hong_kong_approach', 'taiwan_strait_south', 'hainan_southeast'),
+    'SGSIN': ('singapore_strait', 'singapore_east', 'malacca_south'), 'MYPKG': ('malacca_central', 'malacca_north'),
+    'MYTPP': ('singapore_strait', 'malacca_south', 'singapore_east'),
+    'KRPUS': ('korea_strait', 'jeju_south', 'sea_of_japan'), 'JPTYO': ('tokyo_approach',),
+    'JPYOK': ('tokyo_approach',), 'JPUKB': ('kii_channel',),
+    'TWKHH': ('luzon_strait', 'taiwan_strait_south', 'taiwan_strait'), 'VNSGN': ('vietnam_southeast',),
+    'THLCH': ('gulf_of_thailand',), 'IDTPP': ('java_sea_west', 'sunda_strait', 'java_sea'),
+    'LKCMB': ('dondra', 'india_southwest'), 'INNSA': ('india_west',), 'INMUN': ('kutch',),
+    'AEJEA': ('gulf_central', 'hormuz'), 'OMSLL': ('arabian_sea_west', 'gulf_of_aden_east', 'arabian_sea'),
+    'SAJED': ('red_sea_central', 'red_sea_north', 'red_sea_south'), 'EGPSD': ('port_said', 'med_east'),
+    'DJJIB': ('gulf_of_aden', 'bab_el_mandeb'), 'MAPTM': ('gibraltar', 'alboran'), 'ESALG': ('gibraltar', 'alboran'),
+    'ESVLC': ('med_west', 'gulf_of_lion'), 'ESBCN': ('med_west', 'gulf_of_lion', 'ligurian_sea'),
+    'FRFOS': ('gulf_of_lion', 'menorca_east', 'sardinia_south'),
+    'ITGOA': ('ligurian_sea', 'corsica_channel', 'tyrrhenian_north'),
+    'ITGIT': ('messina_strait', 'ionian_west', 'tyrrhenian_south'), 'ITTRS': ('adriatic_north',),
+    'SIKOP': ('adriatic_north',), 'GRPIR': ('saronic_gulf', 'kea_channel'), 'TRAMR': ('marmara', 'bosporus_south'),
+    'MTMAR': ('malta_south', 'sicily_channel', 'ionian_west'), 'ROCND': ('black_sea_west', 'bosporus_north'),
+    'RUNVS': ('black_sea_east', 'black_sea_central'),
+    'NLRTM': ('north_sea_south', 'dover_strait', 'north_sea_central'), 'BEANR': ('north_sea_south', 'dover_strait'),
+    'DEHAM': ('elbe_mouth',), 'DEBRV': ('elbe_mouth', 'german_bight'), 'GBFXT': ('dover_strait', 'north_sea_south'),
+    'GBSOU': ('english_channel',), 'GBLGP': ('dover_strait', 'north_sea_south'),
+    'FRLEH': ('english_channel', 'dover_strait'), 'PLGDN': ('baltic_central', 'baltic_south'),
+    'SEGOT': ('kattegat', 'skagen'), 'PTSIN': ('cape_st_vincent', 'portugal_west'), 'USNYC': ('new_york_approach',),
+    'USSAV': ('savannah_offshore',), 'USHOU': ('gulf_of_mexico',), 'USLAX': ('los_angeles_approach',),
+    'USLGB': ('los_angeles_approach',), 'USOAK': ('san_francisco_approach',), 'USSEA': ('juan_de_fuca_east',),
+    'CAVAN': ('juan_de_fuca_east',), 'CAHAL': ('nova_scotia_south',), 'PABLB': ('panama_pacific',),
+    'PAMIT': ('panama_atlantic',), 'MXZLO': ('mexico_pacific',), 'BRSSZ': ('santos_offshore',),
+    'ARBUE': ('rio_de_la_plata',), 'UYMVD': ('rio_de_la_plata',), 'CLSAI': ('chile_central',), 'PECLL': ('peru',),
+    'COCTG': ('caribbean_central', 'panama_atlantic', 'jamaica_south'), 'JMKIN': ('jamaica_south', 'jamaica_channel'),
+    'ZADUR': ('south_africa_east',), 'ZACPT': ('good_hope',), 'NGAPP': ('gulf_of_guinea',),
+    'TGLFW': ('gulf_of_guinea',), 'KEMBA': ('tanzania', 'somalia_south'),
+    'AUMEL': ('bass_strait', 'bass_strait_west'), 'AUSYD': ('sydney_offshore',), 'AUBNE': ('brisbane_offshore',),
+    'NZAKL': ('nz_northeast',),
+}
+
+
+def _unit_vectors(latitudes: np.ndarray, longitudes: np.ndarray) -> np.ndarray:
+    lat, lon = np.radians(latitudes), np.radians(longitudes)
+    return np.stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)], axis=-1)
+
+
+def build_waypoint_distances() -> np.ndarray:
+    """
+    Calculates the shortest sea distance between every pair of waypoints.
+
+    Returns:
+        np.ndarray: A len(WAYPOINTS) x len(WAYPOINTS) array of kilometers, inf where no route exists.
+    """
+    names = list(WAYPOINTS)
+    index = {name: i for i, name in enumerate(names)}
+    latitudes = np.array([WAYPOINTS[name][0] for name in names])
+    longitudes = np.array([WAYPOINTS[name][1] for name in names])
+
+    distances = np.full((len(names), len(names)), np.inf)
+    np.fill_diagonal(distances, 0.0)
+    for a, b in SEA_LANES:
+        i, j = index[a], index[b]
+        length = CANALS.get((a, b)) or CANALS.get((b, a))
+        if length is None:
+            length = calculate_air_distance((latitudes[i], longitudes[i]), (latitudes[j], longitudes[j]))
+        distances[i, j] = distances[j, i] = min(distances[i, j], length)
+
+    # Floyd-Warshall; the graph is small enough to relax one waypoint at a time over the whole matrix
+    for k in range(len(names)):
+        distances = np.minimum(distances, distances[:, k, None] + distances[None, k, :])
+    return distances
+
+
+class LandMask:
+    """
+    Checks that great circle legs stay over water on the land grid stored in LAND_MASK_PATH.
+    """
+
+    def __init__(self, path: str = LAND_MASK_PATH):
+        with np.load(path) as data:
+            self.land = np.unpackbits(data['land'], axis=1).astype(bool)
+
+    def is_land(self, latitudes: np.ndarray, longitudes: np.ndarray) -> np.ndarray:
+        rows, columns = self.land.shape
+        row = np.clip(((90.0 - latitudes) / LAND_MASK_RESOLUTION).astype(np.int64), 0, rows - 1)
+        column = ((longitudes + 180.0) / LAND_MASK_RESOLUTION).astype(np.int64) % columns
+        return self.land[row, column]
+
+    def over_water(self, source_vectors: np.ndarray, destination_vectors: np.ndarray, distances: np.ndarray,
+                   source_tolerance: float = COAST_TOLERANCE,
+                   destination_tolerance: float = COAST_TOLERANCE) -> np.ndarray:
+        """
+        Checks the great circle legs between pairs of locations for land.
+
+        Points are sampled every LAND_SAMPLE_SPACING kilometers, leaving out the given
+        tolerance at either end of a leg.
+
+        Args:
+            source_vectors (np.ndarray): Unit vectors of the leg starts, one row per leg.
+            destination_vectors (np.ndarray): Unit vectors of the leg ends, one row per leg.
+            distances (np.ndarray): The leg lengths in kilometers.
+            source_tolerance (float): Kilometers of land allowed at the start of a leg.
+            destination_tolerance (float): Kilometers of land allowed at the end of a leg.
+
+        Returns:
+            np.ndarray: True for the legs that stay over water.
+        """
+        lengths = np.nan_to_num(distances)
+        angles = np.arccos(np.clip(np.einsum('ij,ij->i', source_vectors, destination_vectors), -1.0, 1.0))
+        crosses_land = np.zeros(len(lengths), dtype=bool)
+
+        # Walk all legs forward together, dropping each one as soon as it reaches land or its end
+        position = max(source_tolerance, LAND_SAMPLE_SPACING)
+        sampled = np.flatnonzero(lengths >= position + destination_tolerance)
+        while len(sampled):
+            # Spherical interpolation between the two ends of each leg; the points are left
+            # unnormalized since only their direction is converted back to coordinates
+            fraction = position / lengths[sampled, None]
+            angle = angles[sampled, None]
+            points = (np.sin((1 - fraction) * angle) * source_vectors[sampled]
+                      + np.sin(fraction * angle) * destination_vectors[sampled])
+            latitudes = np.degrees(np.arctan2(points[:, 2], np.hypot(points[:, 0], points[:, 1])))
+            longitudes = np.degrees(np.arctan2(points[:, 1], points[:, 0]))
+            on_land = self.is_land(latitudes, longitudes)
+            crosses_land[sampled[on_land]] = True
+
+            position += LAND_SAMPLE_SPACING
+            sampled = sampled[~on_land & (lengths[sampled] >= position + destination_tolerance)]
+        return ~crosses_land
+
+
+class SeaRouter:
+    """
+    Offline sea routing over a graph of waypoints at the major straits, canals and capes.
+
+    SEAPORTS are connected to the waypoints listed in SEAPORT_LINKS; any other location to
+    its PORT_LINKS nearest waypoints that can be reached without crossing land. The sea
+    distance is the shortest path between the two locations through the graph. Two locations
+    sharing the same first waypoint are in the same basin and may sail directly when no land
+    lies between them. Distances between the SEAPORTS are precomputed into a matrix that is
+    answered with a single lookup.
+    """
+
+    def __init__(self, port_distances: Optional[np.ndarray] = None):
+        self.waypoint_index = {name: i for i, name in enumerate(WAYPOINTS)}
+        self.waypoint_latitudes = np.array([lat for lat, _ in WAYPOINTS.values()])
+        self.waypoint_longitudes = np.array([lon for _, lon in WAYPOINTS.values()])
+        self.waypoint_vectors = _unit_vectors(self.waypoint_latitudes, self.waypoint_longitudes)
+        self.waypoint_distances = build_waypoint_distances()
+        self.land_mask = LandMask()
+
+        self.port_codes = list(SEAPORTS)
+        self.port_index: Dict[str, int] = {code: i for i, code in enumerate(self.port_codes)}
+        self.port_latitudes = np.array([lat for lat, _ in SEAPORTS.values()])
+        self.port_longitudes = np.array([lon for _, lon in SEAPORTS.values()])
+        self.port_vectors = _unit_vectors(self.port_latitudes, self.port_longitudes)
+        self.port_links = np.zeros((len(SEAPORTS), PORT_LINKS), dtype=np.int64)
+        self.port_legs = np.full((len(SEAPORTS), PORT_LINKS), np.inf)
+        for i, code in enumerate(self.port_codes):
+            for j, name in enumerate(SEAPORT_LINKS[code]):
+                self.port_links[i, j] = self.waypoint_index[name]
+                self.port_legs[i, j] = calculate_air_distance(SEAPORTS[code], WAYPOINTS[name])
+        if port_distances is None:
+            port_distances = self.build_port_distances()
+        self.port_distances = port_distances
+
+    def build_port_distances(self) -> np.ndarray:
+        """
+        Routes every pair of SEAPORTS over the links in SEAPORT_LINKS.
+
+        Returns:
+            np.ndarray: A len(SEAPORTS) x len(SEAPORTS) array of kilometers, NaN where no route exists.
+        """
+        latitudes, longitudes = self.port_latitudes, self.port_longitudes
+        links, legs = self.port_links, self.port_legs
+        n = len(latitudes)
+        sources = np.repeat(np.arange(n), n)
+        destinations = np.tile(np.arange(n), n)
+        distances = self._route(latitudes[sources], longitudes[sources], links[sources], legs[sources],
+                                latitudes[destinations], longitudes[destinations],
+                                links[destinations], legs[destinations])
+        return distances.reshape(n, n)
+
+    def _links(self, latitudes: np.ndarray, longitudes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        # Batches repeat the same locations, and checking legs for land is the expensive part
+        locations, inverse = np.unique(np.stack([latitudes, longitudes], axis=1), axis=0, return_inverse=True)
+        vectors = _unit_vectors(locations[:, 0], locations[:, 1])
+        links = np.zeros((len(locations), PORT_LINKS), dtype=np.int64)
+        legs = np.full((len(locations), PORT_LINKS), np.inf)
+
+        # Locations at one of the SEAPORTS sail over its links
+        ports = np.argmax(vectors @ self.port_vectors.T, axis=1)
+        port_legs = calculate_air_distance((locations[:, 0], locations[:, 1]),
+                                           (self.port_latitudes[ports], self.port_longitudes[ports]))
+        at_port = port_legs <= SEAPORT_RADIUS
+        links[at_port] = self.port_links[ports[at_port]]
+        legs[at_port] = self.port_legs[ports[at_port]] + port_legs[at_port, None]
+
+        # Any other location links to its nearest waypoints that are reachable over water. The
+        # nearest waypoints have the largest dot product of unit vectors, which is far cheaper
+        # than a haversine per waypoint; only the candidates get exact distances
+        others = np.flatnonzero(~at_port)
+        similarity = vectors[others] @ self.waypoint_vectors.T
+        candidates = np.argpartition(-similarity, LINK_CANDIDATES - 1, axis=1)[:, :LINK_CANDIDATES]
+        distances = calculate_air_distance((locations[others, 0, None], locations[others, 1, None]),
+                                           (self.waypoint_latitudes[candidates], self.waypoint_longitudes[candidates]))
+        distances = np.where(distances <= MAX_PORT_LINK_DISTANCE, distances, np.inf)
+        linkable = np.isfinite(distances)
+        over_water = np.zeros(candidates.shape, dtype=bool)
+        over_water[linkable] = self.land_mask.over_water(
+            np.broadcast_to(vectors[others, None, :], candidates.shape + (3,))[linkable],
+            self.waypoint_vectors[candidates[linkable]], distances[linkable], destination_tolerance=0.0)
+        distances = np.where(over_water, distances, np.inf)
+
+        order = np.argsort(distances, axis=1, kind='stable')[:, :PORT_LINKS]
+        links[others] = np.take_along_axis(candidates, order, axis=1)
+        legs[others] = np.take_along_axis(distances, order, axis=1)
+        return links[inverse.ravel()], legs[inverse.ravel()]
+
+    def _route(self, source_latitudes, source_longitudes, source_links, source_legs,
+               destination_latitudes, destination_longitudes, destination_links, destination_legs) -> np.ndarray:
+        # Every combination of source and destination waypoint, keeping the shortest
+        through_graph = (source_legs[:, :, None]
+                         + self.waypoint_distances[source_links[:, :, None], destination_links[:, None, :]]
+                         + destination_legs[:, None, :])
+        best = through_graph.min(axis=(1, 2))
+
+        # Sailing directly within a basin is only allowed when no land lies between the two locations
+        same_basin = source_links[:, 0] == destination_links[:, 0]
+        same_basin &= np.isfinite(source_legs[:, 0]) & np.isfinite(destination_legs[:, 0])
+        if same_basin.any():
+            lat1, lon1 = source_latitudes[same_basin], source_longitudes[same_basin]
+            lat2, lon2 = destination_latitudes[same_basin], destination_longitudes[same_basin]
+            direct = calculate_air_distance((lat1, lon1), (lat2, lon2))
+            over_water = self.land_mask.over_water(_unit_vectors(lat1, lon1), _unit_vectors(lat2, lon2), direct)
+            best[same_basin] = np.where(over_water, np.minimum(best[same_basin], direct), best[same_basin])
+
+        # Inland or open-ocean locations far from every waypoint are not routed
+        reachable = ((source_legs[:, 0] <= MAX_PORT_LINK_DISTANCE)
+                     & (destination_legs[:, 0] <= MAX_PORT_LINK_DISTANCE) & np.isfinite(best))
+        return np.where(reachable, best, np.nan)
+
+    def route_distances(self, source_latitudes, source_longitudes, destination_latitudes, destination_longitudes) -> np.ndarray:
+        """
+        Calculates the sea distance for arrays of source and destination coordinates.
+
+        Args:
+            source_latitudes (array-like): Source latitudes.
+            source_longitudes (array-like): Source longitudes.
+            destination_latitudes (array-like): Destination latitudes.
+            destination_longitudes (array-like): Destination longitudes.
+
+        Returns:
+            np.ndarray: The distances in kilometers, NaN where no route was found.
+        """
+        source_latitudes = np.asarray(source_latitudes, dtype=np.float64)
+        source_longitudes = np.asarray(source_longitudes, dtype=np.float64)
+        destination_latitudes = np.asarray(destination_latitudes, dtype=np.float64)
+        destination_longitudes = np.asarray(destination_longitudes, dtype=np.float64)
+
+        distances = np.full(len(source_latitudes), np.nan)
+        for start in range(0, len(distances), ROUTE_CHUNK_SIZE):
+            chunk = slice(start, start + ROUTE_CHUNK_SIZE)
+            source_links, source_legs = self._links(source_latitudes[chunk], source_longitudes[chunk])
+            destination_links, destination_legs = self._links(destination_latitudes[chunk], destination_longitudes[chunk])
+            distances[chunk] = self._route(source_latitudes[chunk], source_longitudes[chunk], source_links, source_legs,
+                                           destination_latitudes[chunk], destination_longitudes[chunk],
+                                           destination_links, destination_legs)
+        return distances
+
+    def route_distance(self, source_coordinates, destination_coordinates) -> float:
+        """
+        Calculates the sea distance between two sets of coordinates.
+
+        Args:
+            source_coordinates (tuple): The (latitude, longitude) of the source location.
+            destination_coordinates (tuple): The (latitude, longitude) of the destination location.
+
+        Returns:
+            float: The distance in kilometers, NaN if no route was found.
+        """
+        lat1, lon1 = source_coordinates
+        lat2, lon2 = destination_coordinates
+        return float(self.route_distances([lat1], [lon1], [lat2], [lon2])[0])
+
+    def port_distance(self, source_locode: Optional[str], destination_locode: Optional[str]) -> Optional[float]:
+        """
+        Looks up the precomputed sea distance between two SEAPORTS.
+
+        Args:
+            source_locode (str): The UN/LOCODE of the source port.
+            destination_locode (str): The UN/LOCODE of the destination port.
+
+        Returns:
+            float: The distance in kilometers, or None if either port is not precomputed.
+        """
+        source = self.port_index.get(source_locode)
+        destination = self.port_index.get(destination_locode)
+        if source is None or destination is None:
+            return None
+        distance = float(self.port_distances[source, destination])
+        return None if np.isnan(distance) else distance
+
+    def port_distances_many(self, source_locodes: Sequence, destination_locodes: Sequence) -> np.ndarray:
+        """
+        Looks up the precomputed sea distances for arrays of port pairs.
+
+        Args:
+            source_locodes (sequence): UN/LOCODEs of the source ports.
+            destination_locodes (sequence): UN/LOCODEs of the destination ports.
+
+        Returns:
+            np.ndarray: The distances in kilometers, NaN where a port is not precomputed.
+        """
+        sources = np.fromiter((self.port_index.get(code, -1) for code in source_locodes), dtype=np.int64)
+        destinations = np.fromiter((self.port_index.get(code, -1) for code in destination_locodes), dtype=np.int64)
+        found = (sources >= 0) & (destinations >= 0)
+        distances = np.full(len(sources), np.nan)
+        distances[found] = self.port_distances[sources[found], destinations[found]]
+        return distances
+
+
+def _graph_digest() -> str:
+    definition = [SEA_ROUTE_VERSION, PORT_LINKS, MAX_PORT_LINK_DISTANCE, COAST_TOLERANCE, WAYPOINTS, SEA_LANES,
+                  sorted([list(lane), length] for lane, length in CANALS.items()), SEAPORTS, SEAPORT_LINKS]
+    return hashlib.sha256(json.dumps(definition, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def _load_port_distances(cache_dir: str) -> Optional[np.ndarray]:
+    path = os.path.join(cache_dir, f'sea_routes-{_graph_digest()}.npy')
+    try:
+        port_distances = np.load(path, mmap_mode='r')
+    except (OSError, ValueError):
+        return None
+    if port_distances.shape != (len(SEAPORTS), len(SEAPORTS)):
+        return None
+    return port_distances
+
+
+def _save_port_distances(cache_dir: str, port_distances: np.ndarray):
+    filename = f'sea_routes-{_graph_digest()}.npy'
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix='.sea_routes-', suffix='.npy', dir=cache_dir)
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, port_distances, allow_pickle=False)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, os.path.join(cache_dir, filename))
+        # Drop matrices built from an older graph
+        for entry in os.listdir(cache_dir):
+            if entry.startswith('sea_routes-') and entry != filename:
+                os.remove(os.path.join(cache_dir, entry))
+    except OSError:
+        # Read-only location; the matrix stays in memory
+        pass
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def load_sea_router(cache_dir: Optional[str] = None) -> SeaRouter:
+    """
+    Returns the process-wide sea router.
+
+    The SEAPORTS distance matrix is stored next to the reference data snapshot and
+    memory-mapped on later loads; it is rebuilt whenever the graph changes.
+
+    Args:
+        cache_dir (str, optional): Directory holding the precomputed matrix.
+
+    Returns:
+        SeaRouter: The shared router.
+    """
+    global _router
+    if _router is None:
+        with _router_lock:
+            if _router is None:
+                cache_dir = cache_dir or _default_snapshot_root(os.path.abspath(DATA_DIR))
+                port_distances = _load_port_distances(cache_dir)
+                router = SeaRouter(port_distances)
+                if port_distances is None:
+                    _save_port_distances(cache_dir, router.port_distances)
+                _router = router
+    return _router
+
+
+def reset_sea_router():
+    """
+    Forgets the router so the next access loads it again.
+    """
+    global _router
+    with _router_lock:
+        _router = None
+
+
+def calculate_sea_route_distance(source_coordinates, destination_coordinates) -> Tuple[float, str]:
+    """
+    Calculates the sea distance between two sets of coordinates over the sea routing graph.
+
+    Falls back to the great circle distance multiplied by 2 when no route is found.
+
+    Args:
+        source_coordinates (tuple): The (latitude, longitude) of the source location.
+        destination_coordinates (tuple): The (latitude, longitude) of the destination location.
+
+    Returns:
+        tuple: The distance in kilometers and the distance calculation method used.
+    """
+    distance = load_sea_router().route_distance(source_coordinates, destination_coordinates)
+    if np.isnan(distance):
+        return calculate_sea_distance(source_coordinates, destination_coordinates), SEA_FALLBACK_METHOD
+    return distance, SEA_ROUTE_METHOD
+
+
+if __name__ == "__main__":
+    # Precompute the port matrix and print a few common lanes
+    router = load_sea_router()
+    for source, destination in [('CNSHA', 'NLRTM'), ('SGSIN', 'DEHAM'), ('USNYC', 'NLRTM'), ('CNSHA', 'USLAX')]:
+        print(f"{source} -> {destination}: {router.port_distance(source, destination):.0f} km")
@@ -0,0 +1,543 @@
+import sys
+import json
+import math
+import time
+import hashlib
+import argparse
+import threading
+import traceback
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Iterator, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+try:
+    from batch import calculate_emissions_batch, flatten_shipping_data
+    from config import get_config_value
+    from factor_registry import get_factor_registry, FactorChange
+    from instrumentation import instrumentation, MetricsRecorder
+    from journey import calculate_journeys
+    from engine import get_engine
+    from result import EmissionResult, dumps, echo_request
+    from shipment import calculate_shipment
+except ImportError:
+    from calculate_emissions.batch import calculate_emissions_batch, flatten_shipping_data
+    from calculate_emissions.config import get_config_value
+    from calculate_emissions.factor_registry import get_factor_registry, FactorChange
+    from calculate_emissions.instrumentation import instrumentation, MetricsRecorder
+    from calculate_emissions.journey import calculate_journeys
+    from calculate_emissions.engine import get_engine
+    from calculate_emissions.result import EmissionResult, dumps, echo_request
+    from calculate_emissions.shipment import calculate_shipment
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8080
+DEFAULT_MAX_BATCH_SIZE = 10_000
+DEFAULT_IDEMPOTENCY_MAX_ENTRIES = 100_000
+DEFAULT_IDEMPOTENCY_TTL = 24 * 3600
+
+# Request bodies above this size are refused before they are read
+MAX_BODY_BYTES = 64 * 1024 * 1024
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+
+JSON_CONTENT_TYPE = 'application/json'
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# A response: HTTP status, body and content type
+Response = Tuple[int, bytes, str]
+
+
+class IdempotencyConflict(ValueError):
+    """
+    An idempotency key was reused with a different request.
+    """
+
+
+class IdempotencyCache:
+    """
+    Responses by idempotency key, so a retried request gets the original response back
+    (including its result id) instead of being calculated again.
+
+    Each key remembers a fingerprint of the request it was first used with; reusing it
+    for another request is a conflict. A request arriving while the first one with its
+    key is still being calculated waits for that response. Entries expire after ttl
+    seconds and the least recently used ones are dropped beyond max_entries. When the
+    active emission factor dataset changes, discard drops the responses it affects.
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_IDEMPOTENCY_MAX_ENTRIES, ttl: float = DEFAULT_IDEMPOTENCY_TTL):
+        self.max_entries = int(max_entries)
+        self.ttl = float(ttl)
+        self.hits = 0
+        self.misses = 0
+        # key -> (fingerprint, expiry, response)
+        self._entries = OrderedDict()
+        # key -> (fingerprint, event set once the first request is answered)
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _lookup(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if self.ttl > 0 and entry[1] < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _store(self, key: str, fingerprint: str, response: Response):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (fingerprint, time.monotonic() + self.ttl, response)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_or_calculate(self, key: str, fingerprint: str, calculate: Callable[[], Response]) -> Response:
+        """
+        Returns the response stored for key, or calculates and stores it.
+
+        Args:
+            key (str): The client's idempotency key.
+            fingerprint (str): Digest of the request, see fingerprint.
+            calculate (callable): Produces the response when there is none yet.
+
+        Returns:
+            tuple: The HTTP status, body and content type. Server errors are returned but not stored,
+            so the request can be retried.
+        """
+        while True:
+            with self._lock:
+                entry = self._lookup(key)
+                pending = None if entry is not None else self._pending.get(key)
+                if entry is not None:
+                    if entry[0] == fingerprint:
+                        self.hits += 1
+                elif pending is None:
+                    self._pending[key] = (fingerprint, threading.Event())
+                    self.misses += 1
+            if entry is not None:
+                if entry[0] != fingerprint:
+                    raise IdempotencyConflict("The idempotency key was already used for a different request")
+                if instrumentation.enabled:
+                    instrumentation.cache('idempotency', hits=1)
+                return entry[2]
+            if pending is None:
+                break
+            if pending[0] != fingerprint:
+                raise IdempotencyConflict("The idempotency key is in use by a different request")
+            # Look again once the first request is answered; if it failed, this one takes over
+            pending[1].wait()
+
+        if instrumentation.enabled:
+            instrumentation.cache('idempotency', misses=1)
+        try:
+            response = calculate()
+            if response[0] < 500:
+                self._store(key, fingerprint, response)
+            return response
+        finally:
+            with self._lock:
+                _, event = self._pending.pop(key)
+            event.set()
+
+    def discard(self, change: FactorChange) -> int:
+        """
+        Drops the responses holding a result of change.previous_version that the change
+        affects (see FactorChange.affects), so a retried request is calculated again.
+
+        Returns:
+            int: The number of responses dropped.
+        """
+        with self._lock:
+            entries = list(self._entries.items())
+        # Bodies are parsed outside the lock, as changes are rare and requests keep being answered
+        stale = [(key, entry) for key, entry in entries if entry[2][0] < 300 and any(
+            version == change.previous_version and change.affects(method_name, country_code)
+            for version, method_name, country_code in _factor_uses(json.loads(entry[2][1])))]
+        with self._lock:
+            for key, entry in stale:
+                if self._entries.get(key) is entry:
+                    del self._entries[key]
+        return len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+
+def _factor_uses(document) -> Iterator[Tuple[str, str, Optional[str]]]:
+    # (dataset version, method, country) of every result in a response; journey legs
+    # do not echo their country, so theirs is None
+    if isinstance(document, list):
+        for item in document:
+            yield from _factor_uses(item)
+    elif isinstance(document, dict):
+        factor = document.get('emission_factor')
+        if isinstance(factor, dict) and 'dataset_version' in factor:
+            yield factor['dataset_version'], factor.get('methodology'), (document.get('request') or {}).get('country_code')
+        elif 'emission_factor_calculation_method' in document and 'dataset_version' in document:
+            yield document['dataset_version'], document['emission_factor_calculation_method'], None
+        for value in document.values():
+            if isinstance(value, (dict, list)):
+                yield from _factor_uses(value)
+
+
+def fingerprint(path: str, factor_version: Optional[str], payload) -> str:
+    """
+    Digest of a request, independent of the order of its JSON fields.
+    """
+    document = json.dumps([path, factor_version, payload], sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(document.encode()).hexdigest()
+
+
+def _json_safe(value):
+    # Journey results hold NaN for missing numbers, which is not valid JSON
+    if isinstance(value, dict):
+        return {key: _json_safe(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_json_safe(item) for item in value]
+    if isinstance(value, (float, np.floating)):
+        return None if math.isnan(value) else float(value)
+    return value
+
+
+def _text(value) -> Optional[str]:
+    return value if isinstance(value, str) else None
+
+
+def _error_message(error: Exception) -> str:
+    # Same messages as calculate_emissions in main.py
+    if isinstance(error, KeyError):
+        return f"Required data is missing: {error}"
+    if isinstance(error, ValueError):
+        return str(error)
+    return f"An error occurred while calculating emissions: {error}"
+
+
+class EmissionService:
+    """
+    The calculations behind the HTTP endpoints, independent of the HTTP server.
+
+    The reference data (LOCODE and airport tables, emission factor datasets, sea routes)
+    is loaded once by warm_up, so requests only pay for the calculation itself.
+    Requests that arrive before it is loaded are answered with 503. With a metrics
+    recorder, its measurements are served on /metrics in the Prometheus text format.
+    """
+
+    def __init__(self, factor_version: Optional[str] = None, max_batch_size: Optional[int] = None,
+                 idempotency_cache: Optional[IdempotencyCache] = None, metrics: Optional[MetricsRecorder] = None):
+        self.factor_version = factor_version
+        self.metrics = metrics
+        self.max_batch_size = max_batch_size or get_config_value('SERVICE_MAX_BATCH_SIZE', DEFAULT_MAX_BATCH_SIZE)
+        if idempotency_cache is None:
+            idempotency_cache = IdempotencyCache(
+                get_config_value('IDEMPOTENCY_CACHE_MAX_ENTRIES', DEFAULT_IDEMPOTENCY_MAX_ENTRIES),
+                get_config_value('IDEMPOTENCY_CACHE_TTL', DEFAULT_IDEMPOTENCY_TTL))
+        self.idempotency_cache = idempotency_cache
+        self.error: Optional[str] = None
+        self._ready = threading.Event()
+        self._started_at = time.monotonic()
+
+    @property
+    def ready(self) -> bool:
+        return self._ready.is_set()
+
+    def warm_up(self):
+        """
+        Loads the reference data; the service is ready once it returns.
+        """
+        try:
+            # A wrong factor version fails at start-up rather than on every request
+            get_engine().warm(self.factor_version)
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {e}"
+            raise
+        get_factor_registry().subscribe(self.idempotency_cache.discard)
+        self._ready.set()
+
+    def start_warm_up(self) -> threading.Thread:
+        """
+        Loads the reference data in the background, so health checks are answered meanwhile.
+        """
+        def run():
+            try:
+                self.warm_up()
+            except Exception:
+                traceback.print_exc()
+
+        thread = threading.Thread(target=run, name='reference-data-warm-up', daemon=True)
+        thread.start()
+        return thread
+
+    def health(self) -> dict:
+        return {'status': 'ok', 'uptime': time.monotonic() - self._started_at}
+
+    def readiness(self) -> Tuple[bool, dict]:
+        """
+        Returns whether the reference data is loaded, and the readiness document.
+        """
+        if self.ready:
+            return True, {'status': 'ready', 'dataset_version': get_factor_registry().active.version}
+        if self.error is not None:
+            return False, {'status': 'failed', 'error': self.error}
+        return False, {'status': 'loading'}
+
+    def calculate(self, shipping_data: dict, factor_version: Optional[str] = None) -> dict:
+        """
+        Calculates one shipment (or journey) into the output schema of the README.
+
+        Raises:
+            ValueError: When the shipment cannot be calculated.
+        """
+        if not isinstance(shipping_data, dict):
+            raise ValueError("The request body must be a shipping_data object")
+        factor_version = factor_version or self.factor_version
+        if 'journey' in shipping_data:
+            result = calculate_journeys([shipping_data], factor_version)[0]
+            if 'error' in result:
+                raise ValueError(result['error'])
+            return _json_safe(result)
+        try:
+            return calculate_shipment(shipping_data, factor_version).to_dict()
+        except Exception as e:
+            if instrumentation.enabled:
+                instrumentation.error(_error_message(e))
+            raise ValueError(_error_message(e)) from e
+
+    def calculate_batch(self, shipments: List[dict], factor_version: Optional[str] = None) -> List[dict]:
+        """
+        Calculates many shipments through the batch API, one result per shipment in order.
+
+        Shipments that cannot be calculated get null amounts and an 'error' instead of
+        failing the request.
+        """
+        factor_version = factor_version or self.factor_version
+        results: List[Optional[dict]] = [None] * len(shipments)
+        single, journeys = [], []
+        for position, shipping_data in enumerate(shipments):
+            if not isinstance(shipping_data, dict):
+                results[position] = {'error': "Each shipment must be a shipping_data object"}
+            else:
+                (journeys if 'journey' in shipping_data else single).append(position)
+
+        if single:
+            rows = []
+            for position in single:
+                try:
+                    rows.append(flatten_shipping_data(shipments[position]))
+                except Exception as e:
+                    rows.append({})
+                    results[position] = {'error': _error_message(e), 'request': echo_request(shipments[position])}
+                    if instrumentation.enabled:
+                        instrumentation.error(_error_message(e))
+            frame = calculate_emissions_batch(pd.DataFrame(rows), factor_version)
+            columns = {column: frame[column].tolist() for column in frame.columns}
+            for i, position in enumerate(single):
+                if results[position] is not None:
+                    continue
+                shipping_data = shipments[position]
+                result = EmissionResult(columns['emissions'][i], columns['shipment_mass'][i], columns['distance'][i],
+                                        _text(columns['distance_calculation_method'][i]), columns['emission_factor'][i],
+                                        _text(columns['emission_factor_calculation_method'][i]), shipping_data,
+                                        dataset_version=_text(columns['dataset_version'][i])).to_dict()
+                if isinstance(columns['error'][i], str):
+                    result['error'] = columns['error'][i]
+                results[position] = result
+
+        if journeys:
+            for position, result in zip(journeys, calculate_journeys([shipments[position] for position in journeys],
+                                                                     factor_version)):
+                results[position] = _json_safe(result)
+
+        return results
+
+    def handle(self, method: str, target: str, body: bytes, idempotency_key: Optional[str] = None) -> Response:
+        """
+        Answers one HTTP request.
+
+        Args:
+            method (str): 'GET' or 'POST'.
+            target (str): The request path and query string.
+            body (bytes): The request body.
+            idempotency_key (str, optional): The Idempotency-Key header.
+
+        Returns:
+            tuple: The HTTP status, the body (JSON, or Prometheus text for /metrics) and its content type.
+        """
+        url = urlsplit(target)
+        path = url.path.rstrip('/') or '/'
+        if path == '/healthz':
+            return _response(200, self.health())
+        if path == '/readyz':
+            ready, document = self.readiness()
+            return _response(200 if ready else 503, document)
+        if path == '/metrics' and self.metrics is not None:
+            return 200, self.metrics.to_prometheus().encode(), PROMETHEUS_CONTENT_TYPE
+        if path not in ('/v1/emissions', '/v1/emissions/batch'):
+            return _error(404, f"Unknown path: {url.path}")
+        if method != 'POST':
+            return _error(405, f"{url.path} only accepts POST")
+        if not self.ready:
+            return _error(503, "Reference data is still loading" if self.error is None else self.error)
+
+        try:
+            payload = json.loads(body)
+        except ValueError as e:
+            return _error(400, f"Invalid JSON: {e}")
+        factor_version = parse_qs(url.query).get('factor_version', [None])[0]
+        respond = self._single_response if path == '/v1/emissions' else self._batch_response
+        if idempotency_key is None and isinstance(payload, dict):
+            # The request schema also carries the key in the body
+            idempotency_key = payload.get('idempotency_key')
+
+        if not idempotency_key:
+            return respond(payload, factor_version)
+        try:
+            return self.idempotency_cache.get_or_calculate(
+                f"{path} {idempotency_key}", fingerprint(path, factor_version, payload),
+                lambda: respond(payload, factor_version))
+        except IdempotencyConflict as e:
+            return _error(422, str(e))
+
+    def _single_response(self, shipping_data, factor_version: Optional[str]) -> Response:
+        try:
+            return _response(200, self.calculate(shipping_data, factor_version))
+        except ValueError as e:
+            return _error(422, str(e))
+
+    def _batch_response(self, payload, factor_version: Optional[str]) -> Response:
+        shipments = payload.get('shipments') if isinstance(payload, dict) else payload
+        if not isinstance(shipments, list):
+            return _error(400, "The request body must be a list of shipments or an object with 'shipments'")
+        if len(shipments) > self.max_batch_size:
+            return _error(413, f"At most {self.max_batch_size} shipments can be sent at once")
+        try:
+            return _response(200, {'results': self.calculate_batch(shipments, factor_version)})
+        except ValueError as e:
+            # e.g. an unknown factor_version, which applies to the whole batch
+            return _error(422, str(e))
+
+
+def _response(status: int, document) -> Response:
+    return status, dumps(document).encode(), JSON_CONTENT_TYPE
+
+
+def _error(status: int, message: str) -> Response:
+    return _response(status, {'error': message})
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """
+    Passes requests to the server's EmissionService over persistent HTTP/1.1 connections.
+    """
+
+    protocol_version = 'HTTP/1.1'
+    server_version = 'calculate-emissions'
+    # Headers and body are separate writes; without this the body waits for the client's delayed ACK
+    disable_nagle_algorithm = True
+
+    def _dispatch(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > MAX_BODY_BYTES:
+            status, body, content_type = _error(413, f"Request bodies are limited to {MAX_BODY_BYTES} bytes")
+            self.close_connection = True
+        else:
+            try:
+                status, body, content_type = self.server.service.handle(self.command, self.path, self.rfile.read(length),
+                                                          self.headers.get(IDEMPOTENCY_HEADER))
+            except Exception:
+                self.log_error("%s", traceback.format_exc())
+                status, body, content_type = _error(500, "Internal server error")
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        if status == 503:
+            self.send_header('Retry-After', '1')
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_POST = do_PUT = do_DELETE = _dispatch
+
+    def log_message(self, format, *args):
+        if self.server.access_log:
+            super().log_message(format, *args)
+
+
+class EmissionServer(ThreadingHTTPServer):
+    """
+    Threaded HTTP server around an EmissionService; each connection has its own thread.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], service: EmissionService, access_log: bool = False):
+        super().__init__(address, RequestHandler)
+        self.service = service
+        self.access_log = access_log
+
+
+def serve(host: Optional[str] = None, port: Optional[int] = None, factor_version: Optional[str] = None,
+          access_log: bool = False, metrics: bool = False) -> EmissionServer:
+    """
+    Starts the service in the background and returns the server, which is already accepting connections.
+
+    The reference data is loaded in a background thread; /readyz reports when it is done.
+    Call shutdown() and server_close() on the returned server to stop it.
+
+    Args:
+        host (str, optional): Interface to listen on (SERVICE_HOST by default).
+        port (int, optional): Port to listen on (SERVICE_PORT by default, 0 for any free port).
+        factor_version (str, optional): Emission factor dataset for every request without
+            a factor_version query parameter.
+        access_log (bool): Log every request to stderr.
+        metrics (bool): Record stage timings, cache hit ratios, Mapbox calls and error
+            categories, served on /metrics in the Prometheus text format.
+
+    Returns:
+        EmissionServer: The running server.
+    """
+    host = host or get_config_value('SERVICE_HOST', DEFAULT_HOST)
+    port = get_config_value('SERVICE_PORT', DEFAULT_PORT) if port is None else port
+    recorder = instrumentation.add_hook(MetricsRecorder()) if metrics else None
+    service = EmissionService(factor_version, metrics=recorder)
+    server = EmissionServer((host, port), service, access_log)
+    service.start_warm_up()
+    threading.Thread(target=server.serve_forever, name='emission-server', daemon=True).start()
+    return server
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Serve emission calculations over HTTP with warm reference data.")
+    parser.add_argument('--host', help=f"Interface to listen on (default SERVICE_HOST or {DEFAULT_HOST})")
+    parser.add_argument('--port', type=int, help=f"Port to listen on (default SERVICE_PORT or {DEFAULT_PORT})")
+    parser.add_argument('--factor-version',
+                        help="Emission factor dataset for every request; by default the one that applied on its shipped_at")
+    parser.add_argument('--access-log', action='store_true', help="Log every request to stderr")
+    parser.add_argument('--metrics', action='store_true', help="Serve Prometheus metrics on /metrics")
+    args = parser.parse_args(argv)
+
+    server = serve(args.host, args.port, args.factor_version, args.access_log, args.metrics)
+    host, port = server.server_address[:2]
+    print(f"Serving on http://{host}:{port}", file=sys.stderr)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
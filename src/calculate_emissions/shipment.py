@@ -0,0 +1,61 @@
+from typing import Dict, Optional
+
+try:
+    from calculate_mass import calculate_shipment_mass
+    from calculate_distance import calculate_distance
+    from calculate_emission_factor import get_emission_factor
+    from factor_registry import get_factor_registry
+    from result import EmissionResult
+    from instrumentation import instrumentation, timer
+except ImportError:
+    from calculate_emissions.calculate_mass import calculate_shipment_mass
+    from calculate_emissions.calculate_distance import calculate_distance
+    from calculate_emissions.calculate_emission_factor import get_emission_factor
+    from calculate_emissions.factor_registry import get_factor_registry
+    from calculate_emissions.result import EmissionResult
+    from calculate_emissions.instrumentation import instrumentation, timer
+
+
+def calculate_shipment(shipping_data: Dict, factor_version: Optional[str] = None) -> EmissionResult:
+    """
+    Calculate the emissions of one single-leg shipment.
+
+    This is the calculation behind calculate_emissions in main.py, shared with the HTTP service.
+
+    Args:
+        shipping_data (dict): The shipment, route and method, as described in the README.
+        factor_version (str, optional): The emission factor dataset to use. By default the dataset
+            that applied on 'shipped_at' is used, or the active one.
+
+    Returns:
+        EmissionResult: The calculated emissions and related data.
+    """
+    instrumented = instrumentation.enabled
+
+    # Calculate the shipment mass
+    start = timer() if instrumented else None
+    shipment_mass = calculate_shipment_mass(shipping_data['shipment'])
+    if instrumented:
+        instrumentation.stage('mass', None, timer() - start)
+
+    # Calculate the distance
+    route = shipping_data['route']
+    method = shipping_data['method']
+    distance, distance_calculation_method = calculate_distance(route, method)
+
+    # Get the emission factor from the dataset that applied when the shipment was made
+    if instrumented:
+        start = timer()
+    registry = get_factor_registry()
+    dataset = registry.get(factor_version) if factor_version else registry.resolve(shipping_data.get('shipped_at'))
+    country_code = shipping_data.get('country_code')
+    emission_factor, emission_factor_calculation_method = get_emission_factor(method, distance, country_code, dataset.version)
+    if instrumented:
+        instrumentation.stage('emission_factor', emission_factor_calculation_method, timer() - start)
+
+    # Calculate emissions
+    emissions = shipment_mass * distance * emission_factor
+
+    return EmissionResult(emissions, shipment_mass, distance, distance_calculation_method,
+                          emission_factor, emission_factor_calculation_method, shipping_data,
+                          dataset_version=dataset.version)
@@ -0,0 +1,377 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import threading
+import numpy as np
+import pandas as pd
+from typing import Dict, Optional
+
+# Bump whenever the on-disk layout or the compiled contents change
+SNAPSHOT_FORMAT_VERSION = 4
+
+# Source files compiled into a snapshot, keyed by the name used in the manifest
+SOURCE_FILES = {
+    'un_locode': 'un_locode.csv',
+    'iata_icao': 'iata_icao_airport_coordinates.csv',
+    'emission_factors': 'emission_factors.xlsx',
+}
+
+EXCEL_SHEETS = ['emission_factors', 'electricity_intensity']
+
+# Overrides where snapshots are written, e.g. when the data directory is read-only
+SNAPSHOT_DIR_ENV = 'CALCULATE_EMISSIONS_SNAPSHOT_DIR'
+
+
+def read_locode_csv(un_locodes_csv_path: str) -> Dict[str, np.ndarray]:
+    """
+    Parses the UN/LOCODE CSV into code and coordinate arrays.
+
+    Rows without coordinates, or with coordinates that cannot be parsed, are dropped.
+
+    Args:
+        un_locodes_csv_path (str): The path to the CSV file containing location data.
+
+    Returns:
+        dict: Arrays 'code' (UTF-8 bytes), 'latitude' and 'longitude' of equal length.
+    """
+    try:
+        from utils import parse_coordinates_array
+    except ImportError:
+        from calculate_emissions.utils import parse_coordinates_array
+
+    df = pd.read_csv(un_locodes_csv_path, encoding='utf-8', usecols=['locode', 'coordinates'],
+                     dtype=str, keep_default_na=False)
+
+    latitudes, longitudes, valid = parse_coordinates_array(df['coordinates'].to_numpy(dtype=str))
+
+    return {
+        'code': np.char.encode(df['locode'].to_numpy(dtype=str)[valid], 'utf-8'),
+        'latitude': latitudes[valid],
+        'longitude': longitudes[valid],
+    }
+
+
+def read_airport_csv(iata_icao_csv_path: str) -> Dict[str, np.ndarray]:
+    """
+    Parses the airport CSV into IATA/ICAO code and coordinate arrays.
+
+    Args:
+        iata_icao_csv_path (str): The path to the CSV file containing airport data.
+
+    Returns:
+        dict: Arrays 'iata', 'icao' (UTF-8 bytes), 'latitude' and 'longitude' of equal length.
+    """
+    df = pd.read_csv(iata_icao_csv_path, encoding='utf-8', usecols=['iata', 'icao', 'latitude', 'longitude'],
+                     dtype={'iata': str, 'icao': str}, keep_default_na=False,
+                     na_values={'latitude': [''], 'longitude': ['']})
+    df = df[df['latitude'].notna() & df['longitude'].notna()]
+
+    return {
+        'iata': np.char.encode(df['iata'].to_numpy(dtype=str), 'utf-8'),
+        'icao': np.char.encode(df['icao'].to_numpy(dtype=str), 'utf-8'),
+        'latitude': df['latitude'].to_numpy(dtype=np.float64),
+        'longitude': df['longitude'].to_numpy(dtype=np.float64),
+    }
+
+
+def _frame_to_arrays(df: pd.DataFrame):
+    arrays = {}
+    columns = []
+    for column in df.columns:
+        series = df[column]
+        if pd.api.types.is_numeric_dtype(series):
+            arrays[column] = series.to_numpy(dtype=np.float64)
+            columns.append({'name': column, 'kind': 'float'})
+        else:
+            missing = series.isna().to_numpy()
+            arrays[column] = np.where(missing, '', series.astype(object).to_numpy()).astype(str)
+            arrays[f'{column}.missing'] = missing
+            columns.append({'name': column, 'kind': 'str'})
+    return arrays, columns
+
+
+def _hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _source_stats(data_dir: str) -> Dict[str, list]:
+    stats = {}
+    for name, filename in SOURCE_FILES.items():
+        st = os.stat(os.path.join(data_dir, filename))
+        stats[name] = [st.st_size, st.st_mtime_ns]
+    return stats
+
+
+class Snapshot:
+    """
+    A compiled, versioned copy of the reference data stored as .npy files.
+
+    Arrays are memory-mapped read-only on first access, so forked or co-located
+    workers share the same pages instead of each parsing the sources.
+    """
+
+    def __init__(self, path: str, manifest: dict):
+        self.path = path
+        self.manifest = manifest
+        self._arrays = {}
+        self._lock = threading.Lock()
+
+    @property
+    def version(self) -> str:
+        return self.manifest['version']
+
+    def array(self, name: str) -> np.ndarray:
+        """
+        Returns a read-only memory-mapped array from the snapshot.
+
+        Args:
+            name (str): The array name, e.g. 'locode/latitude'.
+
+        Returns:
+            np.ndarray: The memory-mapped array.
+        """
+        array = self._arrays.get(name)
+        if array is None:
+            with self._lock:
+                array = self._arrays.get(name)
+                if array is None:
+                    filename = self.manifest['arrays'][name]
+                    array = np.load(os.path.join(self.path, filename), mmap_mode='r')
+                    self._arrays[name] = array
+        return array
+
+    def table(self, table_name: str) -> Dict[str, np.ndarray]:
+        """
+        Returns every array of a table keyed by column name.
+
+        Args:
+            table_name (str): The table name, e.g. 'locode' or 'airports'.
+
+        Returns:
+            dict: Column name to memory-mapped array.
+        """
+        prefix = f'{table_name}/'
+        return {name[len(prefix):]: self.array(name) for name in self.manifest['arrays'] if name.startswith(prefix)}
+
+    def frame(self, sheet_name: str) -> pd.DataFrame:
+        """
+        Rebuilds a DataFrame for one of the compiled Excel sheets.
+
+        Args:
+            sheet_name (str): The sheet name, e.g. 'emission_factors'.
+
+        Returns:
+            pd.DataFrame: The sheet with missing strings restored as NaN.
+        """
+        data = {}
+        for column in self.manifest['frames'][sheet_name]:
+            name = column['name']
+            values = self.array(f'{sheet_name}/{name}')
+            if column['kind'] == 'str':
+                values = np.where(self.array(f'{sheet_name}/{name}.missing'), None, values.astype(object))
+            else:
+                values = np.array(values)
+            data[name] = values
+        return pd.DataFrame(data)
+
+
+def _default_snapshot_root(data_dir: str) -> str:
+    return os.environ.get(SNAPSHOT_DIR_ENV) or os.path.join(data_dir, '.snapshot')
+
+
+def _write_array(build_dir: str, arrays_manifest: dict, name: str, values: np.ndarray):
+    filename = name.replace('/', '__') + '.npy'
+    np.save(os.path.join(build_dir, filename), np.ascontiguousarray(values), allow_pickle=False)
+    arrays_manifest[name] = filename
+
+
+def _write_pointer(snapshot_root: str, version: str, stats: Dict[str, list]):
+    fd, tmp_pointer = tempfile.mkstemp(prefix='.current-', dir=snapshot_root)
+    with os.fdopen(fd, 'w') as f:
+        json.dump({'version': version, 'source_stats': stats}, f)
+    os.chmod(tmp_pointer, 0o644)
+    os.replace(tmp_pointer, os.path.join(snapshot_root, 'current.json'))
+
+
+def build_snapshot(data_dir: str, snapshot_root: Optional[str] = None) -> Snapshot:
+    """
+    Compiles the reference data in data_dir into a new snapshot.
+
+    Args:
+        data_dir (str): Directory containing the files listed in SOURCE_FILES.
+        snapshot_root (str, optional): Directory in which snapshots are stored.
+
+    Returns:
+        Snapshot: The freshly built snapshot.
+    """
+    snapshot_root = snapshot_root or _default_snapshot_root(data_dir)
+    os.makedirs(snapshot_root, exist_ok=True)
+
+    stats = _source_stats(data_dir)
+    hashes = {name: _hash_file(os.path.join(data_dir, filename)) for name, filename in SOURCE_FILES.items()}
+    version_digest = hashlib.sha256(json.dumps([SNAPSHOT_FORMAT_VERSION, hashes], sort_keys=True).encode())
+    version = f'v{SNAPSHOT_FORMAT_VERSION}-{version_digest.hexdigest()[:16]}'
+
+    manifest = {
+        'format_version': SNAPSHOT_FORMAT_VERSION,
+        'version': version,
+        'sources': hashes,
+        'source_stats': stats,
+        'arrays': {},
+        'frames': {},
+    }
+
+    build_dir = os.path.join(snapshot_root, version)
+    if not os.path.isdir(build_dir):
+        tmp_dir = tempfile.mkdtemp(prefix='.build-', dir=snapshot_root)
+        try:
+            locodes = read_locode_csv(os.path.join(data_dir, SOURCE_FILES['un_locode']))
+            for column, values in locodes.items():
+                _write_array(tmp_dir, manifest['arrays'], f'locode/{column}', values)
+
+            airports = read_airport_csv(os.path.join(data_dir, SOURCE_FILES['iata_icao']))
+            for column, values in airports.items():
+                _write_array(tmp_dir, manifest['arrays'], f'airports/{column}', values)
+
+            emission_factors_file_path = os.path.join(data_dir, SOURCE_FILES['emission_factors'])
+            for sheet_name in EXCEL_SHEETS:
+                df = pd.read_excel(emission_factors_file_path, sheet_name=sheet_name)
+                arrays, columns = _frame_to_arrays(df)
+                for column, values in arrays.items():
+                    _write_array(tmp_dir, manifest['arrays'], f'{sheet_name}/{column}', values)
+                manifest['frames'][sheet_name] = columns
+
+            with open(os.path.join(tmp_dir, 'manifest.json'), 'w') as f:
+                json.dump(manifest, f, indent=4)
+        except Exception:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+
+        try:
+            # mkdtemp creates the directory private to this user
+            os.chmod(tmp_dir, 0o755)
+            os.rename(tmp_dir, build_dir)
+        except OSError:
+            # Another process finished the same build first
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            if not os.path.isdir(build_dir):
+                raise
+    else:
+        with open(os.path.join(build_dir, 'manifest.json'), 'r') as f:
+            manifest = json.load(f)
+        manifest['source_stats'] = stats
+
+    # Point the root at the new build; readers switch atomically
+    _write_pointer(snapshot_root, version, stats)
+
+    # Drop superseded builds; pages already mapped by running processes stay valid
+    for entry in os.listdir(snapshot_root):
+        if entry.startswith('v') and entry != version:
+            shutil.rmtree(os.path.join(snapshot_root, entry), ignore_errors=True)
+
+    return Snapshot(build_dir, manifest)
+
+
+def _read_current(data_dir: str, snapshot_root: str) -> Optional[Snapshot]:
+    try:
+        with open(os.path.join(snapshot_root, 'current.json'), 'r') as f:
+            pointer = json.load(f)
+        build_dir = os.path.join(snapshot_root, pointer['version'])
+        with open(os.path.join(build_dir, 'manifest.json'), 'r') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError, KeyError):
+        return None
+
+    if manifest.get('format_version') != SNAPSHOT_FORMAT_VERSION:
+        return None
+
+    # Cheap check first; only hash the sources when their size or mtime moved
+    stats = _source_stats(data_dir)
+    if pointer.get('source_stats') != stats:
+        for name, filename in SOURCE_FILES.items():
+            if manifest['sources'].get(name) != _hash_file(os.path.join(data_dir, filename)):
+                return None
+        # Same contents (e.g. the files were copied or touched); record the new stats so the
+        # next start skips the hashing. A read-only snapshot root just keeps rehashing.
+        try:
+            _write_pointer(snapshot_root, pointer['version'], stats)
+        except OSError:
+            pass
+    return Snapshot(build_dir, manifest)
+
+
+_snapshots = {}
+_snapshots_lock = threading.Lock()
+
+
+def load_snapshot(data_dir: str, snapshot_root: Optional[str] = None) -> Snapshot:
+    """
+    Returns the snapshot for data_dir, rebuilding it if any source file changed.
+
+    The result is cached per process; call clear_snapshots to force a recheck.
+
+    Args:
+        data_dir (str): Directory containing the files listed in SOURCE_FILES.
+        snapshot_root (str, optional): Directory in which snapshots are stored.
+
+    Returns:
+        Snapshot: The up-to-date snapshot.
+    """
+    data_dir = os.path.abspath(data_dir)
+    snapshot_root = snapshot_root or _default_snapshot_root(data_dir)
+    key = (data_dir, snapshot_root)
+
+    snapshot = _snapshots.get(key)
+    if snapshot is None:
+        with _snapshots_lock:
+            snapshot = _snapshots.get(key)
+            if snapshot is None:
+                snapshot = _read_current(data_dir, snapshot_root) or build_snapshot(data_dir, snapshot_root)
+                _snapshots[key] = snapshot
+    return snapshot
+
+
+def snapshot_for(source_path: str, source_name: str) -> Optional[Snapshot]:
+    """
+    Returns the snapshot covering a source file, or None if it cannot be used.
+
+    A snapshot is only used when source_path is the expected file of a data
+    directory that holds every source; otherwise callers read the file directly.
+
+    Args:
+        source_path (str): Path of the source file being loaded.
+        source_name (str): Key of the file in SOURCE_FILES.
+
+    Returns:
+        Snapshot: The snapshot, or None.
+    """
+    if os.path.basename(source_path) != SOURCE_FILES[source_name]:
+        return None
+    data_dir = os.path.dirname(os.path.abspath(source_path))
+    if not all(os.path.isfile(os.path.join(data_dir, filename)) for filename in SOURCE_FILES.values()):
+        return None
+    try:
+        return load_snapshot(data_dir)
+    except OSError:
+        return None
+
+
+def clear_snapshots():
+    """
+    Forgets the snapshots loaded by this process.
+    """
+    with _snapshots_lock:
+        _snapshots.clear()
+
+
+if __name__ == "__main__":
+    # Compile the bundled reference data
+    data_dir = os.path.join(os.path.dirname(__file__), '../data')
+    snapshot = build_snapshot(data_dir)
+    print(f"Snapshot {snapshot.version} written to {snapshot.path}")
@@ -0,0 +1,356 @@
+import threading
+import numpy as np
+from typing import Dict, Optional, Tuple
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+
+try:
+    from config import get_config_value
+    from calculate_distance import un_locode_file_path, iata_icao_file_path
+    from reference_data import CodeIndex, load_locode_table, load_airport_table
+    from sea_routing import SEAPORTS
+except ImportError:
+    from calculate_emissions.config import get_config_value
+    from calculate_emissions.calculate_distance import un_locode_file_path, iata_icao_file_path
+    from calculate_emissions.reference_data import CodeIndex, load_locode_table, load_airport_table
+    from calculate_emissions.sea_routing import SEAPORTS
+
+EARTH_RADIUS = 6371.0  # Earth radius in kilometers, as in calculate_air_distance
+
+# Facility types that locations can be snapped to. The UN/LOCODE extract has no function
+# codes, so seaports are the curated terminals of the sea routing graph.
+FACILITY_TYPES = ('airport', 'seaport', 'locode')
+
+# Hub used for the legs of each distance type when snapping is enabled
+SNAP_FACILITIES = {
+    'air': 'airport',
+    'sea': 'seaport',
+}
+
+DEFAULT_SNAP_MAX_DISTANCE = 500.0
+
+# Queries are answered in blocks so the candidate arrays stay small
+QUERY_BLOCK_SIZE = 4096
+
+# Each grid level is this many times coarser than the previous one
+GRID_LEVEL_FACTOR = 2
+GRID_LEVELS = 16
+FINEST_CELL_DIVISOR = 8
+
+_NEIGHBOUR_OFFSETS = np.array([(x, y, z) for x in (-1, 0, 1) for y in (-1, 0, 1) for z in (-1, 0, 1)], dtype=np.int64)
+
+
+def unit_vectors(latitudes, longitudes) -> np.ndarray:
+    """
+    Converts coordinates in degrees to 3D unit vectors, so chord length orders points like great circle distance.
+    """
+    lat, lon = np.radians(np.asarray(latitudes, dtype=np.float64)), np.radians(np.asarray(longitudes, dtype=np.float64))
+    return np.stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)], axis=-1)
+
+
+def chord_to_km(chord: np.ndarray) -> np.ndarray:
+    return 2 * EARTH_RADIUS * np.arcsin(np.clip(chord / 2, 0.0, 1.0))
+
+
+class _Grid:
+    """
+    Points bucketed into cubic cells of the given size; every point within one cell
+    size of a query lies in the 27 cells around the query's cell.
+    """
+
+    def __init__(self, vectors: np.ndarray, cell_size: float):
+        self.cell_size = cell_size
+        self.base = int(np.ceil(2 / cell_size)) + 4
+        keys = self._keys(np.floor(vectors / cell_size).astype(np.int64))
+        self.order = np.argsort(keys, kind='stable')
+        self.sorted_keys = keys[self.order]
+
+    def _keys(self, cells: np.ndarray) -> np.ndarray:
+        cells = cells + self.base // 2
+        return (cells[..., 0] * self.base + cells[..., 1]) * self.base + cells[..., 2]
+
+    def candidates(self, queries: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        cells = np.floor(queries / self.cell_size).astype(np.int64)
+        keys = self._keys(cells[:, None, :] + _NEIGHBOUR_OFFSETS[None, :, :]).ravel()
+        starts = np.searchsorted(self.sorted_keys, keys, side='left')
+        counts = np.searchsorted(self.sorted_keys, keys, side='right') - starts
+        total = counts.sum()
+        # Expand every (query, cell) range into the positions it covers
+        offsets = np.repeat(starts - (np.cumsum(counts) - counts), counts) + np.arange(total)
+        owners = np.repeat(np.repeat(np.arange(len(queries)), len(_NEIGHBOUR_OFFSETS)), counts)
+        return owners, self.order[offsets]
+
+
+def _segment_smallest(owners: np.ndarray, values: np.ndarray, items: np.ndarray, n: int, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Picks the k smallest values of each owner, ascending, with ties going to the lowest item.
+    owners must be sorted. k is small, so each owner's minimum is taken k times instead of
+    sorting all candidates.
+    """
+    smallest = np.full((n, k), np.inf)
+    picked = np.full((n, k), -1, dtype=np.int64)
+    if not len(owners):
+        return smallest, picked
+    starts = np.flatnonzero(np.r_[True, owners[1:] != owners[:-1]])
+    present = owners[starts]
+    segments = np.repeat(np.arange(len(starts)), np.diff(np.r_[starts, len(owners)]))
+    values = values.copy()
+    for rank in range(k):
+        minimum = np.minimum.reduceat(values, starts)
+        at_minimum = values == minimum[segments]
+        item = np.minimum.reduceat(np.where(at_minimum, items, np.iinfo(np.int64).max), starts)
+        taken = np.isfinite(minimum)
+        smallest[present[taken], rank] = minimum[taken]
+        picked[present[taken], rank] = item[taken]
+        values[at_minimum & (items == item[segments])] = np.inf
+    return smallest, picked
+
+
+class SpatialIndex:
+    """
+    Nearest-neighbour index over coordinates on the sphere.
+
+    Points are stored as unit vectors. Queries use scipy's cKDTree when scipy is
+    installed; otherwise a multi-level grid answers them with vectorized NumPy, and
+    the few queries with no neighbours in the coarsest grid fall back to a scan.
+    """
+
+    def __init__(self, latitudes, longitudes):
+        self.vectors = unit_vectors(latitudes, longitudes)
+        self.tree = cKDTree(self.vectors) if cKDTree is not None and len(self.vectors) else None
+        self.grids = []
+        if self.tree is None and len(self.vectors):
+            # Facilities cluster on land, so the finest cells are well below the average
+            # spacing; queries in dense regions are then answered from a few candidates
+            cell_size = float(np.sqrt(4 * np.pi / len(self.vectors))) / FINEST_CELL_DIVISOR
+            for _ in range(GRID_LEVELS):
+                self.grids.append(_Grid(self.vectors, cell_size))
+                if cell_size >= 2:
+                    break
+                cell_size *= GRID_LEVEL_FACTOR
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def query(self, latitudes, longitudes, k: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Finds the k nearest points of every query location.
+
+        Args:
+            latitudes (array-like): Query latitudes in degrees.
+            longitudes (array-like): Query longitudes in degrees.
+            k (int): Number of neighbours per query.
+
+        Returns:
+            tuple: (distances, indexes) arrays of shape (n, k), nearest first. Distances are great
+            circle kilometers; missing neighbours (NaN queries, fewer than k points) have NaN and -1.
+        """
+        queries = np.atleast_2d(unit_vectors(latitudes, longitudes))
+        n = len(queries)
+        distances = np.full((n, k), np.nan)
+        indexes = np.full((n, k), -1, dtype=np.int64)
+        valid = np.flatnonzero(~np.isnan(queries).any(axis=1))
+        if not len(valid) or not len(self.vectors):
+            return distances, indexes
+
+        k_found = min(k, len(self.vectors))
+        for start in range(0, len(valid), QUERY_BLOCK_SIZE):
+            rows = valid[start:start + QUERY_BLOCK_SIZE]
+            if self.tree is not None:
+                chords, found = self.tree.query(queries[rows], k=k_found)
+                chords, found = chords.reshape(len(rows), k_found), found.reshape(len(rows), k_found)
+            else:
+                chords, found = self._grid_query(queries[rows], k_found)
+            distances[rows, :k_found] = chord_to_km(chords)
+            indexes[rows, :k_found] = found
+        return distances, indexes
+
+    def _grid_query(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        chords = np.full((len(queries), k), np.inf)
+        found = np.full((len(queries), k), -1, dtype=np.int64)
+        # Upper bound of each query's k-th neighbour distance, known once k candidates were seen
+        bounds = np.full(len(queries), np.inf)
+        pending = np.arange(len(queries))
+        for grid in self.grids:
+            # Queries with a bound wait for the first level whose cells are at least that large
+            selected = pending[(bounds[pending] <= grid.cell_size) | np.isinf(bounds[pending])]
+            if not len(selected):
+                continue
+            owners, candidates = grid.candidates(queries[selected])
+            offsets = queries[selected][owners] - self.vectors[candidates]
+            candidate_chords = np.sqrt(np.einsum('ij,ij->i', offsets, offsets))
+            block_chords, block_found = _segment_smallest(owners, candidate_chords, candidates, len(selected), k)
+            # Exact once the k-th neighbour is within one cell; anything nearer is in the 27 cells
+            resolved = block_chords[:, -1] <= grid.cell_size
+            chords[selected[resolved]] = block_chords[resolved]
+            found[selected[resolved]] = block_found[resolved]
+            bounds[selected] = block_chords[:, -1]
+            pending = np.setdiff1d(pending, selected[resolved], assume_unique=True)
+
+        for row in pending:
+            all_chords = np.linalg.norm(self.vectors - queries[row], axis=1)
+            nearest = np.argpartition(all_chords, k - 1)[:k] if k < len(all_chords) else np.arange(len(all_chords))
+            nearest = nearest[np.lexsort((nearest, all_chords[nearest]))]
+            chords[row], found[row] = all_chords[nearest], nearest
+        return chords, found
+
+
+class FacilityIndex:
+    """
+    Spatial index over the locations of one facility type, with their codes.
+    """
+
+    def __init__(self, facility: str, codes: np.ndarray, latitudes: np.ndarray, longitudes: np.ndarray):
+        self.facility = facility
+        self.codes = codes
+        self.latitudes = np.asarray(latitudes, dtype=np.float64)
+        self.longitudes = np.asarray(longitudes, dtype=np.float64)
+        self.index = SpatialIndex(self.latitudes, self.longitudes)
+
+    def nearest(self, latitudes, longitudes, k: int = 1) -> Dict[str, np.ndarray]:
+        """
+        Finds the k nearest facilities of every query location.
+
+        Args:
+            latitudes (array-like): Query latitudes in degrees.
+            longitudes (array-like): Query longitudes in degrees.
+            k (int): Number of facilities per query.
+
+        Returns:
+            dict: Arrays 'code', 'latitude', 'longitude' and 'distance' (km) of shape (n, k), nearest
+            first; None, NaN where there is no neighbour.
+        """
+        distances, indexes = self.index.query(latitudes, longitudes, k)
+        found = indexes >= 0
+        safe = np.where(found, indexes, 0)
+        return {
+            'code': np.where(found, self.codes[safe], None),
+            'latitude': np.where(found, self.latitudes[safe], np.nan),
+            'longitude': np.where(found, self.longitudes[safe], np.nan),
+            'distance': distances,
+        }
+
+
+def _codes_for_rows(size: int, index: CodeIndex) -> np.ndarray:
+    codes = np.full(size, None, dtype=object)
+    rows, row_codes = index.row_codes()
+    codes[rows] = row_codes
+    return codes
+
+
+def _build_facility_index(facility: str) -> FacilityIndex:
+    if facility == 'airport':
+        airports = load_airport_table(iata_icao_file_path)
+        # Only airports with an IATA code serve scheduled or cargo traffic
+        codes = _codes_for_rows(len(airports), airports.indexes['iata'])
+        rows = np.flatnonzero(codes != None)  # noqa: E711
+        return FacilityIndex(facility, codes[rows], airports.latitudes[rows], airports.longitudes[rows])
+    if facility == 'seaport':
+        codes = np.array(list(SEAPORTS), dtype=object)
+        coordinates = np.array(list(SEAPORTS.values()))
+        return FacilityIndex(facility, codes, coordinates[:, 0], coordinates[:, 1])
+    if facility == 'locode':
+        locodes = load_locode_table(un_locode_file_path)
+        codes = _codes_for_rows(len(locodes), locodes.indexes['locode'])
+        rows = np.flatnonzero(codes != None)  # noqa: E711
+        return FacilityIndex(facility, codes[rows], locodes.latitudes[rows], locodes.longitudes[rows])
+    raise ValueError(f"Unknown facility type: {facility}")
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def load_facility_index(facility: str) -> FacilityIndex:
+    """
+    Returns the spatial index of a facility type, building it once per process.
+
+    Args:
+        facility (str): One of FACILITY_TYPES.
+
+    Returns:
+        FacilityIndex: The shared index.
+    """
+    index = _indexes.get(facility)
+    if index is None:
+        with _indexes_lock:
+            index = _indexes.get(facility)
+            if index is None:
+                index = _build_facility_index(facility)
+                _indexes[facility] = index
+    return index
+
+
+def clear_facility_indexes():
+    """
+    Forgets the spatial indexes so they are built again from the reference data on next use.
+    """
+    with _indexes_lock:
+        _indexes.clear()
+
+
+def hub_snapping_enabled() -> bool:
+    return bool(get_config_value('SNAP_TO_HUBS', False))
+
+
+def snap_to_hubs(latitudes, longitudes, distance_type: str, max_distance: Optional[float] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Moves locations to the nearest hub able to serve legs of the given distance type.
+
+    Args:
+        latitudes (array-like): Latitudes in degrees.
+        longitudes (array-like): Longitudes in degrees.
+        distance_type (str): 'air' snaps to airports, 'sea' to seaports.
+        max_distance (float, optional): Locations farther than this many kilometers from a hub are
+            left as they are; defaults to SNAP_MAX_DISTANCE.
+
+    Returns:
+        tuple: Snapped latitude and longitude arrays and a mask of the locations that were moved.
+    """
+    latitudes = np.asarray(latitudes, dtype=np.float64)
+    longitudes = np.asarray(longitudes, dtype=np.float64)
+    if max_distance is None:
+        max_distance = get_config_value('SNAP_MAX_DISTANCE', DEFAULT_SNAP_MAX_DISTANCE)
+    nearest = load_facility_index(SNAP_FACILITIES[distance_type]).nearest(latitudes, longitudes, 1)
+    snapped = nearest['distance'][:, 0] <= max_distance
+    return (np.where(snapped, nearest['latitude'][:, 0], latitudes),
+            np.where(snapped, nearest['longitude'][:, 0], longitudes), snapped)
+
+
+def is_raw_location(location: dict) -> bool:
+    """
+    True for locations given as coordinates or an address rather than a LOCODE or airport code,
+    which are the locations hub snapping moves.
+    """
+    return not (location.get('locode') or {}).get('locode') and not location.get('airport_code')
+
+
+def snap_location(location: dict, coordinates: Tuple[float, float], distance_type: str) -> Tuple[float, float]:
+    """
+    Snaps the resolved coordinates of a single route endpoint when SNAP_TO_HUBS is enabled.
+
+    Args:
+        location (dict): The endpoint as given in the route.
+        coordinates (tuple): Its resolved (latitude, longitude).
+        distance_type (str): The distance type of the leg.
+
+    Returns:
+        tuple: The coordinates of the nearest hub, or the given coordinates when the endpoint is
+        a LOCODE or airport code, the leg is not air or sea, or no hub is within SNAP_MAX_DISTANCE.
+    """
+    if distance_type not in SNAP_FACILITIES or not hub_snapping_enabled() or not is_raw_location(location):
+        return coordinates
+    latitudes, longitudes, _ = snap_to_hubs([coordinates[0]], [coordinates[1]], distance_type)
+    return float(latitudes[0]), float(longitudes[0])
+
+
+if __name__ == "__main__":
+    # Example usage: nearest airports and seaports of a few warehouses
+    latitudes = [52.37, 48.86, 31.23]
+    longitudes = [4.90, 2.35, 121.47]
+    for facility in ('airport', 'seaport'):
+        nearest = load_facility_index(facility).nearest(latitudes, longitudes, k=3)
+        print(facility, nearest['code'].tolist(), np.round(nearest['distance'], 1).tolist())
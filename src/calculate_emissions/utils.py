@@ -1,8 +1,62 @@
+import os
+import re
+import logging
 import numpy as np
-import requests
 import pandas as pd
-from typing import Optional
+from typing import Optional, Tuple
 
+try:
+    from mapbox_client import get_mapbox_client
+    from reference_data import load_locode_table, load_airport_table, load_emission_factor_table
+    from great_circle import haversine, haversine_array, great_circle_distance
+    from factor_registry import get_factor_registry, emission_factors_file_path as bundled_emission_factors_file_path
+    from instrumentation import instrumentation, timer
+    from country_codes import normalize_country_code
+except ImportError:
+    from calculate_emissions.mapbox_client import get_mapbox_client
+    from calculate_emissions.reference_data import load_locode_table, load_airport_table, load_emission_factor_table
+    from calculate_emissions.great_circle import haversine, haversine_array, great_circle_distance
+    from calculate_emissions.factor_registry import get_factor_registry, emission_factors_file_path as bundled_emission_factors_file_path
+    from calculate_emissions.instrumentation import instrumentation, timer
+    from calculate_emissions.country_codes import normalize_country_code
+
+logger = logging.getLogger(__name__)
+
+
+def _degrees_minutes_to_decimal(degree_min_str: str, max_degrees: float = 180) -> float:
+    """
+    Converts a degree minute string (e.g., '4042N') to decimal degrees.
+
+    Args:
+        degree_min_str (str): The degree minute string to convert.
+        max_degrees (float): The largest absolute value allowed, 90 for a latitude and 180 for a longitude.
+
+    Returns:
+        float: The decimal degree value.
+
+    Raises:
+        ValueError: If the minutes are 60 or more, or the value is out of range.
+    """
+    degrees = int(degree_min_str[:-3])
+    minutes = int(degree_min_str[-3:-1])
+    direction = degree_min_str[-1]
+
+    decimal_degrees = degrees + minutes / 60
+    if minutes >= 60 or decimal_degrees > max_degrees:
+        raise ValueError(f"Coordinate '{degree_min_str}' is out of range")
+
+    if direction in ['S', 'W']:
+        decimal_degrees = -decimal_degrees
+
+    return decimal_degrees
+
+
+# Layout of the UN/LOCODE coordinates ('DDMMH DDDMMH'), parsed column-wise by parse_coordinates_array;
+# the pattern also accepts other spacings and degree widths
+_COORDINATES_WIDTH = 12
+_LATITUDE_DIGITS = [0, 1, 2, 3]
+_LONGITUDE_DIGITS = [6, 7, 8, 9, 10]
+_COORDINATES_PATTERN = re.compile(r'(\d+)(\d\d)([NS]) +(\d+)(\d\d)([EW])')
 
 
 def parse_coordinates(coord_str):
@@ -14,45 +68,97 @@ def parse_coordinates(coord_str):
     
     Returns:
         tuple: A tuple containing latitude and longitude in decimal degrees.
+
+    Raises:
+        ValueError: If the string is malformed or the coordinates are out of range.
     """
     coord_str = str(coord_str).strip()  # Ensure the input is a string and strip any extra whitespace
 
-    try:
-        # Split the string based on whitespace and filter out any empty strings
-        parts = list(filter(None, coord_str.split(' ')))
-        lat_str = parts[0]
-        lon_str = parts[1]
-        
-    except ValueError as e:
-        raise ValueError(f"Input should be in the format '4042N 07400W', got '{coord_str}'") from e
+    match = _COORDINATES_PATTERN.fullmatch(coord_str)
+    if match is None:
+        raise ValueError(f"Input should be in the format '4042N 07400W', got '{coord_str}'")
+    lat_degrees, lat_minutes, lat_direction, lon_degrees, lon_minutes, lon_direction = match.groups()
 
-    def convert_to_decimal(degree_min_str):
-        """
-        Converts a degree minute string (e.g., '4042N') to decimal degrees.
-        
-        Args:
-            degree_min_str (str): The degree minute string to convert.
-        
-        Returns:
-            float: The decimal degree value.
-        """
-        degrees = int(degree_min_str[:-3])
-        minutes = int(degree_min_str[-3:-1])
-        direction = degree_min_str[-1]
-        
-        decimal_degrees = degrees + minutes / 60
-        
-        if direction in ['S', 'W']:
-            decimal_degrees = -decimal_degrees
-        
-        return decimal_degrees
-    
-    latitude = convert_to_decimal(lat_str)
-    longitude = convert_to_decimal(lon_str)
+    latitude = _degrees_minutes_to_decimal(lat_degrees + lat_minutes + lat_direction, 90)
+    longitude = _degrees_minutes_to_decimal(lon_degrees + lon_minutes + lon_direction, 180)
     
     return latitude, longitude
 
 
+def parse_coordinates_array(coord_strs) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Parses a column of coordinates in the format '4042N 07400W' to decimal degrees.
+
+    Strings in the UN/LOCODE layout are decoded with array operations on their
+    code points; other spacings and degree widths go through a regular expression.
+    Valid strings give exactly the values of parse_coordinates. Empty, missing or
+    malformed entries (including a hemisphere letter that is missing or on the
+    wrong axis, minutes of 60 or more, and latitudes beyond 90 or longitudes
+    beyond 180 degrees) are NaN instead of raising.
+
+    Args:
+        coord_strs (array-like): The coordinate strings; None and NaN count as missing.
+
+    Returns:
+        tuple: Latitude and longitude arrays in decimal degrees, and a boolean validity mask.
+    """
+    values = np.asarray(coord_strs)
+    if values.dtype.kind != 'U':
+        values = np.asarray(coord_strs, dtype=object)
+        values = np.where(pd.isna(values), '', values).astype(str)
+    values = np.char.strip(values)
+    n = len(values)
+    latitudes = np.full(n, np.nan)
+    longitudes = np.full(n, np.nan)
+    if n == 0:
+        return latitudes, longitudes, np.zeros(0, dtype=bool)
+
+    # One row per character position, holding that character of every string; code points
+    # above 255 are clipped as they can never be digits, hemisphere letters or spaces
+    width = values.dtype.itemsize // 4
+    chars = np.zeros((_COORDINATES_WIDTH, n), dtype=np.uint8)
+    columns = min(width, _COORDINATES_WIDTH)
+    chars[:columns] = np.minimum(values.view(np.uint32).reshape(n, width)[:, :columns].T, 255)
+    # Characters below '0' wrap around, so a single bound checks for digits
+    digits = chars - np.uint8(ord('0'))
+
+    valid = (np.char.str_len(values) == _COORDINATES_WIDTH) & (chars[5] == ord(' '))
+    for position in _LATITUDE_DIGITS + _LONGITUDE_DIGITS:
+        valid &= digits[position] <= 9
+    lat_hemisphere = chars[4]
+    lon_hemisphere = chars[11]
+    valid &= (lat_hemisphere == ord('N')) | (lat_hemisphere == ord('S'))
+    valid &= (lon_hemisphere == ord('E')) | (lon_hemisphere == ord('W'))
+
+    # Same operations as _degrees_minutes_to_decimal: integer degrees plus minutes / 60
+    lat_digits = digits[_LATITUDE_DIGITS][:, valid].astype(np.int64)
+    lon_digits = digits[_LONGITUDE_DIGITS][:, valid].astype(np.int64)
+    lat_minutes = lat_digits[2] * 10 + lat_digits[3]
+    lon_minutes = lon_digits[3] * 10 + lon_digits[4]
+    latitude = (lat_digits[0] * 10 + lat_digits[1]) + lat_minutes / 60
+    longitude = (lon_digits[0] * 100 + lon_digits[1] * 10 + lon_digits[2]) + lon_minutes / 60
+    latitudes[valid] = np.where(lat_hemisphere[valid] == ord('S'), -latitude, latitude)
+    longitudes[valid] = np.where(lon_hemisphere[valid] == ord('W'), -longitude, longitude)
+    # Same range checks as _degrees_minutes_to_decimal
+    valid[valid] = (lat_minutes < 60) & (lon_minutes < 60) & (latitude <= 90) & (longitude <= 180)
+    latitudes[~valid] = np.nan
+    longitudes[~valid] = np.nan
+
+    for row in np.flatnonzero(~valid & (values != '')):
+        match = _COORDINATES_PATTERN.fullmatch(values[row])
+        if match is None:
+            continue
+        lat_degrees, lat_minutes, lat_direction, lon_degrees, lon_minutes, lon_direction = match.groups()
+        try:
+            latitude = _degrees_minutes_to_decimal(lat_degrees + lat_minutes + lat_direction, 90)
+            longitude = _degrees_minutes_to_decimal(lon_degrees + lon_minutes + lon_direction, 180)
+        except ValueError:
+            continue
+        latitudes[row], longitudes[row], valid[row] = latitude, longitude, True
+
+    return latitudes, longitudes, valid
+
+
 def get_coordinates_from_locode(locode: str, un_locodes_csv_path: str):
     """
     Fetches the geographic coordinates for a given UN/LOCODE from a CSV file.
@@ -65,29 +171,38 @@ def get_coordinates_from_locode(locode: str, un_locodes_csv_path: str):
         tuple: A tuple containing the latitude and longitude of the location.
     """
     try:
-        # Load the CSV file into a DataFrame
-        df = pd.read_csv(un_locodes_csv_path, encoding = 'utf-8')
-
-        # Fetch location by LOCODE from the DataFrame
-        location = df[df['locode'] == locode]
-        if not location.empty:
-            coord_str = location['coordinates'].values[0]
-            return parse_coordinates(coord_str)
+        # Fetch location by LOCODE from the preloaded index
+        coordinates = load_locode_table(un_locodes_csv_path).get('locode', locode)
+        if coordinates is not None:
+            return coordinates
         else:
             raise ValueError(f"Coordinates not found for LOCODE: {locode}")
     except Exception as e:
         raise RuntimeError(f"An error occurred while fetching coordinates for LOCODE {locode}: {e}")
 
+def address_query(address: dict) -> str:
+    """
+    Builds the Mapbox geocoding query for an address.
+
+    Args:
+        address (dict): The address with optional 'street_line1', 'city', 'postcode' and 'country_code'.
+
+    Returns:
+        str: The comma separated query.
+    """
+    return ', '.join(filter(None, [address.get('street_line1'), address.get('city'), address.get('postcode'), address.get('country_code')]))
+
 def get_coordinates_from_address(address: dict):
-    query = ', '.join(filter(None, [address.get('street_line1'), address.get('city'), address.get('postcode'), address.get('country_code')]))
-    url = f"https://api.mapbox.com/geocoding/v5/mapbox.places/{query}.json?access_token={MAPBOX_ACCESS_TOKEN}"
-    response = requests.get(url)
-    response_data = response.json()
+    """
+    Geocodes an address using the Mapbox Geocoding API.
+
+    Args:
+        address (dict): The address with optional 'street_line1', 'city', 'postcode' and 'country_code'.
 
-    if response_data['features']:
-        coordinates = response_data['features'][0]['geometry']['coordinates']
-        return coordinates[1], coordinates[0]  # return as (lat, lon)
-    return (0.0, 0.0)
+    Returns:
+        tuple: The (latitude, longitude) of the best match, or (0.0, 0.0) if nothing matched.
+    """
+    return get_mapbox_client().geocode(address_query(address))
 
 def get_coordinates_from_airport_code(airport_code: str, iata_icao_csv_path: str):
     """
@@ -101,25 +216,21 @@ def get_coordinates_from_airport_code(airport_code: str, iata_icao_csv_path: str
         tuple: A tuple containing the latitude and longitude of the airport.
     """
     try:
-        # Load the CSV file into a DataFrame
-        df = pd.read_csv(iata_icao_csv_path, encoding = 'utf-8')
+        airports = load_airport_table(iata_icao_csv_path)
 
-        # Determine the appropriate column to search based on the length of the airport code
+        # Determine the appropriate index to search based on the length of the airport code
         if len(airport_code) == 3:
-            # Search in the IATA column
-            location = df[df['iata'] == airport_code]
+            # Search in the IATA index
+            coordinates = airports.get('iata', airport_code)
         elif len(airport_code) == 4:
-            # Search in the ICAO column
-            location = df[df['icao'] == airport_code]
+            # Search in the ICAO index
+            coordinates = airports.get('icao', airport_code)
         else:
             raise ValueError(f"Invalid airport code length for code: {airport_code}")
 
         # Check if the location was found
-        if not location.empty:
-            # Fetch the latitude and longitude
-            latitude = location['latitude'].values[0]
-            longitude = location['longitude'].values[0]
-            return float(latitude), float(longitude)
+        if coordinates is not None:
+            return coordinates
         else:
             raise ValueError(f"Coordinates not found for airport code: {airport_code}")
     
@@ -127,16 +238,37 @@ def get_coordinates_from_airport_code(airport_code: str, iata_icao_csv_path: str
         raise RuntimeError(f"An error occurred while fetching coordinates for airport code {airport_code}: {e}")
 
 def get_coordinates(location: dict, un_locode_file_path: str, iata_icao_file_path: str):
+    start = timer() if instrumentation.enabled else None
     if location.get('locode') and location['locode'].get('locode'):
-        return get_coordinates_from_locode(location['locode']['locode'], un_locode_file_path)
+        kind, coordinates = 'locode', get_coordinates_from_locode(location['locode']['locode'], un_locode_file_path)
     elif location.get('coordinates') and location['coordinates'].get('lat') and location['coordinates'].get('lon'):
-        return (location['coordinates']['lat'], location['coordinates']['lon'])
+        kind, coordinates = 'coordinates', (location['coordinates']['lat'], location['coordinates']['lon'])
     elif location.get('address'):
-        return get_coordinates_from_address(location['address'])
+        kind, coordinates = 'address', get_coordinates_from_address(location['address'])
     elif location.get('airport_code'):
-        return get_coordinates_from_airport_code(location['airport_code'], iata_icao_file_path)
+        kind, coordinates = 'airport_code', get_coordinates_from_airport_code(location['airport_code'], iata_icao_file_path)
     else:
-        return (0.0, 0.0)
+        kind, coordinates = 'none', (0.0, 0.0)
+    if start is not None:
+        instrumentation.stage('coordinates', kind, timer() - start)
+    return coordinates
+
+def get_country_code(location: dict):
+    """
+    Returns the ISO country code of a location when it can be told without a lookup.
+
+    Args:
+        location (dict): The location, as accepted by get_coordinates.
+
+    Returns:
+        str: The ISO alpha-2 country code from the LOCODE prefix or the address (alpha-3 codes are
+        converted, see normalize_country_code), or None.
+    """
+    if location.get('locode') and location['locode'].get('locode'):
+        return normalize_country_code(location['locode']['locode'][:2])
+    elif location.get('address') and location['address'].get('country_code'):
+        return normalize_country_code(location['address']['country_code'])
+    return None
     
 def convert_distance_to_km(distance: float, unit: str):
     if unit == 'mi':
@@ -147,8 +279,12 @@ def convert_distance_to_km(distance: float, unit: str):
 
 def determine_distance_type(method: dict, emission_factors_file_path: str):
     try:
-        # Load the Excel file
-        df = pd.read_excel(emission_factors_file_path, sheet_name='emission_factors')
+        # The bundled workbook is served by the active dataset of the factor registry, so
+        # methods added by a newer dataset get their distance type too
+        if os.path.abspath(emission_factors_file_path) == os.path.abspath(bundled_emission_factors_file_path):
+            emission_factors = get_factor_registry().active.table
+        else:
+            emission_factors = load_emission_factor_table(emission_factors_file_path)
         
         # Extract the provided method or vessel_type
         method_key = method.get('method') or method.get('vessel_type')
@@ -160,17 +296,17 @@ def determine_distance_type(method: dict, emission_factors_file_path: str):
         if 'plane' in method_key:
             return 'air'
         
-        # Look for the provided method in the DataFrame
-        result = df.loc[df['method'] == method_key, 'distance_calculation_method']
+        # Look for the provided method in the compiled table
+        distance_type = emission_factors.distance_types.get(method_key)
         
         # If a match is found, return the value
-        if not result.empty:
-            return result.values[0]
+        if distance_type is not None:
+            return distance_type
         
         # If no match is found, return None or raise an error
         return None
     except Exception as e:
-        print(f"Error: {e}")
+        logger.warning("Could not determine the distance type: %s", e)
         return None
 
 def calculate_land_distance(source_coordinates, destination_coordinates):
@@ -184,60 +320,35 @@ def calculate_land_distance(source_coordinates, destination_coordinates):
     Returns:
         float: The distance in kilometers.
     """
-    lat1, lon1 = source_coordinates
-    lat2, lon2 = destination_coordinates
-    
-    url = f"https://api.mapbox.com/directions/v5/mapbox/driving/{lon1},{lat1};{lon2},{lat2}"
-    params = {
-        'access_token': MAPBOX_ACCESS_TOKEN,
-        'geometries': 'geojson',
-        'overview': 'full'
-    }
-    
-    response = requests.get(url, params=params)
-    response_data = response.json()
-    
-    if 'routes' in response_data and len(response_data['routes']) > 0:
-        distance_meters = response_data['routes'][0]['distance']
-        distance_kilometers = distance_meters / 1000  # Convert meters to kilometers
-        return distance_kilometers
-    else:
-        raise ValueError("Unable to calculate distance using Mapbox API")
+    return get_mapbox_client().route_distance(source_coordinates, destination_coordinates)
 
 def calculate_air_distance(source_coordinates, destination_coordinates):
     """
     Calculates the great circle distance between two sets of coordinates using the Haversine formula.
+
+    Single coordinates take the scalar path of great_circle.py, arrays the vectorized one;
+    both return identical distances.
     
     Args:
         source_coordinates (tuple): The (latitude, longitude) of the source location.
         destination_coordinates (tuple): The (latitude, longitude) of the destination location.
     
     Returns:
-        float: The distance in kilometers.
+        float: The distance in kilometers (an array when arrays of coordinates are given).
     """
     lat1, lon1 = source_coordinates
     lat2, lon2 = destination_coordinates
-    R = 6371.0  # Earth radius in kilometers
-    
-    lat1, lon1, lat2, lon2 = map(np.radians, [lat1, lon1, lat2, lon2])
-    
-    dlat = lat2 - lat1
-    dlon = lon2 - lon1
-    
-    a = np.sin(dlat / 2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2)**2
-    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
-    
-    distance = R * c
-    return distance
+    if isinstance(lat1, (int, float)) and isinstance(lon1, (int, float)) and isinstance(lat2, (int, float)) and isinstance(lon2, (int, float)):
+        return haversine(lat1, lon1, lat2, lon2)
+    return haversine_array(lat1, lon1, lat2, lon2)
 
 def calculate_sea_distance(source_coordinates, destination_coordinates):
     """
-    Calculates the sea distance between two sets of coordinates.
+    Estimates the sea distance between two sets of coordinates.
 
-    For now, this function calculates the air distance (great circle distance) between 
-    the source and destination coordinates and multiplies it by 2 as a placeholder.
-    In the future, this function needs to be updated to calculate the distance based on 
-    sea routes.
+    This is the air distance (great circle distance) between the source and destination
+    coordinates multiplied by 2. It is the fallback for sea legs that the sea routing
+    graph in sea_routing.py cannot route.
 
     Args:
         source_coordinates (tuple): The (latitude, longitude) of the source location.
@@ -246,5 +357,6 @@ def calculate_sea_distance(source_coordinates, destination_coordinates):
     Returns:
         float: The estimated sea distance in kilometers.
     """
-    distance = calculate_air_distance(source_coordinates, destination_coordinates) * 2
+    # Repeated lanes are answered from the great circle memo
+    distance = great_circle_distance(source_coordinates, destination_coordinates) * 2
     return distance
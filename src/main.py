@@ -1,56 +1,48 @@
 import os
-import json
 import sys
 from typing import Dict
 
 # Ensure the 'src' directory is in sys.path for module imports
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
 
-from calculate_emissions.calculate_mass import calculate_shipment_mass
-from calculate_emissions.calculate_distance import calculate_distance
-from calculate_emissions.calculate_emission_factor import get_emission_factor
+from calculate_emissions.shipment import calculate_shipment
+from calculate_emissions.batch import calculate_emissions_batch
+from calculate_emissions.journey import calculate_journey, calculate_journeys
+from calculate_emissions.result import EmissionResult, dumps
+from calculate_emissions.instrumentation import instrumentation
 
-def calculate_emissions(shipping_data: Dict):
+def calculate_emissions(shipping_data: Dict, as_json: bool = True, factor_version: str = None):
     """
     Calculate the emissions for a given shipment based on the provided data.
 
     Parameters:
-    - shipping_data (Dict): A dictionary containing shipment details.
+    - shipping_data (Dict): A dictionary containing shipment details. A 'journey' list of legs
+      and hubs is calculated as a multi-leg journey (see calculate_emissions.journey).
+    - as_json (bool): Return the result serialized as an indented JSON string (default). When False
+      the EmissionResult is returned as is and can be serialized on demand with to_json or to_dict.
+    - factor_version (str, optional): The emission factor dataset to use. By default the dataset
+      that applied on 'shipped_at' is used, or the active one (see calculate_emissions.factor_registry).
 
     Returns:
-    - str: A JSON string representing the calculated emissions and related data.
+    - str or EmissionResult: The calculated emissions and related data (a dict for journeys).
     """
     try:
-        # Calculate the shipment mass
-        shipment_mass = calculate_shipment_mass(shipping_data['shipment'])
+        # Multi-leg journeys are calculated leg by leg, plus their hubs
+        if 'journey' in shipping_data:
+            result = calculate_journey(shipping_data, factor_version)
+            return dumps(result, compact=False) if as_json else result
 
-        # Calculate the distance
-        route = shipping_data['route']
-        method = shipping_data['method']
-        distance, distance_calculation_method = calculate_distance(route, method)
-
-        # Get the emission factor
-        country_code = shipping_data.get('country_code')
-        emission_factor, emission_factor_calculation_method = get_emission_factor(method, distance, country_code)
-
-        # Calculate emissions
-        emissions = shipment_mass * distance * emission_factor
-
-        # Prepare the output dictionary
-        output_data = {
-            "emissions": emissions,
-            "shipment_mass": shipment_mass,
-            "distance": distance,
-            "distance_calculation_method": distance_calculation_method,
-            "emission_factor": emission_factor,
-            "emission_factor_calculation_method": emission_factor_calculation_method
-        }
+        result = calculate_shipment(shipping_data, factor_version)
 
         # Convert the output data to JSON format
-        return json.dumps(output_data, indent=4)
+        return dumps(result.as_flat_dict(), compact=False) if as_json else result
     except KeyError as e:
+        if instrumentation.enabled:
+            instrumentation.error(f"Required data is missing: {e}")
         raise ValueError(f"Required data is missing: {e}")
     except Exception as e:
+        if instrumentation.enabled:
+            instrumentation.error(str(e))
         raise ValueError(f"An error occurred while calculating emissions: {e}")
 
 if __name__ == "__main__":
@@ -0,0 +1,74 @@
+import os
+import sys
+
+import pytest
+
+# Hermetic runs: no config file, no Mapbox cache file, land legs by great circle
+src_dir = os.path.join(os.path.dirname(__file__), '..', 'src')
+sys.path.insert(0, os.path.abspath(src_dir))
+# The local Mapbox stub of the benchmarks
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'benchmarks')))
+# Worker processes of the parallel executor import the package too
+os.environ['PYTHONPATH'] = os.pathsep.join(filter(None, [os.path.abspath(src_dir), os.environ.get('PYTHONPATH')]))
+os.environ['CALCULATE_EMISSIONS_CONFIG'] = os.devnull
+os.environ['LAND_DISTANCE_MODE'] = 'offline'
+os.environ['MAPBOX_CACHE_PATH'] = ''
+
+
+@pytest.fixture
+def factor_registry():
+    """
+    The process-wide factor registry, built again after the test so datasets it registers do not leak.
+    """
+    from calculate_emissions.factor_registry import get_factor_registry, reset_factor_registry
+    reset_factor_registry()
+    yield get_factor_registry()
+    reset_factor_registry()
+
+
+@pytest.fixture
+def register_scaled(factor_registry):
+    """
+    Registers a copy of the bundled factors scaled by a factor: register_scaled(version, methods=None, factor=2,
+    activate=False) multiplies the emission factors of the given methods (every method by default).
+    """
+    import pandas as pd
+    from calculate_emissions.factor_registry import SHEETS, emission_factors_file_path
+    sheets = pd.read_excel(emission_factors_file_path, sheet_name=list(SHEETS))
+
+    def register(version, methods=None, factor=2, activate=False):
+        factors = sheets['emission_factors'].copy()
+        scaled = factors['method'].isin(methods) if methods is not None else slice(None)
+        factors.loc[scaled, 'emission_factor'] *= factor
+        return factor_registry.register(version, factors, sheets['electricity_intensity'], activate=activate)
+
+    return register
+
+
+@pytest.fixture
+def doubled_factors(register_scaled):
+    """
+    Registers and activates 'doubled', the bundled factors multiplied by two.
+    """
+    return register_scaled('doubled', activate=True)
+
+
+@pytest.fixture
+def mapbox_stub():
+    """
+    A local Mapbox stub answering without latency.
+    """
+    from mapbox_stub import MapboxStub
+    with MapboxStub(latency=0.0) as stub:
+        yield stub
+
+
+@pytest.fixture
+def mapbox_client(mapbox_stub):
+    """
+    A Mapbox client of the stub, without a cache and with short backoffs.
+    """
+    from calculate_emissions.mapbox_client import MapboxClient
+    client = MapboxClient('token', mapbox_stub.url, requests_per_minute=60_000, backoff=0.01)
+    yield client
+    client.close()
@@ -0,0 +1,100 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from calculate_emissions import batch
+from calculate_emissions.batch import calculate_emissions_batch
+from calculate_emissions.batch_planner import BatchPlan, plan_batch
+from calculate_emissions.engine import get_engine
+
+
+def _versions(df):
+    return np.full(len(df), 'bundled', dtype=object)
+
+
+def _assert_plan_does_not_change_results(df, monkeypatch):
+    planned = calculate_emissions_batch(df)
+    with monkeypatch.context() as patch:
+        # Every row its own key, so each shipment is calculated on its own
+        patch.setattr(batch, 'plan_batch', lambda df, versions, failed=None: BatchPlan(np.arange(len(df), dtype=np.uint64)))
+        unplanned = calculate_emissions_batch(df)
+    pd.testing.assert_frame_equal(planned, unplanned)
+    return planned
+
+
+@pytest.fixture
+def geocoding(mapbox_stub, monkeypatch):
+    """
+    Geocodes addresses with the local Mapbox stub.
+    """
+    monkeypatch.setenv('MAPBOX_API_URL', mapbox_stub.url)
+    monkeypatch.setenv('MAPBOX_ACCESS_TOKEN', 'token')
+    get_engine().reset()
+    yield mapbox_stub
+    monkeypatch.undo()
+    get_engine().reset()
+
+
+def test_locode_endpoints_ignore_stray_coordinates(monkeypatch):
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({
+        'mass_amount': np.arange(1.0, 7.0) * 1000,
+        'source_locode': ['NLRTM'] * 6,
+        'source_lat': rng.uniform(-60, 60, 6),
+        'source_lon': rng.uniform(-180, 180, 6),
+        'destination_locode': ['DEHAM'] * 3 + ['SGSIN'] * 3,
+        'destination_airport_code': ['JFK', None, 'SFO', None, 'LAX', None],
+        'method': ['container_ship'] * 6,
+    })
+    assert plan_batch(df, _versions(df)).unique == 2
+    results = _assert_plan_does_not_change_results(df, monkeypatch)
+    assert results['error'].isna().all()
+    assert results['distance'].nunique() == 2
+
+
+def test_provided_distances_are_planned_by_distance(monkeypatch):
+    df = pd.DataFrame({
+        'mass_amount': [1000.0, 2000.0, 3000.0, 4000.0, 5000.0],
+        'distance': [500.0, '500', 500, 0.0, 0.0],
+        'distance_unit': ['km'] * 5,
+        'source_locode': ['NLRTM', 'DEHAM', None, 'NLRTM', 'NLRTM'],
+        'destination_locode': ['USNYC', None, 'SGSIN', 'DEHAM', 'SGSIN'],
+        'method': ['container_ship'] * 5,
+    })
+    # A distance of 0 is not provided, so those rows are planned by their endpoints
+    assert plan_batch(df, _versions(df)).unique == 3
+    results = _assert_plan_does_not_change_results(df, monkeypatch)
+    assert results['distance'].tolist()[:3] == [500.0] * 3
+    assert results['distance'][3] != results['distance'][4]
+
+
+def test_structured_addresses_match_whatever_their_key_order(geocoding, monkeypatch):
+    hamburg = {'street_line1': 'Am Sandtorkai 1', 'city': 'Hamburg', 'postcode': '20457', 'country_code': 'DE'}
+    df = pd.DataFrame({
+        'mass_amount': [1000.0, 2000.0, 3000.0],
+        'source_address': [hamburg, dict(reversed(list(hamburg.items()))), {'city': 'Bremen', 'country_code': 'DE'}],
+        'destination_locode': ['DEMUC'] * 3,
+        'method': ['diesel_truck'] * 3,
+    })
+    assert plan_batch(df, _versions(df)).unique == 2
+    results = _assert_plan_does_not_change_results(df, monkeypatch)
+    assert results['error'].isna().all()
+    assert results['distance'][0] == results['distance'][1] != results['distance'][2]
+
+
+def test_dedup_ratio_counts_rows_per_calculation(monkeypatch):
+    lanes = pd.DataFrame({
+        'source_locode': ['NLRTM', 'DEHAM', None],
+        'destination_locode': ['USNYC', 'NLRTM', None],
+        'source_airport_code': [None, None, 'JFK'],
+        'destination_airport_code': [None, None, 'SFO'],
+        'method': ['container_ship', 'container_ship', 'cargo_plane'],
+    })
+    df = pd.concat([lanes] * 4, ignore_index=True)
+    df['mass_amount'] = np.arange(1.0, 13.0) * 100
+
+    plan = plan_batch(df, _versions(df))
+    assert (plan.rows, plan.unique, plan.dedup_ratio) == (12, 3, 4.0)
+    np.testing.assert_array_equal(plan.unique_rows, [0, 1, 2])
+    np.testing.assert_array_equal(plan.inverse, np.tile([0, 1, 2], 4))
+    _assert_plan_does_not_change_results(df, monkeypatch)
@@ -0,0 +1,10 @@
+import run
+
+
+def test_regression_check_fails_without_a_baseline(tmp_path, capsys):
+    output = tmp_path / 'results.json'
+    status = run.main(['--fail-on-regression', '--baseline', str(tmp_path / 'baseline.json'), '-o', str(output)])
+
+    assert status == 2
+    assert not output.exists()
+    assert '--save-baseline' in capsys.readouterr().err
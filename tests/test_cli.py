@@ -0,0 +1,23 @@
+import io
+import json
+
+import pandas as pd
+
+from calculate_emissions.cli import process_chunk, read_ndjson_chunks
+
+SHIPMENT = {'id': 'a', 'shipment': {'mass': {'amount': 1000.0, 'unit': 'kg'}},
+            'route': {'source': {'airport_code': 'JFK'}, 'destination': {'airport_code': 'SFO'}},
+            'method': {'method': 'cargo_plane'}}
+JOURNEY = {'id': 'b', 'shipment': {'mass': {'amount': 1000.0, 'unit': 'kg'}},
+           'journey': [{'route': {'source': {'airport_code': 'JFK'}, 'destination': {'airport_code': 'SFO'}},
+                        'method': {'method': 'cargo_plane'}}]}
+
+
+def test_journey_records_are_rejected_explicitly():
+    stream = io.StringIO(json.dumps(SHIPMENT) + '\n' + json.dumps(JOURNEY) + '\n')
+    (chunk, parse_errors), = read_ndjson_chunks(stream, 10)
+    results = process_chunk(chunk, parse_errors, 'id')
+
+    assert results['id'].tolist() == ['a', 'b']
+    assert results.loc[0, 'emissions'] > 0 and pd.isna(results.loc[0, 'error'])
+    assert results.loc[1, 'error'] == "Journeys are not supported by the CLI, use calculate_journeys"
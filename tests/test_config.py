@@ -0,0 +1,42 @@
+import pytest
+
+from calculate_emissions.config import get_config_value, load_config, reset_config
+
+
+@pytest.fixture
+def config(monkeypatch):
+    """
+    Loads the configuration again after the test sets its environment overrides.
+    """
+    reset_config()
+    yield monkeypatch
+    monkeypatch.undo()
+    reset_config()
+
+
+def test_environment_overrides_take_the_type_of_their_default(config):
+    config.setenv('SNAP_TO_HUBS', 'yes')
+    config.setenv('SNAP_MAX_DISTANCE', '250')
+    config.setenv('GREAT_CIRCLE_CACHE_MAX_ENTRIES', '1000')
+    config.setenv('ROAD_DETOUR_FACTORS', '{"DE": 1.25}')
+    config.setenv('EMISSION_FACTOR_DATASETS', '[]')
+    config.setenv('MAPBOX_API_URL', 'http://localhost:1')
+    assert get_config_value('SNAP_TO_HUBS') is True
+    assert get_config_value('SNAP_MAX_DISTANCE') == 250.0 and isinstance(get_config_value('SNAP_MAX_DISTANCE'), float)
+    assert get_config_value('GREAT_CIRCLE_CACHE_MAX_ENTRIES') == 1000
+    assert get_config_value('ROAD_DETOUR_FACTORS') == {'DE': 1.25}
+    assert get_config_value('EMISSION_FACTOR_DATASETS') == []
+    assert get_config_value('MAPBOX_API_URL') == 'http://localhost:1'
+
+
+def test_empty_overrides_fall_back_to_the_default(config):
+    config.setenv('SNAP_MAX_DISTANCE', '')
+    assert get_config_value('SNAP_MAX_DISTANCE', 500.0) == 500.0
+
+
+@pytest.mark.parametrize('key, value', [('SNAP_TO_HUBS', 'maybe'), ('SNAP_MAX_DISTANCE', 'far'),
+                                        ('MAPBOX_TIMEOUT', 'true'), ('ROAD_DETOUR_FACTORS', '[1.25]')])
+def test_invalid_overrides_fail_on_load(config, key, value):
+    config.setenv(key, value)
+    with pytest.raises(ValueError, match=key):
+        load_config()
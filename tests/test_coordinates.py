@@ -0,0 +1,46 @@
+import math
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from calculate_emissions.utils import parse_coordinates, parse_coordinates_array
+
+LOCODE_CSV = os.path.join(os.path.dirname(__file__), '..', 'src', 'data', 'un_locode.csv')
+
+
+def _scalar(coord_str):
+    try:
+        return parse_coordinates(coord_str)
+    except ValueError:
+        return math.nan, math.nan
+
+
+def test_array_parser_matches_scalar_parser_on_locode_table():
+    coordinates = pd.read_csv(LOCODE_CSV, usecols=['coordinates'], dtype=str,
+                              keep_default_na=False)['coordinates'].to_numpy(dtype=str)
+    coordinates = coordinates[coordinates != '']
+    latitudes, longitudes, valid = parse_coordinates_array(coordinates)
+    expected = np.array([_scalar(value) for value in coordinates])
+
+    np.testing.assert_array_equal(valid, ~np.isnan(expected[:, 0]))
+    np.testing.assert_array_equal(latitudes, expected[:, 0])
+    np.testing.assert_array_equal(longitudes, expected[:, 1])
+    assert np.all(np.abs(latitudes[valid]) <= 90) and np.all(np.abs(longitudes[valid]) <= 180)
+
+
+@pytest.mark.parametrize('coord_str', ['4829N 38150E', '2946S 31219E', '3313N 06883E', '9130N 00000E',
+                                       '4060N 07400W', '40 60N 074 00W'])
+def test_out_of_range_coordinates_are_rejected(coord_str):
+    with pytest.raises(ValueError):
+        parse_coordinates(coord_str)
+    latitudes, longitudes, valid = parse_coordinates_array([coord_str])
+    assert not valid[0] and np.isnan(latitudes[0]) and np.isnan(longitudes[0])
+
+
+def test_range_limits_are_inclusive():
+    latitudes, longitudes, valid = parse_coordinates_array(['9000N 18000W', '9000S 18000E'])
+    assert valid.all()
+    np.testing.assert_array_equal(latitudes, [90.0, -90.0])
+    np.testing.assert_array_equal(longitudes, [-180.0, 180.0])
@@ -0,0 +1,35 @@
+import pytest
+
+from calculate_emissions.config import reset_config
+from calculate_emissions.country_codes import ALPHA_3_TO_ALPHA_2, normalize_country_code
+from calculate_emissions.road_distance import DETOUR_FACTORS, detour_factor, detour_factors
+from calculate_emissions.utils import get_country_code
+
+
+@pytest.mark.parametrize('code, expected', [('USA', 'US'), ('deu', 'DE'), (' US ', 'US'), ('gb', 'GB'),
+                                            ('', None), (None, None), ('global_average', 'global_average'),
+                                            ('XYZ', 'XYZ')])
+def test_normalize_country_code(code, expected):
+    assert normalize_country_code(code) == expected
+
+
+def test_every_alpha_3_code_maps_to_a_distinct_alpha_2_code():
+    assert len(set(ALPHA_3_TO_ALPHA_2.values())) == len(ALPHA_3_TO_ALPHA_2)
+    assert set(DETOUR_FACTORS) <= set(ALPHA_3_TO_ALPHA_2.values())
+
+
+def test_alpha_3_codes_get_the_country_detour_factor(monkeypatch):
+    assert get_country_code({'address': {'city': 'Chicago', 'country_code': 'USA'}}) == 'US'
+    assert detour_factor('USA', 'CAN') == detour_factor('US', 'CA') == (DETOUR_FACTORS['US'] + DETOUR_FACTORS['CA']) / 2
+    monkeypatch.setenv('ROAD_DETOUR_FACTORS', '{"DEU": 1.1}')
+    reset_config()
+    try:
+        assert detour_factors()['DE'] == 1.1
+    finally:
+        monkeypatch.undo()
+        reset_config()
+
+
+def test_alpha_3_codes_get_the_country_electricity_intensity(factor_registry):
+    table = factor_registry.active.table
+    assert table.electricity_intensity('USA') == table.electricity_intensity('US') != table.electricity_intensity()
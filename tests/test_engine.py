@@ -0,0 +1,38 @@
+import pytest
+
+from calculate_emissions.engine import get_engine
+from calculate_emissions.great_circle import get_great_circle_memo
+from calculate_emissions.mapbox_cache import get_mapbox_cache
+from calculate_emissions.spatial_index import load_facility_index
+
+
+@pytest.fixture
+def engine():
+    engine = get_engine()
+    engine.reset()
+    yield engine
+    engine.reset()
+
+
+def test_reset_applies_a_changed_configuration(engine, monkeypatch, tmp_path):
+    monkeypatch.setenv('MAPBOX_ACCESS_TOKEN', 'first')
+    monkeypatch.setenv('MAPBOX_CACHE_PATH', str(tmp_path / 'first.sqlite'))
+    monkeypatch.setenv('GREAT_CIRCLE_CACHE_MAX_ENTRIES', '100')
+    client, cache, memo = engine.mapbox, get_mapbox_cache(), get_great_circle_memo()
+    assert (client.access_token, cache.path, memo.max_entries) == ('first', str(tmp_path / 'first.sqlite'), 100)
+
+    monkeypatch.setenv('MAPBOX_ACCESS_TOKEN', 'second')
+    monkeypatch.setenv('MAPBOX_CACHE_PATH', str(tmp_path / 'second.sqlite'))
+    monkeypatch.setenv('GREAT_CIRCLE_CACHE_MAX_ENTRIES', '200')
+    engine.reset()
+    assert engine.mapbox is not client and engine.mapbox.access_token == 'second'
+    assert get_mapbox_cache().path == str(tmp_path / 'second.sqlite')
+    assert engine.mapbox.cache is get_mapbox_cache()
+    assert get_great_circle_memo().max_entries == 200
+
+
+def test_reset_forgets_the_routing_state(engine):
+    router, index = engine.sea_router, load_facility_index('seaport')
+    engine.reset()
+    assert engine.sea_router is not router
+    assert load_facility_index('seaport') is not index
@@ -0,0 +1,17 @@
+from calculate_emissions.factor_registry import FactorChange
+
+CHANGE = FactorChange('old', 'new', frozenset({'cargo_plane_long_haul'}), frozenset({'DE'}),
+                      frozenset({'electric_truck'}))
+
+
+def test_change_affects_changed_methods():
+    assert CHANGE.affects('cargo_plane_long_haul', 'FR')
+    assert not CHANGE.affects('container_ship', 'DE')
+
+
+def test_change_affects_electric_methods_of_changed_countries():
+    assert CHANGE.affects('electric_truck', 'DE')
+    assert CHANGE.affects('electric_truck')
+    assert not CHANGE.affects('electric_truck', 'FR')
+    assert FactorChange('old', 'new', frozenset(), frozenset({'global_average'}),
+                        frozenset({'electric_truck'})).affects('electric_truck', 'FR')
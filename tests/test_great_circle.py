@@ -0,0 +1,35 @@
+import math
+
+import numpy as np
+import pytest
+
+from calculate_emissions.great_circle import haversine, haversine_array
+
+
+@pytest.fixture
+def pairs():
+    rng = np.random.default_rng(7)
+    n = 100_000
+    lat1, lat2 = rng.uniform(-90, 90, n), rng.uniform(-90, 90, n)
+    lon1, lon2 = rng.uniform(-180, 180, n), rng.uniform(-180, 180, n)
+    # Short lanes too, where the small-angle branch is taken
+    lat2[::2], lon2[::2] = lat1[::2] + rng.normal(0, 1, n // 2), lon1[::2] + rng.normal(0, 1, n // 2)
+    return lat1, lon1, lat2, lon2
+
+
+def test_scalar_and_array_distances_are_bit_identical(pairs):
+    lat1, lon1, lat2, lon2 = pairs
+    scalar = np.array([haversine(*pair) for pair in zip(lat1.tolist(), lon1.tolist(), lat2.tolist(), lon2.tolist())])
+    np.testing.assert_array_equal(haversine_array(lat1, lon1, lat2, lon2), scalar)
+
+
+def test_distances_match_libm(pairs):
+    lat1, lon1, lat2, lon2 = (np.radians(values) for values in pairs)
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    expected = 6371.0 * 2 * np.array([math.asin(math.sqrt(value)) for value in a.tolist()])
+    np.testing.assert_allclose(haversine_array(*pairs), expected, rtol=1e-15, atol=1e-12)
+
+
+def test_nan_coordinates_propagate():
+    assert math.isnan(haversine(math.nan, 0.0, 1.0, 1.0))
+    assert np.isnan(haversine_array([math.nan], [0.0], [1.0], [1.0])).all()
@@ -0,0 +1,80 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from calculate_emissions.batch import calculate_emissions_batch
+from calculate_emissions.ledger import IncrementalLedger
+from calculate_emissions.parallel import ParallelExecutor
+
+SHIPMENTS = pd.DataFrame({
+    'mass_amount': [100.0, 200.0, 300.0, 400.0] * 2,
+    'mass_unit': ['kg'] * 8,
+    'source_airport_code': ['JFK'] * 8,
+    'destination_airport_code': ['LAX'] * 8,
+    'method': ['cargo_plane'] * 8,
+})
+PLANES_AND_SHIPS = pd.concat([SHIPMENTS, SHIPMENTS.assign(source_airport_code=None, destination_airport_code=None,
+                                                          source_locode='NLRTM', destination_locode='USNYC',
+                                                          method='container_ship')], ignore_index=True)
+
+
+@pytest.fixture
+def ledger(tmp_path, factor_registry):
+    ledger = IncrementalLedger(str(tmp_path / 'ledger.sqlite'))
+    yield ledger
+    ledger.close()
+
+
+def test_ledger_with_executor_stores_results_of_the_runtime_dataset(ledger, doubled_factors):
+    expected = calculate_emissions_batch(SHIPMENTS)
+
+    with ParallelExecutor(workers=2) as executor:
+        first = ledger.calculate(SHIPMENTS, calculate=executor.calculate)
+        second = ledger.calculate(SHIPMENTS, calculate=executor.calculate)
+
+    for result in (first, second):
+        assert (result['dataset_version'] == 'doubled').all()
+        np.testing.assert_array_equal(result['emissions'].to_numpy(), expected['emissions'].to_numpy())
+    assert ledger.report.reused == len(SHIPMENTS)
+
+
+def test_ledger_recalculates_a_dataset_registered_again_with_other_factors(ledger, register_scaled):
+    register_scaled('custom', factor=2, activate=True)
+    doubled = ledger.calculate(SHIPMENTS)
+
+    register_scaled('custom', factor=3, activate=True)
+    tripled = ledger.calculate(SHIPMENTS)
+
+    assert ledger.report.reused == 0
+    np.testing.assert_allclose(tripled['emissions'].to_numpy(), doubled['emissions'].to_numpy() * 1.5)
+
+
+def test_ledger_keeps_results_when_an_unrelated_dataset_is_registered(ledger, register_scaled):
+    ledger.calculate(SHIPMENTS)
+    register_scaled('unrelated')
+    ledger.calculate(SHIPMENTS)
+
+    assert ledger.report.reused == len(SHIPMENTS)
+
+
+def test_ledger_reuses_results_of_methods_unchanged_in_a_dataset_registered_again(ledger, factor_registry,
+                                                                                  register_scaled):
+    ledger.calculate(PLANES_AND_SHIPS)
+
+    register_scaled(factor_registry.active.version, ['cargo_plane_long_haul'])
+    ledger.calculate(PLANES_AND_SHIPS)
+
+    assert ledger.report.reused == 8
+
+
+def test_ledger_discards_results_of_the_methods_changed_in_the_active_dataset(ledger, factor_registry,
+                                                                              register_scaled):
+    bundled = factor_registry.active
+    ledger.calculate(PLANES_AND_SHIPS)
+    assert len(ledger.store) == 8
+
+    register_scaled(bundled.version, ['cargo_plane_long_haul'])
+
+    assert len(ledger.store) == 4
+    ledger.calculate(PLANES_AND_SHIPS)
+    assert ledger.report.reused == 8
@@ -0,0 +1,100 @@
+from types import SimpleNamespace
+
+import pytest
+
+from calculate_emissions import mapbox_cache
+from calculate_emissions.mapbox_cache import MapboxCache, address_cache_key, route_cache_key
+from calculate_emissions.mapbox_client import MapboxClient
+
+LANES = [((52.37, 4.90), (51.92, 4.48)), ((48.86, 2.35), (50.85, 4.35)), ((52.37, 4.90), (51.92, 4.48))]
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """
+    Replaces the cache's wall clock by one that only moves when the test sets it.
+    """
+    clock = SimpleNamespace(now=1_000_000.0)
+    monkeypatch.setattr(mapbox_cache, 'time', SimpleNamespace(time=lambda: clock.now))
+    return clock
+
+
+def test_keys_are_normalized():
+    assert address_cache_key(' 1 Main  St,, Springfield ') == address_cache_key('1 main st, springfield')
+    assert route_cache_key((52.370001, 4.9), (-0.00001, 4.48)) == route_cache_key((52.37, 4.90001), (0.0, 4.48))
+
+
+def test_entries_expire_after_the_ttl(clock):
+    cache = MapboxCache(':memory:', ttl=60)
+    cache.set('geocode:a', [1.0, 2.0])
+
+    clock.now += 59
+    assert cache.get('geocode:a') == [1.0, 2.0]
+    clock.now += 2
+    assert cache.get('geocode:a') is None
+    assert cache.stats()['entries'] == 0
+
+
+def test_least_recently_used_entries_are_evicted_beyond_max_entries(clock):
+    cache = MapboxCache(':memory:', ttl=0, max_entries=4)
+    for key in 'abcd':
+        clock.now += 1
+        cache.set(key, key)
+    clock.now += 1
+    cache.get('a')
+
+    clock.now += 1
+    cache.set('e', 'e')
+
+    assert [key for key in 'abcde' if cache.get(key) is not None] == ['a', 'd', 'e']
+
+
+def test_hits_and_misses_are_counted():
+    cache = MapboxCache(':memory:')
+    cache.get('geocode:a')
+    cache.set('geocode:a', [1.0, 2.0])
+    cache.get('geocode:a')
+    cache.get('geocode:a')
+
+    assert cache.stats() == {'hits': 2, 'misses': 1, 'hit_ratio': 2 / 3, 'entries': 1}
+    cache.clear()
+    assert cache.stats() == {'hits': 0, 'misses': 0, 'hit_ratio': 0.0, 'entries': 0}
+
+
+def test_cached_lanes_are_not_requested_again(mapbox_stub, tmp_path):
+    cache = MapboxCache(str(tmp_path / 'mapbox.sqlite'))
+    client = MapboxClient('token', mapbox_stub.url, requests_per_minute=60_000, cache=cache)
+    first = client.route_distances(LANES) + client.geocode_many(['1 Main St, Springfield', '1 main st,springfield'])
+    requests = mapbox_stub.requests
+    client.close()
+
+    # A new client on the same file, as in the next run of a job
+    client = MapboxClient('token', mapbox_stub.url, requests_per_minute=60_000, cache=MapboxCache(cache.path))
+    second = client.route_distances(LANES) + client.geocode_many(['1 Main St, Springfield', '1 main st,springfield'])
+    client.close()
+
+    assert requests == 3
+    assert mapbox_stub.requests == requests
+    assert second == first
+
+
+def test_many_to_many_lanes_share_matrix_requests_and_cache_entries(mapbox_stub, tmp_path):
+    depots = [(52.37, 4.90), (51.92, 4.48), (50.85, 4.35)]
+    stores = [(48.86, 2.35), (51.22, 4.40), (50.94, 6.96), (52.52, 13.40)]
+    lanes = [(depot, store) for depot in depots for store in stores]
+    client = MapboxClient('token', mapbox_stub.url, requests_per_minute=60_000,
+                          cache=MapboxCache(str(tmp_path / 'mapbox.sqlite')))
+
+    distances = client.lane_distances(lanes)
+    assert mapbox_stub.requests == 1
+    assert client.matrix_distances(depots, stores).ravel().tolist() == distances
+    assert [client.route_distance(*lane) for lane in lanes] == distances
+    assert mapbox_stub.requests == 1
+    client.close()
+
+
+def test_sparse_lanes_use_directions_requests(mapbox_stub, mapbox_client):
+    distances = mapbox_client.lane_distances(LANES)
+
+    assert mapbox_stub.requests == 2
+    assert distances == mapbox_client.route_distances(LANES)
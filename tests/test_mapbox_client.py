@@ -0,0 +1,57 @@
+import pytest
+import requests
+
+from calculate_emissions import mapbox_client as mapbox_client_module
+from mapbox_stub import _geocode
+
+
+@pytest.mark.parametrize('query', ['1 Main St, Springfield, 12345, US', 'Unit 4/12 Harbour Rd #3, Sydney?, AU'])
+def test_geocode_sends_the_query_as_one_path_segment(mapbox_client, query):
+    assert mapbox_client.geocode(query) == pytest.approx(_geocode(query))
+
+
+@pytest.mark.parametrize('status', [429, 500, 503])
+def test_rate_limits_and_server_errors_are_retried(mapbox_stub, mapbox_client, status):
+    mapbox_stub.fail(2, status)
+
+    assert mapbox_client.geocode('1 Main St') == pytest.approx(_geocode('1 Main St'))
+    assert mapbox_stub.requests == 3
+    assert mapbox_client.request_count == 3
+
+
+def test_backoff_doubles_and_honours_retry_after(mapbox_stub, mapbox_client, monkeypatch):
+    delays = []
+    monkeypatch.setattr(mapbox_client_module.time, 'sleep', delays.append)
+    mapbox_stub.fail(3, 503)
+    mapbox_stub.fail(1, 429, retry_after=2)
+
+    mapbox_client.geocode('1 Main St')
+
+    assert delays == [0.01, 0.02, 0.04, 2.0]
+
+
+def test_errors_are_raised_once_retries_are_exhausted(mapbox_stub, mapbox_client):
+    mapbox_client.max_retries = 1
+    mapbox_stub.fail(2, 502)
+
+    with pytest.raises(requests.HTTPError):
+        mapbox_client.geocode('1 Main St')
+    assert mapbox_stub.requests == 2
+
+
+def test_other_client_errors_are_not_retried(mapbox_stub, mapbox_client):
+    mapbox_stub.fail(1, 401)
+
+    with pytest.raises(requests.HTTPError):
+        mapbox_client.geocode('1 Main St')
+    assert mapbox_stub.requests == 1
+
+
+def test_identical_requests_in_flight_share_one_call(mapbox_stub, mapbox_client):
+    mapbox_stub.latency = 0.2
+    lanes = [((52.37, 4.90), (51.92, 4.48))] * 8
+
+    results = mapbox_client.route_distances(lanes) + mapbox_client.geocode_many(['1 Main St'] * 8)
+
+    assert mapbox_stub.requests == 2
+    assert len(set(results[:8])) == 1 and len(set(results[8:])) == 1
@@ -0,0 +1,40 @@
+from dataclasses import replace
+
+import numpy as np
+import pandas as pd
+
+from calculate_emissions.batch import calculate_emissions_batch
+from calculate_emissions.parallel import ParallelExecutor
+
+SHIPMENTS = pd.DataFrame({
+    'mass_amount': [100.0] * 8,
+    'mass_unit': ['kg'] * 8,
+    'source_airport_code': ['JFK'] * 8,
+    'destination_airport_code': ['LAX'] * 8,
+    'method': ['cargo_plane'] * 8,
+})
+
+
+def test_workers_use_datasets_registered_at_runtime(doubled_factors):
+    expected = calculate_emissions_batch(SHIPMENTS)
+    assert (expected['dataset_version'] == 'doubled').all()
+
+    with ParallelExecutor(workers=2) as executor:
+        result = executor.calculate(SHIPMENTS)
+
+    assert (result['dataset_version'] == 'doubled').all()
+    np.testing.assert_array_equal(result['emissions'].to_numpy(), expected['emissions'].to_numpy())
+
+
+def test_workers_use_dated_datasets_per_row(doubled_factors, factor_registry):
+    bundled = factor_registry.versions()[0]
+    factor_registry.activate(bundled)
+    factor_registry.add(replace(doubled_factors, valid_from=pd.Timestamp('2024-01-01', tz='UTC')))
+    shipments = SHIPMENTS.assign(shipped_at=['2023-06-01', '2024-06-01'] * 4)
+
+    with ParallelExecutor(workers=2) as executor:
+        result = executor.calculate(shipments)
+
+    assert result['dataset_version'].tolist() == [bundled, 'doubled'] * 4
+    emissions = result['emissions'].to_numpy()
+    np.testing.assert_allclose(emissions[1::2], emissions[0::2] * 2)
@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+
+from calculate_emissions.sea_routing import (CANALS, PORT_LINKS, SEA_LANES, SEAPORT_LINKS, SEAPORTS, WAYPOINTS,
+                                             LandMask, SeaRouter, _unit_vectors)
+from calculate_emissions.utils import calculate_air_distance
+
+# Published port-to-port sea distances (km)
+KNOWN_DISTANCES = [
+    # Tyrrhenian and Ligurian Sea to the Adriatic, around Italy through the Strait of Messina
+    ('ITGOA', 'ITTRS', 2270.0),
+    ('ITGOA', 'SIKOP', 2260.0),
+    ('ESBCN', 'ITTRS', 2580.0),
+    # Baltic to the North Sea, through the Kiel Canal or around Skagen
+    ('PLGDN', 'NLRTM', 1200.0),
+    ('PLGDN', 'DEHAM', 780.0),
+    ('SEGOT', 'NLRTM', 1000.0),
+]
+
+
+@pytest.fixture(scope='module')
+def router():
+    return SeaRouter()
+
+
+@pytest.fixture(scope='module')
+def land_mask():
+    return LandMask()
+
+
+def test_every_seaport_has_links():
+    assert set(SEAPORT_LINKS) == set(SEAPORTS)
+    for links in SEAPORT_LINKS.values():
+        assert 1 <= len(links) <= PORT_LINKS
+        assert set(links) <= set(WAYPOINTS)
+
+
+def test_sea_lanes_stay_over_water(land_mask):
+    lanes = [lane for lane in SEA_LANES if lane not in CANALS]
+    starts = np.array([WAYPOINTS[a] for a, _ in lanes])
+    ends = np.array([WAYPOINTS[b] for _, b in lanes])
+    lengths = calculate_air_distance((starts[:, 0], starts[:, 1]), (ends[:, 0], ends[:, 1]))
+    over_water = land_mask.over_water(_unit_vectors(starts[:, 0], starts[:, 1]), _unit_vectors(ends[:, 0], ends[:, 1]),
+                                      lengths, source_tolerance=0.0, destination_tolerance=0.0)
+    assert [lane for lane, ok in zip(lanes, over_water) if not ok] == []
+
+
+@pytest.mark.parametrize('source, destination, known', KNOWN_DISTANCES)
+def test_port_distances_match_published_distances(router, source, destination, known):
+    assert router.port_distance(source, destination) == pytest.approx(known, rel=0.1)
+    assert router.port_distance(destination, source) == pytest.approx(router.port_distance(source, destination))
+
+
+@pytest.mark.parametrize('source, destination, known', KNOWN_DISTANCES)
+def test_coordinates_at_a_port_sail_over_its_links(router, source, destination, known):
+    lat1, lon1 = SEAPORTS[source]
+    lat2, lon2 = SEAPORTS[destination]
+    distance = router.route_distance((lat1 + 0.05, lon1 - 0.05), (lat2, lon2))
+    assert distance == pytest.approx(router.port_distance(source, destination), abs=15.0)
+
+
+def test_coordinates_are_not_linked_across_land(router):
+    # La Spezia is nearer to the northern Adriatic than to most Tyrrhenian waypoints
+    assert router.route_distance((44.10, 9.83), (45.44, 12.33)) > 2000.0
+
+
+def _over_water(land_mask, source, destination):
+    (lat1, lon1), (lat2, lon2) = SEAPORTS[source], SEAPORTS[destination]
+    length = calculate_air_distance((lat1, lon1), (lat2, lon2))
+    return land_mask.over_water(_unit_vectors(np.array([lat1]), np.array([lon1])),
+                                _unit_vectors(np.array([lat2]), np.array([lon2])), np.array([length]))[0]
+
+
+def test_same_basin_shortcut_needs_open_water(router, land_mask):
+    assert not _over_water(land_mask, 'ITGOA', 'ITTRS')
+    assert _over_water(land_mask, 'ITTRS', 'SIKOP')
+    assert router.port_distance('ITTRS', 'SIKOP') == pytest.approx(calculate_air_distance(SEAPORTS['ITTRS'], SEAPORTS['SIKOP']))
+
+
+def test_inland_locations_are_not_routed(router):
+    assert np.isnan(router.route_distance((48.86, 2.35), (51.95, 4.05)))
@@ -0,0 +1,60 @@
+import json
+import threading
+
+import pytest
+
+from calculate_emissions.service import EmissionService
+
+PLANE = {
+    'shipment': {'mass': {'amount': 100, 'unit': 'kg'}},
+    'route': {'source': {'airport_code': 'JFK'}, 'destination': {'airport_code': 'LAX'}},
+    'method': {'method': 'cargo_plane'},
+}
+SHIP = {
+    'shipment': {'containers': 2},
+    'route': {'source': {'locode': 'NLRTM'}, 'destination': {'locode': 'USNYC'}},
+    'method': {'method': 'container_ship', 'trade_lane': 'aggregated_transsuez'},
+}
+
+
+@pytest.fixture
+def service(factor_registry):
+    service = EmissionService()
+    service.warm_up()
+    return service
+
+
+def post(service, path, payload, key):
+    status, body, _ = service.handle('POST', path, json.dumps(payload).encode(), key)
+    assert status == 200, body
+    return json.loads(body)
+
+
+def test_idempotency_cache_discards_responses_of_changed_methods(service, register_scaled):
+    plane = post(service, '/v1/emissions', PLANE, 'plane')
+    ship = post(service, '/v1/emissions/batch', [SHIP], 'ship')
+    assert len(service.idempotency_cache) == 2
+
+    register_scaled('plane-update', [plane['emission_factor']['methodology']], activate=True)
+
+    assert len(service.idempotency_cache) == 1
+    assert post(service, '/v1/emissions/batch', [SHIP], 'ship') == ship
+    recalculated = post(service, '/v1/emissions', PLANE, 'plane')
+    assert recalculated['emission_factor']['dataset_version'] == 'plane-update'
+    assert recalculated['emissions-mass']['amount'] == pytest.approx(plane['emissions-mass']['amount'] * 2)
+
+
+def test_idempotency_cache_counts_concurrent_requests_once(service):
+    cache = service.idempotency_cache
+    start_line = threading.Barrier(8)
+
+    def request():
+        start_line.wait()
+        post(service, '/v1/emissions', PLANE, 'concurrent')
+
+    threads = [threading.Thread(target=request) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert (cache.misses, cache.hits) == (1, 7)
@@ -0,0 +1,55 @@
+import json
+import os
+import shutil
+
+import pytest
+
+from calculate_emissions import snapshot
+from calculate_emissions.snapshot import SOURCE_FILES, build_snapshot, load_snapshot
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), '..', 'src', 'data')
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    data_dir = tmp_path / 'data'
+    data_dir.mkdir()
+    for filename in SOURCE_FILES.values():
+        shutil.copy(os.path.join(DATA_DIR, filename), data_dir / filename)
+    return str(data_dir)
+
+
+@pytest.fixture
+def hashed(monkeypatch):
+    hashed = []
+    hash_file = snapshot._hash_file
+    monkeypatch.setattr(snapshot, '_hash_file', lambda path: hashed.append(path) or hash_file(path))
+    return hashed
+
+
+def test_touched_sources_are_hashed_once(data_dir, tmp_path, hashed):
+    root = str(tmp_path / 'snapshots')
+    built = build_snapshot(data_dir, root)
+    for filename in SOURCE_FILES.values():
+        path = os.path.join(data_dir, filename)
+        os.utime(path, ns=(os.stat(path).st_atime_ns, os.stat(path).st_mtime_ns + 10 ** 9))
+    hashed.clear()
+
+    assert snapshot._read_current(data_dir, root).version == built.version
+    assert len(hashed) == len(SOURCE_FILES)
+    with open(os.path.join(root, 'current.json')) as f:
+        assert json.load(f)['source_stats'] == snapshot._source_stats(data_dir)
+
+    hashed.clear()
+    assert snapshot._read_current(data_dir, root).version == built.version
+    assert hashed == []
+
+
+def test_changed_sources_are_rebuilt(data_dir, tmp_path):
+    root = str(tmp_path / 'snapshots')
+    built = build_snapshot(data_dir, root)
+    with open(os.path.join(data_dir, SOURCE_FILES['iata_icao']), 'a') as f:
+        f.write('\n')
+
+    assert snapshot._read_current(data_dir, root) is None
+    assert load_snapshot(data_dir, root).version != built.version